@@ -4,22 +4,27 @@ db = db.getSiblingDB('transactions_db');
 // Создаем коллекцию транзакций
 db.createCollection('transactions');
 
-// Создаем индексы для оптимизации поиска
-db.transactions.createIndex({ "plan_id": 1 });
-db.transactions.createIndex({ "user_id": 1 });
-db.transactions.createIndex({ "type": 1 });
-db.transactions.createIndex({ "category": 1 });
-db.transactions.createIndex({ "created_at": -1 });
-db.transactions.createIndex({ "amount": 1 });
+// Индексы по правилу ESR (equality, sort, range) под фактические запросы сервиса;
+// тот же набор объявлен в planning_service/database/mongo_indexes.py
+// (make mongo-indexes-report / make mongo-indexes-apply).
+// Одиночные индексы по type, category, amount, created_at не используются запросами,
+// которые всегда начинаются с равенства по user_id, и только замедляют вставку.
 
-// Составной индекс для поиска по пользователю и плану
-db.transactions.createIndex({ "user_id": 1, "plan_id": 1 });
+// Список и seek-пагинация транзакций пользователя по (created_at, _id), аналитика пользователя
+db.transactions.createIndex({ "user_id": 1, "created_at": -1, "_id": -1 });
 
-// Составной индекс для поиска по типу и категории
-db.transactions.createIndex({ "type": 1, "category": 1 });
+// Список, аналитика и дашборд плана
+db.transactions.createIndex({ "user_id": 1, "plan_id": 1, "created_at": -1, "_id": -1 });
 
-// Составной индекс для аналитики по дате и типу
-db.transactions.createIndex({ "created_at": -1, "type": 1 });
+// Фильтр по категории
+db.transactions.createIndex({ "user_id": 1, "category": 1, "created_at": -1, "_id": -1 });
+
+// Коллекция дневных агрегатов для аналитики: ключ (user_id, plan_id, day, type, category)
+db.createCollection('transaction_rollups');
+db.transaction_rollups.createIndex(
+    { "user_id": 1, "plan_id": 1, "day": 1, "type": 1, "category": 1 },
+    { unique: true }
+);
 
 print("Collections and indexes created successfully!");
 
@@ -104,6 +109,38 @@ db.transactions.insertMany(testTransactions);
 
 print(`Inserted ${testTransactions.length} test transactions`);
 
+// Строим дневные агрегаты по тестовым данным (дальше они обновляются сервисом)
+db.transactions.aggregate([
+    {
+        $group: {
+            _id: {
+                user_id: "$user_id",
+                plan_id: "$plan_id",
+                day: { $dateToString: { format: "%Y-%m-%d", date: "$created_at" } },
+                type: "$type",
+                category: "$category"
+            },
+            total_amount: { $sum: "$amount" },
+            count: { $sum: 1 }
+        }
+    },
+    {
+        $project: {
+            _id: 0,
+            user_id: "$_id.user_id",
+            plan_id: "$_id.plan_id",
+            day: "$_id.day",
+            type: "$_id.type",
+            category: "$_id.category",
+            total_amount: 1,
+            count: 1
+        }
+    },
+    { $out: "transaction_rollups" }
+]);
+
+print("Rollups built: " + db.transaction_rollups.count());
+
 // Выводим статистику
 print("Database initialization completed!");
 print("Transactions collection statistics:");
@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+"""
+Микробенчмарк зависимости аутентификации API Gateway (get_current_user)
+
+Сравниваются:
+  * uncached - прежний путь: jwt.decode + поиск в users_db + построение UserResponse
+               на каждый запрос (кеш проверенных токенов отключен)
+  * cached   - кеш проверенных токенов: хеш токена + поиск в LRU
+
+Нагрузка - поток вызовов зависимости с --tokens различными токенами (активные
+сессии), выбираемыми по кругу; для cached первая проверка каждого токена входит
+в прогрев. Результат - вызовов в секунду и задержка одного вызова в микросекундах.
+
+Запуск:
+    PYTHONPATH=src/common:src/api-gateway python performance_tests/benchmarks/bench_auth_dependency.py
+"""
+
+import argparse
+import asyncio
+import statistics
+import time
+from datetime import timedelta
+from typing import List
+
+from fastapi.security import HTTPAuthorizationCredentials
+
+from api_gateway.dependencies import get_current_user
+from api_gateway.services.auth_service import create_access_token
+from api_gateway.services.token_cache import token_cache
+
+
+async def run_calls(credentials: List[HTTPAuthorizationCredentials], calls: int) -> List[float]:
+    """Задержки вызовов зависимости в микросекундах"""
+    timings = []
+    count = len(credentials)
+    for i in range(calls):
+        start = time.perf_counter()
+        await get_current_user(credentials[i % count])
+        timings.append((time.perf_counter() - start) * 1_000_000)
+    return timings
+
+
+async def measure(credentials: List[HTTPAuthorizationCredentials], calls: int, cached: bool) -> dict:
+    token_cache.clear()
+    token_cache.max_size = max(len(credentials), 1) if cached else 0
+    await run_calls(credentials, len(credentials))  # прогрев
+
+    start = time.perf_counter()
+    timings = await run_calls(credentials, calls)
+    elapsed = time.perf_counter() - start
+    timings.sort()
+    return {
+        "ops": calls / elapsed,
+        "p50_us": statistics.median(timings),
+        "p99_us": timings[int(len(timings) * 0.99) - 1]
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Auth dependency microbenchmark")
+    parser.add_argument("--calls", type=int, default=100000, help="Measured dependency calls")
+    parser.add_argument("--tokens", type=int, default=1000, help="Distinct active tokens")
+    args = parser.parse_args()
+
+    credentials = [
+        HTTPAuthorizationCredentials(
+            scheme="Bearer",
+            credentials=create_access_token({"sub": "admin"}, expires_delta=timedelta(minutes=30))
+        )
+        for _ in range(args.tokens)
+    ]
+
+    original_size = token_cache.max_size
+    try:
+        results = {
+            "uncached": asyncio.run(measure(credentials, args.calls, cached=False)),
+            "cached": asyncio.run(measure(credentials, args.calls, cached=True))
+        }
+    finally:
+        token_cache.clear()
+        token_cache.max_size = original_size
+
+    baseline = results["uncached"]["ops"]
+    print(f"Calls: {args.calls}, distinct tokens: {args.tokens}")
+    print("| mode     | calls/s   | p50, us | p99, us | speedup |")
+    print("|----------|-----------|---------|---------|---------|")
+    for mode, r in results.items():
+        print(f"| {mode:<8} | {r['ops']:9.0f} | {r['p50_us']:7.1f} | {r['p99_us']:7.1f} | {r['ops'] / baseline:6.1f}x |")
+
+
+if __name__ == "__main__":
+    main()
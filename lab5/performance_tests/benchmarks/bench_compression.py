@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк сжатия ответов: объем передаваемых данных и задержка для 100 и 1000 элементов
+
+Upstream (заглушка planning-service с тем же CompressionMiddleware, что в сервисе) отдает
+список транзакций, шлюз проксирует его двумя путями:
+  * passthrough - /api/transactions-mongo: upstream сжимает ответ, шлюз передает сжатые
+                  байты клиенту без распаковки
+  * typed       - /api/transactions: шлюз запрашивает у upstream identity, разбирает JSON
+                  и сжимает ответ для клиента один раз
+
+Для каждой кодировки (identity, gzip, br, zstd - если установлены brotli и zstandard)
+измеряются байты ответа, задержка на loopback (запрос + распаковка + json.loads) и
+расчетное время на канале --link-mbit (задержка loopback + байты / пропускная способность).
+
+Запуск:
+    PYTHONPATH=src/common:src/api-gateway:src/planning-service python performance_tests/benchmarks/bench_compression.py
+"""
+
+import argparse
+import asyncio
+import gzip
+import json
+import socket
+import statistics
+import threading
+import time
+from datetime import datetime, timedelta
+
+import httpx
+import uvicorn
+from fastapi import FastAPI, Response
+
+from api_gateway.config import settings
+from api_gateway.main import app as gateway_app
+from budget_common.compression import available_encodings
+from planning_service.services.compression import CompressionMiddleware
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+DECODERS = {
+    "identity": lambda body: body,
+    "gzip": gzip.decompress,
+    "br": lambda body: brotli.decompress(body),
+    "zstd": lambda body: zstandard.ZstdDecompressor().decompressobj().decompress(body)
+}
+
+
+def make_transactions(count: int) -> bytes:
+    now = datetime.utcnow()
+    return json.dumps([
+        {
+            "_id": f"{i:024x}",
+            "plan_id": i % 20,
+            "user_id": "admin",
+            "type": "expense" if i % 3 else "income",
+            "amount": round(10 + i * 1.37, 2),
+            "category": ("food", "rent", "transport", "salary")[i % 4],
+            "description": f"Transaction {i}",
+            "date": (now - timedelta(minutes=i)).isoformat(),
+            "created_at": now.isoformat()
+        }
+        for i in range(count)
+    ]).encode()
+
+
+def make_upstream(sizes) -> FastAPI:
+    upstream = FastAPI()
+    upstream.add_middleware(CompressionMiddleware)
+    bodies = {size: make_transactions(size) for size in sizes}
+
+    @upstream.get("/transactions-mongo")
+    async def transactions_mongo(limit: int):
+        return Response(content=bodies[limit], media_type="application/json")
+
+    # Типизированный маршрут шлюза пробрасывает только plan_id - через него и передается размер
+    @upstream.get("/transactions")
+    async def transactions(plan_id: int):
+        return Response(content=bodies[plan_id], media_type="application/json")
+
+    @upstream.get("/health/live")
+    async def liveness():
+        return {"status": "ok"}
+
+    return upstream
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def serve(app, port: int) -> uvicorn.Server:
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning", access_log=False))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.05)
+    return server
+
+
+async def measure(client: httpx.AsyncClient, url: str, headers: dict, encoding: str, requests: int) -> dict:
+    headers = {**headers, "Accept-Encoding": encoding}
+    latencies, size = [], 0
+    for i in range(requests + 10):
+        start = time.perf_counter()
+        async with client.stream("GET", url, headers=headers) as response:
+            response.raise_for_status()
+            assert response.headers.get("content-encoding", "identity") == encoding
+            body = b"".join([chunk async for chunk in response.aiter_raw()])
+        json.loads(DECODERS[encoding](body))
+        if i >= 10:  # первые запросы - прогрев
+            latencies.append((time.perf_counter() - start) * 1000)
+        size = len(body)
+    return {"bytes": size, "p50_ms": statistics.median(latencies)}
+
+
+async def run(args) -> None:
+    upstream_port, gateway_port = free_port(), free_port()
+    settings.planning_service_url = f"http://127.0.0.1:{upstream_port}"
+    servers = [serve(make_upstream(args.sizes), upstream_port), serve(gateway_app, gateway_port)]
+
+    encodings = ["identity"] + [encoding for encoding in ("gzip", "br", "zstd") if encoding in available_encodings(settings)]
+    rows = []
+    try:
+        base = f"http://127.0.0.1:{gateway_port}"
+        async with httpx.AsyncClient(timeout=60) as client:
+            login = await client.post(f"{base}/auth/login", json={"username": "admin", "password": "secret"})
+            headers = {"Authorization": f"Bearer {login.json()['access_token']}"}
+            for path, route in (("passthrough", "/api/transactions-mongo?limit="), ("typed", "/api/transactions?plan_id=")):
+                for size in args.sizes:
+                    for encoding in encodings:
+                        result = await measure(client, f"{base}{route}{size}", headers, encoding, args.requests)
+                        rows.append((path, size, encoding, result))
+    finally:
+        for server in servers:
+            server.should_exit = True
+
+    print(
+        f"{args.requests} requests per row; link estimate for {args.link_mbit:g} Mbit/s; "
+        f"levels gzip {settings.compression_gzip_level}, br {settings.compression_brotli_level}, "
+        f"zstd {settings.compression_zstd_level}"
+    )
+    print("| path        | items | encoding | bytes   | ratio | loopback p50, ms | on link, ms |")
+    print("|-------------|-------|----------|---------|-------|------------------|-------------|")
+    identity = {(path, size): r["bytes"] for path, size, encoding, r in rows if encoding == "identity"}
+    for path, size, encoding, r in rows:
+        on_link = r["p50_ms"] + r["bytes"] * 8 / (args.link_mbit * 1000)
+        print(
+            f"| {path:<11} | {size:5d} | {encoding:<8} | {r['bytes']:7d} | {r['bytes'] / identity[(path, size)]:5.2f} "
+            f"| {r['p50_ms']:16.2f} | {on_link:11.2f} |"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Response compression bandwidth/latency benchmark")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100, 1000], help="Items per response")
+    parser.add_argument("--requests", type=int, default=200, help="Measured requests per row")
+    parser.add_argument("--link-mbit", type=float, default=10.0, help="Client link bandwidth for the estimate")
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
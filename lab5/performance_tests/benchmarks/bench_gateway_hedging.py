@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк хвостовой задержки API Gateway с hedge-запросами
+
+Upstream (заглушка planning-service) отвечает на GET /plans за --base-ms, но доля
+--tail-ratio запросов задерживается на --tail-ms (пауза GC, медленный запрос к БД).
+Сравниваются:
+  * no-hedge - один запрос к upstream, медленный ответ целиком попадает в задержку шлюза
+  * hedge    - после p95 задержки маршрута шлюз отправляет вторую попытку и берет первый ответ
+
+Upstream и шлюз запускаются uvicorn в фоновых потоках на локальных портах, запросы идут
+по настоящим сокетам. Перед замером шлюз прогревается, чтобы накопить окно задержек.
+
+Запуск:
+    PYTHONPATH=src/common:src/api-gateway python performance_tests/benchmarks/bench_gateway_hedging.py
+"""
+
+import argparse
+import asyncio
+import random
+import socket
+import statistics
+import threading
+import time
+
+import httpx
+import uvicorn
+from fastapi import FastAPI
+
+from api_gateway.config import settings
+from api_gateway.main import app as gateway_app
+from api_gateway.services.upstream_policy import upstream_policy
+
+
+def make_upstream(base_ms: float, tail_ms: float, tail_ratio: float) -> FastAPI:
+    upstream = FastAPI()
+
+    @upstream.get("/plans")
+    async def plans():
+        delay = tail_ms if random.random() < tail_ratio else base_ms
+        await asyncio.sleep(delay / 1000)
+        return [{"id": 1, "title": "Monthly Budget"}]
+
+    return upstream
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def serve(app, port: int) -> uvicorn.Server:
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning", access_log=False))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.05)
+    return server
+
+
+async def measure(url: str, headers: dict, requests: int, concurrency: int) -> dict:
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(limits=limits, timeout=60) as client:
+        for _ in range(100):  # прогрев: окно задержек для расчета p95
+            await client.get(url, headers=headers)
+
+        hedges, hedges_won = upstream_policy.hedges, upstream_policy.hedges_won
+        latencies = []
+        queue = asyncio.Queue()
+        for _ in range(requests):
+            queue.put_nowait(None)
+
+        async def worker():
+            while not queue.empty():
+                queue.get_nowait()
+                start = time.perf_counter()
+                response = await client.get(url, headers=headers)
+                response.raise_for_status()
+                latencies.append((time.perf_counter() - start) * 1000)
+
+        start = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    return {
+        "rps": requests / elapsed,
+        "p50_ms": statistics.median(latencies),
+        "p99_ms": latencies[max(0, int(len(latencies) * 0.99) - 1)],
+        "max_ms": latencies[-1],
+        "hedges": upstream_policy.hedges - hedges,
+        "hedges_won": upstream_policy.hedges_won - hedges_won
+    }
+
+
+async def run(args) -> None:
+    upstream_port, gateway_port = free_port(), free_port()
+    settings.planning_service_url = f"http://127.0.0.1:{upstream_port}"
+    servers = [
+        serve(make_upstream(args.base_ms, args.tail_ms, args.tail_ratio), upstream_port),
+        serve(gateway_app, gateway_port)
+    ]
+
+    try:
+        base = f"http://127.0.0.1:{gateway_port}"
+        async with httpx.AsyncClient() as client:
+            login = await client.post(f"{base}/auth/login", json={"username": "admin", "password": "secret"})
+        headers = {"Authorization": f"Bearer {login.json()['access_token']}"}
+
+        results = {}
+        for mode, hedge_enabled in (("no-hedge", False), ("hedge", True)):
+            settings.upstream_hedge_enabled = hedge_enabled
+            results[mode] = await measure(f"{base}/api/plans", headers, args.requests, args.concurrency)
+    finally:
+        for server in servers:
+            server.should_exit = True
+
+    print(
+        f"Upstream: {args.base_ms:.0f} ms, {args.tail_ratio:.0%} of requests {args.tail_ms:.0f} ms; "
+        f"{args.requests} requests, concurrency {args.concurrency}"
+    )
+    print("| mode     | req/s  | p50, ms | p99, ms | max, ms | hedges | hedges won |")
+    print("|----------|--------|---------|---------|---------|--------|------------|")
+    for mode, r in results.items():
+        print(
+            f"| {mode:<8} | {r['rps']:6.1f} | {r['p50_ms']:7.2f} | {r['p99_ms']:7.2f} | {r['max_ms']:7.2f} "
+            f"| {r['hedges']:6d} | {r['hedges_won']:10d} |"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="API Gateway hedged request tail latency benchmark")
+    parser.add_argument("--requests", type=int, default=2000, help="Measured requests per mode")
+    parser.add_argument("--concurrency", type=int, default=10, help="Concurrent client requests")
+    parser.add_argument("--base-ms", type=float, default=5.0, help="Usual upstream latency")
+    parser.add_argument("--tail-ms", type=float, default=250.0, help="Latency of slow upstream responses")
+    parser.add_argument("--tail-ratio", type=float, default=0.03, help="Share of slow upstream responses")
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
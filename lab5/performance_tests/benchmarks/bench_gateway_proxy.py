@@ -0,0 +1,199 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк проксирования списка транзакций MongoDB через API Gateway
+
+Сравниваются два пути шлюза на одном и том же upstream-ответе:
+  * buffered  - прежний proxy_mongo_request: тело ответа читается целиком,
+                разбирается response.json() и повторно сериализуется FastAPI
+  * streaming - proxy_stream_request: байты ответа передаются потоком без разбора
+
+Upstream (заглушка planning-service с заранее сериализованным ответом из --docs
+транзакций) и шлюз запускаются uvicorn в фоновых потоках на локальных портах,
+запросы идут по настоящим сокетам. Пиковая память - tracemalloc на время одного
+запроса (клиент читает ответ потоком и отбрасывает его).
+
+Запуск:
+    PYTHONPATH=src/common:src/api-gateway python performance_tests/benchmarks/bench_gateway_proxy.py --docs 1000
+"""
+
+import argparse
+import asyncio
+import json
+import socket
+import statistics
+import threading
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+from typing import Any
+
+import httpx
+import uvicorn
+from fastapi import Depends, FastAPI, HTTPException, Request, Response
+from fastapi.responses import JSONResponse
+
+from api_gateway.config import settings
+from api_gateway.dependencies import get_current_user
+from api_gateway.main import app as gateway_app
+from api_gateway.models.auth import UserResponse
+
+
+async def buffered_proxy(request: Request, username: str, endpoint: str) -> Any:
+    """Прежняя реализация proxy_mongo_request (буферизация и повторная сериализация)"""
+    url = f"{settings.planning_service_url}{endpoint}"
+    body = None
+    if request.method in ["POST", "PUT"]:
+        body = await request.body()
+    try:
+        async with httpx.AsyncClient() as client:
+            response = await client.request(
+                method=request.method,
+                url=url,
+                headers={"X-User": username},
+                content=body,
+                params=dict(request.query_params)
+            )
+            response.raise_for_status()
+            next_cursor = response.headers.get("X-Next-Cursor")
+            if next_cursor:
+                return JSONResponse(content=response.json(), headers={"X-Next-Cursor": next_cursor})
+            return response.json()
+    except httpx.HTTPStatusError as e:
+        raise HTTPException(status_code=e.response.status_code, detail=e.response.text)
+    except httpx.RequestError as e:
+        raise HTTPException(status_code=503, detail=f"Service unavailable: {str(e)}")
+
+
+@gateway_app.get("/bench/buffered/transactions-mongo")
+async def bench_buffered(request: Request, current_user: UserResponse = Depends(get_current_user)):
+    return await buffered_proxy(request, current_user.username, "/transactions-mongo")
+
+
+def make_upstream(docs: int) -> FastAPI:
+    now = datetime.utcnow()
+    body = json.dumps([
+        {
+            "_id": f"{i:024x}",
+            "plan_id": i % 20,
+            "type": "expense" if i % 3 else "income",
+            "amount": round(10 + i * 1.37, 2),
+            "description": f"Transaction {i}",
+            "category": "food",
+            "user_id": "admin",
+            "created_at": (now - timedelta(minutes=i)).isoformat()
+        }
+        for i in range(docs)
+    ]).encode()
+
+    upstream = FastAPI()
+
+    @upstream.get("/transactions-mongo")
+    async def transactions():
+        return Response(content=body, media_type="application/json", headers={"X-Next-Cursor": "bench"})
+
+    upstream.state.body_size = len(body)
+    return upstream
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def serve(app, port: int) -> uvicorn.Server:
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning", access_log=False))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.05)
+    return server
+
+
+async def fetch(client: httpx.AsyncClient, url: str, headers: dict) -> int:
+    size = 0
+    async with client.stream("GET", url, headers=headers) as response:
+        response.raise_for_status()
+        async for chunk in response.aiter_raw():
+            size += len(chunk)
+    return size
+
+
+async def measure(url: str, headers: dict, requests: int, concurrency: int) -> dict:
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(limits=limits, timeout=60) as client:
+        await fetch(client, url, headers)  # прогрев
+
+        tracemalloc.start()
+        await fetch(client, url, headers)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+        latencies = []
+        queue = asyncio.Queue()
+        for _ in range(requests):
+            queue.put_nowait(None)
+
+        async def worker():
+            while not queue.empty():
+                queue.get_nowait()
+                start = time.perf_counter()
+                await fetch(client, url, headers)
+                latencies.append((time.perf_counter() - start) * 1000)
+
+        start = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    return {
+        "rps": requests / elapsed,
+        "p50_ms": statistics.median(latencies),
+        "p99_ms": latencies[max(0, int(len(latencies) * 0.99) - 1)],
+        "peak_kb": peak / 1024
+    }
+
+
+async def run(args) -> None:
+    upstream = make_upstream(args.docs)
+    upstream_port, gateway_port = free_port(), free_port()
+    settings.planning_service_url = f"http://127.0.0.1:{upstream_port}"
+    servers = [serve(upstream, upstream_port), serve(gateway_app, gateway_port)]
+
+    try:
+        base = f"http://127.0.0.1:{gateway_port}"
+        async with httpx.AsyncClient() as client:
+            login = await client.post(f"{base}/auth/login", json={"username": "admin", "password": "secret"})
+        headers = {"Authorization": f"Bearer {login.json()['access_token']}"}
+
+        results = {
+            "buffered": await measure(f"{base}/bench/buffered/transactions-mongo", headers, args.requests, args.concurrency),
+            "streaming": await measure(f"{base}/api/transactions-mongo", headers, args.requests, args.concurrency)
+        }
+    finally:
+        for server in servers:
+            server.should_exit = True
+
+    baseline = results["buffered"]["rps"]
+    print(
+        f"Body: {args.docs} transactions ({upstream.state.body_size / 1024:.0f} KB), "
+        f"{args.requests} requests, concurrency {args.concurrency}"
+    )
+    print("| path      | req/s  | p50, ms | p99, ms | peak alloc per request, KB | speedup |")
+    print("|-----------|--------|---------|---------|----------------------------|---------|")
+    for mode, r in results.items():
+        print(
+            f"| {mode:<9} | {r['rps']:6.1f} | {r['p50_ms']:7.2f} | {r['p99_ms']:7.2f} "
+            f"| {r['peak_kb']:26.0f} | {r['rps'] / baseline:6.1f}x |"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="API Gateway proxy throughput benchmark")
+    parser.add_argument("--docs", type=int, default=1000, help="Transactions in the upstream response")
+    parser.add_argument("--requests", type=int, default=500, help="Measured requests per path")
+    parser.add_argument("--concurrency", type=int, default=10, help="Concurrent client requests")
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк входа в API Gateway под конкурентной нагрузкой
+
+Пароли хранятся хешами (argon2id или bcrypt), проверка хеша - десятки миллисекунд CPU.
+Сравниваются:
+  * inline      - наивный вариант: проверка хеша прямо в цикле событий шлюза
+  * thread-pool - CredentialStore: проверка в ограниченном пуле потоков
+
+--concurrency клиентов выполняют POST /auth/login, одновременно отдельный клиент
+каждые 10 мс запрашивает GET /auth/me с уже выданным токеном (остальной трафик шлюза).
+Результат - входов в секунду, задержка входа и задержка остального трафика.
+
+Шлюз запускается uvicorn в фоновом потоке на локальном порту, запросы идут по настоящим сокетам.
+
+Запуск:
+    PYTHONPATH=src/common:src/api-gateway python performance_tests/benchmarks/bench_login.py
+"""
+
+import argparse
+import asyncio
+import socket
+import statistics
+import threading
+import time
+
+import httpx
+import uvicorn
+
+from api_gateway.config import settings
+from api_gateway.main import app as gateway_app
+from api_gateway.services.credential_store import credential_store
+
+CREDENTIALS = {"username": "admin", "password": "secret"}
+
+
+async def run_inline(func, *args):
+    """Проверка хеша в цикле событий (без пула потоков)"""
+    return func(*args)
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def serve(app, port: int) -> uvicorn.Server:
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning", access_log=False))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.05)
+    return server
+
+
+def percentile(values, q: float) -> float:
+    ordered = sorted(values)
+    return ordered[max(0, int(len(ordered) * q) - 1)]
+
+
+async def measure(base: str, logins: int, concurrency: int) -> dict:
+    limits = httpx.Limits(max_connections=concurrency + 1)
+    async with httpx.AsyncClient(limits=limits, timeout=60) as client:
+        login = await client.post(f"{base}/auth/login", json=CREDENTIALS)
+        headers = {"Authorization": f"Bearer {login.json()['access_token']}"}
+
+        login_latencies, probe_latencies = [], []
+        remaining = [logins]
+        done = asyncio.Event()
+
+        async def login_worker():
+            while remaining[0] > 0:
+                remaining[0] -= 1
+                start = time.perf_counter()
+                response = await client.post(f"{base}/auth/login", json=CREDENTIALS)
+                response.raise_for_status()
+                login_latencies.append((time.perf_counter() - start) * 1000)
+
+        async def probe():
+            while not done.is_set():
+                start = time.perf_counter()
+                response = await client.get(f"{base}/auth/me", headers=headers)
+                response.raise_for_status()
+                probe_latencies.append((time.perf_counter() - start) * 1000)
+                await asyncio.sleep(0.01)
+
+        probe_task = asyncio.create_task(probe())
+        start = time.perf_counter()
+        await asyncio.gather(*(login_worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - start
+        done.set()
+        await probe_task
+
+    return {
+        "logins_per_second": logins / elapsed,
+        "login_p50_ms": statistics.median(login_latencies),
+        "login_p99_ms": percentile(login_latencies, 0.99),
+        "other_p50_ms": statistics.median(probe_latencies),
+        "other_p99_ms": percentile(probe_latencies, 0.99),
+        "other_max_ms": max(probe_latencies)
+    }
+
+
+async def run(args) -> None:
+    port = free_port()
+    settings.upstream_health_check_interval = 0  # planning-service в бенчмарке не участвует
+    server = serve(gateway_app, port)
+    base = f"http://127.0.0.1:{port}"
+
+    results = {}
+    try:
+        original_run = credential_store._run
+        for mode in ("inline", "thread-pool"):
+            credential_store._run = run_inline if mode == "inline" else original_run
+            results[mode] = await measure(base, args.logins, args.concurrency)
+        credential_store._run = original_run
+    finally:
+        server.should_exit = True
+
+    print(
+        f"Scheme: {credential_store.context.default_scheme()}, {settings.password_hash_workers} workers; "
+        f"{args.logins} logins, concurrency {args.concurrency}"
+    )
+    print("| mode        | logins/s | login p50, ms | login p99, ms | other p50, ms | other p99, ms | other max, ms |")
+    print("|-------------|----------|---------------|---------------|---------------|---------------|---------------|")
+    for mode, r in results.items():
+        print(
+            f"| {mode:<11} | {r['logins_per_second']:8.1f} | {r['login_p50_ms']:13.2f} | {r['login_p99_ms']:13.2f} "
+            f"| {r['other_p50_ms']:13.2f} | {r['other_p99_ms']:13.2f} | {r['other_max_ms']:13.2f} |"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="API Gateway login throughput benchmark")
+    parser.add_argument("--logins", type=int, default=200, help="Logins per mode")
+    parser.add_argument("--concurrency", type=int, default=10, help="Concurrent login clients")
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
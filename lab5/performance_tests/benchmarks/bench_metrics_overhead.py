@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк накладных расходов метрик Prometheus и трассировки
+
+Приложение FastAPI с одним маршрутом /items/{item_id} (внутри - одна операция хранилища
+через observe_store) вызывается напрямую через ASGI, без сети и сервера, чтобы расходы
+не терялись на фоне сокетов:
+  * plain           - без middleware
+  * metrics         - с MetricsMiddleware (счетчик, гистограмма и in-flight по шаблону маршрута)
+  * metrics+tracing - дополнительно TracingMiddleware (трасса, span, Server-Timing; без экспорта)
+
+Дополнительно измеряются стоимость observe_store (обертка операции хранилища) и время
+формирования ответа /metrics.
+
+Запуск:
+    PYTHONPATH=src/common:src/api-gateway python performance_tests/benchmarks/bench_metrics_overhead.py
+"""
+
+import argparse
+import asyncio
+import statistics
+import time
+
+from fastapi import FastAPI
+
+from api_gateway.metrics import MetricsMiddleware, metrics_response, observe_store
+from api_gateway.tracing import TracingMiddleware
+
+
+MODES = ("plain", "metrics", "metrics+tracing")
+
+
+def make_app(mode: str) -> FastAPI:
+    app = FastAPI()
+    if mode != "plain":
+        app.add_middleware(MetricsMiddleware)
+    if mode == "metrics+tracing":
+        app.add_middleware(TracingMiddleware)
+
+    @app.get("/items/{item_id}")
+    async def item(item_id: int):
+        with observe_store("redis", "get"):
+            pass
+        return {"id": item_id}
+
+    return app
+
+
+async def call(app, item_id: int) -> None:
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "GET", "scheme": "http",
+        "path": f"/items/{item_id}", "raw_path": f"/items/{item_id}".encode(), "root_path": "",
+        "query_string": b"", "headers": [(b"host", b"bench")], "client": ("127.0.0.1", 1), "server": ("bench", 80)
+    }
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        if message["type"] == "http.response.start":
+            assert message["status"] == 200
+
+    await app(scope, receive, send)
+
+
+async def measure(app, requests: int, distinct_ids: int) -> float:
+    """Микросекунды на запрос"""
+    start = time.perf_counter()
+    for i in range(requests):
+        await call(app, i % distinct_ids)
+    return (time.perf_counter() - start) / requests * 1e6
+
+
+async def run(args) -> None:
+    apps = {mode: make_app(mode) for mode in MODES}
+    rounds = {mode: [] for mode in apps}
+    for app in apps.values():
+        await measure(app, 500, args.distinct_ids)  # прогрев
+    # Варианты чередуются, чтобы колебания частоты CPU и фоновой нагрузки влияли на оба одинаково
+    for _ in range(args.rounds):
+        for mode, app in apps.items():
+            rounds[mode].append(await measure(app, args.requests, args.distinct_ids))
+    results = {mode: statistics.median(values) for mode, values in rounds.items()}
+
+    start = time.perf_counter()
+    for _ in range(args.requests):
+        with observe_store("redis", "get"):
+            pass
+    store_us = (time.perf_counter() - start) / args.requests * 1e6
+
+    start = time.perf_counter()
+    for _ in range(100):
+        body = metrics_response().body
+    scrape_ms = (time.perf_counter() - start) / 100 * 1000
+
+    print(f"{args.requests} requests per round, median of {args.rounds} rounds, {args.distinct_ids} distinct item ids")
+    print("| mode            | us/request | overhead, us | overhead, % |")
+    print("|-----------------|------------|--------------|-------------|")
+    for mode, us in results.items():
+        overhead = us - results["plain"]
+        print(f"| {mode:<15} | {us:10.1f} | {overhead:12.1f} | {overhead / results['plain'] * 100:11.1f} |")
+    print()
+    print(f"observe_store: {store_us:.2f} us/operation; /metrics scrape: {scrape_ms:.2f} ms ({len(body)} bytes)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Prometheus metrics and tracing overhead benchmark")
+    parser.add_argument("--requests", type=int, default=2000, help="Requests per round")
+    parser.add_argument("--rounds", type=int, default=15, help="Alternating rounds per mode")
+    parser.add_argument("--distinct-ids", type=int, default=1000, help="Distinct path parameters (route template cache)")
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк наборов индексов коллекции транзакций MongoDB
+
+Сравниваются два набора индексов на одной и той же синтетической нагрузке:
+  * legacy   - исходный набор из init-transactions.js (одиночные индексы по
+               plan_id, user_id, type, category, created_at, amount и составные)
+  * declared - набор DECLARED_INDEXES из planning_service.database.mongo_indexes (ESR)
+
+Для каждого набора измеряются пропускная способность вставки (insert_one, как в
+create_transaction) и задержка типичных запросов сервиса. Работает на отдельной
+базе данных (по умолчанию transactions_bench), которая удаляется после запуска.
+
+Запуск (нужен работающий MongoDB, например make up):
+    PYTHONPATH=src/common:src/planning-service python performance_tests/benchmarks/bench_mongo_indexes.py \\
+        --url mongodb://localhost:27017 --docs 100000
+"""
+
+import argparse
+import random
+import statistics
+import time
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List
+
+from pymongo import ASCENDING, DESCENDING, IndexModel, MongoClient
+
+from planning_service.database.mongo_indexes import DECLARED_INDEXES
+from planning_service.services.transaction_mongo_service import TRANSACTIONS_SORT
+
+LEGACY_INDEXES = [
+    IndexModel([("plan_id", ASCENDING)]),
+    IndexModel([("user_id", ASCENDING)]),
+    IndexModel([("type", ASCENDING)]),
+    IndexModel([("category", ASCENDING)]),
+    IndexModel([("created_at", DESCENDING)]),
+    IndexModel([("amount", ASCENDING)]),
+    IndexModel([("user_id", ASCENDING), ("plan_id", ASCENDING)]),
+    IndexModel([("type", ASCENDING), ("category", ASCENDING)]),
+    IndexModel([("created_at", DESCENDING), ("type", ASCENDING)]),
+    IndexModel([("user_id", ASCENDING), ("created_at", DESCENDING), ("_id", DESCENDING)]),
+]
+
+INDEX_SETS = {
+    "legacy": LEGACY_INDEXES,
+    "declared": DECLARED_INDEXES["transactions"],
+}
+
+CATEGORIES = ["food", "housing", "salary", "transportation", "utilities", "entertainment"]
+
+
+def make_doc(users: int, now: datetime, i: int) -> dict:
+    return {
+        "plan_id": random.randint(1, 20),
+        "type": random.choice(["income", "expense"]),
+        "amount": round(random.uniform(1, 5000), 2),
+        "description": f"Transaction {i}",
+        "category": random.choice(CATEGORIES),
+        "user_id": f"user{random.randint(1, users)}",
+        "created_at": now - timedelta(seconds=i)
+    }
+
+
+def query_shapes(users: int) -> Dict[str, Callable]:
+    """Формы запросов TransactionMongoService (страница из 100 документов)"""
+    now = datetime.utcnow()
+
+    def user():
+        return f"user{random.randint(1, users)}"
+
+    return {
+        "list": lambda c: list(c.find({"user_id": user()}).sort(TRANSACTIONS_SORT).limit(100)),
+        "list_plan": lambda c: list(c.find({"user_id": user(), "plan_id": random.randint(1, 20)}).sort(TRANSACTIONS_SORT).limit(100)),
+        "list_category": lambda c: list(c.find({"user_id": user(), "category": random.choice(CATEGORIES)}).sort(TRANSACTIONS_SORT).limit(100)),
+        "list_type_amount": lambda c: list(c.find({
+            "user_id": user(), "type": "expense", "amount": {"$gte": 1000}
+        }).sort(TRANSACTIONS_SORT).limit(100)),
+        "list_date_range": lambda c: list(c.find({
+            "user_id": user(), "created_at": {"$gte": now - timedelta(days=7)}
+        }).sort(TRANSACTIONS_SORT).limit(100)),
+        "plan_totals": lambda c: list(c.aggregate([
+            {"$match": {"user_id": user(), "plan_id": random.randint(1, 20)}},
+            {"$group": {"_id": "$type", "total_amount": {"$sum": "$amount"}, "count": {"$sum": 1}}}
+        ])),
+    }
+
+
+def bench_inserts(collection, count: int, users: int) -> float:
+    """Вставка по одному документу; возвращает документов в секунду"""
+    now = datetime.utcnow()
+    start = time.perf_counter()
+    for i in range(count):
+        collection.insert_one(make_doc(users, now, i))
+    return count / (time.perf_counter() - start)
+
+
+def bench_queries(collection, users: int, repeat: int) -> Dict[str, dict]:
+    results = {}
+    for name, query in query_shapes(users).items():
+        query(collection)  # прогрев
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            query(collection)
+            timings.append((time.perf_counter() - start) * 1000)
+        timings.sort()
+        results[name] = {
+            "p50_ms": statistics.median(timings),
+            "p95_ms": timings[int(len(timings) * 0.95) - 1],
+        }
+    return results
+
+
+def run(database, index_set: List[IndexModel], args) -> dict:
+    collection = database["transactions"]
+    collection.drop()
+    collection.create_indexes(index_set)
+
+    # Основной объем загружается батчами, вставка по одному измеряется поверх него
+    now = datetime.utcnow()
+    for offset in range(0, args.docs, 10000):
+        batch = [make_doc(args.users, now, offset + i) for i in range(min(10000, args.docs - offset))]
+        collection.insert_many(batch, ordered=False)
+
+    inserts = bench_inserts(collection, args.inserts, args.users)
+    queries = bench_queries(collection, args.users, args.repeat)
+    stats = database.command("collStats", "transactions")
+    collection.drop()
+    return {"inserts_per_s": inserts, "queries": queries, "index_size_mb": stats["totalIndexSize"] / 2 ** 20}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="MongoDB index set benchmark")
+    parser.add_argument("--url", default="mongodb://localhost:27017", help="MongoDB URL")
+    parser.add_argument("--database", default="transactions_bench", help="Scratch database (dropped afterwards)")
+    parser.add_argument("--docs", type=int, default=100000, help="Preloaded documents")
+    parser.add_argument("--users", type=int, default=100, help="Distinct user_id values")
+    parser.add_argument("--inserts", type=int, default=5000, help="Measured single-document inserts")
+    parser.add_argument("--repeat", type=int, default=200, help="Runs per query shape")
+    args = parser.parse_args()
+
+    random.seed(42)
+    client = MongoClient(args.url)
+    database = client[args.database]
+    try:
+        results = {name: run(database, index_set, args) for name, index_set in INDEX_SETS.items()}
+    finally:
+        client.drop_database(args.database)
+        client.close()
+
+    legacy, declared = results["legacy"], results["declared"]
+    print(f"Documents: {args.docs}, users: {args.users}, measured inserts: {args.inserts}, query runs: {args.repeat}")
+    print("| metric | legacy | declared |")
+    print("|--------|--------|----------|")
+    print(f"| indexes | {len(LEGACY_INDEXES)} | {len(INDEX_SETS['declared'])} |")
+    print(f"| index size, MB | {legacy['index_size_mb']:.1f} | {declared['index_size_mb']:.1f} |")
+    print(f"| inserts/s | {legacy['inserts_per_s']:.0f} | {declared['inserts_per_s']:.0f} |")
+    for name in legacy["queries"]:
+        l, d = legacy["queries"][name], declared["queries"][name]
+        print(
+            f"| {name} p50/p95, ms | {l['p50_ms']:.2f} / {l['p95_ms']:.2f} "
+            f"| {d['p50_ms']:.2f} / {d['p95_ms']:.2f} |"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк сериализации страницы транзакций MongoDB (1000 документов)
+
+Сравниваются три пути формирования ответа GET /transactions-mongo:
+  * full   - TransactionMongo.from_mongo для каждого документа + повторная
+             валидация response_model и json.dumps (как делает FastAPI)
+  * lean   - документы как есть через TypeAdapter.dump_json (параметр lean=true)
+  * fields - то же, что lean, но по проекции из трех полей (fields=id,amount,created_at)
+
+Запуск:
+    PYTHONPATH=src/common:src/planning-service python performance_tests/benchmarks/bench_transactions_serialization.py
+"""
+
+import argparse
+import json
+import random
+import statistics
+import time
+from datetime import datetime, timedelta
+from typing import List
+
+from bson import ObjectId
+from pydantic import TypeAdapter
+
+from planning_service.models.mongodb_models import TransactionMongo, dump_transactions_json
+
+# Путь FastAPI: валидация и сериализация списка моделей по response_model
+transactions_adapter = TypeAdapter(List[TransactionMongo])
+
+CATEGORIES = ["food", "housing", "salary", "transportation", "utilities", "entertainment"]
+
+
+def make_docs(count: int) -> List[dict]:
+    """Синтетические документы в том виде, в котором их возвращает PyMongo"""
+    now = datetime.utcnow()
+    return [
+        {
+            "_id": ObjectId(),
+            "plan_id": random.randint(1, 20),
+            "type": random.choice(["income", "expense"]),
+            "amount": round(random.uniform(1, 5000), 2),
+            "description": f"Transaction {i}",
+            "category": random.choice(CATEGORIES),
+            "user_id": "admin",
+            "created_at": now - timedelta(minutes=i)
+        }
+        for i in range(count)
+    ]
+
+
+def full_path(docs: List[dict]) -> bytes:
+    transactions = [TransactionMongo.from_mongo(dict(doc)) for doc in docs]
+    # FastAPI повторно валидирует ответ по response_model и сериализует через json.dumps
+    validated = transactions_adapter.validate_python(transactions)
+    content = transactions_adapter.dump_python(validated, mode="json", by_alias=True)
+    return json.dumps(content, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def lean_path(docs: List[dict]) -> bytes:
+    return dump_transactions_json(dict(doc) for doc in docs)
+
+
+def fields_path(docs: List[dict]) -> bytes:
+    projected = ({"_id": doc["_id"], "amount": doc["amount"], "created_at": doc["created_at"]} for doc in docs)
+    return dump_transactions_json(projected)
+
+
+def measure(func, docs: List[dict], repeat: int) -> dict:
+    func(docs)  # прогрев
+    timings = []
+    size = 0
+    for _ in range(repeat):
+        start = time.perf_counter()
+        size = len(func(docs))
+        timings.append((time.perf_counter() - start) * 1000)
+    return {
+        "mean_ms": statistics.mean(timings),
+        "p50_ms": statistics.median(timings),
+        "min_ms": min(timings),
+        "bytes": size
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Transactions serialization benchmark")
+    parser.add_argument("--docs", type=int, default=1000, help="Documents per page")
+    parser.add_argument("--repeat", type=int, default=50, help="Number of measured runs")
+    args = parser.parse_args()
+
+    docs = make_docs(args.docs)
+    results = {
+        "full": measure(full_path, docs, args.repeat),
+        "lean": measure(lean_path, docs, args.repeat),
+        "fields": measure(fields_path, docs, args.repeat)
+    }
+
+    baseline = results["full"]["mean_ms"]
+    print(f"Page size: {args.docs} documents, {args.repeat} runs")
+    print("| mode   | mean, ms | p50, ms | min, ms | body, bytes | speedup |")
+    print("|--------|----------|---------|---------|-------------|---------|")
+    for mode, r in results.items():
+        print(
+            f"| {mode:<6} | {r['mean_ms']:8.2f} | {r['p50_ms']:7.2f} | {r['min_ms']:7.2f} "
+            f"| {r['bytes']:11d} | {baseline / r['mean_ms']:6.1f}x |"
+        )
+
+
+if __name__ == "__main__":
+    main()
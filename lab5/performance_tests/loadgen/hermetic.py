@@ -0,0 +1,127 @@
+"""
+Изолированное окружение для нагрузочных прогонов без Docker: API Gateway и Planning Service
+в одном процессе, запросы между ними и от генератора - через ASGI, без сети
+
+Хранилища по умолчанию тоже в памяти процесса:
+  * PostgreSQL - in-memory режим планов и транзакций Planning Service (USE_IN_MEMORY);
+  * MongoDB    - mongomock (MONGODB_URL=mongomock://);
+  * Redis      - fakeredis (REDIS_URL=fakeredis://).
+Любое из них можно заменить локальным сервером, передав его URL. Оба приложения запускаются
+со своими lifespan, как в контейнерах; настройки сервисов возвращаются при выходе.
+
+    async with HermeticEnvironment(redis_url="redis://localhost:6379/0") as environment:
+        async with environment.client() as client:
+            response = await client.get(f"{GATEWAY_URL}/health")
+
+Модули сервисов должны быть в PYTHONPATH (src/common, src/api-gateway и src/planning-service).
+"""
+
+import os
+import sys
+from contextlib import AsyncExitStack
+from typing import Any, Dict, List, Optional, Tuple
+
+import httpx
+
+GATEWAY_URL = "http://api-gateway"
+PLANNING_URL = "http://planning-service"
+
+
+class HermeticEnvironment:
+    def __init__(
+        self,
+        postgres_url: Optional[str] = None,
+        mongodb_url: Optional[str] = None,
+        redis_url: Optional[str] = None
+    ):
+        self.postgres_url = postgres_url
+        self.mongodb_url = mongodb_url
+        self.redis_url = redis_url
+        self.gateway_app = None
+        self.planning_app = None
+        self._stack: Optional[AsyncExitStack] = None
+        self._restore: List[Tuple[Any, str, Any]] = []
+
+    def describe(self) -> Dict[str, str]:
+        """Какие хранилища использованы - для отчета генератора нагрузки"""
+        return {
+            "postgres": "local server" if self.postgres_url else "in-memory",
+            "mongodb": "local server" if self.mongodb_url else "mongomock",
+            "redis": "local server" if self.redis_url else "fakeredis"
+        }
+
+    def _override(self, settings, **values) -> None:
+        for name, value in values.items():
+            self._restore.append((settings, name, getattr(settings, name)))
+            setattr(settings, name, value)
+
+    def _import_planning(self):
+        # URL PostgreSQL читается при импорте модуля подключения, поэтому задается до импорта
+        connection = sys.modules.get("planning_service.database.connection")
+        if self.postgres_url:
+            if connection is not None and connection.DATABASE_URL != self.postgres_url:
+                raise RuntimeError("planning_service is already imported with another DATABASE_URL")
+            os.environ["DATABASE_URL"] = self.postgres_url
+
+        from planning_service.config import settings
+        from planning_service.main import app
+
+        self._override(
+            settings,
+            use_in_memory=not self.postgres_url,
+            mongodb_url=self.mongodb_url or "mongomock://",
+            redis_url=self.redis_url or "fakeredis://",
+            enable_cache=True
+        )
+        if not self.mongodb_url:
+            # mongomock не поддерживает $indexStats, а индексы в памяти ничего не ускоряют
+            self._override(settings, mongo_ensure_indexes=False)
+        return app
+
+    def _import_gateway(self):
+        from api_gateway.config import settings
+        from api_gateway.main import app
+
+        self._override(settings, planning_service_url=PLANNING_URL, planning_service_urls=[], upstream_dns_discovery=False)
+        return app
+
+    async def __aenter__(self) -> "HermeticEnvironment":
+        self.planning_app = self._import_planning()
+        self.gateway_app = self._import_gateway()
+
+        from api_gateway.config import settings as gateway_settings
+        from api_gateway.services.upstream_client import upstream_client
+
+        self._stack = AsyncExitStack()
+        try:
+            await self._stack.enter_async_context(self.planning_app.router.lifespan_context(self.planning_app))
+            # Общий клиент шлюза к planning-service ходит в приложение напрямую; lifespan шлюза его не пересоздает
+            upstream_client._client = httpx.AsyncClient(
+                transport=httpx.ASGITransport(app=self.planning_app),
+                timeout=gateway_settings.upstream_read_timeout
+            )
+            await self._stack.enter_async_context(self.gateway_app.router.lifespan_context(self.gateway_app))
+        except BaseException:
+            await self.__aexit__(*sys.exc_info())
+            raise
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        try:
+            if self._stack is not None:
+                await self._stack.aclose()
+                self._stack = None
+        finally:
+            for settings, name, value in reversed(self._restore):
+                setattr(settings, name, value)
+            self._restore.clear()
+
+    def mounts(self) -> Dict[str, httpx.AsyncBaseTransport]:
+        """Транспорты для httpx.AsyncClient(mounts=...): GATEWAY_URL и PLANNING_URL - приложения процесса"""
+        return {
+            GATEWAY_URL: httpx.ASGITransport(app=self.gateway_app),
+            PLANNING_URL: httpx.ASGITransport(app=self.planning_app)
+        }
+
+    def client(self, **kwargs) -> httpx.AsyncClient:
+        return httpx.AsyncClient(mounts=self.mounts(), **kwargs)
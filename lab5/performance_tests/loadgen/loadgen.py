@@ -0,0 +1,479 @@
+#!/usr/bin/env python3
+"""
+Генератор нагрузки по сценариям (asyncio + httpx) вместо wrk-скриптов
+
+Сценарий - JSON-файл (см. performance_tests/loadgen/scenarios):
+  * operations - смесь операций с весами: планы, транзакции PostgreSQL и MongoDB,
+    аналитика, инвалидация кеша; путь и тело - шаблоны с {user}, {plan_id}, {amount},
+    {type}, {category}, {seq}. Операции GET считаются чтением, остальные - записью;
+  * users - пользователи: login (вход через /auth/login шлюза, токены получаются и
+    обновляются автоматически) или x-user (запросы напрямую в Planning Service
+    с заголовком X-User); популярность пользователей - распределение Ципфа с zipf_s;
+  * keys - планов на пользователя (создаются перед замером, если их не хватает) и
+    распределение Ципфа популярности планов;
+  * arrival - открытая модель нагрузки: запросы отправляются с заданной частотой
+    (пуассоновский или равномерный поток) независимо от того, ответил ли сервис.
+    Задержка считается от запланированного момента отправки, поэтому отставание
+    генератора и очереди в сервисе не скрываются (coordinated omission).
+
+Задержки каждой операции копятся в HdrHistogram (микросекунды, 3 значащие цифры).
+Отчет - JSON (перцентили и закодированные гистограммы, их можно объединять и
+сравнивать между запусками) и Markdown; --compare печатает разницу с прошлым отчетом.
+
+Запуск:
+    python performance_tests/loadgen/loadgen.py performance_tests/loadgen/scenarios/gateway_mixed.json
+    python performance_tests/loadgen/loadgen.py performance_tests/loadgen/scenarios/gateway_mixed.json \\
+        --rate 300 --duration 60 --compare performance_tests/reports/gateway_mixed-20250101-120000.json
+
+С --hermetic оба сервиса запускаются в этом же процессе с хранилищами в памяти (hermetic.py),
+Docker не нужен; --postgres-url, --mongodb-url, --redis-url подключают локальные серверы:
+    PYTHONPATH=src/common:src/api-gateway:src/planning-service python performance_tests/loadgen/loadgen.py \\
+        performance_tests/loadgen/scenarios/gateway_mixed.json --hermetic --redis-url redis://localhost:6379/0
+"""
+
+import argparse
+import asyncio
+import bisect
+import itertools
+import json
+import random
+import re
+import time
+from collections import Counter
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+import httpx
+from hdrh.histogram import HdrHistogram
+
+# Диапазон гистограмм: от 1 мкс до 60 с, 3 значащие цифры
+HDR_LOWEST_US = 1
+HDR_HIGHEST_US = 60_000_000
+HDR_DIGITS = 3
+PERCENTILES = (50, 90, 99, 99.9)
+CATEGORIES = ("Food", "Transport", "Housing", "Salary", "Entertainment", "Health")
+PLACEHOLDER_RE = re.compile(r"\{(\w+)\}")
+
+
+def new_histogram() -> HdrHistogram:
+    return HdrHistogram(HDR_LOWEST_US, HDR_HIGHEST_US, HDR_DIGITS)
+
+
+class ZipfSampler:
+    """Индекс 0..n-1 с вероятностью, пропорциональной 1 / (индекс + 1) ** s; s = 0 - равномерно"""
+
+    def __init__(self, n: int, s: float, rng: random.Random):
+        self.rng = rng
+        self.cumulative = list(itertools.accumulate(1.0 / (rank ** s) for rank in range(1, n + 1)))
+
+    def sample(self) -> int:
+        return bisect.bisect_left(self.cumulative, self.rng.random() * self.cumulative[-1])
+
+
+@dataclass
+class Operation:
+    name: str
+    weight: float
+    method: str
+    path: str
+    service: str = "gateway"
+    json: Optional[Any] = None
+    params: Optional[Dict[str, Any]] = None
+
+    @property
+    def kind(self) -> str:
+        return "read" if self.method == "GET" else "write"
+
+
+@dataclass
+class Scenario:
+    name: str
+    operations: List[Operation]
+    description: str = ""
+    gateway_url: str = "http://localhost:8000"
+    planning_url: str = "http://localhost:8081"
+    users: Dict[str, Any] = field(default_factory=lambda: {
+        "auth": "login", "credentials": [{"username": "admin", "password": "secret"}], "zipf_s": 0.0
+    })
+    keys: Dict[str, Any] = field(default_factory=lambda: {"plans_per_user": 5, "zipf_s": 1.0})
+    arrival: Dict[str, Any] = field(default_factory=lambda: {"rate": 100, "duration": 30, "warmup": 5, "process": "poisson"})
+    max_in_flight: int = 1000
+    timeout: float = 10.0
+
+    @classmethod
+    def load(cls, path: Path) -> "Scenario":
+        data = json.loads(path.read_text())
+        data["operations"] = [Operation(**operation) for operation in data["operations"]]
+        scenario = cls(**data)
+        if scenario.users.get("auth", "login") == "x-user":
+            gateway_operations = [op.name for op in scenario.operations if op.service != "planning"]
+            if gateway_operations:
+                raise ValueError(f"x-user scenarios call the planning service only: {gateway_operations}")
+        return scenario
+
+
+class Identity:
+    """Пользователь сценария: заголовки для шлюза и Planning Service, его планы"""
+
+    def __init__(self, username: str, password: Optional[str] = None):
+        self.username = username
+        self.password = password
+        self.token: Optional[str] = None
+        self.plan_ids: List[int] = []
+
+    def headers(self, service: str) -> Dict[str, str]:
+        if service == "planning":
+            return {"X-User": self.username}
+        return {"Authorization": f"Bearer {self.token}"}
+
+
+class OperationStats:
+    def __init__(self, name: str, kind: str):
+        self.name = name
+        self.kind = kind
+        self.latency = new_histogram()  # от запланированного момента отправки до ответа
+        self.service_time = new_histogram()  # от фактической отправки до ответа
+        self.errors: Counter = Counter()
+
+    @staticmethod
+    def _record(histogram: HdrHistogram, seconds: float) -> None:
+        histogram.record_value(min(max(int(seconds * 1e6), HDR_LOWEST_US), HDR_HIGHEST_US))
+
+    def record(self, latency: float, service_time: float, error: Optional[str]) -> None:
+        self._record(self.latency, latency)
+        self._record(self.service_time, service_time)
+        if error is not None:
+            self.errors[error] += 1
+
+    def summary(self, duration: float) -> Dict[str, Any]:
+        count = self.latency.get_total_count()
+        return {
+            "kind": self.kind,
+            "count": count,
+            "rps": round(count / duration, 1) if duration else 0.0,
+            "errors": dict(self.errors),
+            "latency_ms": histogram_summary(self.latency),
+            "service_time_p99_ms": round(self.service_time.get_value_at_percentile(99) / 1000, 2),
+            "hdr": self.latency.encode().decode()
+        }
+
+
+def histogram_summary(histogram: HdrHistogram) -> Dict[str, float]:
+    summary = {f"p{p:g}": round(histogram.get_value_at_percentile(p) / 1000, 2) for p in PERCENTILES}
+    summary["max"] = round(histogram.get_max_value() / 1000, 2)
+    summary["mean"] = round(histogram.get_mean_value() / 1000, 2)
+    return summary
+
+
+def render(template: Any, variables: Dict[str, Any]) -> Any:
+    """Подстановка переменных в шаблон; строка из одного {name} заменяется значением с его типом"""
+    if isinstance(template, str):
+        match = PLACEHOLDER_RE.fullmatch(template)
+        if match:
+            return variables[match.group(1)]
+        return PLACEHOLDER_RE.sub(lambda m: str(variables[m.group(1)]), template)
+    if isinstance(template, dict):
+        return {key: render(value, variables) for key, value in template.items()}
+    if isinstance(template, list):
+        return [render(value, variables) for value in template]
+    return template
+
+
+class LoadGenerator:
+    def __init__(self, scenario: Scenario, seed: int):
+        self.scenario = scenario
+        self.rng = random.Random(seed)
+        self.seed = seed
+        self.stats = {op.name: OperationStats(op.name, op.kind) for op in scenario.operations}
+        self.weights = list(itertools.accumulate(op.weight for op in scenario.operations))
+        self.identities = self._identities()
+        self.user_sampler = ZipfSampler(len(self.identities), scenario.users.get("zipf_s", 0.0), self.rng)
+        self.plan_sampler = ZipfSampler(scenario.keys["plans_per_user"], scenario.keys.get("zipf_s", 0.0), self.rng)
+        self.sequence = itertools.count(1)
+        self.in_flight = 0
+        self.dropped = 0
+        self.max_schedule_lag = 0.0
+        self.client: Optional[httpx.AsyncClient] = None
+        self.environment: Dict[str, str] = {"mode": "external"}
+
+    def _identities(self) -> List[Identity]:
+        users = self.scenario.users
+        if users.get("auth", "login") == "x-user":
+            return [Identity(f"{users.get('prefix', 'loadtest-')}{i}") for i in range(users.get("count", 100))]
+        return [Identity(c["username"], c["password"]) for c in users["credentials"]]
+
+    def _url(self, service: str, path: str) -> str:
+        base = self.scenario.planning_url if service == "planning" else self.scenario.gateway_url
+        return base.rstrip("/") + path
+
+    async def _login(self, identity: Identity) -> None:
+        response = await self.client.post(
+            self._url("gateway", "/auth/login"),
+            json={"username": identity.username, "password": identity.password}
+        )
+        response.raise_for_status()
+        identity.token = response.json()["access_token"]
+
+    async def _ensure_plans(self, identity: Identity, service: str) -> None:
+        """Планы пользователя для операций с {plan_id}: существующие и недостающие новые"""
+        prefix = "" if service == "planning" else "/api"
+        response = await self.client.get(self._url(service, f"{prefix}/plans"), headers=identity.headers(service))
+        response.raise_for_status()
+        identity.plan_ids = [plan["id"] for plan in response.json()][:self.scenario.keys["plans_per_user"]]
+        while len(identity.plan_ids) < self.scenario.keys["plans_per_user"]:
+            response = await self.client.post(
+                self._url(service, f"{prefix}/plans"),
+                json={
+                    "title": f"Load test plan {len(identity.plan_ids) + 1}",
+                    "description": f"Created by loadgen for {identity.username}",
+                    "planned_income": 5000.0,
+                    "planned_expenses": 3000.0
+                },
+                headers=identity.headers(service)
+            )
+            response.raise_for_status()
+            identity.plan_ids.append(response.json()["id"])
+
+    async def setup(self) -> None:
+        service = "planning" if self.scenario.users.get("auth", "login") == "x-user" else "gateway"
+        semaphore = asyncio.Semaphore(20)
+
+        async def prepare(identity: Identity) -> None:
+            async with semaphore:
+                if service == "gateway":
+                    await self._login(identity)
+                await self._ensure_plans(identity, service)
+
+        await asyncio.gather(*(prepare(identity) for identity in self.identities))
+
+    def _variables(self, identity: Identity) -> Dict[str, Any]:
+        return {
+            "user": identity.username,
+            "plan_id": identity.plan_ids[self.plan_sampler.sample()],
+            "amount": round(self.rng.uniform(1, 500), 2),
+            "type": self.rng.choice(("income", "expense")),
+            "category": self.rng.choice(CATEGORIES),
+            "seq": next(self.sequence)
+        }
+
+    async def _issue(self, operation: Operation, intended: float, measured: bool) -> None:
+        identity = self.identities[self.user_sampler.sample()]
+        variables = self._variables(identity)
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        error = None
+        try:
+            response = await self.client.request(
+                operation.method,
+                self._url(operation.service, render(operation.path, variables)),
+                json=render(operation.json, variables),
+                params=render(operation.params, variables),
+                headers=identity.headers(operation.service)
+            )
+            if response.status_code >= 400:
+                error = str(response.status_code)
+                if response.status_code == 401 and operation.service == "gateway" and identity.password:
+                    await self._login(identity)
+        except httpx.HTTPError as exc:
+            error = type(exc).__name__
+        finally:
+            self.in_flight -= 1
+        if measured:
+            finished = loop.time()
+            self.stats[operation.name].record(finished - intended, finished - started, error)
+
+    async def run(self, mounts: Optional[Dict[str, httpx.AsyncBaseTransport]] = None) -> Dict[str, Any]:
+        arrival = self.scenario.arrival
+        rate, duration, warmup = arrival["rate"], arrival["duration"], arrival.get("warmup", 0)
+        limits = httpx.Limits(max_connections=self.scenario.max_in_flight, max_keepalive_connections=100)
+        async with httpx.AsyncClient(timeout=self.scenario.timeout, limits=limits, mounts=mounts) as self.client:
+            await self.setup()
+
+            loop = asyncio.get_running_loop()
+            tasks = set()
+            start = loop.time()
+            offset = 0.0
+            while True:
+                offset += self.rng.expovariate(rate) if arrival.get("process", "poisson") == "poisson" else 1.0 / rate
+                if offset >= warmup + duration:
+                    break
+                intended = start + offset
+                delay = intended - loop.time()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                else:
+                    self.max_schedule_lag = max(self.max_schedule_lag, -delay)
+
+                index = bisect.bisect_left(self.weights, self.rng.random() * self.weights[-1])
+                if self.in_flight >= self.scenario.max_in_flight:
+                    self.dropped += 1
+                    continue
+                self.in_flight += 1
+                task = asyncio.create_task(self._issue(self.scenario.operations[index], intended, offset >= warmup))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+            if tasks:
+                await asyncio.wait(tasks, timeout=self.scenario.timeout)
+
+        return self.report(duration)
+
+    def report(self, duration: float) -> Dict[str, Any]:
+        by_kind = {"read": new_histogram(), "write": new_histogram()}
+        for stats in self.stats.values():
+            by_kind[stats.kind].add(stats.latency)
+        total = sum(histogram.get_total_count() for histogram in by_kind.values())
+        errors = sum(sum(stats.errors.values()) for stats in self.stats.values())
+        return {
+            "scenario": self.scenario.name,
+            "description": self.scenario.description,
+            "started_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "config": {
+                "rate": self.scenario.arrival["rate"],
+                "duration": duration,
+                "warmup": self.scenario.arrival.get("warmup", 0),
+                "process": self.scenario.arrival.get("process", "poisson"),
+                "users": len(self.identities),
+                "users_zipf_s": self.scenario.users.get("zipf_s", 0.0),
+                "plans_per_user": self.scenario.keys["plans_per_user"],
+                "plans_zipf_s": self.scenario.keys.get("zipf_s", 0.0),
+                "seed": self.seed,
+                "environment": self.environment
+            },
+            "totals": {
+                "requests": total,
+                "rps": round(total / duration, 1),
+                "errors": errors,
+                "dropped": self.dropped,
+                "max_schedule_lag_ms": round(self.max_schedule_lag * 1000, 2)
+            },
+            "kinds": {
+                kind: {"count": histogram.get_total_count(), "latency_ms": histogram_summary(histogram)}
+                for kind, histogram in by_kind.items() if histogram.get_total_count()
+            },
+            "operations": {name: stats.summary(duration) for name, stats in self.stats.items()}
+        }
+
+
+def markdown(report: Dict[str, Any]) -> str:
+    config, totals = report["config"], report["totals"]
+    lines = [
+        f"## {report['scenario']} ({report['started_at']})",
+        "",
+        f"{config['rate']} req/s {config['process']}, {config['duration']} s (+{config['warmup']} s warmup), "
+        f"{config['users']} users (zipf s={config['users_zipf_s']}), {config['plans_per_user']} plans/user "
+        f"(zipf s={config['plans_zipf_s']}), seed {config['seed']}",
+        "",
+        "Environment: " + ", ".join(f"{key}={value}" for key, value in config.get("environment", {"mode": "external"}).items()),
+        "",
+        f"Requests: {totals['requests']} ({totals['rps']} req/s), errors: {totals['errors']}, "
+        f"dropped: {totals['dropped']}, max schedule lag: {totals['max_schedule_lag_ms']} ms",
+        "",
+        "| operation | kind | count | req/s | p50, ms | p90, ms | p99, ms | p99.9, ms | max, ms | errors |",
+        "|-----------|------|-------|-------|---------|---------|---------|-----------|---------|--------|",
+    ]
+    rows = [(name, op["kind"], op) for name, op in report["operations"].items()]
+    rows += [(f"**{kind}**", kind, {**summary, "rps": "", "errors": {}}) for kind, summary in report["kinds"].items()]
+    for name, kind, op in rows:
+        latency = op["latency_ms"]
+        errors = ", ".join(f"{code}: {count}" for code, count in op["errors"].items()) or "-"
+        lines.append(
+            f"| {name} | {kind} | {op['count']} | {op['rps']} | {latency['p50']} | {latency['p90']} | "
+            f"{latency['p99']} | {latency['p99.9']} | {latency['max']} | {errors} |"
+        )
+    return "\n".join(lines) + "\n"
+
+
+def compare(report: Dict[str, Any], baseline: Dict[str, Any]) -> str:
+    """Изменение p50/p99 и пропускной способности операций относительно прошлого отчета"""
+    lines = [f"## {report['scenario']}: {baseline['started_at']} -> {report['started_at']}", ""]
+    if baseline["scenario"] != report["scenario"] or baseline["config"]["rate"] != report["config"]["rate"]:
+        lines += [f"Baseline: {baseline['scenario']} at {baseline['config']['rate']} req/s - not the same workload", ""]
+    if baseline["config"].get("environment") != report["config"].get("environment"):
+        lines += ["Baseline ran in another environment (hermetic vs external or different stores)", ""]
+    lines += [
+        "| operation | p50, ms | p99, ms | req/s |",
+        "|-----------|---------|---------|-------|",
+    ]
+
+    def delta(old: float, new: float) -> str:
+        if not old:
+            return f"{new}"
+        return f"{old} -> {new} ({(new - old) / old * 100:+.1f}%)"
+
+    for name, op in report["operations"].items():
+        old = baseline["operations"].get(name)
+        if old is None or not old["count"]:
+            continue
+        lines.append(
+            f"| {name} | {delta(old['latency_ms']['p50'], op['latency_ms']['p50'])} | "
+            f"{delta(old['latency_ms']['p99'], op['latency_ms']['p99'])} | {delta(old['rps'], op['rps'])} |"
+        )
+    return "\n".join(lines) + "\n"
+
+
+async def run_hermetic(generator: LoadGenerator, args) -> Dict[str, Any]:
+    """Прогон сценария по сервисам, запущенным в этом процессе (см. hermetic.py)"""
+    from hermetic import GATEWAY_URL, PLANNING_URL, HermeticEnvironment
+
+    environment = HermeticEnvironment(args.postgres_url, args.mongodb_url, args.redis_url)
+    async with environment:
+        generator.scenario.gateway_url = GATEWAY_URL
+        generator.scenario.planning_url = PLANNING_URL
+        generator.environment = {"mode": "hermetic", **environment.describe()}
+        return await generator.run(mounts=environment.mounts())
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Scenario-based open-loop load generator")
+    parser.add_argument("scenario", type=Path, help="Scenario JSON file")
+    parser.add_argument("--rate", type=float, help="Arrival rate, requests per second")
+    parser.add_argument("--duration", type=float, help="Measured seconds")
+    parser.add_argument("--warmup", type=float, help="Seconds of load before measuring")
+    parser.add_argument("--users", type=int, help="Number of x-user identities")
+    parser.add_argument("--gateway-url", help="API Gateway base URL")
+    parser.add_argument("--planning-url", help="Planning Service base URL")
+    parser.add_argument("--seed", type=int, default=1, help="Random seed (arrivals, operation mix, users, keys)")
+    parser.add_argument("--report-dir", type=Path, default=Path("performance_tests/reports"), help="Report directory")
+    parser.add_argument("--compare", type=Path, help="Earlier JSON report to compare with")
+    parser.add_argument("--hgrm", action="store_true", help="Also write per-operation HdrHistogram percentile files (.hgrm)")
+    parser.add_argument("--hermetic", action="store_true", help="Run both services in this process with in-memory stores")
+    parser.add_argument("--postgres-url", help="With --hermetic: use this local PostgreSQL instead of the in-memory store")
+    parser.add_argument("--mongodb-url", help="With --hermetic: use this local MongoDB instead of mongomock")
+    parser.add_argument("--redis-url", help="With --hermetic: use this local Redis instead of fakeredis")
+    args = parser.parse_args()
+
+    scenario = Scenario.load(args.scenario)
+    for key in ("rate", "duration", "warmup"):
+        if getattr(args, key) is not None:
+            scenario.arrival[key] = getattr(args, key)
+    if args.users is not None:
+        scenario.users["count"] = args.users
+    if args.gateway_url:
+        scenario.gateway_url = args.gateway_url
+    if args.planning_url:
+        scenario.planning_url = args.planning_url
+
+    generator = LoadGenerator(scenario, args.seed)
+    if args.hermetic:
+        report = asyncio.run(run_hermetic(generator, args))
+    else:
+        report = asyncio.run(generator.run())
+
+    args.report_dir.mkdir(parents=True, exist_ok=True)
+    stem = args.report_dir / f"{scenario.name}-{time.strftime('%Y%m%d-%H%M%S')}"
+    stem.with_suffix(".json").write_text(json.dumps(report, indent=2))
+    text = markdown(report)
+    if args.compare:
+        text += "\n" + compare(report, json.loads(args.compare.read_text()))
+    stem.with_suffix(".md").write_text(text)
+    if args.hgrm:
+        for name, stats in generator.stats.items():
+            with open(f"{stem}-{name}.hgrm", "wb") as out:
+                stats.latency.output_percentile_distribution(out, 1000)
+    print(text)
+    print(f"Report: {stem}.json, {stem}.md")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+"""
+Синтетические данные для микробенчмарков Planning Service
+
+Данные имеют тот же вид, что и на горячих путях сервиса: документы MongoDB
+от PyMongo (ObjectId, datetime), строки планов и транзакций PostgreSQL, список
+планов после json-кеша Redis (даты - строки). Генератор с фиксированным seed,
+чтобы результаты запусков были сравнимы.
+"""
+
+import random
+from datetime import datetime, timedelta
+from typing import List
+
+from bson import ObjectId
+
+CATEGORIES = ["food", "housing", "salary", "transportation", "utilities", "entertainment"]
+BASE_TIME = datetime(2024, 1, 15, 10, 30)
+
+
+def make_plans(count: int) -> List[dict]:
+    """Строки budget_plans в том виде, в котором их возвращает plans_service"""
+    rng = random.Random(count)
+    return [
+        {
+            "id": i + 1,
+            "title": f"Budget plan {i}",
+            "description": f"Synthetic plan {i} for benchmarks",
+            "planned_income": round(rng.uniform(1000, 10000), 2),
+            "planned_expenses": round(rng.uniform(500, 8000), 2),
+            "user_id": "admin",
+            "created_at": BASE_TIME + timedelta(minutes=i),
+            "updated_at": BASE_TIME + timedelta(minutes=i, seconds=30)
+        }
+        for i in range(count)
+    ]
+
+
+def make_transactions(count: int) -> List[dict]:
+    """Строки transactions PostgreSQL одного плана"""
+    rng = random.Random(count)
+    return [
+        {
+            "id": i + 1,
+            "plan_id": 1,
+            "type": rng.choice(["income", "expense"]),
+            "amount": round(rng.uniform(1, 5000), 2),
+            "description": f"Transaction {i}",
+            "category": rng.choice(CATEGORIES),
+            "user_id": "admin",
+            "created_at": BASE_TIME - timedelta(minutes=i)
+        }
+        for i in range(count)
+    ]
+
+
+def make_mongo_docs(count: int) -> List[dict]:
+    """Документы коллекции transactions в том виде, в котором их возвращает PyMongo"""
+    rng = random.Random(count)
+    return [
+        {
+            "_id": ObjectId(),
+            "plan_id": rng.randint(1, 20),
+            "type": rng.choice(["income", "expense"]),
+            "amount": round(rng.uniform(1, 5000), 2),
+            "description": f"Transaction {i}",
+            "category": rng.choice(CATEGORIES),
+            "user_id": "admin",
+            "created_at": BASE_TIME - timedelta(minutes=i)
+        }
+        for i in range(count)
+    ]
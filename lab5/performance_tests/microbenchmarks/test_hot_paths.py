@@ -0,0 +1,97 @@
+"""
+Микробенчмарки CPU-работы Planning Service на один запрос
+
+Каждый горячий путь измеряется на синтетических данных нескольких размеров;
+группы pytest-benchmark совпадают с путями, размер - параметр теста.
+
+Запуск:
+    make perf-micro-baseline   # сохранить базовые результаты
+    make perf-micro            # сравнить с последними сохраненными, ошибка при регрессии
+"""
+
+import pytest
+
+from planning_service.database.redis import RedisManager
+from planning_service.models.mongodb_models import TransactionMongo
+from planning_service.models.pydantic_models import BudgetPlanResponse
+from planning_service.services.analytics_service import summarize_plan
+from planning_service.services.cache_service import CacheService
+
+from synthetic_data import make_mongo_docs, make_plans, make_transactions
+
+pytest.importorskip("pytest_benchmark")
+
+SIZES = [10, 100, 1000]
+
+
+class TestCacheKeys:
+    """CacheService._make_key: короткие ключи и ключи длиннее 200 символов (md5)"""
+
+    @pytest.mark.benchmark(group="cache_make_key")
+    @pytest.mark.parametrize("parts", [1, 3, 30])
+    def test_make_key(self, benchmark, parts):
+        cache = CacheService()
+        args = ["admin", *(f"filter-value-{i}" for i in range(parts - 1))]
+        key = benchmark(cache._make_key, "mongo:transactions", *args)
+        assert key.startswith("mongo:transactions:")
+
+
+class TestRedisSerialization:
+    """RedisManager.encode / decode списка планов (значение ключа plans:user:<user>)"""
+
+    @pytest.mark.benchmark(group="redis_encode")
+    @pytest.mark.parametrize("size", SIZES)
+    def test_encode(self, benchmark, size):
+        plans = make_plans(size)
+        data = benchmark(RedisManager.encode, plans)
+        assert data.startswith("[{")
+
+    @pytest.mark.benchmark(group="redis_decode")
+    @pytest.mark.parametrize("size", SIZES)
+    def test_decode(self, benchmark, size):
+        data = RedisManager.encode(make_plans(size))
+        plans = benchmark(RedisManager.decode, data)
+        assert len(plans) == size
+
+
+class TestMongoModels:
+    """TransactionMongo.from_mongo для страницы документов PyMongo"""
+
+    @pytest.mark.benchmark(group="transaction_mongo_from_mongo")
+    @pytest.mark.parametrize("size", [100, 1000, 10000])
+    def test_from_mongo(self, benchmark, size):
+        docs = make_mongo_docs(size)
+
+        # from_mongo заменяет ObjectId строкой на месте, поэтому каждый раунд - на копиях документов
+        def from_mongo():
+            return [TransactionMongo.from_mongo(dict(doc)) for doc in docs]
+
+        transactions = benchmark(from_mongo)
+        assert len(transactions) == size
+
+
+class TestPlanResponses:
+    """Валидация BudgetPlanResponse для списка планов из кеша (даты - строки ISO)"""
+
+    @pytest.mark.benchmark(group="budget_plan_response")
+    @pytest.mark.parametrize("size", SIZES)
+    def test_validate_cached_plans(self, benchmark, size):
+        cached = RedisManager.decode(RedisManager.encode(make_plans(size)))
+
+        def validate():
+            return [BudgetPlanResponse(**plan) for plan in cached]
+
+        plans = benchmark(validate)
+        assert plans[-1].id == size
+
+
+class TestAnalytics:
+    """analytics_service.summarize_plan: суммирование транзакций плана"""
+
+    @pytest.mark.benchmark(group="analytics_summarize")
+    @pytest.mark.parametrize("size", [100, 1000, 10000])
+    def test_summarize_plan(self, benchmark, size):
+        plan = make_plans(1)[0]
+        transactions = make_transactions(size)
+        analytics = benchmark(summarize_plan, 1, plan, transactions)
+        assert analytics.balance == pytest.approx(analytics.total_income - analytics.total_expenses)
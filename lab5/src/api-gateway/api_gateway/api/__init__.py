@@ -1,4 +1,6 @@
 from api_gateway.api.auth import router as auth_router
 from api_gateway.api.proxy import router as proxy_router
+from api_gateway.api.batch import router as batch_router
+from api_gateway.api.profiling import router as profiling_router
 
-__all__ = ["auth_router", "proxy_router"] 
\ No newline at end of file
+__all__ = ["auth_router", "proxy_router", "batch_router", "profiling_router"] 
\ No newline at end of file
@@ -1,9 +1,11 @@
 from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi.security import HTTPAuthorizationCredentials
 from datetime import timedelta
 
 from api_gateway.models.auth import Token, UserLogin, UserResponse
-from api_gateway.services.auth_service import authenticate_user, create_access_token
-from api_gateway.dependencies import get_current_user
+from api_gateway.services.auth_service import authenticate_user, create_access_token, revoke_token
+from api_gateway.services.credential_store import CredentialStoreBusy
+from api_gateway.dependencies import get_current_user, security
 from api_gateway.config import settings
 
 router = APIRouter(prefix="/auth", tags=["auth"])
@@ -29,7 +31,14 @@ async def login(user_credentials: UserLogin):
     }
     ```
     """
-    user = authenticate_user(user_credentials.username, user_credentials.password)
+    try:
+        user = await authenticate_user(user_credentials.username, user_credentials.password)
+    except CredentialStoreBusy as e:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Too many concurrent logins, retry later",
+            headers={"Retry-After": str(e.retry_after)},
+        )
     if not user:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -38,7 +47,7 @@ async def login(user_credentials: UserLogin):
         )
     access_token_expires = timedelta(minutes=settings.access_token_expire_minutes)
     access_token = create_access_token(
-        data={"sub": user.username}, expires_delta=access_token_expires
+        data={"sub": user.username, "ver": user.token_version}, expires_delta=access_token_expires
     )
     return {"access_token": access_token, "token_type": "bearer"}
 
@@ -58,4 +67,24 @@ async def read_users_me(current_user: UserResponse = Depends(get_current_user)):
     }
     ```
     """
-    return current_user 
\ No newline at end of file
+    return current_user
+
+@router.post("/logout")
+async def logout(
+    credentials: HTTPAuthorizationCredentials = Depends(security),
+    current_user: UserResponse = Depends(get_current_user)
+):
+    """
+    Revoke the current access token
+    
+    The token is rejected by the gateway until it expires, even though its signature stays valid.
+    
+    Example response:
+    ```json
+    {
+        "message": "Token revoked"
+    }
+    ```
+    """
+    revoke_token(credentials.credentials)
+    return {"message": "Token revoked"}
@@ -0,0 +1,48 @@
+from fastapi import APIRouter, Depends
+
+from api_gateway.dependencies import get_current_user
+from api_gateway.models.auth import UserResponse
+from api_gateway.models.batch import BatchRequest, BatchResponse
+from api_gateway.services.batch_service import execute_batch
+
+router = APIRouter(prefix="/api", tags=["batch"])
+
+
+@router.post("/batch", response_model=BatchResponse, response_model_exclude_none=True)
+async def batch(batch_request: BatchRequest, current_user: UserResponse = Depends(get_current_user)):
+    """
+    Execute several API calls in one request
+
+    The token is checked once; sub-requests go to the planning service concurrently,
+    an item waits only for the items it references. A reference `{id.field}` is replaced
+    with a value from the response of an earlier item, `{id.*.field}` runs the item once
+    for every element of that list. Each item gets its own status; an item whose
+    dependency failed gets 424.
+
+    Example request:
+    ```json
+    {
+        "requests": [
+            {"id": "plans", "path": "/api/plans"},
+            {"id": "analytics", "path": "/api/plans/{plans.*.id}/analytics"},
+            {"id": "recent", "path": "/api/transactions-mongo", "params": {"limit": 5}}
+        ]
+    }
+    ```
+
+    Example response:
+    ```json
+    {
+        "results": [
+            {"id": "plans", "status": 200, "body": [{"id": 1, "name": "Monthly Budget"}]},
+            {
+                "id": "analytics",
+                "status": 200,
+                "items": [{"id": "analytics[0]", "status": 200, "body": {"plan_id": 1, "balance": 700.0}}]
+            },
+            {"id": "recent", "status": 200, "body": []}
+        ]
+    }
+    ```
+    """
+    return await execute_batch(current_user.username, batch_request.requests)
@@ -53,13 +53,14 @@ async def get_plan_analytics(plan_id: int, current_user: UserResponse = Depends(
     return await proxy_service.get_plan_analytics(current_user.username, plan_id)
 
 
-# Простое проксирование для всех MongoDB endpoints
+# Потоковое проксирование всех MongoDB endpoints: тела и заголовки передаются без разбора,
+# большие списки и выгрузки не накапливаются в памяти шлюза
 @router.api_route("/transactions-mongo/{path:path}", methods=["GET", "POST", "PUT", "DELETE"])
 async def proxy_mongo_transactions(path: str, request: Request, current_user: UserResponse = Depends(get_current_user)):
-    return await proxy_service.proxy_mongo_request(request, current_user.username, f"/transactions-mongo/{path}")
+    return await proxy_service.proxy_stream_request(request, current_user.username, f"/transactions-mongo/{path}")
 
 
 # Проксирование для корневого endpoint MongoDB транзакций
 @router.api_route("/transactions-mongo", methods=["GET", "POST"])
 async def proxy_mongo_transactions_root(request: Request, current_user: UserResponse = Depends(get_current_user)):
-    return await proxy_service.proxy_mongo_request(request, current_user.username, "/transactions-mongo") 
\ No newline at end of file
+    return await proxy_service.proxy_stream_request(request, current_user.username, "/transactions-mongo")
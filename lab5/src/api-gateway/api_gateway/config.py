@@ -1,5 +1,6 @@
 from pydantic_settings import BaseSettings
 from pydantic import ConfigDict
+from typing import Dict, List, Tuple
 
 
 class Settings(BaseSettings):
@@ -7,9 +8,143 @@ class Settings(BaseSettings):
     secret_key: str = "your-secret-key-here-change-this-in-production"
     algorithm: str = "HS256"
     access_token_expire_minutes: int = 30
+    token_cache_enabled: bool = True  # кешировать проверенные токены до их exp
+    token_cache_max_size: int = 10000
+    
+    # Хеширование паролей (проверка в ограниченном пуле потоков, устаревшие хеши обновляются при входе)
+    password_hash_scheme: str = "argon2"  # argon2 (нужен argon2-cffi, иначе bcrypt) | bcrypt
+    password_argon2_time_cost: int = 2
+    password_argon2_memory_cost: int = 19456  # KiB
+    password_argon2_parallelism: int = 1
+    password_bcrypt_rounds: int = 12
+    password_hash_workers: int = 4  # потоков проверки паролей
+    password_hash_max_pending: int = 64  # проверок в очереди, сверх них вход отвечает 503
     
     # Planning Service
     planning_service_url: str = "http://planning-service:8080"
+    planning_service_urls: List[str] = []  # реплики (JSON-список); пусто - planning_service_url
+    upstream_dns_discovery: bool = False  # каждый адрес хоста planning_service_url - отдельная реплика
+    upstream_balancing: str = "round_robin"  # round_robin | least_outstanding | consistent_hash (по пользователю)
+    upstream_hash_virtual_nodes: int = 100  # точек кольца на реплику для consistent_hash
+    upstream_health_check_interval: float = 5.0  # период активных проверок, секунды; 0 - не проверять
+    upstream_health_check_path: str = "/health/live"  # не должен обращаться к хранилищам
+    upstream_health_check_timeout: float = 2.0
+    upstream_unhealthy_threshold: int = 2  # неудачных проверок подряд до вывода реплики
+    upstream_outlier_consecutive_failures: int = 5  # ошибок/5xx подряд до пассивного исключения
+    upstream_outlier_base_ejection_seconds: float = 30.0  # умножается на число исключений
+    upstream_outlier_max_ejection_percent: int = 50
+    
+    # Пул HTTP-клиента к planning-service
+    upstream_max_connections: int = 100
+    upstream_max_keepalive_connections: int = 50
+    upstream_keepalive_expiry: float = 30.0  # сколько секунд хранится простаивающее соединение
+    upstream_connect_timeout: float = 5.0
+    upstream_read_timeout: float = 30.0
+    upstream_write_timeout: float = 30.0
+    upstream_pool_timeout: float = 5.0  # ожидание свободного соединения пула
+    upstream_http2: bool = False  # нужен необязательный пакет h2 (httpx[http2])
+    
+    # Дедлайны, повторы и хеджирование вызовов planning-service
+    upstream_default_deadline: float = 10.0  # секунд до заголовков ответа
+    # Префикс пути шлюза -> дедлайн в секундах; выбирается самый длинный совпавший префикс
+    upstream_route_deadlines: Dict[str, float] = {
+        "/api/plans": 5.0,
+        "/api/transactions": 5.0,
+        "/api/transactions-mongo": 10.0,
+        "/api/transactions-mongo/export": 30.0
+    }
+    upstream_retry_attempts: int = 2  # дополнительные попытки GET после сетевых ошибок и 502/503/504
+    upstream_retry_base_delay_ms: float = 50.0  # задержка с полным джиттером: uniform(0, base * 2^attempt)
+    upstream_retry_budget_ratio: float = 0.1  # повторов и хеджей на исходный запрос
+    upstream_retry_budget_min_per_second: float = 5.0
+    upstream_hedge_enabled: bool = True  # вторая попытка GET, если первая медленнее квантиля
+    upstream_hedge_quantile: float = 0.95
+    upstream_hedge_min_delay_ms: float = 5.0
+    
+    # Кеш ответов шлюза для GET-маршрутов
+    response_cache_backend: str = "none"  # none | memory | redis
+    response_cache_redis_url: str = "redis://redis:6379/1"
+    response_cache_max_entries: int = 10000  # для бэкенда memory
+    response_cache_max_body_bytes: int = 1048576  # ответы больше порога проходят потоком без кеширования
+    # Префикс пути -> TTL в секундах; выбирается самый длинный совпавший префикс, 0 - не кешировать
+    response_cache_routes: Dict[str, int] = {
+        "/api/plans": 30,
+        "/api/transactions": 30,
+        "/api/transactions-mongo": 30,
+        "/api/transactions-mongo/export": 0
+    }
+    
+    # Ограничение частоты: token bucket на пользователя и на пару пользователь-маршрут
+    rate_limit_backend: str = "none"  # none | memory | redis
+    rate_limit_redis_url: str = "redis://redis:6379/2"
+    rate_limit_user_rate: float = 50.0  # запросов в секунду на пользователя для маршрутов /api
+    rate_limit_user_burst: int = 100
+    # Префикс пути -> (запросов в секунду, всплеск) на пользователя; выбирается самый длинный совпавший префикс
+    rate_limit_routes: Dict[str, Tuple[float, int]] = {
+        "/api/transactions-mongo": (20.0, 40),
+        "/api/batch": (5.0, 10)
+    }
+    
+    # Circuit breaker на группу маршрутов planning-service (/plans, /transactions, /transactions-mongo)
+    circuit_breaker_enabled: bool = True
+    circuit_breaker_window_size: int = 20  # последних вызовов для расчета долей
+    circuit_breaker_minimum_calls: int = 10  # вызовов в окне, прежде чем цепь может разомкнуться
+    circuit_breaker_failure_rate_threshold: float = 50.0  # процент сетевых ошибок, дедлайнов и 5xx
+    circuit_breaker_slow_call_duration_ms: float = 2000.0
+    circuit_breaker_slow_call_rate_threshold: float = 80.0  # процент вызовов медленнее порога выше
+    circuit_breaker_open_seconds: float = 10.0  # столько отказывать сразу, затем пробные вызовы (half-open)
+    circuit_breaker_half_open_calls: int = 3  # пробных вызовов, которые все должны пройти для замыкания цепи
+    circuit_breaker_fallback_enabled: bool = False  # отдавать последний успешный ответ GET при отказе
+    circuit_breaker_fallback_max_age: float = 300.0  # секунды
+    circuit_breaker_fallback_max_entries: int = 10000
+    
+    # Адаптивный лимит параллельных вызовов planning-service (AIMD по задержке ответов)
+    adaptive_concurrency_enabled: bool = True
+    adaptive_concurrency_initial: int = 50
+    adaptive_concurrency_min: int = 5
+    adaptive_concurrency_max: int = 100  # не больше upstream_max_connections
+    adaptive_concurrency_latency_target_ms: float = 500.0  # более медленные ответы уменьшают лимит
+    adaptive_concurrency_backoff: float = 0.9  # множитель уменьшения
+    
+    # Пакетные запросы (POST /api/batch)
+    batch_max_requests: int = 50  # подзапросов в пакете
+    batch_max_fanout: int = 100  # вызовов от одного элемента, перебирающего ссылку
+    batch_max_concurrency: int = 10  # параллельных вызовов planning-service на пакет
+    
+    # Сжатие ответов по Accept-Encoding
+    compression_enabled: bool = True
+    compression_min_size: int = 1024  # ответы меньше порога отдаются без сжатия
+    compression_encodings: List[str] = ["zstd", "br", "gzip"]  # порядок предпочтения; zstd/br - если установлены
+    compression_gzip_level: int = 6  # 1-9
+    compression_brotli_level: int = 4  # 0-11
+    compression_zstd_level: int = 3  # 1-22
+    
+    # Метрики Prometheus (GET /metrics)
+    metrics_enabled: bool = True
+    metrics_event_loop_interval: float = 0.5  # период замера задержки цикла событий, 0 - не замерять
+    metrics_event_loop_stall_ms: float = 0  # блокировка цикла дольше порога записывается со стеком, 0 - не отслеживать
+    metrics_event_loop_stall_history: int = 50  # последние блокировки в отчете о цикле событий
+    metrics_event_loop_stack_depth: int = 30  # кадров стека в записи о блокировке
+    
+    # Трассировка: передача X-Request-ID и W3C traceparent, span и заголовок Server-Timing
+    tracing_enabled: bool = True
+    tracing_service_name: str = "api-gateway"
+    tracing_exporter: str = "none"  # none | file (строки OTLP/JSON) | otlp (OTLP/HTTP JSON)
+    tracing_file_path: str = "traces/api-gateway.jsonl"
+    tracing_otlp_endpoint: str = "http://localhost:4318/v1/traces"
+    tracing_sample_ratio: float = 1.0  # доля экспортируемых новых трасс; для входящего traceparent решает он сам
+    tracing_export_interval: float = 1.0  # период отправки пачек span, секунды
+    tracing_max_queue: int = 10000  # span в очереди экспорта, сверх нее отбрасываются самые старые
+    tracing_server_timing: bool = True
+    
+    # Профилирование запросов администраторов (заголовок X-Profile или ?profile=, GET /admin/profiles)
+    profiling_enabled: bool = True
+    profiling_profiler: str = "auto"  # auto (pyinstrument, если установлен) | pyinstrument | cprofile
+    profiling_interval: float = 0.001  # интервал сэмплирования pyinstrument, секунды
+    profiling_sample_rate: int = 0  # профилировать каждый N-й запрос в сводный профиль маршрута, 0 - не сэмплировать
+    profiling_store_size: int = 20  # сохраненные профили (X-Profile: store), сверх них удаляются самые старые
+    profiling_max_stacks: int = 5000  # различных стеков на маршрут, остальные учитываются как [other]
+    profiling_report_lines: int = 60  # функций в отчете cProfile
     
     # API Gateway
     api_gateway_host: str = "0.0.0.0"
@@ -1,17 +1,26 @@
 from fastapi import Depends, HTTPException, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 
-from api_gateway.services.auth_service import get_current_user as get_user_from_token
+from api_gateway.services.auth_service import authenticate_token
 from api_gateway.models.auth import UserResponse
 
 security = HTTPBearer()
 
 async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)) -> UserResponse:
-    user = get_user_from_token(credentials.credentials)
+    user = authenticate_token(credentials.credentials)
     if user is None:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Could not validate credentials",
             headers={"WWW-Authenticate": "Bearer"},
         )
-    return UserResponse(id=user.id, username=user.username, is_admin=user.is_admin) 
\ No newline at end of file
+    return user 
+
+
+async def get_current_admin(current_user: UserResponse = Depends(get_current_user)) -> UserResponse:
+    if not current_user.is_admin:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Admin privileges required",
+        )
+    return current_user
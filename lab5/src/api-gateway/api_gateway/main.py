@@ -1,21 +1,120 @@
-from fastapi import FastAPI
+import math
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+from contextlib import asynccontextmanager
 
 from api_gateway.config import settings
-from api_gateway.api import auth_router, proxy_router
+from api_gateway.metrics import MetricsMiddleware, event_loop_monitor, metrics_response, state_collector
+from api_gateway.tracing import TracingMiddleware, span_exporter
+from api_gateway.profiling import ProfilingMiddleware, profile_store
+from api_gateway.api import auth_router, proxy_router, batch_router, profiling_router
+from api_gateway.services.upstream_client import upstream_client
+from api_gateway.services.upstream_pool import upstream_pool
+from api_gateway.services.token_cache import token_cache
+from api_gateway.services.credential_store import credential_store
+from api_gateway.services.compression import CompressionMiddleware, compression_stats
+from api_gateway.services.response_cache import ResponseCacheMiddleware, response_cache
+from api_gateway.services.rate_limiter import RateLimitMiddleware, rate_limiter
+from api_gateway.services.concurrency_limiter import UpstreamOverloaded, concurrency_limiter
+from api_gateway.services.upstream_policy import UpstreamDeadlineExceeded, upstream_policy
+from api_gateway.services.circuit_breaker import CircuitOpen, circuit_breakers, last_known_good
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Общий пул соединений к planning-service на все время жизни приложения
+    await upstream_client.start()
+    # Активные проверки реплик planning-service в фоне
+    await upstream_pool.start()
+    await event_loop_monitor.start()
+    await span_exporter.start()
+    yield
+    await span_exporter.close()
+    await event_loop_monitor.close()
+    await upstream_pool.close()
+    await upstream_client.close()
+    await response_cache.close()
+    await rate_limiter.close()
+    credential_store.close()
+
 
 app = FastAPI(
     title="API Gateway", 
     description="Budget Planning System API Gateway", 
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
+# Сжатие внутри кеша: в кеше хранятся уже сжатые тела (поле кеша учитывает Accept-Encoding)
+app.add_middleware(CompressionMiddleware)
+app.add_middleware(ResponseCacheMiddleware)
+# Добавленный последним middleware выполняется первым: лимит проверяется до кеша и маршрутов
+app.add_middleware(RateLimitMiddleware)
+# Метрики снаружи всех middleware: учитываются и ответы лимитера и кеша
+app.add_middleware(MetricsMiddleware)
+# Трасса запроса открывается первой: в Server-Timing входят все middleware
+app.add_middleware(TracingMiddleware)
+# Профилирование снаружи всех middleware: в профиль запроса попадает вся его обработка
+app.add_middleware(ProfilingMiddleware)
+
+state_collector.add_cache("token", token_cache.stats)
+state_collector.add_cache("response", response_cache.stats)
+state_collector.add_pool("planning-service", upstream_client.pool_usage)
+
 app.include_router(auth_router)
 app.include_router(proxy_router)
+app.include_router(batch_router)
+app.include_router(profiling_router)
+
+
+@app.exception_handler(UpstreamOverloaded)
+async def upstream_overloaded_handler(request: Request, exc: UpstreamOverloaded):
+    return JSONResponse(
+        status_code=503,
+        content={"detail": "Service overloaded, retry later"},
+        headers={"Retry-After": str(exc.retry_after)}
+    )
+
+
+@app.exception_handler(CircuitOpen)
+async def circuit_open_handler(request: Request, exc: CircuitOpen):
+    return JSONResponse(
+        status_code=503,
+        content={"detail": "Service unavailable (circuit open)"},
+        headers={"Retry-After": str(max(1, math.ceil(exc.retry_after)))}
+    )
+
+
+@app.exception_handler(UpstreamDeadlineExceeded)
+async def upstream_deadline_handler(request: Request, exc: UpstreamDeadlineExceeded):
+    return JSONResponse(status_code=504, content={"detail": "Upstream deadline exceeded"})
 
 
 @app.get("/health")
 async def health_check():
-    return {"status": "healthy", "service": "api-gateway"}
+    return {
+        "status": "healthy",
+        "service": "api-gateway",
+        "upstream_pool": upstream_client.stats(),
+        "upstreams": upstream_pool.stats(),
+        "token_cache": token_cache.stats(),
+        "credential_store": credential_store.stats(),
+        "response_cache": response_cache.stats(),
+        "rate_limiter": rate_limiter.stats(),
+        "concurrency_limiter": concurrency_limiter.stats(),
+        "upstream_policy": upstream_policy.stats(),
+        "circuit_breakers": circuit_breakers.stats(),
+        "last_known_good": last_known_good.stats(),
+        "compression": compression_stats.stats(),
+        "tracing": span_exporter.stats(),
+        "profiling": profile_store.stats()
+    }
+
+
+@app.get("/metrics", include_in_schema=False)
+async def metrics():
+    """Метрики в формате Prometheus"""
+    return metrics_response()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,25 @@
+from budget_common import metrics
+
+from api_gateway.config import settings
+
+# Глобальный экземпляр метрик сервиса
+service_metrics = metrics.ServiceMetrics(settings)
+
+registry = service_metrics.registry
+http_requests_in_flight = service_metrics.http_requests_in_flight
+store_operation_duration = service_metrics.store_operation_duration
+observe_store = service_metrics.observe_store
+state_collector = service_metrics.state_collector
+event_loop_monitor = service_metrics.event_loop_monitor
+
+
+def metrics_response():
+    """Ответ GET /metrics в формате Prometheus"""
+    return service_metrics.response()
+
+
+class MetricsMiddleware(metrics.MetricsMiddleware):
+    """Метрики HTTP-запросов шлюза в реестре service_metrics"""
+
+    def __init__(self, app):
+        super().__init__(app, settings, service_metrics)
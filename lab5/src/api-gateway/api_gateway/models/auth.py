@@ -44,9 +44,10 @@ class UserResponse(BaseModel):
 class User(BaseModel):
     id: int = Field(...)
     username: str = Field(...)
-    password: str = Field(...)
     is_admin: bool = Field(False)
 
 
 class UserInDB(User):
-    hashed_password: str = Field(...) 
\ No newline at end of file
+    hashed_password: str = Field(...)
+    # Увеличивается при смене пароля: токены с прежней версией (claim ver) не принимаются
+    token_version: int = Field(0) 
\ No newline at end of file
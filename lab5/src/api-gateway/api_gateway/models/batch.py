@@ -0,0 +1,37 @@
+from pydantic import BaseModel, Field, ConfigDict
+from typing import Any, Dict, List, Literal, Optional
+
+
+class BatchSubRequest(BaseModel):
+    id: str = Field(..., pattern=r"^[A-Za-z_][A-Za-z0-9_-]*$", description="Item ID, used in references from later items")
+    method: Literal["GET", "POST", "PUT", "PATCH", "DELETE"] = Field("GET", description="HTTP method")
+    path: str = Field(..., description="Gateway path, e.g. /api/plans/{plans.*.id}")
+    params: Optional[Dict[str, Any]] = Field(None, description="Query parameters")
+    body: Optional[Any] = Field(None, description="JSON body for POST/PUT/PATCH")
+
+
+class BatchRequest(BaseModel):
+    requests: List[BatchSubRequest] = Field(..., min_length=1, description="Sub-requests in dependency order")
+
+    model_config = ConfigDict(
+        json_schema_extra={
+            "example": {
+                "requests": [
+                    {"id": "plans", "path": "/api/plans"},
+                    {"id": "details", "path": "/api/plans/{plans.*.id}"},
+                    {"id": "analytics", "path": "/api/plans/{plans.*.id}/analytics"}
+                ]
+            }
+        }
+    )
+
+
+class BatchItemResult(BaseModel):
+    id: str = Field(..., description="Item ID")
+    status: int = Field(..., description="HTTP status of the sub-request (highest status for a fan-out item)")
+    body: Optional[Any] = Field(None, description="Response body of the sub-request")
+    items: Optional[List["BatchItemResult"]] = Field(None, description="Per-value results of a fan-out item")
+
+
+class BatchResponse(BaseModel):
+    results: List[BatchItemResult] = Field(..., description="Results in request order")
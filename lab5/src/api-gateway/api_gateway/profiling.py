@@ -0,0 +1,25 @@
+from typing import Dict
+
+from budget_common import profiling
+
+from api_gateway.config import settings
+from api_gateway.services.auth_service import authenticate_token
+
+# Глобальный экземпляр хранилища профилей
+profile_store = profiling.ProfileStore(settings)
+
+
+def _is_admin(headers: Dict[bytes, bytes]) -> bool:
+    authorization = headers.get(b"authorization", b"").decode("latin-1")
+    scheme, _, token = authorization.partition(" ")
+    if scheme.lower() != "bearer" or not token:
+        return False
+    user = authenticate_token(token)
+    return user is not None and user.is_admin
+
+
+class ProfilingMiddleware(profiling.ProfilingMiddleware):
+    """Профилирование запросов шлюза; профилировать может администратор по JWT"""
+
+    def __init__(self, app):
+        super().__init__(app, settings, profile_store, _is_admin)
@@ -1,38 +1,20 @@
 from datetime import datetime, timedelta
 from typing import Optional
+from uuid import uuid4
 from jose import JWTError, jwt
-from passlib.context import CryptContext
 
 from api_gateway.config import settings
-from api_gateway.models.auth import User
+from api_gateway.models.auth import User, UserResponse
+from api_gateway.services.credential_store import credential_store
+from api_gateway.services.token_cache import token_cache
+from api_gateway.tracing import span
 
-users_db = {
-    "admin": User(
-        id=1,
-        username="admin",
-        password="secret",
-        is_admin=True
-    )
-}
+users_db = credential_store.users
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
-
-def verify_password(plain_password: str, hashed_password: str) -> bool:
-    return pwd_context.verify(plain_password, hashed_password)
-
-
-def get_password_hash(password: str) -> str:
-    return pwd_context.hash(password)
-
-
-def authenticate_user(username: str, password: str) -> Optional[User]:
-    user = users_db.get(username)
-    if not user:
-        return None
-    if user.password != password:
-        return None
-    return user
+async def authenticate_user(username: str, password: str) -> Optional[User]:
+    """Проверка пароля по хешу вне цикла событий (CredentialStoreBusy при переполненной очереди)"""
+    return await credential_store.authenticate(username, password)
 
 
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
@@ -41,7 +23,8 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
         expire = datetime.utcnow() + expires_delta
     else:
         expire = datetime.utcnow() + timedelta(minutes=15)
-    to_encode.update({"exp": expire})
+    # jti делает токены уникальными: отзыв одного входа не затрагивает другие, выданные в ту же секунду
+    to_encode.update({"exp": expire, "jti": uuid4().hex})
     encoded_jwt = jwt.encode(to_encode, settings.secret_key, algorithm=settings.algorithm)
     return encoded_jwt
 
@@ -62,6 +45,49 @@ def get_current_user(token: str) -> Optional[User]:
     if payload is None:
         return None
     
-    username = payload.get("sub")
-    user = users_db.get(username)
-    return user 
\ No newline at end of file
+    return _token_user(payload)
+
+
+def _token_user(payload: dict) -> Optional[User]:
+    """Пользователь токена; None, если он удален или токен выдан до смены пароля"""
+    user = users_db.get(payload.get("sub"))
+    if user is None or payload.get("ver", 0) != user.token_version:
+        return None
+    return user
+
+
+def authenticate_token(token: str) -> Optional[UserResponse]:
+    """Пользователь по токену: из кеша проверенных токенов или после полной проверки JWT"""
+    with span("authenticate_token", phase="auth"):
+        return _authenticate_token(token)
+
+
+def _authenticate_token(token: str) -> Optional[UserResponse]:
+    if token_cache.is_revoked(token):
+        return None
+    
+    cached_user = token_cache.get(token)
+    if cached_user is not None:
+        return cached_user
+    
+    payload = verify_token(token)
+    if payload is None:
+        return None
+    
+    user = _token_user(payload)
+    if user is None:
+        return None
+    
+    user_response = UserResponse(id=user.id, username=user.username, is_admin=user.is_admin)
+    if "exp" in payload:
+        token_cache.put(token, user_response, payload["exp"])
+    return user_response
+
+
+def revoke_token(token: str) -> bool:
+    """Отзыв токена до его exp; False, если токен и так недействителен"""
+    payload = verify_token(token)
+    if payload is None or "exp" not in payload:
+        return False
+    token_cache.revoke(token, payload["exp"])
+    return True
@@ -0,0 +1,246 @@
+import asyncio
+import re
+import httpx
+from fastapi import HTTPException
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import quote, unquote
+
+from api_gateway.config import settings
+from api_gateway.models.batch import BatchItemResult, BatchResponse, BatchSubRequest
+from api_gateway.services.circuit_breaker import CircuitOpen, circuit_breakers
+from api_gateway.services.concurrency_limiter import UpstreamOverloaded
+from api_gateway.services.response_cache import WRITE_METHODS, response_cache
+from api_gateway.services.upstream_client import upstream_client
+from api_gateway.services.upstream_policy import UpstreamDeadlineExceeded, upstream_policy
+from api_gateway.tracing import span
+
+# Ссылка на результат предыдущего элемента: {id.поле.0.поле}, * - перебор элементов списка
+REFERENCE = re.compile(r"\{([A-Za-z_][A-Za-z0-9_-]*)((?:\.[^.{}]+)*)\}")
+
+# Маршруты шлюза, доступные в пакете (/api/<корень>/... -> /<корень>/... planning-service)
+BATCH_ROOTS = {"plans", "transactions", "transactions-mongo"}
+
+
+class BatchReferenceError(Exception):
+    pass
+
+
+def has_dot_segments(path: str) -> bool:
+    """
+    Сегменты . и .. в пути (в том числе %2e): httpx нормализует их при сборке URL,
+    и запрос уходит мимо проверки корня, например /api/plans/../cache/clear -> /cache/clear
+    """
+    return any(unquote(segment) in (".", "..") for segment in path.split("?", 1)[0].split("/"))
+
+
+def upstream_endpoint(path: str) -> Optional[str]:
+    """Путь planning-service для пути шлюза или None, если маршрут не проксируется"""
+    if not path.startswith("/api/"):
+        return None
+    endpoint = path[len("/api"):]
+    root = endpoint[1:].split("/", 1)[0].split("?", 1)[0]
+    return endpoint if root in BATCH_ROOTS else None
+
+
+def _placeholders(value: Any) -> List[Tuple[str, str]]:
+    """Все ссылки (id, путь) в строках пути, параметров и тела"""
+    if isinstance(value, str):
+        return REFERENCE.findall(value)
+    if isinstance(value, dict):
+        return [ref for item in value.values() for ref in _placeholders(item)]
+    if isinstance(value, list):
+        return [ref for item in value for ref in _placeholders(item)]
+    return []
+
+
+def _item_placeholders(item: BatchSubRequest) -> List[Tuple[str, str]]:
+    return _placeholders([item.path, item.params, item.body])
+
+
+def validate_batch(requests: List[BatchSubRequest]) -> None:
+    """Проверка пакета до выполнения: размер, уникальность id, ссылки только на предыдущие элементы"""
+    if len(requests) > settings.batch_max_requests:
+        raise HTTPException(status_code=400, detail=f"Batch is limited to {settings.batch_max_requests} requests")
+
+    seen = set()
+    for item in requests:
+        if item.id in seen:
+            raise HTTPException(status_code=400, detail=f"Duplicate batch item id '{item.id}'")
+
+        placeholders = _item_placeholders(item)
+        for ref_id, _ in placeholders:
+            if ref_id not in seen:
+                raise HTTPException(
+                    status_code=400,
+                    detail=f"Item '{item.id}' references '{ref_id}', which is not an earlier item"
+                )
+        fan_out = {placeholder for placeholder in placeholders if "*" in placeholder[1].split(".")}
+        if len(fan_out) > 1:
+            raise HTTPException(status_code=400, detail=f"Item '{item.id}' may iterate over one reference only")
+        seen.add(item.id)
+
+
+def select(value: Any, path: str) -> Tuple[List[Any], bool]:
+    """Значения по пути ссылки; второй элемент - был ли перебор (*)"""
+    values, many = [value], False
+    for segment in path.split(".")[1:]:
+        selected = []
+        for current in values:
+            if segment == "*" and isinstance(current, list):
+                selected.extend(current)
+            elif isinstance(current, list) and segment.isdigit() and int(segment) < len(current):
+                selected.append(current[int(segment)])
+            elif isinstance(current, dict) and segment in current:
+                selected.append(current[segment])
+            else:
+                raise BatchReferenceError(f"'{segment}' not found")
+        many = many or segment == "*"
+        values = selected
+    return values, many
+
+
+def _substitute(value: Any, resolved: Dict[Tuple[str, str], Any], in_path: bool = False) -> Any:
+    """Подстановка значений ссылок; строка из одной ссылки в теле заменяется значением с его типом"""
+    if isinstance(value, str):
+        match = REFERENCE.fullmatch(value)
+        if match and not in_path:
+            return resolved[match.groups()]
+
+        def replace(m):
+            text = str(resolved[m.groups()])
+            return quote(text, safe="") if in_path else text
+
+        return REFERENCE.sub(replace, value)
+    if isinstance(value, dict):
+        return {key: _substitute(item, resolved) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_substitute(item, resolved) for item in value]
+    return value
+
+
+def _reference_value(result: BatchItemResult) -> Any:
+    """Значение элемента для ссылок: тело ответа или список тел для элемента с перебором"""
+    if result.items is not None:
+        return [item.body for item in result.items]
+    return result.body
+
+
+class BatchExecutor:
+    """
+    Выполнение пакета подзапросов одного пользователя.
+    Каждый элемент ждет только те элементы, на которые ссылается, независимые подзапросы
+    идут параллельно; одновременных запросов к planning-service не больше BATCH_MAX_CONCURRENCY.
+    """
+
+    def __init__(self, username: str):
+        self.username = username
+        self.semaphore = asyncio.Semaphore(settings.batch_max_concurrency)
+        self.tasks: Dict[str, asyncio.Task] = {}
+        self.writes_succeeded = False
+
+    async def run(self, requests: List[BatchSubRequest]) -> BatchResponse:
+        for item in requests:
+            self.tasks[item.id] = asyncio.create_task(self._run_item(item))
+        results = await asyncio.gather(*self.tasks.values())
+
+        # Подзапросы идут мимо middleware кеша ответов, поэтому кеш сбрасывается здесь
+        if self.writes_succeeded:
+            await response_cache.invalidate_user(self.username)
+        return BatchResponse(results=list(results))
+
+    async def _run_item(self, item: BatchSubRequest) -> BatchItemResult:
+        placeholders = _item_placeholders(item)
+        dependencies = {}
+        for ref_id in dict.fromkeys(ref_id for ref_id, _ in placeholders):
+            dependency = await self.tasks[ref_id]
+            if dependency.status >= 400:
+                return BatchItemResult(id=item.id, status=424, body={"detail": f"Dependency '{ref_id}' failed"})
+            dependencies[ref_id] = _reference_value(dependency)
+
+        if has_dot_segments(item.path):
+            return BatchItemResult(id=item.id, status=400, body={"detail": f"Invalid batch path '{item.path}'"})
+        endpoint = upstream_endpoint(item.path)
+        if endpoint is None:
+            return BatchItemResult(id=item.id, status=404, body={"detail": f"Unknown batch path '{item.path}'"})
+
+        try:
+            resolved, fan_out = {}, None
+            for placeholder in placeholders:
+                ref_id, path = placeholder
+                values, many = select(dependencies[ref_id], path)
+                if many:
+                    fan_out = (placeholder, values)
+                else:
+                    resolved[placeholder] = values[0]
+        except BatchReferenceError as e:
+            return BatchItemResult(id=item.id, status=400, body={"detail": f"Invalid reference in '{item.id}': {e}"})
+
+        if fan_out is None:
+            status, body = await self._call(item, endpoint, resolved)
+            return BatchItemResult(id=item.id, status=status, body=body)
+
+        placeholder, values = fan_out
+        if len(values) > settings.batch_max_fanout:
+            return BatchItemResult(
+                id=item.id,
+                status=400,
+                body={"detail": f"Item '{item.id}' expands to {len(values)} requests, limit is {settings.batch_max_fanout}"}
+            )
+
+        calls = await asyncio.gather(*(
+            self._call(item, endpoint, {**resolved, placeholder: value}) for value in values
+        ))
+        items = [BatchItemResult(id=f"{item.id}[{i}]", status=status, body=body) for i, (status, body) in enumerate(calls)]
+        return BatchItemResult(id=item.id, status=max((sub.status for sub in items), default=200), items=items)
+
+    async def _call(self, item: BatchSubRequest, endpoint: str, resolved: Dict[Tuple[str, str], Any]) -> Tuple[int, Any]:
+        path = _substitute(endpoint, resolved, in_path=True)
+        params = _substitute(item.params, resolved) if item.params else None
+        body = _substitute(item.body, resolved) if item.body is not None else None
+        # Значение ссылки может само быть сегментом . или ..
+        if has_dot_segments(path):
+            return 400, {"detail": f"Invalid batch path '{path}'"}
+
+        async def send(url: str) -> httpx.Response:
+            return await upstream_client.request(
+                method=item.method,
+                url=url,
+                headers={"X-User": self.username, "Accept-Encoding": "identity"},
+                params=params,
+                json=body
+            )
+
+        async with self.semaphore:
+            try:
+                with span("batch_call", phase="upstream", endpoint=path):
+                    response = await circuit_breakers.call(
+                        path, lambda: upstream_policy.call(item.method, path, send, key=self.username)
+                    )
+            except httpx.RequestError as e:
+                return 503, {"detail": f"Service unavailable: {str(e)}"}
+            except CircuitOpen:
+                return 503, {"detail": "Service unavailable (circuit open)"}
+            except UpstreamOverloaded:
+                return 503, {"detail": "Service overloaded, retry later"}
+            except UpstreamDeadlineExceeded:
+                return 504, {"detail": "Upstream deadline exceeded"}
+
+        if item.method in WRITE_METHODS and response.status_code < 400:
+            self.writes_succeeded = True
+        return response.status_code, _response_body(response)
+
+
+def _response_body(response: httpx.Response) -> Any:
+    if not response.content:
+        return None
+    if "json" in response.headers.get("content-type", ""):
+        try:
+            return response.json()
+        except ValueError:
+            pass
+    return response.text
+
+
+async def execute_batch(username: str, requests: List[BatchSubRequest]) -> BatchResponse:
+    validate_batch(requests)
+    return await BatchExecutor(username).run(requests)
@@ -0,0 +1,219 @@
+import time
+from collections import OrderedDict, deque
+from typing import Any, Awaitable, Callable, Deque, Dict, Hashable, Optional, Tuple
+
+import httpx
+
+from api_gateway.config import settings
+from api_gateway.services.upstream_policy import UpstreamDeadlineExceeded
+
+
+class CircuitOpen(Exception):
+    """Группа маршрутов planning-service отключена автоматическим выключателем"""
+
+    def __init__(self, group: str, retry_after: float):
+        super().__init__(f"Circuit for {group} is open")
+        self.group = group
+        self.retry_after = retry_after
+
+
+def route_group(endpoint: str) -> str:
+    """Группа маршрутов - первый сегмент пути planning-service: /plans/1/analytics -> /plans"""
+    return "/" + endpoint.lstrip("/").split("?", 1)[0].split("/", 1)[0]
+
+
+class CircuitBreaker:
+    """
+    Автоматический выключатель одной группы маршрутов.
+    closed: исходы последних CIRCUIT_BREAKER_WINDOW_SIZE вызовов; при доле ошибок (сетевые
+    ошибки, дедлайн, 5xx) или медленных вызовов выше порога цепь размыкается.
+    open: вызовы сразу отклоняются, без обращения к upstream, CIRCUIT_BREAKER_OPEN_SECONDS.
+    half_open: пропускается CIRCUIT_BREAKER_HALF_OPEN_CALLS пробных вызовов; все успешны -
+    цепь замыкается, любая ошибка или медленный ответ - снова размыкается.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, group: str):
+        self.group = group
+        self.state = self.CLOSED
+        self._outcomes: Deque[Tuple[bool, bool]] = deque(maxlen=settings.circuit_breaker_window_size)
+        self._opened_at = 0.0
+        self._probes = 0
+        self._probe_successes = 0
+        self.opened = 0
+        self.rejected = 0
+
+    def acquire(self) -> None:
+        """Разрешение на вызов; CircuitOpen, если цепь разомкнута или пробные вызовы уже идут"""
+        if self.state == self.OPEN:
+            remaining = self._opened_at + settings.circuit_breaker_open_seconds - time.monotonic()
+            if remaining > 0:
+                self.rejected += 1
+                raise CircuitOpen(self.group, remaining)
+            self.state = self.HALF_OPEN
+            self._probes = 0
+            self._probe_successes = 0
+
+        if self.state == self.HALF_OPEN:
+            if self._probes >= settings.circuit_breaker_half_open_calls:
+                self.rejected += 1
+                raise CircuitOpen(self.group, 1)
+            self._probes += 1
+
+    def release(self) -> None:
+        """Вызов завершился без исхода (отмена, локальный отказ шлюза): пробный слот возвращается"""
+        if self.state == self.HALF_OPEN and self._probes > 0:
+            self._probes -= 1
+
+    def record(self, seconds: float, ok: bool) -> None:
+        slow = seconds * 1000 >= settings.circuit_breaker_slow_call_duration_ms
+        if self.state == self.HALF_OPEN:
+            if not ok or slow:
+                self._open()
+                return
+            self._probe_successes += 1
+            if self._probe_successes >= settings.circuit_breaker_half_open_calls:
+                self.state = self.CLOSED
+                self._outcomes.clear()
+            return
+
+        if self.state == self.OPEN:
+            # Исход вызова, начатого до размыкания
+            return
+
+        self._outcomes.append((ok, slow))
+        if len(self._outcomes) < settings.circuit_breaker_minimum_calls:
+            return
+        if (
+            self.failure_rate() >= settings.circuit_breaker_failure_rate_threshold
+            or self.slow_call_rate() >= settings.circuit_breaker_slow_call_rate_threshold
+        ):
+            self._open()
+
+    def _open(self) -> None:
+        self.state = self.OPEN
+        self._opened_at = time.monotonic()
+        self._outcomes.clear()
+        self.opened += 1
+
+    def failure_rate(self) -> float:
+        if not self._outcomes:
+            return 0.0
+        return 100.0 * sum(1 for ok, _ in self._outcomes if not ok) / len(self._outcomes)
+
+    def slow_call_rate(self) -> float:
+        if not self._outcomes:
+            return 0.0
+        return 100.0 * sum(1 for _, slow in self._outcomes if slow) / len(self._outcomes)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "state": self.state,
+            "calls": len(self._outcomes),
+            "failure_rate": round(self.failure_rate(), 1),
+            "slow_call_rate": round(self.slow_call_rate(), 1),
+            "opened": self.opened,
+            "rejected": self.rejected
+        }
+
+
+class CircuitBreakerRegistry:
+    """Выключатели по группам маршрутов; создаются при первом вызове группы"""
+
+    def __init__(self):
+        self.breakers: Dict[str, CircuitBreaker] = {}
+
+    def get(self, endpoint: str) -> CircuitBreaker:
+        group = route_group(endpoint)
+        breaker = self.breakers.get(group)
+        if breaker is None:
+            breaker = self.breakers[group] = CircuitBreaker(group)
+        return breaker
+
+    async def call(self, endpoint: str, invoke: Callable[[], Awaitable[httpx.Response]]) -> httpx.Response:
+        """Вызов upstream через выключатель группы; ошибкой считаются сетевые ошибки, дедлайн и 5xx"""
+        if not settings.circuit_breaker_enabled:
+            return await invoke()
+
+        breaker = self.get(endpoint)
+        breaker.acquire()
+        start = time.monotonic()
+        try:
+            response = await invoke()
+        except httpx.PoolTimeout:
+            # Нехватка соединений в пуле шлюза - не отказ upstream
+            breaker.release()
+            raise
+        except (httpx.TransportError, UpstreamDeadlineExceeded):
+            breaker.record(time.monotonic() - start, False)
+            raise
+        except BaseException:
+            breaker.release()
+            raise
+        breaker.record(time.monotonic() - start, response.status_code < 500)
+        return response
+
+    def reset(self) -> None:
+        self.breakers.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        return {group: breaker.stats() for group, breaker in self.breakers.items()}
+
+
+# Глобальный экземпляр выключателей
+circuit_breakers = CircuitBreakerRegistry()
+
+
+class LastKnownGoodCache:
+    """
+    Последние успешные ответы GET-запросов в памяти процесса (LRU).
+    Отдаются, пока upstream недоступен, если включен CIRCUIT_BREAKER_FALLBACK_ENABLED
+    и ответ не старше CIRCUIT_BREAKER_FALLBACK_MAX_AGE.
+    """
+
+    def __init__(self):
+        self._entries: "OrderedDict[Hashable, Tuple[float, Any]]" = OrderedDict()
+        self.served = 0
+
+    @staticmethod
+    def key(username: Optional[str], endpoint: str, params: Optional[Dict[str, Any]]) -> Hashable:
+        return username, endpoint, tuple(sorted((params or {}).items()))
+
+    def put(self, key: Hashable, body: Any) -> None:
+        if not settings.circuit_breaker_fallback_enabled:
+            return
+        self._entries[key] = (time.monotonic(), body)
+        self._entries.move_to_end(key)
+        while len(self._entries) > settings.circuit_breaker_fallback_max_entries:
+            self._entries.popitem(last=False)
+
+    def get(self, key: Hashable) -> Optional[Tuple[float, Any]]:
+        """(возраст в секундах, тело) или None"""
+        if not settings.circuit_breaker_fallback_enabled:
+            return None
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        age = time.monotonic() - entry[0]
+        if age > settings.circuit_breaker_fallback_max_age:
+            del self._entries[key]
+            return None
+        self.served += 1
+        return age, entry[1]
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": settings.circuit_breaker_fallback_enabled,
+            "entries": len(self._entries),
+            "served": self.served
+        }
+
+
+# Глобальный экземпляр последних успешных ответов
+last_known_good = LastKnownGoodCache()
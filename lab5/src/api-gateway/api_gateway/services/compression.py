@@ -0,0 +1,13 @@
+from budget_common import compression
+
+from api_gateway.config import settings
+
+# Глобальный экземпляр счетчиков сжатия
+compression_stats = compression.CompressionStats(settings)
+
+
+class CompressionMiddleware(compression.CompressionMiddleware):
+    """Сжатие ответов шлюза по настройкам COMPRESSION_*"""
+
+    def __init__(self, app):
+        super().__init__(app, settings, compression_stats)
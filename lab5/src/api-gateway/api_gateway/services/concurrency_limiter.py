@@ -0,0 +1,90 @@
+import time
+from typing import Any, Dict
+
+from api_gateway.config import settings
+
+
+class UpstreamOverloaded(Exception):
+    """Запрос к planning-service отклонен адаптивным лимитом параллельности"""
+
+    def __init__(self, retry_after: int = 1):
+        super().__init__("Upstream concurrency limit reached")
+        self.retry_after = retry_after
+
+
+class AdaptiveConcurrencyLimiter:
+    """
+    Адаптивный лимит одновременных запросов шлюза к planning-service (AIMD).
+    Пока задержка upstream ниже целевой, лимит растет на 1 за каждые limit успешных
+    запросов; при медленном ответе, ошибке 5xx или сетевой ошибке лимит умножается на
+    backoff (не чаще раза за целевую задержку). Запросы сверх лимита сразу получают 503,
+    а не ждут в очереди перегруженного upstream.
+    """
+
+    def __init__(
+        self,
+        enabled: bool = True,
+        initial_limit: int = 50,
+        min_limit: int = 5,
+        max_limit: int = 100,
+        latency_target_ms: float = 500.0,
+        backoff: float = 0.9
+    ):
+        self.enabled = enabled
+        self.limit = float(initial_limit)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.latency_target = latency_target_ms / 1000
+        self.backoff = backoff
+        self.in_flight = 0
+        self.rejected = 0
+        self.decreases = 0
+        self._last_decrease = 0.0
+
+    def acquire(self) -> None:
+        """Занять слот или отклонить запрос (UpstreamOverloaded)"""
+        if self.enabled and self.in_flight >= int(self.limit):
+            self.rejected += 1
+            raise UpstreamOverloaded()
+        self.in_flight += 1
+
+    def release(self) -> None:
+        self.in_flight -= 1
+
+    def observe(self, latency: float, ok: bool) -> None:
+        """Учет задержки (до получения заголовков ответа) и исхода запроса"""
+        if not self.enabled:
+            return
+
+        if not ok or latency > self.latency_target:
+            now = time.monotonic()
+            if now - self._last_decrease >= self.latency_target:
+                self.limit = max(float(self.min_limit), self.limit * self.backoff)
+                self.decreases += 1
+                self._last_decrease = now
+        elif self.in_flight >= int(self.limit) / 2:
+            # Рост только когда лимит действительно используется
+            self.limit = min(float(self.max_limit), self.limit + 1 / self.limit)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": self.enabled,
+            "limit": int(self.limit),
+            "min_limit": self.min_limit,
+            "max_limit": self.max_limit,
+            "in_flight": self.in_flight,
+            "rejected": self.rejected,
+            "decreases": self.decreases,
+            "latency_target_ms": self.latency_target * 1000
+        }
+
+
+# Глобальный экземпляр лимитера
+concurrency_limiter = AdaptiveConcurrencyLimiter(
+    enabled=settings.adaptive_concurrency_enabled,
+    initial_limit=settings.adaptive_concurrency_initial,
+    min_limit=settings.adaptive_concurrency_min,
+    max_limit=settings.adaptive_concurrency_max,
+    latency_target_ms=settings.adaptive_concurrency_latency_target_ms,
+    backoff=settings.adaptive_concurrency_backoff
+)
@@ -0,0 +1,151 @@
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional
+
+from passlib.context import CryptContext
+from passlib.hash import argon2
+
+from api_gateway.config import settings
+from api_gateway.models.auth import UserInDB
+from api_gateway.services.token_cache import token_cache
+
+logger = logging.getLogger(__name__)
+
+# Хеш пароля "secret" (bcrypt); при первом входе перевыпускается с текущей схемой и параметрами
+_ADMIN_PASSWORD_HASH = "$2b$12$0WHdZXTfnsnOhtC9xjsp.u7a38vQN0HoHwqzPX3/RKkkielh.1F/."
+
+
+class CredentialStoreBusy(Exception):
+    """Очередь проверки паролей заполнена, вход нужно повторить позже"""
+
+    def __init__(self, retry_after: int = 1):
+        self.retry_after = retry_after
+
+
+def make_password_context() -> CryptContext:
+    """
+    Контекст хеширования: новые хеши - PASSWORD_HASH_SCHEME с текущими параметрами,
+    хеши другой схемы или с более слабыми параметрами проверяются и помечаются к перевыпуску
+    """
+    scheme = settings.password_hash_scheme
+    if scheme == "argon2" and not argon2.has_backend():
+        logger.warning("argon2-cffi is not installed, passwords are hashed with bcrypt")
+        scheme = "bcrypt"
+    return CryptContext(
+        schemes=[scheme] + [other for other in ("argon2", "bcrypt") if other != scheme],
+        default=scheme,
+        deprecated="auto",
+        argon2__time_cost=settings.password_argon2_time_cost,
+        argon2__min_rounds=settings.password_argon2_time_cost,
+        argon2__memory_cost=settings.password_argon2_memory_cost,
+        argon2__parallelism=settings.password_argon2_parallelism,
+        bcrypt__rounds=settings.password_bcrypt_rounds,
+        bcrypt__min_rounds=settings.password_bcrypt_rounds
+    )
+
+
+class CredentialStore:
+    """
+    Учетные данные пользователей шлюза: хеши паролей в памяти процесса.
+    Проверка хеша занимает десятки миллисекунд CPU, поэтому выполняется в ограниченном
+    пуле потоков (argon2-cffi и bcrypt отпускают GIL) и не останавливает цикл событий;
+    если проверок в очереди больше PASSWORD_HASH_MAX_PENDING, вход сразу отклоняется.
+    Хеш устаревшей схемы или с устаревшими параметрами перевыпускается при успешном входе.
+    """
+
+    def __init__(self, users: Dict[str, UserInDB]):
+        self.users = users
+        self.context = make_password_context()
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._dummy_hash: Optional[str] = None
+        self.pending = 0
+        self.verified = 0
+        self.rejected = 0
+        self.rehashed = 0
+        self.busy = 0
+
+    @property
+    def executor(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(
+                max_workers=settings.password_hash_workers, thread_name_prefix="password-hash"
+            )
+        return self._executor
+
+    async def _run(self, func: Callable, *args) -> Any:
+        if self.pending >= settings.password_hash_max_pending:
+            self.busy += 1
+            raise CredentialStoreBusy()
+        self.pending += 1
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self.executor, func, *args)
+        finally:
+            self.pending -= 1
+
+    def _verify_unknown(self, password: str) -> bool:
+        # Проверка с фиктивным хешем: время ответа не выдает, существует ли пользователь
+        if self._dummy_hash is None:
+            self._dummy_hash = self.context.hash("dummy-password")
+        self.context.verify(password, self._dummy_hash)
+        return False
+
+    async def authenticate(self, username: str, password: str) -> Optional[UserInDB]:
+        user = self.users.get(username)
+        if user is None:
+            await self._run(self._verify_unknown, password)
+            self.rejected += 1
+            return None
+
+        valid, new_hash = await self._run(self.context.verify_and_update, password, user.hashed_password)
+        if not valid:
+            self.rejected += 1
+            return None
+
+        self.verified += 1
+        if new_hash is not None:
+            user.hashed_password = new_hash
+            self.rehashed += 1
+        return user
+
+    def set_password(self, username: str, password: str) -> None:
+        """
+        Новый хеш пароля пользователя (синхронно, для начальной загрузки и администрирования).
+        Выданные ранее токены пользователя перестают приниматься
+        """
+        user = self.users[username]
+        user.hashed_password = self.context.hash(password)
+        user.token_version += 1
+        token_cache.invalidate_user(username)
+
+    def set_admin(self, username: str, is_admin: bool) -> None:
+        """Смена прав: кешированные проверки токенов сбрасываются, следующая проверка видит новые права"""
+        self.users[username].is_admin = is_admin
+        token_cache.invalidate_user(username)
+
+    def remove_user(self, username: str) -> None:
+        """Удаление пользователя: его токены больше не проходят проверку"""
+        self.users.pop(username, None)
+        token_cache.invalidate_user(username)
+
+    def close(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "scheme": self.context.default_scheme(),
+            "workers": settings.password_hash_workers,
+            "pending": self.pending,
+            "verified": self.verified,
+            "rejected": self.rejected,
+            "rehashed": self.rehashed,
+            "busy": self.busy
+        }
+
+
+# Глобальный экземпляр хранилища учетных данных
+credential_store = CredentialStore({
+    "admin": UserInDB(id=1, username="admin", hashed_password=_ADMIN_PASSWORD_HASH, is_admin=True)
+})
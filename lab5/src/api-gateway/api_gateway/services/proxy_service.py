@@ -1,8 +1,31 @@
+import math
 import httpx
 from fastapi import HTTPException, Request
-from typing import Any, Dict
+from fastapi.responses import JSONResponse, StreamingResponse
+from typing import Any, Dict, Hashable, Optional
 
 from api_gateway.config import settings
+from api_gateway.services.circuit_breaker import CircuitOpen, circuit_breakers, last_known_good
+from api_gateway.services.upstream_client import upstream_client
+from api_gateway.services.upstream_policy import UpstreamDeadlineExceeded, upstream_policy
+from api_gateway.tracing import span
+
+
+def _stale_response(key: Optional[Hashable]) -> Optional[JSONResponse]:
+    """Последний успешный ответ GET вместо ошибки upstream (если резерв включен и ответ не устарел)"""
+    entry = last_known_good.get(key) if key is not None else None
+    if entry is None:
+        return None
+    age, body = entry
+    return JSONResponse(
+        content=body,
+        headers={
+            "Age": str(math.floor(age)),
+            "Warning": '110 - "Response is Stale"',
+            # Резервный ответ не должен попасть в кеш ответов шлюза и клиента
+            "Cache-Control": "no-store"
+        }
+    )
 
 
 async def proxy_request(
@@ -12,52 +35,153 @@ async def proxy_request(
     json_data: Dict[str, Any] = None,
     params: Dict[str, Any] = None
 ) -> Any:
-    url = f"{settings.planning_service_url}{endpoint}"
+    """
+    Проксирование типизированного маршрута: ответ upstream передается потоком без разбора
+    (статус, заголовки и тело как есть). GET при включенном CIRCUIT_BREAKER_FALLBACK_ENABLED
+    буферизуется: для резервного ответа нужна копия тела.
+    """
+    username = (headers or {}).get("X-User")
+    # Сжатие для клиента делается один раз - в CompressionMiddleware шлюза
+    request_headers = {**(headers or {}), "Accept-Encoding": "identity"}
+    if method == "GET" and settings.circuit_breaker_fallback_enabled:
+        return await _proxy_buffered_request(endpoint, username, request_headers, params)
+    
+    async def send(url: str) -> httpx.Response:
+        upstream_request = upstream_client.build_request(
+            method=method, url=url, headers=request_headers, json=json_data, params=params
+        )
+        return await upstream_client.send_stream(upstream_request)
     
     try:
-        async with httpx.AsyncClient() as client:
-            response = await client.request(
-                method=method,
-                url=url,
-                headers=headers,
-                json=json_data,
-                params=params
+        with span("proxy_request", phase="upstream", endpoint=endpoint):
+            response = await circuit_breakers.call(
+                endpoint,
+                lambda: upstream_policy.call(method, endpoint, send, close=upstream_client.close_stream, key=username)
             )
-            response.raise_for_status()
-            return response.json()
-    except httpx.HTTPStatusError as e:
-        raise HTTPException(status_code=e.response.status_code, detail=e.response.text)
     except httpx.RequestError as e:
         raise HTTPException(status_code=503, detail=f"Service unavailable: {str(e)}")
+    
+    return _streaming_response(response)
 
 
-async def proxy_mongo_request(request: Request, username: str, endpoint: str) -> Any:
-    """Проксирование MongoDB запросов к planning-service"""
-    url = f"{settings.planning_service_url}{endpoint}"
-    
-    # Получаем тело запроса
-    body = None
-    if request.method in ["POST", "PUT"]:
-        body = await request.body()
+async def _proxy_buffered_request(
+    endpoint: str,
+    username: Optional[str],
+    request_headers: Dict[str, str],
+    params: Optional[Dict[str, Any]]
+) -> Any:
+    """GET с разбором JSON ответа: успешный ответ сохраняется в last_known_good, при отказе отдается он"""
+    fallback_key = last_known_good.key(username, endpoint, params)
     
-    # Получаем query параметры
-    query_params = dict(request.query_params)
+    async def send(url: str) -> httpx.Response:
+        return await upstream_client.request(method="GET", url=url, headers=request_headers, params=params)
     
     try:
-        async with httpx.AsyncClient() as client:
-            response = await client.request(
-                method=request.method,
-                url=url,
-                headers={"X-User": username},
-                content=body,
-                params=query_params
+        with span("proxy_request", phase="upstream", endpoint=endpoint):
+            response = await circuit_breakers.call(
+                endpoint, lambda: upstream_policy.call("GET", endpoint, send, key=username)
             )
-            response.raise_for_status()
-            return response.json()
+        response.raise_for_status()
     except httpx.HTTPStatusError as e:
+        stale = _stale_response(fallback_key) if e.response.status_code >= 500 else None
+        if stale is not None:
+            return stale
         raise HTTPException(status_code=e.response.status_code, detail=e.response.text)
     except httpx.RequestError as e:
+        stale = _stale_response(fallback_key)
+        if stale is not None:
+            return stale
         raise HTTPException(status_code=503, detail=f"Service unavailable: {str(e)}")
+    except (CircuitOpen, UpstreamDeadlineExceeded):
+        stale = _stale_response(fallback_key)
+        if stale is not None:
+            return stale
+        raise
+    
+    data = response.json()
+    last_known_good.put(fallback_key, data)
+    return data
+
+
+# Hop-by-hop заголовки относятся к одному соединению и не пробрасываются (RFC 7230, 6.1)
+HOP_BY_HOP_HEADERS = {
+    "connection", "keep-alive", "proxy-authenticate", "proxy-authorization",
+    "te", "trailer", "transfer-encoding", "upgrade"
+}
+
+# Заголовки клиента, которые шлюз подменяет сам: адрес и учетные данные upstream
+OVERRIDDEN_REQUEST_HEADERS = {"host", "authorization", "x-user"}
+
+# Заголовки ответа upstream, которые шлюз формирует сам (Server-Timing upstream входит в Server-Timing шлюза)
+OVERRIDDEN_RESPONSE_HEADERS = {"server-timing", "x-request-id"}
+
+
+def _forward_request_headers(request: Request, username: str) -> list:
+    """Заголовки запроса к upstream: заголовки клиента без hop-by-hop и учетных данных + X-User"""
+    headers = [
+        (name, value) for name, value in request.headers.items()
+        if name not in HOP_BY_HOP_HEADERS and name not in OVERRIDDEN_REQUEST_HEADERS
+    ]
+    headers.append(("X-User", username))
+    if "accept-encoding" not in request.headers:
+        # Иначе httpx запросит gzip сам и сжатое тело уйдет клиенту, который его не просил
+        headers.append(("Accept-Encoding", "identity"))
+    return headers
+
+
+def _forward_response_headers(response: httpx.Response) -> list:
+    """Сырые заголовки ответа upstream без hop-by-hop (повторяющиеся, например Set-Cookie, сохраняются)"""
+    return [
+        (name.encode("latin-1"), value.encode("latin-1"))
+        for name, value in response.headers.multi_items()
+        if name.lower() not in HOP_BY_HOP_HEADERS and name.lower() not in OVERRIDDEN_RESPONSE_HEADERS
+    ]
+
+
+async def proxy_stream_request(request: Request, username: str, endpoint: str) -> StreamingResponse:
+    """
+    Потоковое проксирование к planning-service без буферизации и разбора тел.
+    Тело запроса и ответа передаются как поток байтов; статус и заголовки ответа
+    (ETag, Content-Encoding, Cache-Control, X-Next-Cursor, ...) сохраняются как есть.
+    """
+    headers = _forward_request_headers(request, username)
+    params = request.query_params.multi_items()
+    content = request.stream() if request.method in ("POST", "PUT", "PATCH", "DELETE") else None
+    
+    async def send(url: str) -> httpx.Response:
+        # Для каждой попытки (повтор, hedge) строится новый запрос; тело есть только у записи, ее не повторяют
+        upstream_request = upstream_client.build_request(
+            method=request.method, url=url, headers=headers, params=params, content=content
+        )
+        return await upstream_client.send_stream(upstream_request)
+    
+    try:
+        with span("proxy_stream_request", phase="upstream", endpoint=endpoint):
+            response = await circuit_breakers.call(
+                endpoint,
+                lambda: upstream_policy.call(request.method, endpoint, send, close=upstream_client.close_stream, key=username)
+            )
+    except httpx.RequestError as e:
+        raise HTTPException(status_code=503, detail=f"Service unavailable: {str(e)}")
+    
+    return _streaming_response(response)
+
+
+def _streaming_response(response: httpx.Response) -> StreamingResponse:
+    """Ответ клиенту из открытого потока upstream: статус, заголовки и байты тела без изменений"""
+    async def body():
+        # Поток закрывается при любом исходе передачи: обрыв upstream, отключение клиента, ошибка.
+        # BackgroundTask выполняется только после успешной отправки тела, поэтому здесь не подходит
+        try:
+            # aiter_raw отдает байты как есть, без распаковки Content-Encoding
+            async for chunk in response.aiter_raw():
+                yield chunk
+        finally:
+            await upstream_client.close_stream(response)
+
+    streaming_response = StreamingResponse(body(), status_code=response.status_code)
+    streaming_response.raw_headers = _forward_response_headers(response)
+    return streaming_response
 
 
 async def get_plans(username: str) -> Any:
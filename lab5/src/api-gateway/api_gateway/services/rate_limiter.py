@@ -0,0 +1,222 @@
+import json
+import logging
+import math
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from api_gateway.config import settings
+from api_gateway.metrics import observe_store
+from api_gateway.services.auth_service import authenticate_token
+
+logger = logging.getLogger(__name__)
+
+# Корзина: ключ, скорость пополнения (токенов в секунду), емкость
+Bucket = Tuple[str, float, int]
+
+
+def route_limit(path: str) -> Optional[Tuple[float, int]]:
+    """Лимит маршрута по самому длинному префиксу из RATE_LIMIT_ROUTES"""
+    best = None
+    for prefix, limit in settings.rate_limit_routes.items():
+        if (path == prefix or path.startswith(prefix.rstrip("/") + "/")) and (best is None or len(prefix) > len(best[0])):
+            best = (prefix, limit)
+    return best
+
+
+def user_buckets(user: str, path: str) -> List[Bucket]:
+    """Корзины запроса: общая корзина пользователя и корзина пользователя на маршруте"""
+    buckets = [(f"user:{user}", settings.rate_limit_user_rate, settings.rate_limit_user_burst)]
+    route = route_limit(path)
+    if route is not None:
+        prefix, (rate, burst) = route
+        buckets.append((f"route:{user}:{prefix}", rate, burst))
+    return buckets
+
+
+class MemoryTokenBucketBackend:
+    """Корзины в памяти процесса: лимит на каждый экземпляр шлюза"""
+
+    def __init__(self):
+        self._buckets: Dict[str, Tuple[float, float]] = {}
+
+    async def take(self, buckets: List[Bucket]) -> float:
+        now = time.monotonic()
+        refilled = []
+        for key, rate, burst in buckets:
+            tokens, updated_at = self._buckets.get(key, (float(burst), now))
+            refilled.append(min(float(burst), tokens + (now - updated_at) * rate))
+
+        # Токен списывается из всех корзин сразу или ни из одной
+        retry_after = max(
+            ((1 - tokens) / rate for tokens, (_, rate, _) in zip(refilled, buckets) if tokens < 1),
+            default=0.0
+        )
+        for tokens, (key, _, _) in zip(refilled, buckets):
+            self._buckets[key] = (tokens - 1 if retry_after == 0 else tokens, now)
+        return retry_after
+
+    async def close(self) -> None:
+        self._buckets.clear()
+
+    def size(self) -> Optional[int]:
+        return len(self._buckets)
+
+
+# Атомарная проверка нескольких корзин; время берется у Redis, чтобы экземпляры шлюза не зависели от своих часов
+TOKEN_BUCKET_SCRIPT = """
+local now_parts = redis.call('TIME')
+local now = tonumber(now_parts[1]) + tonumber(now_parts[2]) / 1000000
+local tokens = {}
+local retry_after = 0
+for i, key in ipairs(KEYS) do
+    local rate = tonumber(ARGV[i * 2 - 1])
+    local burst = tonumber(ARGV[i * 2])
+    local state = redis.call('HMGET', key, 'tokens', 'ts')
+    local value = tonumber(state[1]) or burst
+    local ts = tonumber(state[2]) or now
+    value = math.min(burst, value + math.max(0, now - ts) * rate)
+    if value < 1 then
+        retry_after = math.max(retry_after, (1 - value) / rate)
+    end
+    tokens[i] = value
+end
+for i, key in ipairs(KEYS) do
+    local rate = tonumber(ARGV[i * 2 - 1])
+    local burst = tonumber(ARGV[i * 2])
+    local value = tokens[i]
+    if retry_after == 0 then
+        value = value - 1
+    end
+    redis.call('HSET', key, 'tokens', tostring(value), 'ts', tostring(now))
+    redis.call('EXPIRE', key, math.ceil(burst / rate) + 1)
+end
+return tostring(retry_after)
+"""
+
+
+class RedisTokenBucketBackend:
+    """Корзины в Redis: общий лимит для всех экземпляров шлюза"""
+
+    def __init__(self, url: str):
+        import redis.asyncio as redis
+        self.client = redis.from_url(url)
+        self._script = self.client.register_script(TOKEN_BUCKET_SCRIPT)
+
+    async def take(self, buckets: List[Bucket]) -> float:
+        keys = [f"gw:rl:{key}" for key, _, _ in buckets]
+        args = [value for _, rate, burst in buckets for value in (rate, burst)]
+        with observe_store("redis", "token_bucket"):
+            return float(await self._script(keys=keys, args=args))
+
+    async def close(self) -> None:
+        await self.client.aclose()
+
+    def size(self) -> Optional[int]:
+        return None
+
+
+class RateLimiter:
+    """Ограничение частоты запросов пользователя (token bucket) с выбираемым хранилищем"""
+
+    def __init__(self):
+        self._backend = None
+        self.allowed = 0
+        self.limited = 0
+        self.errors = 0
+
+    @property
+    def enabled(self) -> bool:
+        return settings.rate_limit_backend in ("memory", "redis")
+
+    @property
+    def backend(self):
+        if self._backend is None:
+            if settings.rate_limit_backend == "redis":
+                self._backend = RedisTokenBucketBackend(settings.rate_limit_redis_url)
+            else:
+                self._backend = MemoryTokenBucketBackend()
+        return self._backend
+
+    async def check(self, user: str, path: str) -> float:
+        """0, если запрос разрешен, иначе через сколько секунд повторить"""
+        try:
+            retry_after = await self.backend.take(user_buckets(user, path))
+        except Exception as e:
+            # Недоступное хранилище лимитов не должно останавливать шлюз
+            self.errors += 1
+            logger.warning(f"Rate limiter backend error, request allowed: {e}")
+            return 0.0
+
+        if retry_after > 0:
+            self.limited += 1
+        else:
+            self.allowed += 1
+        return retry_after
+
+    async def close(self) -> None:
+        if self._backend is not None:
+            await self._backend.close()
+            self._backend = None
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "backend": settings.rate_limit_backend,
+            "user_rate": settings.rate_limit_user_rate,
+            "user_burst": settings.rate_limit_user_burst,
+            "buckets": self._backend.size() if self._backend is not None else 0,
+            "allowed": self.allowed,
+            "limited": self.limited,
+            "errors": self.errors
+        }
+
+
+# Глобальный экземпляр лимитера
+rate_limiter = RateLimiter()
+
+
+class RateLimitMiddleware:
+    """
+    ASGI-middleware ограничения частоты запросов к /api/*.
+    Пользователь определяется по Bearer-токену (запросы без валидного токена отклонит
+    аутентификация); при исчерпании корзины сразу отдается 429 с Retry-After.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not rate_limiter.enabled or not scope["path"].startswith("/api/"):
+            await self.app(scope, receive, send)
+            return
+
+        user = self._user(scope["headers"])
+        if user is not None:
+            retry_after = await rate_limiter.check(user, scope["path"])
+            if retry_after > 0:
+                await self._reject(send, retry_after)
+                return
+
+        await self.app(scope, receive, send)
+
+    @staticmethod
+    def _user(headers: List[Tuple[bytes, bytes]]) -> Optional[str]:
+        authorization = next((value for name, value in headers if name == b"authorization"), b"").decode("latin-1")
+        scheme, _, token = authorization.partition(" ")
+        if scheme.lower() != "bearer" or not token:
+            return None
+        user = authenticate_token(token)
+        return user.username if user is not None else None
+
+    @staticmethod
+    async def _reject(send, retry_after: float):
+        body = json.dumps({"detail": "Rate limit exceeded"}).encode()
+        await send({
+            "type": "http.response.start",
+            "status": 429,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(body)).encode()),
+                (b"retry-after", str(max(1, math.ceil(retry_after))).encode())
+            ]
+        })
+        await send({"type": "http.response.body", "body": body})
@@ -0,0 +1,429 @@
+import hashlib
+import json
+import logging
+import re
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+from api_gateway.config import settings
+from api_gateway.metrics import observe_store
+from api_gateway.tracing import span
+from api_gateway.services.auth_service import authenticate_token
+
+logger = logging.getLogger(__name__)
+
+# Заголовки, которые не сохраняются в кеше: относятся к соединению или к конкретному ответу
+UNCACHED_HEADERS = {
+    b"connection", b"keep-alive", b"transfer-encoding", b"te", b"trailer", b"upgrade",
+    b"set-cookie", b"content-length", b"date", b"age", b"x-cache"
+}
+
+WRITE_METHODS = {"POST", "PUT", "PATCH", "DELETE"}
+
+# Маршруты, которые сами сбрасывают кеш пользователя (пакет из одних GET не должен его сбрасывать)
+SELF_INVALIDATING_PATHS = {"/api/batch"}
+
+_MAX_AGE = re.compile(r"(?:^|,)\s*(?:s-maxage|max-age)\s*=\s*(\d+)")
+
+# Срок хранения счетчика поколений пользователя в Redis; должен превышать время любого запроса
+GENERATION_TTL = 86400
+
+# Запись ответа, только если кеш пользователя не сбрасывался с начала запроса.
+# KEYS - хеш ответов и счетчик поколений; ARGV - ожидаемое поколение, поле, запись, TTL хеша
+STORE_SCRIPT = """
+if (redis.call('GET', KEYS[2]) or '0') ~= ARGV[1] then
+    return 0
+end
+redis.call('HSET', KEYS[1], ARGV[2], ARGV[3])
+redis.call('EXPIRE', KEYS[1], ARGV[4])
+return 1
+"""
+
+
+def route_ttl(path: str) -> int:
+    """TTL маршрута по самому длинному префиксу из RESPONSE_CACHE_ROUTES; 0 - не кешировать"""
+    best_prefix, ttl = "", 0
+    for prefix, prefix_ttl in settings.response_cache_routes.items():
+        if (path == prefix or path.startswith(prefix.rstrip("/") + "/")) and len(prefix) > len(best_prefix):
+            best_prefix, ttl = prefix, prefix_ttl
+    return ttl
+
+
+def response_ttl(route_seconds: int, cache_control: Optional[str]) -> int:
+    """Итоговый TTL с учетом Cache-Control upstream: no-store/no-cache запрещают кеширование, max-age ограничивает"""
+    if not cache_control:
+        return route_seconds
+    directives = cache_control.lower()
+    if "no-store" in directives or "no-cache" in directives:
+        return 0
+    match = _MAX_AGE.search(directives)
+    if match:
+        return min(route_seconds, int(match.group(1)))
+    return route_seconds
+
+
+def cache_field(path: str, query_string: bytes, accept_encoding: str) -> str:
+    """Поле кеша внутри записей пользователя: путь + отсортированный query + Accept-Encoding"""
+    query = "&".join(sorted(query_string.decode("latin-1").split("&"))) if query_string else ""
+    return f"{path}?{query}|{accept_encoding}"
+
+
+def make_etag(body: bytes) -> bytes:
+    return b'W/"' + hashlib.sha1(body).hexdigest().encode() + b'"'
+
+
+def encode_entry(status: int, headers: List[Tuple[bytes, bytes]], body: bytes, expires_at: float) -> bytes:
+    """Запись кеша: JSON-заголовок и тело ответа, разделенные переводом строки"""
+    meta = {
+        "status": status,
+        "headers": [[name.decode("latin-1"), value.decode("latin-1")] for name, value in headers],
+        "stored_at": time.time(),
+        "expires_at": expires_at
+    }
+    return json.dumps(meta, separators=(",", ":")).encode() + b"\n" + body
+
+
+def decode_entry(data: bytes) -> Tuple[dict, bytes]:
+    meta, _, body = data.partition(b"\n")
+    return json.loads(meta), body
+
+
+class MemoryResponseCacheBackend:
+    """Кеш ответов в памяти процесса (LRU); подходит для одного экземпляра шлюза"""
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[Tuple[str, str], Tuple[float, bytes]]" = OrderedDict()
+        self._by_user: Dict[str, set] = {}
+        self._generations: Dict[str, int] = {}
+
+    async def generation(self, user: str) -> int:
+        return self._generations.get(user, 0)
+
+    async def get(self, user: str, field: str) -> Optional[bytes]:
+        entry = self._entries.get((user, field))
+        if entry is None:
+            return None
+        if entry[0] <= time.time():
+            self._remove((user, field))
+            return None
+        self._entries.move_to_end((user, field))
+        return entry[1]
+
+    async def set(self, user: str, field: str, data: bytes, ttl: int, generation: int) -> bool:
+        # Проверка и запись без await между ними, поэтому атомарны в цикле событий
+        if self._generations.get(user, 0) != generation:
+            return False
+        key = (user, field)
+        self._entries[key] = (time.time() + ttl, data)
+        self._entries.move_to_end(key)
+        self._by_user.setdefault(user, set()).add(field)
+        while len(self._entries) > self.max_entries:
+            oldest, _ = self._entries.popitem(last=False)
+            self._by_user.get(oldest[0], set()).discard(oldest[1])
+        return True
+
+    async def invalidate_user(self, user: str) -> None:
+        self._generations[user] = self._generations.get(user, 0) + 1
+        for field in self._by_user.pop(user, set()):
+            self._entries.pop((user, field), None)
+
+    def _remove(self, key: Tuple[str, str]) -> None:
+        self._entries.pop(key, None)
+        self._by_user.get(key[0], set()).discard(key[1])
+
+    async def close(self) -> None:
+        self._entries.clear()
+        self._by_user.clear()
+        self._generations.clear()
+
+    def size(self) -> int:
+        return len(self._entries)
+
+
+class RedisResponseCacheBackend:
+    """
+    Кеш ответов в Redis, общий для всех экземпляров шлюза.
+    Ответы пользователя лежат в одном хеше gw:resp:{user}, поэтому инвалидация - один DEL
+    вместе с увеличением поколения gw:resp-gen:{user}.
+    """
+
+    def __init__(self, url: str, max_ttl: int):
+        import redis.asyncio as redis
+        self.client = redis.from_url(url)
+        self.max_ttl = max_ttl
+        self._store = self.client.register_script(STORE_SCRIPT)
+
+    @staticmethod
+    def _key(user: str) -> str:
+        return f"gw:resp:{user}"
+
+    @staticmethod
+    def _generation_key(user: str) -> str:
+        return f"gw:resp-gen:{user}"
+
+    async def generation(self, user: str) -> int:
+        with observe_store("redis", "get"):
+            generation = await self.client.get(self._generation_key(user))
+        return int(generation or 0)
+
+    async def get(self, user: str, field: str) -> Optional[bytes]:
+        with observe_store("redis", "hget"):
+            data = await self.client.hget(self._key(user), field)
+        if data is None:
+            return None
+        # У полей хеша нет собственного TTL, срок хранится в записи
+        if decode_entry(data)[0]["expires_at"] <= time.time():
+            return None
+        return data
+
+    async def set(self, user: str, field: str, data: bytes, ttl: int, generation: int) -> bool:
+        with observe_store("redis", "hset"):
+            stored = await self._store(
+                keys=[self._key(user), self._generation_key(user)],
+                args=[str(generation), field, data, self.max_ttl]
+            )
+        return bool(stored)
+
+    async def invalidate_user(self, user: str) -> None:
+        with observe_store("redis", "delete"):
+            async with self.client.pipeline(transaction=True) as pipe:
+                pipe.delete(self._key(user))
+                pipe.incr(self._generation_key(user))
+                pipe.expire(self._generation_key(user), GENERATION_TTL)
+                await pipe.execute()
+
+    async def close(self) -> None:
+        await self.client.aclose()
+
+    def size(self) -> Optional[int]:
+        return None
+
+
+class ResponseCache:
+    """Кеш ответов шлюза на GET-запросы: ключ - пользователь и путь с query"""
+
+    def __init__(self):
+        self._backend = None
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.invalidations = 0
+        self.errors = 0
+
+    @property
+    def enabled(self) -> bool:
+        return settings.response_cache_backend in ("memory", "redis")
+
+    @property
+    def backend(self):
+        if self._backend is None:
+            if settings.response_cache_backend == "redis":
+                max_ttl = max(settings.response_cache_routes.values(), default=0) or 1
+                self._backend = RedisResponseCacheBackend(settings.response_cache_redis_url, max_ttl)
+            else:
+                self._backend = MemoryResponseCacheBackend(settings.response_cache_max_entries)
+        return self._backend
+
+    async def generation(self, user: str) -> Optional[int]:
+        """Поколение кеша пользователя; увеличивается при каждом сбросе"""
+        try:
+            return await self.backend.generation(user)
+        except Exception as e:
+            self.errors += 1
+            logger.error(f"Response cache generation error: {e}")
+            return None
+
+    async def get(self, user: str, field: str) -> Optional[bytes]:
+        try:
+            return await self.backend.get(user, field)
+        except Exception as e:
+            self.errors += 1
+            logger.error(f"Response cache get error: {e}")
+            return None
+
+    async def set(self, user: str, field: str, data: bytes, ttl: int, generation: int) -> None:
+        """Сохранение ответа, если кеш пользователя не сбрасывался после чтения поколения"""
+        try:
+            if await self.backend.set(user, field, data, ttl, generation):
+                self.stores += 1
+        except Exception as e:
+            self.errors += 1
+            logger.error(f"Response cache set error: {e}")
+
+    async def invalidate_user(self, user: str) -> None:
+        try:
+            await self.backend.invalidate_user(user)
+            self.invalidations += 1
+        except Exception as e:
+            self.errors += 1
+            logger.error(f"Response cache invalidation error: {e}")
+
+    async def close(self) -> None:
+        if self._backend is not None:
+            await self._backend.close()
+            self._backend = None
+
+    def stats(self) -> dict:
+        return {
+            "backend": settings.response_cache_backend,
+            "size": self._backend.size() if self._backend is not None else 0,
+            "hits": self.hits,
+            "misses": self.misses,
+            "stores": self.stores,
+            "invalidations": self.invalidations,
+            "errors": self.errors
+        }
+
+
+response_cache = ResponseCache()
+
+
+class ResponseCacheMiddleware:
+    """
+    ASGI-middleware кеша ответов шлюза.
+    GET маршрутов из RESPONSE_CACHE_ROUTES отдаются из кеша без запроса к planning-service,
+    с поддержкой If-None-Match (304). При промахе ответ, который можно кешировать (статус 200,
+    тело не больше RESPONSE_CACHE_MAX_BODY_BYTES, Cache-Control upstream разрешает), собирается
+    целиком, отдается клиенту с ETag и сохраняется; остальные ответы передаются без задержки.
+    Успешный запрос на запись сбрасывает кеш пользователя; ответ GET, начатого до такого сброса,
+    не сохраняется.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not response_cache.enabled:
+            await self.app(scope, receive, send)
+            return
+
+        method = scope["method"]
+        if method == "GET":
+            ttl = route_ttl(scope["path"])
+        elif method in WRITE_METHODS and scope["path"] not in SELF_INVALIDATING_PATHS:
+            ttl = None
+        else:
+            await self.app(scope, receive, send)
+            return
+
+        headers = {name: value for name, value in scope["headers"]}
+        user = self._user(headers)
+        if user is None or ttl == 0:
+            await self.app(scope, receive, send)
+            return
+
+        if ttl is None:
+            await self._write(scope, receive, send, user)
+        else:
+            await self._read(scope, receive, send, user, headers, ttl)
+
+    @staticmethod
+    def _user(headers: Dict[bytes, bytes]) -> Optional[str]:
+        authorization = headers.get(b"authorization", b"").decode("latin-1")
+        scheme, _, token = authorization.partition(" ")
+        if scheme.lower() != "bearer" or not token:
+            return None
+        user = authenticate_token(token)
+        return user.username if user is not None else None
+
+    async def _write(self, scope, receive, send, user: str):
+        async def send_wrapper(message):
+            # Сброс до начала ответа: GET, отправленный сразу после ответа на запись, не получит старую запись кеша
+            if message["type"] == "http.response.start" and message["status"] < 400:
+                await response_cache.invalidate_user(user)
+            await send(message)
+
+        await self.app(scope, receive, send_wrapper)
+
+    async def _read(self, scope, receive, send, user: str, headers: Dict[bytes, bytes], ttl: int):
+        field = cache_field(scope["path"], scope["query_string"], headers.get(b"accept-encoding", b"").decode("latin-1"))
+        request_cache_control = headers.get(b"cache-control", b"").decode("latin-1").lower()
+
+        if "no-cache" not in request_cache_control:
+            with span("response_cache.get", phase="cache") as lookup:
+                data = await response_cache.get(user, field)
+                if lookup is not None:
+                    lookup.attributes["cache.hit"] = data is not None
+            if data is not None:
+                response_cache.hits += 1
+                await self._send_cached(send, data, headers.get(b"if-none-match"))
+                return
+
+        response_cache.misses += 1
+        await self._fetch_and_store(scope, receive, send, user, field, ttl)
+
+    @staticmethod
+    async def _send_cached(send, data: bytes, if_none_match: Optional[bytes]):
+        meta, body = decode_entry(data)
+        response_headers = [(name.encode("latin-1"), value.encode("latin-1")) for name, value in meta["headers"]]
+        response_headers.append((b"age", str(int(time.time() - meta["stored_at"])).encode()))
+        response_headers.append((b"x-cache", b"HIT"))
+
+        etag = next((value for name, value in response_headers if name == b"etag"), None)
+        if etag is not None and if_none_match is not None and etag in [tag.strip() for tag in if_none_match.split(b",")]:
+            await send({"type": "http.response.start", "status": 304, "headers": response_headers})
+            await send({"type": "http.response.body", "body": b""})
+            return
+
+        response_headers.append((b"content-length", str(len(body)).encode()))
+        await send({"type": "http.response.start", "status": meta["status"], "headers": response_headers})
+        await send({"type": "http.response.body", "body": body})
+
+    async def _fetch_and_store(self, scope, receive, send, user: str, field: str, ttl: int):
+        max_body = settings.response_cache_max_body_bytes
+        # Поколение до запроса: запись, завершившаяся во время запроса, его увеличит,
+        # и ответ с возможно устаревшими данными не попадет в кеш
+        generation = await response_cache.generation(user)
+        state = {"status": None, "headers": [], "start": None, "chunks": [], "size": 0, "cacheable": True, "etag": None}
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                state["status"] = message["status"]
+                state["headers"] = [
+                    (name.lower(), value) for name, value in message.get("headers", [])
+                ]
+                cache_control = next(
+                    (value.decode("latin-1") for name, value in state["headers"] if name == b"cache-control"), None
+                )
+                state["ttl"] = response_ttl(ttl, cache_control)
+                state["cacheable"] = generation is not None and state["status"] == 200 and state["ttl"] > 0
+                message = {**message, "headers": list(message.get("headers", [])) + [(b"x-cache", b"MISS")]}
+                if state["cacheable"]:
+                    # Заголовки отправляются после всего тела, чтобы в них был ETag
+                    state["start"] = message
+                    return
+            elif message["type"] == "http.response.body" and state["cacheable"]:
+                state["chunks"].append(message.get("body", b""))
+                state["size"] += len(state["chunks"][-1])
+                if state["size"] > max_body:
+                    # Слишком большие ответы не кешируются: накопленное уходит клиенту, остальное - потоком
+                    state["cacheable"] = False
+                    await send(state["start"])
+                    message = {**message, "body": b"".join(state["chunks"])}
+                    state["chunks"] = []
+                elif message.get("more_body", False):
+                    return
+                else:
+                    body = b"".join(state["chunks"])
+                    start = state["start"]
+                    state["etag"] = next((value for name, value in state["headers"] if name == b"etag"), None)
+                    if state["etag"] is None:
+                        state["etag"] = make_etag(body)
+                        start = {**start, "headers": start["headers"] + [(b"etag", state["etag"])]}
+                    await send(start)
+                    message = {**message, "body": body}
+            await send(message)
+
+        await self.app(scope, receive, send_wrapper)
+
+        if not state["cacheable"] or state["etag"] is None:
+            return
+
+        body = b"".join(state["chunks"])
+        cached_headers = [(name, value) for name, value in state["headers"] if name not in UNCACHED_HEADERS]
+        if not any(name == b"etag" for name, _ in cached_headers):
+            cached_headers.append((b"etag", state["etag"]))
+        data = encode_entry(state["status"], cached_headers, body, time.time() + state["ttl"])
+        await response_cache.set(user, field, data, state["ttl"], generation)
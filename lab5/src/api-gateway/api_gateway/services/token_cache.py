@@ -0,0 +1,100 @@
+import hashlib
+import time
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+from api_gateway.config import settings
+from api_gateway.models.auth import UserResponse
+
+
+def token_key(token: str) -> bytes:
+    """Ключ кеша - хеш токена, сам токен в памяти кеша не хранится"""
+    return hashlib.sha256(token.encode()).digest()
+
+
+class VerifiedTokenCache:
+    """
+    Ограниченный LRU-кеш проверенных JWT в памяти процесса.
+    Запись живет до exp токена и хранит уже разрешенного пользователя, поэтому повторный
+    запрос с тем же токеном не выполняет jwt.decode, поиск в users_db и построение UserResponse.
+    Отозванные токены хранятся до своего exp и не проходят проверку даже при валидной подписи.
+    При смене пароля, прав или удалении пользователя его записи сбрасываются (invalidate_user).
+    """
+
+    def __init__(self, max_size: int = 10000):
+        self.max_size = max_size
+        self._entries: "OrderedDict[bytes, Tuple[float, UserResponse]]" = OrderedDict()
+        self._revoked: Dict[bytes, float] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, token: str) -> Optional[UserResponse]:
+        """Пользователь по ранее проверенному токену или None (промах или истекший токен)"""
+        key = token_key(token)
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+
+        expires_at, user = entry
+        if expires_at <= time.time():
+            del self._entries[key]
+            self.misses += 1
+            return None
+
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return user
+
+    def put(self, token: str, user: UserResponse, expires_at: float) -> None:
+        """Сохранение проверенного токена до его exp"""
+        if self.max_size <= 0 or expires_at <= time.time():
+            return
+
+        key = token_key(token)
+        self._entries[key] = (expires_at, user)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def is_revoked(self, token: str) -> bool:
+        if not self._revoked:
+            return False
+        expires_at = self._revoked.get(token_key(token))
+        return expires_at is not None and expires_at > time.time()
+
+    def revoke(self, token: str, expires_at: float) -> None:
+        """Отзыв токена: удаление из кеша и запрет до exp (logout, компрометация)"""
+        key = token_key(token)
+        self._entries.pop(key, None)
+        self._revoked[key] = expires_at
+        self._prune_revoked()
+
+    def invalidate_user(self, username: str) -> int:
+        """Удаление всех записей пользователя (смена пароля, прав, удаление); возвращает число записей"""
+        keys = [key for key, (_, user) in self._entries.items() if user.username == username]
+        for key in keys:
+            del self._entries[key]
+        return len(keys)
+
+    def clear(self) -> None:
+        self._entries.clear()
+        self._revoked.clear()
+
+    def _prune_revoked(self) -> None:
+        now = time.time()
+        for key in [key for key, expires_at in self._revoked.items() if expires_at <= now]:
+            del self._revoked[key]
+
+    def stats(self) -> dict:
+        return {
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "revoked": len(self._revoked),
+            "hits": self.hits,
+            "misses": self.misses
+        }
+
+
+# Глобальный экземпляр кеша
+token_cache = VerifiedTokenCache(max_size=settings.token_cache_max_size if settings.token_cache_enabled else 0)
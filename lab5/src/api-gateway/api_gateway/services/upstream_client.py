@@ -0,0 +1,205 @@
+import asyncio
+import httpx
+import logging
+import time
+from typing import Any, Dict, Optional
+
+from api_gateway.config import settings
+from api_gateway.services.concurrency_limiter import concurrency_limiter
+from api_gateway.tracing import CLIENT, outgoing_headers, record_upstream_timing, span
+
+logger = logging.getLogger(__name__)
+
+
+def _http2_available() -> bool:
+    """HTTP/2 в httpx требует необязательный пакет h2 (httpx[http2])"""
+    try:
+        import h2  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+
+def origin(url) -> str:
+    """Адрес реплики upstream (схема, хост, порт) для учета запросов по репликам"""
+    url = httpx.URL(url)
+    return f"{url.scheme}://{url.netloc.decode('ascii')}"
+
+
+class UpstreamClient:
+    """
+    Общий HTTP-клиент шлюза к planning-service на все время жизни приложения.
+    Соединения переиспользуются (keep-alive), поэтому запрос не платит за установку TCP.
+    Открывается и закрывается в lifespan; без lifespan создается лениво при первом запросе.
+    """
+
+    def __init__(self):
+        self._client: Optional[httpx.AsyncClient] = None
+        self._transport: Optional[httpx.AsyncHTTPTransport] = None
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.requests_total = 0
+        self.pool_timeouts = 0
+        self.outstanding: Dict[str, int] = {}
+
+    def _create_client(self) -> httpx.AsyncClient:
+        http2 = settings.upstream_http2
+        if http2 and not _http2_available():
+            logger.warning("UPSTREAM_HTTP2 is enabled but the h2 package is not installed, using HTTP/1.1")
+            http2 = False
+
+        self._transport = httpx.AsyncHTTPTransport(
+            limits=httpx.Limits(
+                max_connections=settings.upstream_max_connections,
+                max_keepalive_connections=settings.upstream_max_keepalive_connections,
+                keepalive_expiry=settings.upstream_keepalive_expiry
+            ),
+            http2=http2
+        )
+        return httpx.AsyncClient(
+            transport=self._transport,
+            timeout=httpx.Timeout(
+                connect=settings.upstream_connect_timeout,
+                read=settings.upstream_read_timeout,
+                write=settings.upstream_write_timeout,
+                pool=settings.upstream_pool_timeout
+            )
+        )
+
+    async def start(self) -> None:
+        """Открытие клиента (вызывается в lifespan)"""
+        if self._client is None:
+            self._client = self._create_client()
+
+    async def close(self) -> None:
+        """Закрытие клиента и всех соединений пула (вызывается в lifespan)"""
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+            self._transport = None
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        if self._client is None:
+            self._client = self._create_client()
+        return self._client
+
+    def _begin(self, url) -> None:
+        # Сверх адаптивного лимита запрос отклоняется до обращения к upstream (UpstreamOverloaded)
+        concurrency_limiter.acquire()
+        self.in_flight += 1
+        self.requests_total += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        key = origin(url)
+        self.outstanding[key] = self.outstanding.get(key, 0) + 1
+
+    def _end(self, url) -> None:
+        self.in_flight -= 1
+        concurrency_limiter.release()
+        key = origin(url)
+        self.outstanding[key] -= 1
+
+    async def request(self, method: str, url: str, **kwargs) -> httpx.Response:
+        """Запрос с полностью прочитанным ответом; каждая попытка - отдельный span с traceparent"""
+        self._begin(url)
+        start = time.perf_counter()
+        ok, cancelled = False, False
+        try:
+            with span(f"HTTP {method}", kind=CLIENT, **{"http.method": method, "http.url": str(url)}) as attempt:
+                kwargs["headers"] = {**(kwargs.get("headers") or {}), **outgoing_headers()}
+                response = await self.client.request(method, url, **kwargs)
+                if attempt is not None:
+                    attempt.attributes["http.status_code"] = response.status_code
+            record_upstream_timing(response.headers.get("server-timing"))
+            ok = response.status_code < 500
+            return response
+        except httpx.PoolTimeout:
+            self.pool_timeouts += 1
+            raise
+        except asyncio.CancelledError:
+            # Отмененная попытка (проигравший hedge, дедлайн) не говорит о перегрузке upstream
+            cancelled = True
+            raise
+        finally:
+            if not cancelled:
+                concurrency_limiter.observe(time.perf_counter() - start, ok)
+            self._end(url)
+
+    def build_request(self, method: str, url: str, **kwargs) -> httpx.Request:
+        return self.client.build_request(method, url, **kwargs)
+
+    async def send_stream(self, request: httpx.Request) -> httpx.Response:
+        """Отправка запроса с потоковым ответом; ответ обязательно закрывается через close_stream"""
+        self._begin(request.url)
+        start = time.perf_counter()
+        try:
+            # Span попытки заканчивается на заголовках ответа, передача тела в него не входит
+            with span(f"HTTP {request.method}", kind=CLIENT, **{"http.method": request.method, "http.url": str(request.url)}):
+                request.headers.update(outgoing_headers())
+                response = await self.client.send(request, stream=True)
+            record_upstream_timing(response.headers.get("server-timing"))
+        except httpx.PoolTimeout:
+            self.pool_timeouts += 1
+            concurrency_limiter.observe(time.perf_counter() - start, False)
+            self._end(request.url)
+            raise
+        except asyncio.CancelledError:
+            self._end(request.url)
+            raise
+        except BaseException:
+            concurrency_limiter.observe(time.perf_counter() - start, False)
+            self._end(request.url)
+            raise
+        # Задержка для лимитера - до получения заголовков, передача тела в нее не входит
+        concurrency_limiter.observe(time.perf_counter() - start, response.status_code < 500)
+        return response
+
+    async def close_stream(self, response: httpx.Response) -> None:
+        """Закрытие потокового ответа и возврат соединения в пул"""
+        try:
+            await response.aclose()
+        finally:
+            self._end(response.request.url)
+
+    def _pool_connections(self) -> Optional[Dict[str, int]]:
+        """Соединения пула httpcore (best effort: внутренний API)"""
+        pool = getattr(self._transport, "_pool", None)
+        connections = getattr(pool, "connections", None)
+        if connections is None:
+            return None
+        return {
+            "open": len(connections),
+            "idle": sum(1 for connection in connections if connection.is_idle())
+        }
+
+    def pool_usage(self) -> Optional[Dict[str, int]]:
+        """Занятые и свободные соединения пула для метрик Prometheus"""
+        if self._client is None:
+            return None
+        connections = self._pool_connections()
+        idle = connections["idle"] if connections is not None else 0
+        in_use = connections["open"] - idle if connections is not None else self.in_flight
+        return {"in_use": in_use, "idle": idle, "max": settings.upstream_max_connections}
+
+    def stats(self) -> Dict[str, Any]:
+        """Метрики пула: занятость, пик, ожидания свободного соединения"""
+        max_connections = settings.upstream_max_connections
+        stats = {
+            "started": self._client is not None,
+            "http2": bool(self._transport is not None and settings.upstream_http2 and _http2_available()),
+            "max_connections": max_connections,
+            "max_keepalive_connections": settings.upstream_max_keepalive_connections,
+            "in_flight": self.in_flight,
+            "max_in_flight": self.max_in_flight,
+            "saturation": round(self.in_flight / max_connections, 3) if max_connections else None,
+            "requests_total": self.requests_total,
+            "pool_timeouts": self.pool_timeouts
+        }
+        connections = self._pool_connections()
+        if connections is not None:
+            stats["connections"] = connections
+        return stats
+
+
+# Глобальный экземпляр клиента
+upstream_client = UpstreamClient()
@@ -0,0 +1,286 @@
+import asyncio
+import random
+import re
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional, Set
+
+import httpx
+
+from api_gateway.config import settings
+from api_gateway.services.upstream_pool import Upstream, upstream_pool
+
+# Ответы upstream, после которых идемпотентный запрос можно повторить
+RETRYABLE_STATUSES = {502, 503, 504}
+
+# Идентификаторы в пути заменяются, чтобы задержки /plans/1 и /plans/2 считались вместе
+_ID_SEGMENT = re.compile(r"/(?:\d+|[0-9a-f]{24})(?=/|$)")
+
+SendFunc = Callable[[str], Awaitable[httpx.Response]]
+CloseFunc = Callable[[httpx.Response], Awaitable[None]]
+
+
+class UpstreamDeadlineExceeded(Exception):
+    """Ответ planning-service не получен до дедлайна маршрута"""
+
+
+def route_key(endpoint: str) -> str:
+    return _ID_SEGMENT.sub("/{id}", endpoint.split("?", 1)[0])
+
+
+def route_deadline(endpoint: str) -> float:
+    """Дедлайн маршрута (секунды до заголовков ответа) по самому длинному префиксу пути шлюза"""
+    path = f"/api{endpoint}"
+    best, deadline = "", settings.upstream_default_deadline
+    for prefix, seconds in settings.upstream_route_deadlines.items():
+        if (path == prefix or path.startswith(prefix.rstrip("/") + "/")) and len(prefix) > len(best):
+            best, deadline = prefix, seconds
+    return deadline
+
+
+async def _close_noop(response: httpx.Response) -> None:
+    return None
+
+
+class RetryBudget:
+    """
+    Общий бюджет повторов и hedge-запросов шлюза.
+    Каждый исходный запрос пополняет бюджет на ratio, каждый повтор списывает 1;
+    кроме того, бюджет пополняется на min_per_second в секунду, чтобы при малой нагрузке
+    повторы были возможны. Так повторы не умножают нагрузку на уже перегруженный upstream.
+    """
+
+    def __init__(self, ratio: float, min_per_second: float):
+        self.ratio = ratio
+        self.min_per_second = min_per_second
+        self.max_balance = max(10.0, min_per_second * 10)
+        self.balance = self.max_balance
+        self._updated_at = time.monotonic()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.balance = min(self.max_balance, self.balance + (now - self._updated_at) * self.min_per_second)
+        self._updated_at = now
+
+    def deposit(self) -> None:
+        self._refill()
+        self.balance = min(self.max_balance, self.balance + self.ratio)
+
+    def try_withdraw(self) -> bool:
+        self._refill()
+        if self.balance < 1:
+            return False
+        self.balance -= 1
+        return True
+
+
+class LatencyTracker:
+    """Скользящее окно задержек по маршрутам для расчета задержки hedge-запроса"""
+
+    def __init__(self, window: int = 512, min_samples: int = 20, recompute_every: int = 32):
+        self.window = window
+        self.min_samples = min_samples
+        self.recompute_every = recompute_every
+        self._samples: Dict[str, Deque[float]] = {}
+        self._quantiles: Dict[str, Optional[float]] = {}
+        self._recorded: Dict[str, int] = {}
+
+    def record(self, route: str, seconds: float) -> None:
+        samples = self._samples.setdefault(route, deque(maxlen=self.window))
+        samples.append(seconds)
+        self._recorded[route] = self._recorded.get(route, 0) + 1
+        # Квантиль пересчитывается раз в recompute_every замеров, а не на каждый запрос
+        if self._recorded[route] % self.recompute_every == 0:
+            self._quantiles.pop(route, None)
+
+    def quantile(self, route: str, q: float) -> Optional[float]:
+        samples = self._samples.get(route)
+        if samples is None or len(samples) < self.min_samples:
+            return None
+        if self._quantiles.get(route) is None:
+            ordered = sorted(samples)
+            self._quantiles[route] = ordered[min(len(ordered) - 1, int(len(ordered) * q))]
+        return self._quantiles[route]
+
+    def routes(self) -> List[str]:
+        return list(self._samples)
+
+
+class UpstreamPolicy:
+    """
+    Дедлайны, повторы и hedge-запросы для вызовов planning-service.
+    Дедлайн маршрута действует для всех методов. Идемпотентные GET дополнительно
+    повторяются при сетевых ошибках и 502/503/504 с экспоненциальной задержкой с jitter,
+    пока позволяют число попыток, дедлайн и общий бюджет повторов; если ответ не пришел
+    за p95 задержки маршрута, отправляется вторая попытка и берется первый ответ.
+    """
+
+    def __init__(self):
+        self.budget = RetryBudget(settings.upstream_retry_budget_ratio, settings.upstream_retry_budget_min_per_second)
+        self.latency = LatencyTracker()
+        self.retries = 0
+        self.hedges = 0
+        self.hedges_won = 0
+        self.budget_exhausted = 0
+        self.deadline_exceeded = 0
+
+    @staticmethod
+    async def _send(upstream: Upstream, endpoint: str, send: SendFunc) -> httpx.Response:
+        """Одна попытка к реплике; сетевые ошибки и 5xx учитываются пассивной проверкой пула"""
+        try:
+            response = await send(f"{upstream.url}{endpoint}")
+        except httpx.PoolTimeout:
+            raise
+        except httpx.TransportError:
+            upstream_pool.report(upstream, False)
+            raise
+        upstream_pool.report(upstream, response.status_code < 500)
+        return response
+
+    async def call(
+        self,
+        method: str,
+        endpoint: str,
+        send: SendFunc,
+        close: CloseFunc = _close_noop,
+        key: Optional[str] = None
+    ) -> httpx.Response:
+        """
+        Вызов upstream; send(url) выполняет одну попытку, close закрывает ненужный ответ,
+        key - ключ балансировки (пользователь) для consistent_hash
+        """
+        deadline = time.monotonic() + route_deadline(endpoint)
+        if method != "GET":
+            return await self._within_deadline(self._send(upstream_pool.choose(key), endpoint, send), deadline)
+
+        self.budget.deposit()
+        route = route_key(endpoint)
+        tried: Set[str] = set()
+        attempt = 0
+        while True:
+            try:
+                response = await self._attempt(route, endpoint, send, close, deadline, key, tried)
+            except httpx.PoolTimeout:
+                # Нехватка соединений в собственном пуле шлюза повтором не лечится
+                raise
+            except httpx.TransportError:
+                if not self._may_retry(attempt, deadline):
+                    raise
+            else:
+                if response.status_code not in RETRYABLE_STATUSES or not self._may_retry(attempt, deadline):
+                    return response
+                await close(response)
+
+            attempt += 1
+            self.retries += 1
+            # Full jitter: случайная задержка от 0 до base * 2^(attempt-1), но не дальше дедлайна
+            backoff = random.uniform(0, settings.upstream_retry_base_delay_ms / 1000 * 2 ** (attempt - 1))
+            await asyncio.sleep(max(0.0, min(backoff, deadline - time.monotonic())))
+
+    def _may_retry(self, attempt: int, deadline: float) -> bool:
+        if attempt >= settings.upstream_retry_attempts or time.monotonic() >= deadline:
+            return False
+        if not self.budget.try_withdraw():
+            self.budget_exhausted += 1
+            return False
+        return True
+
+    async def _within_deadline(self, awaitable: Awaitable[httpx.Response], deadline: float) -> httpx.Response:
+        try:
+            return await asyncio.wait_for(awaitable, timeout=max(0.0, deadline - time.monotonic()))
+        except asyncio.TimeoutError:
+            self.deadline_exceeded += 1
+            raise UpstreamDeadlineExceeded()
+
+    def _hedge_delay(self, route: str) -> Optional[float]:
+        if not settings.upstream_hedge_enabled:
+            return None
+        quantile = self.latency.quantile(route, settings.upstream_hedge_quantile)
+        if quantile is None:
+            return None
+        return max(quantile, settings.upstream_hedge_min_delay_ms / 1000)
+
+    async def _attempt(
+        self,
+        route: str,
+        endpoint: str,
+        send: SendFunc,
+        close: CloseFunc,
+        deadline: float,
+        key: Optional[str],
+        tried: Set[str]
+    ) -> httpx.Response:
+        start = time.monotonic()
+        # Повтор идет на реплику, которую этот запрос еще не пробовал, hedge - на другую реплику
+        upstream = upstream_pool.choose(key, exclude=tried)
+        tried.add(upstream.url)
+        primary = asyncio.ensure_future(self._send(upstream, endpoint, send))
+        tasks = [primary]
+        winner = None
+        try:
+            hedge_delay = self._hedge_delay(route)
+            if hedge_delay is not None:
+                await asyncio.wait(tasks, timeout=max(0.0, min(hedge_delay, deadline - time.monotonic())))
+                if not primary.done() and time.monotonic() < deadline:
+                    if self.budget.try_withdraw():
+                        hedge_upstream = upstream_pool.choose(key, exclude={upstream.url})
+                        tried.add(hedge_upstream.url)
+                        tasks.append(asyncio.ensure_future(self._send(hedge_upstream, endpoint, send)))
+                        self.hedges += 1
+                    else:
+                        self.budget_exhausted += 1
+
+            winner = await self._first_completed(tasks, deadline)
+            if winner is not primary:
+                self.hedges_won += 1
+            response = winner.result()
+            self.latency.record(route, time.monotonic() - start)
+            return response
+        finally:
+            await self._discard(tasks, winner, close)
+
+    async def _first_completed(self, tasks: List[asyncio.Future], deadline: float) -> asyncio.Future:
+        """Первая попытка, получившая ответ; ошибки попыток игнорируются, пока есть другие"""
+        pending = set(tasks)
+        error: Optional[BaseException] = None
+        while pending:
+            done, pending = await asyncio.wait(
+                pending, timeout=max(0.0, deadline - time.monotonic()), return_when=asyncio.FIRST_COMPLETED
+            )
+            if not done:
+                self.deadline_exceeded += 1
+                raise UpstreamDeadlineExceeded()
+            for task in tasks:
+                if task in done and task.exception() is None:
+                    return task
+            error = next(task.exception() for task in tasks if task in done)
+        raise error
+
+    @staticmethod
+    async def _discard(tasks: List[asyncio.Future], winner: Optional[asyncio.Future], close: CloseFunc) -> None:
+        """Отмена проигравших попыток и закрытие уже полученных ими ответов"""
+        losers = [task for task in tasks if task is not winner]
+        for task in losers:
+            task.cancel()
+        for result in await asyncio.gather(*losers, return_exceptions=True):
+            if isinstance(result, httpx.Response):
+                await close(result)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "retries": self.retries,
+            "hedges": self.hedges,
+            "hedges_won": self.hedges_won,
+            "budget_exhausted": self.budget_exhausted,
+            "budget_balance": round(self.budget.balance, 2),
+            "deadline_exceeded": self.deadline_exceeded,
+            "hedge_delay_ms": {
+                route: round(delay * 1000, 2)
+                for route in self.latency.routes()
+                if (delay := self._hedge_delay(route)) is not None
+            }
+        }
+
+
+# Глобальный экземпляр политики
+upstream_policy = UpstreamPolicy()
@@ -0,0 +1,226 @@
+import asyncio
+import bisect
+import hashlib
+import itertools
+import logging
+import random
+import socket
+import time
+from typing import Any, Dict, Iterable, List, Optional, Set
+
+import httpx
+
+from api_gateway.config import settings
+from api_gateway.services.upstream_client import origin, upstream_client
+
+logger = logging.getLogger(__name__)
+
+def _hash(value: str) -> int:
+    return int.from_bytes(hashlib.md5(value.encode()).digest()[:8], "big")
+
+
+class Upstream:
+    """Реплика planning-service и ее состояние: активная проверка и пассивное исключение"""
+
+    def __init__(self, url: str):
+        self.url = url.rstrip("/")
+        self.key = origin(self.url)
+        self.healthy = True
+        self.health_failures = 0
+        self.consecutive_failures = 0
+        self.ejections = 0
+        self.ejected_until = 0.0
+        self.requests = 0
+        self.failures = 0
+
+    @property
+    def ejected(self) -> bool:
+        return self.ejected_until > time.monotonic()
+
+    @property
+    def available(self) -> bool:
+        return self.healthy and not self.ejected
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "url": self.url,
+            "healthy": self.healthy,
+            "ejected": self.ejected,
+            "ejections": self.ejections,
+            "outstanding": upstream_client.outstanding.get(self.key, 0),
+            "requests": self.requests,
+            "failures": self.failures
+        }
+
+
+class UpstreamPool:
+    """
+    Пул реплик planning-service с балансировкой на стороне шлюза.
+    Стратегии: round_robin, least_outstanding (меньше всего незавершенных запросов, включая
+    открытые потоки) и consistent_hash по пользователю (запросы пользователя идут на одну
+    реплику, ее кеши в памяти процесса остаются прогретыми). Реплики исключаются активной
+    проверкой GET /health и пассивно - после серии ошибок подряд (outlier ejection).
+    Если доступных реплик нет, запросы распределяются по всем (лучше попытка, чем отказ).
+    """
+
+    def __init__(self):
+        self.upstreams: Dict[str, Upstream] = {}
+        self._ring: List[int] = []
+        self._ring_nodes: List[Upstream] = []
+        self._round_robin = itertools.count()
+        self._health_task: Optional[asyncio.Task] = None
+        self._configured: tuple = ()
+        self._sync_config()
+
+    @staticmethod
+    def configured_urls() -> List[str]:
+        return settings.planning_service_urls or [settings.planning_service_url]
+
+    def _sync_config(self) -> None:
+        """Состав из настроек (при DNS-обнаружении состав задают проверки)"""
+        configured = tuple(self.configured_urls())
+        if configured != self._configured:
+            self._configured = configured
+            self.set_upstreams(configured)
+
+    def set_upstreams(self, urls: Iterable[str]) -> None:
+        """Обновление состава пула; состояние оставшихся реплик сохраняется"""
+        current = {}
+        for url in urls:
+            url = url.rstrip("/")
+            current[url] = self.upstreams.get(url) or Upstream(url)
+        if list(current) == list(self.upstreams):
+            return
+
+        self.upstreams = current
+        ring = sorted(
+            (_hash(f"{upstream.url}#{i}"), upstream)
+            for upstream in current.values()
+            for i in range(settings.upstream_hash_virtual_nodes)
+        )
+        self._ring = [point for point, _ in ring]
+        self._ring_nodes = [upstream for _, upstream in ring]
+
+    def choose(self, key: Optional[str] = None, exclude: Set[str] = frozenset()) -> Upstream:
+        """Реплика для попытки; exclude - реплики, уже использованные этим запросом (повтор, hedge)"""
+        if not settings.upstream_dns_discovery:
+            self._sync_config()
+        upstreams = list(self.upstreams.values())
+        candidates = [upstream for upstream in upstreams if upstream.available and upstream.url not in exclude]
+        if not candidates:
+            candidates = [upstream for upstream in upstreams if upstream.url not in exclude] or upstreams
+        if len(candidates) == 1:
+            return candidates[0]
+
+        strategy = settings.upstream_balancing
+        if strategy == "consistent_hash" and key is not None:
+            return self._hash_choice(key, candidates)
+        if strategy == "least_outstanding":
+            outstanding = upstream_client.outstanding
+            lowest = min(outstanding.get(upstream.key, 0) for upstream in candidates)
+            return random.choice([upstream for upstream in candidates if outstanding.get(upstream.key, 0) == lowest])
+        return candidates[next(self._round_robin) % len(candidates)]
+
+    def _hash_choice(self, key: str, candidates: List[Upstream]) -> Upstream:
+        """Первая доступная реплика по часовой стрелке от хеша ключа"""
+        allowed = set(id(upstream) for upstream in candidates)
+        start = bisect.bisect(self._ring, _hash(key))
+        for i in range(len(self._ring_nodes)):
+            upstream = self._ring_nodes[(start + i) % len(self._ring_nodes)]
+            if id(upstream) in allowed:
+                return upstream
+        return candidates[0]
+
+    def report(self, upstream: Upstream, ok: bool) -> None:
+        """Пассивная проверка: результат запроса (ошибка - сетевая ошибка или 5xx)"""
+        upstream.requests += 1
+        if ok:
+            upstream.consecutive_failures = 0
+            return
+
+        upstream.failures += 1
+        upstream.consecutive_failures += 1
+        if upstream.consecutive_failures >= settings.upstream_outlier_consecutive_failures and self._may_eject():
+            upstream.ejections += 1
+            upstream.consecutive_failures = 0
+            # Повторное исключение длится дольше: base * число исключений
+            upstream.ejected_until = time.monotonic() + settings.upstream_outlier_base_ejection_seconds * upstream.ejections
+            logger.warning(f"Upstream {upstream.url} ejected after consecutive failures")
+
+    def _may_eject(self) -> bool:
+        ejected = sum(1 for upstream in self.upstreams.values() if upstream.ejected)
+        return (ejected + 1) * 100 <= len(self.upstreams) * settings.upstream_outlier_max_ejection_percent
+
+    async def check_health(self) -> None:
+        """Активная проверка всех реплик (и обновление состава через DNS, если включено)"""
+        if settings.upstream_dns_discovery:
+            await self._discover()
+        await asyncio.gather(*(self._check(upstream) for upstream in list(self.upstreams.values())))
+
+    async def _check(self, upstream: Upstream) -> None:
+        try:
+            # Напрямую через клиент: проверки не занимают слоты адаптивного лимита
+            response = await upstream_client.client.get(
+                f"{upstream.url}{settings.upstream_health_check_path}",
+                timeout=settings.upstream_health_check_timeout
+            )
+            ok = response.status_code == 200
+        except httpx.HTTPError:
+            ok = False
+
+        if ok:
+            if not upstream.healthy:
+                logger.info(f"Upstream {upstream.url} is healthy again")
+            upstream.healthy = True
+            upstream.health_failures = 0
+        else:
+            upstream.health_failures += 1
+            if upstream.healthy and upstream.health_failures >= settings.upstream_unhealthy_threshold:
+                upstream.healthy = False
+                logger.warning(f"Upstream {upstream.url} failed health checks")
+
+    async def _discover(self) -> None:
+        """Все адреса имени сервиса (docker compose --scale отдает IP каждой реплики)"""
+        url = httpx.URL(settings.planning_service_url)
+        port = url.port or (443 if url.scheme == "https" else 80)
+        try:
+            addresses = await asyncio.get_running_loop().getaddrinfo(url.host, port, type=socket.SOCK_STREAM)
+        except OSError as e:
+            logger.warning(f"Upstream discovery failed for {url.host}: {e}")
+            return
+        hosts = sorted({f"[{ip}]" if ":" in ip else ip for ip in (address[4][0] for address in addresses)})
+        if hosts:
+            self.set_upstreams(f"{url.scheme}://{host}:{port}" for host in hosts)
+
+    async def _health_loop(self) -> None:
+        while True:
+            try:
+                await self.check_health()
+            except Exception as e:
+                logger.warning(f"Upstream health check failed: {e}")
+            await asyncio.sleep(settings.upstream_health_check_interval)
+
+    async def start(self) -> None:
+        """Запуск фоновых проверок (вызывается в lifespan)"""
+        if settings.upstream_health_check_interval > 0 and self._health_task is None:
+            self._health_task = asyncio.create_task(self._health_loop())
+
+    async def close(self) -> None:
+        if self._health_task is not None:
+            self._health_task.cancel()
+            try:
+                await self._health_task
+            except asyncio.CancelledError:
+                pass
+            self._health_task = None
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "balancing": settings.upstream_balancing,
+            "available": sum(1 for upstream in self.upstreams.values() if upstream.available),
+            "upstreams": [upstream.stats() for upstream in self.upstreams.values()]
+        }
+
+
+# Глобальный экземпляр пула
+upstream_pool = UpstreamPool()
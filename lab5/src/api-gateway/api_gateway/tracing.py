@@ -0,0 +1,22 @@
+from budget_common import tracing
+from budget_common.tracing import CLIENT, outgoing_headers, parse_traceparent, span  # noqa: F401
+
+from api_gateway.config import settings
+
+# Префикс фаз planning-service из его Server-Timing в Server-Timing шлюза
+UPSTREAM_TIMING_PREFIX = "planning-"
+
+# Глобальный экземпляр экспорта span
+span_exporter = tracing.SpanExporter(settings)
+
+
+def record_upstream_timing(value):
+    """Фазы upstream из его Server-Timing попадают в Server-Timing шлюза с префиксом planning-"""
+    tracing.record_remote_timing(value, UPSTREAM_TIMING_PREFIX)
+
+
+class TracingMiddleware(tracing.TracingMiddleware):
+    """Трассировка запросов шлюза с экспортом span через span_exporter"""
+
+    def __init__(self, app):
+        super().__init__(app, settings, span_exporter)
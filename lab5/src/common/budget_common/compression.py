@@ -0,0 +1,258 @@
+import zlib
+from typing import Any, Dict, List, Optional, Tuple
+
+try:
+    import brotli
+except ImportError:  # brotli - необязательная зависимость
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:  # zstandard - необязательная зависимость
+    zstandard = None
+
+# Типы содержимого, которые имеет смысл сжимать (изображения, архивы и т.п. уже сжаты)
+COMPRESSIBLE_TYPES = ("text/", "application/json", "application/x-ndjson", "application/xml", "application/javascript")
+
+
+class _GzipEncoder:
+    def __init__(self, level: int):
+        self._compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+    def encode(self, data: bytes, final: bool) -> bytes:
+        return self._compressor.compress(data) + self._compressor.flush(zlib.Z_FINISH if final else zlib.Z_SYNC_FLUSH)
+
+
+class _BrotliEncoder:
+    def __init__(self, level: int):
+        self._compressor = brotli.Compressor(quality=level)
+
+    def encode(self, data: bytes, final: bool) -> bytes:
+        output = self._compressor.process(data)
+        return output + (self._compressor.finish() if final else self._compressor.flush())
+
+
+class _ZstdEncoder:
+    def __init__(self, level: int):
+        self._compressor = zstandard.ZstdCompressor(level=level).compressobj()
+
+    def encode(self, data: bytes, final: bool) -> bytes:
+        output = self._compressor.compress(data)
+        return output + self._compressor.flush(zstandard.COMPRESSOBJ_FLUSH_FINISH if final else zstandard.COMPRESSOBJ_FLUSH_BLOCK)
+
+
+def available_encodings(settings) -> List[str]:
+    """Кодировки из COMPRESSION_ENCODINGS в порядке предпочтения, для которых установлены библиотеки"""
+    installed = {"gzip": True, "br": brotli is not None, "zstd": zstandard is not None}
+    return [encoding for encoding in settings.compression_encodings if installed.get(encoding)]
+
+
+def make_encoder(encoding: str, settings):
+    if encoding == "zstd":
+        return _ZstdEncoder(settings.compression_zstd_level)
+    if encoding == "br":
+        return _BrotliEncoder(settings.compression_brotli_level)
+    return _GzipEncoder(settings.compression_gzip_level)
+
+
+def negotiate(accept_encoding: str, available: List[str]) -> Optional[str]:
+    """
+    Кодировка ответа по Accept-Encoding: наибольший q, при равенстве - порядок сервера.
+    None - клиент не принимает ни одну из доступных кодировок (ответ без сжатия)
+    """
+    weights: Dict[str, float] = {}
+    for part in accept_encoding.split(","):
+        name, _, params = part.partition(";")
+        name = name.strip().lower()
+        if not name:
+            continue
+        q = 1.0
+        for param in params.split(";"):
+            key, _, value = param.strip().partition("=")
+            if key.lower() == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        weights[name] = q
+
+    best, best_q = None, 0.0
+    for encoding in available:
+        q = weights.get(encoding, weights.get("*", 0.0))
+        if q > best_q:
+            best, best_q = encoding, q
+    return best
+
+
+def _compressible(headers: List[Tuple[bytes, bytes]], status: int) -> bool:
+    if status < 200 or status in (204, 304):
+        return False
+    content_type = b""
+    for name, value in headers:
+        lower = name.lower()
+        if lower == b"content-encoding":
+            # Ответ уже сжат (например, вызванный сервис сжал его сам) - передается как есть
+            return False
+        if lower == b"content-type":
+            content_type = value
+    return content_type.decode("latin-1").lower().startswith(COMPRESSIBLE_TYPES)
+
+
+def _content_length(headers: List[Tuple[bytes, bytes]]) -> Optional[int]:
+    for name, value in headers:
+        if name.lower() == b"content-length":
+            try:
+                return int(value)
+            except ValueError:
+                return None
+    return None
+
+
+def _encoded_headers(headers: List[Tuple[bytes, bytes]], encoding: str) -> List[Tuple[bytes, bytes]]:
+    """Заголовки сжатого ответа: без Content-Length, слабый ETag, Vary: Accept-Encoding"""
+    result, vary = [], None
+    for name, value in headers:
+        lower = name.lower()
+        if lower == b"content-length":
+            continue
+        if lower == b"etag" and not value.startswith(b"W/"):
+            # Байты ответа другие, поэтому сильный ETag становится слабым
+            value = b"W/" + value
+        if lower == b"vary":
+            vary = value
+            continue
+        result.append((name, value))
+    if vary is None:
+        vary = b"Accept-Encoding"
+    elif b"accept-encoding" not in vary.lower() and vary.strip() != b"*":
+        vary += b", Accept-Encoding"
+    result.append((b"vary", vary))
+    result.append((b"content-encoding", encoding.encode()))
+    return result
+
+
+class CompressionStats:
+    """Счетчики сжатия по кодировкам для /health"""
+
+    def __init__(self, settings):
+        self.settings = settings
+        self.responses: Dict[str, int] = {}
+        self.bytes_in: Dict[str, int] = {}
+        self.bytes_out: Dict[str, int] = {}
+        self.skipped_small = 0
+
+    def record(self, encoding: str, bytes_in: int, bytes_out: int) -> None:
+        self.responses[encoding] = self.responses.get(encoding, 0) + 1
+        self.bytes_in[encoding] = self.bytes_in.get(encoding, 0) + bytes_in
+        self.bytes_out[encoding] = self.bytes_out.get(encoding, 0) + bytes_out
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": self.settings.compression_enabled,
+            "encodings": available_encodings(self.settings),
+            "min_size": self.settings.compression_min_size,
+            "skipped_small": self.skipped_small,
+            "responses": dict(self.responses),
+            "ratio": {
+                encoding: round(self.bytes_out[encoding] / self.bytes_in[encoding], 3)
+                for encoding in self.responses
+                if self.bytes_in[encoding]
+            }
+        }
+
+
+class _CompressingResponder:
+    """
+    Обертка send одного ответа. Начало ответа задерживается до первого фрагмента тела:
+    тело целиком меньше порога уходит без сжатия, иначе сжимается; потоковый ответ
+    сжимается по фрагментам, каждый фрагмент сбрасывается клиенту сразу.
+    """
+
+    def __init__(self, send, encoding: str, settings, stats: CompressionStats):
+        self.send = send
+        self.encoding = encoding
+        self.settings = settings
+        self.compression_stats = stats
+        self.start: Optional[Dict[str, Any]] = None
+        self.encoder = None
+        self.passthrough = False
+        self.bytes_in = 0
+        self.bytes_out = 0
+
+    async def __call__(self, message: Dict[str, Any]) -> None:
+        if self.passthrough:
+            await self.send(message)
+            return
+
+        if message["type"] == "http.response.start":
+            headers = list(message.get("headers", []))
+            length = _content_length(headers)
+            min_size = self.settings.compression_min_size
+            if not _compressible(headers, message["status"]) or (length is not None and length < min_size):
+                self.passthrough = True
+                if length is not None and length < min_size:
+                    self.compression_stats.skipped_small += 1
+                await self.send(message)
+                return
+            self.start = message
+            return
+
+        if message["type"] != "http.response.body":
+            await self.send(message)
+            return
+
+        body = message.get("body", b"")
+        more_body = message.get("more_body", False)
+        if self.encoder is None:
+            if not more_body and len(body) < self.settings.compression_min_size:
+                self.passthrough = True
+                self.compression_stats.skipped_small += 1
+                await self.send(self.start)
+                await self.send(message)
+                return
+            self.encoder = make_encoder(self.encoding, self.settings)
+            headers = _encoded_headers(self.start["headers"], self.encoding)
+            if not more_body:
+                # Ответ одним фрагментом: длина сжатого тела известна
+                encoded = self.encoder.encode(body, final=True)
+                headers.append((b"content-length", str(len(encoded)).encode()))
+                await self.send({**self.start, "headers": headers})
+                await self.send({"type": "http.response.body", "body": encoded})
+                self.compression_stats.record(self.encoding, len(body), len(encoded))
+                return
+            await self.send({**self.start, "headers": headers})
+
+        encoded = self.encoder.encode(body, final=not more_body)
+        self.bytes_in += len(body)
+        self.bytes_out += len(encoded)
+        await self.send({"type": "http.response.body", "body": encoded, "more_body": more_body})
+        if not more_body:
+            self.compression_stats.record(self.encoding, self.bytes_in, self.bytes_out)
+
+
+class CompressionMiddleware:
+    """
+    ASGI-middleware сжатия ответов по Accept-Encoding: zstd и br, если установлены
+    zstandard и brotli, иначе gzip. Сжимаются только текстовые и JSON-ответы не меньше
+    COMPRESSION_MIN_SIZE; уже сжатые ответы (Content-Encoding) не трогаются.
+    """
+
+    def __init__(self, app, settings, stats: CompressionStats):
+        self.app = app
+        self.settings = settings
+        self.stats = stats
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self.settings.compression_enabled:
+            await self.app(scope, receive, send)
+            return
+
+        accept_encoding = next(
+            (value for name, value in scope["headers"] if name == b"accept-encoding"), b""
+        ).decode("latin-1")
+        encoding = negotiate(accept_encoding, available_encodings(self.settings)) if accept_encoding else None
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        await self.app(scope, receive, _CompressingResponder(send, encoding, self.settings, self.stats))
@@ -0,0 +1,326 @@
+import asyncio
+import logging
+import sys
+import threading
+import time
+import traceback
+from collections import deque
+from contextlib import contextmanager
+from typing import Any, Callable, Deque, Dict, Iterator, List, Optional
+
+from prometheus_client import CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Gauge, Histogram, generate_latest
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+from starlette.responses import Response
+
+from budget_common.tracing import CLIENT, MAX_ROUTE_TEMPLATES, route_template, span
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+STORE_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0)
+
+
+class StateCollector:
+    """
+    Состояние компонентов (кеши, пулы соединений) на момент сбора /metrics:
+    значения берутся из их счетчиков, обработка запросов на это времени не тратит
+    """
+
+    def __init__(self):
+        self.caches: Dict[str, Callable[[], dict]] = {}
+        self.pools: Dict[str, Callable[[], Optional[Dict[str, int]]]] = {}
+
+    def add_cache(self, name: str, stats: Callable[[], dict]) -> None:
+        """stats() возвращает hits и misses"""
+        self.caches[name] = stats
+
+    def add_pool(self, name: str, stats: Callable[[], Optional[Dict[str, int]]]) -> None:
+        """stats() возвращает in_use, idle и max или None, если пул не создан"""
+        self.pools[name] = stats
+
+    def collect(self):
+        lookups = CounterMetricFamily("cache_requests", "Cache lookups by result", labels=["cache", "result"])
+        hit_ratio = GaugeMetricFamily("cache_hit_ratio", "Share of cache lookups that were hits", labels=["cache"])
+        for name, stats in self.caches.items():
+            values = stats()
+            hits, misses = values["hits"], values["misses"]
+            lookups.add_metric([name, "hit"], hits)
+            lookups.add_metric([name, "miss"], misses)
+            hit_ratio.add_metric([name], hits / (hits + misses) if hits + misses else 0.0)
+
+        connections = GaugeMetricFamily("connection_pool_connections", "Pool connections by state", labels=["pool", "state"])
+        utilization = GaugeMetricFamily("connection_pool_utilization", "In-use connections / pool maximum", labels=["pool"])
+        for name, stats in self.pools.items():
+            values = stats()
+            if values is None:
+                continue
+            for state in ("in_use", "idle", "max"):
+                connections.add_metric([name, state], values[state])
+            utilization.add_metric([name], values["in_use"] / values["max"] if values["max"] else 0.0)
+
+        yield from (lookups, hit_ratio, connections, utilization)
+
+
+class EventLoopLagMonitor:
+    """
+    Задержка таймера цикла событий: насколько позже запланированного он срабатывает.
+
+    Блокировки: цикл каждые METRICS_EVENT_LOOP_STALL_MS / 2 отмечает пульс, фоновый поток
+    проверяет его. Если пульса нет дольше порога, поток снимает стек потока цикла событий
+    (синхронный вызов, который его держит) и текущую задачу; когда цикл освобождается,
+    блокировка записывается с полной длительностью. Поток не зависит от цикла, поэтому
+    стек снимается во время блокировки, а не после нее.
+    """
+
+    def __init__(self, settings, lag: Histogram, stalls: Counter, stall_duration: Histogram):
+        self.settings = settings
+        self._lag = lag
+        self._stalls = stalls
+        self._stall_duration = stall_duration
+        self._task: Optional[asyncio.Task] = None
+        self.last_lag = 0.0
+        self.max_lag = 0.0
+
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._loop_thread_id: Optional[int] = None
+        self._beat = 0.0
+        self._watchdog: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        self._blocked: Optional[Dict[str, Any]] = None
+        self.stalls: Deque[Dict[str, Any]] = deque(maxlen=self.settings.metrics_event_loop_stall_history)
+        self.stall_count = 0
+        self.max_stall_ms = 0.0
+
+    async def _run(self, interval: float) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            start = loop.time()
+            await asyncio.sleep(interval)
+            self.last_lag = max(0.0, loop.time() - start - interval)
+            self.max_lag = max(self.max_lag, self.last_lag)
+            self._lag.observe(self.last_lag)
+
+    async def start(self) -> None:
+        if self.settings.metrics_enabled and self.settings.metrics_event_loop_interval > 0 and self._task is None:
+            self._task = asyncio.create_task(self._run(self.settings.metrics_event_loop_interval))
+        self.watch()
+
+    async def close(self) -> None:
+        self._loop = None
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def _threshold(self) -> float:
+        return self.settings.metrics_event_loop_stall_ms / 1000
+
+    def watch(self) -> None:
+        """
+        Отслеживать блокировки текущего цикла событий; в том же цикле повторный вызов ничего
+        не делает. Вызывается при старте и из MetricsMiddleware: TestClient без lifespan
+        обрабатывает каждый запрос в новом цикле
+        """
+        if not self.settings.metrics_enabled or self.settings.metrics_event_loop_stall_ms <= 0:
+            return
+        loop = asyncio.get_running_loop()
+        if loop is self._loop:
+            return
+        self._loop_thread_id = threading.get_ident()
+        self._beat = time.monotonic()
+        self._loop = loop
+        loop.call_later(self._threshold() / 2, self._heartbeat, loop)
+        if self._watchdog is None:
+            self._watchdog = threading.Thread(target=self._watch, name="event-loop-watchdog", daemon=True)
+            self._watchdog.start()
+
+    def _heartbeat(self, loop: asyncio.AbstractEventLoop) -> None:
+        if loop is not self._loop:
+            return
+        threshold = self._threshold()
+        if threshold <= 0:
+            self._loop = None
+            return
+        now = time.monotonic()
+        blocked = now - self._beat - threshold / 2
+        with self._lock:
+            self._beat = now
+            captured, self._blocked = self._blocked, None
+        if blocked >= threshold:
+            self._record(blocked, captured)
+        loop.call_later(threshold / 2, self._heartbeat, loop)
+
+    def _watch(self) -> None:
+        """Поток-сторож: снимает стек цикла событий, пока тот заблокирован"""
+        while True:
+            threshold = self._threshold()
+            time.sleep(threshold / 4 if threshold > 0 else 1.0)
+            loop = self._loop
+            if loop is None or threshold <= 0 or not loop.is_running():
+                continue
+            with self._lock:
+                if self._blocked is None and time.monotonic() - self._beat - threshold / 2 >= threshold:
+                    self._blocked = self._capture(loop)
+
+    def _capture(self, loop: asyncio.AbstractEventLoop) -> Dict[str, Any]:
+        frame = sys._current_frames().get(self._loop_thread_id)
+        stack = traceback.format_stack(frame) if frame is not None else []
+        task = asyncio.current_task(loop)
+        return {
+            "task": task.get_name() if task is not None else None,
+            "coroutine": getattr(task.get_coro(), "__qualname__", None) if task is not None else None,
+            "stack": [line.rstrip() for line in stack[-self.settings.metrics_event_loop_stack_depth:]]
+        }
+
+    def _record(self, blocked: float, captured: Optional[Dict[str, Any]]) -> None:
+        stall = {
+            "at": time.time(),
+            "duration_ms": round(blocked * 1000, 1),
+            **(captured or {"task": None, "coroutine": None, "stack": []})
+        }
+        self.stalls.append(stall)
+        self.stall_count += 1
+        self.max_stall_ms = max(self.max_stall_ms, stall["duration_ms"])
+        self._stalls.inc()
+        self._stall_duration.observe(blocked)
+        logger.warning(
+            "Event loop blocked for %.1f ms in %s\n%s",
+            stall["duration_ms"], stall["coroutine"] or "callback", "\n".join(stall["stack"])
+        )
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "lag_ms": round(self.last_lag * 1000, 2),
+            "max_lag_ms": round(self.max_lag * 1000, 2),
+            "stall_threshold_ms": self.settings.metrics_event_loop_stall_ms,
+            "stalls": self.stall_count,
+            "max_stall_ms": self.max_stall_ms
+        }
+
+    def recent_stalls(self) -> List[Dict[str, Any]]:
+        return list(reversed(self.stalls))
+
+
+class ServiceMetrics:
+    """
+    Метрики одного сервиса в собственном реестре: в нем нет метрик процесса, тестов
+    и других приложений того же процесса. HTTP-запросы, операции хранилищ, цикл событий
+    и состояние компонентов.
+    """
+
+    def __init__(self, settings):
+        self.settings = settings
+        self.registry = CollectorRegistry()
+        self.http_requests = Counter(
+            "http_requests", "HTTP requests by route template and status", ["method", "route", "status"],
+            registry=self.registry
+        )
+        self.http_request_duration = Histogram(
+            "http_request_duration_seconds", "HTTP request latency by route template", ["method", "route"],
+            buckets=LATENCY_BUCKETS, registry=self.registry
+        )
+        self.http_requests_in_flight = Gauge(
+            "http_requests_in_flight", "HTTP requests being processed by route template", ["method", "route"],
+            registry=self.registry
+        )
+        self.store_operation_duration = Histogram(
+            "store_operation_duration_seconds", "Store operation latency", ["store", "operation"],
+            buckets=STORE_BUCKETS, registry=self.registry
+        )
+        event_loop_lag = Histogram(
+            "event_loop_lag_seconds", "Delay of a periodic event loop timer beyond its interval",
+            buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5), registry=self.registry
+        )
+        event_loop_stalls = Counter(
+            "event_loop_stalls", "Event loop blocked longer than METRICS_EVENT_LOOP_STALL_MS", registry=self.registry
+        )
+        event_loop_stall_duration = Histogram(
+            "event_loop_stall_duration_seconds", "Duration of event loop stalls",
+            buckets=(0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0), registry=self.registry
+        )
+        self.event_loop_monitor = EventLoopLagMonitor(settings, event_loop_lag, event_loop_stalls, event_loop_stall_duration)
+        self.state_collector = StateCollector()
+        self.registry.register(self.state_collector)
+        # Дочерние ряды метрик по значениям меток: labels() проверяет метки под блокировкой на каждом вызове
+        self._store_series: Dict[tuple, Any] = {}
+
+    @contextmanager
+    def observe_store(self, store: str, operation: str) -> Iterator[None]:
+        """Длительность операции хранилища (в том числе завершившейся ошибкой) и span трассы"""
+        series = self._store_series.get((store, operation))
+        if series is None:
+            series = self._store_series[(store, operation)] = self.store_operation_duration.labels(store, operation)
+        start = time.perf_counter()
+        try:
+            with span(f"{store} {operation}", phase=store, kind=CLIENT, **{"db.system": store, "db.operation": operation}):
+                yield
+        finally:
+            series.observe(time.perf_counter() - start)
+
+    def response(self) -> Response:
+        return Response(generate_latest(self.registry), media_type=CONTENT_TYPE_LATEST)
+
+
+class MetricsMiddleware:
+    """
+    ASGI-middleware метрик HTTP: число запросов, гистограмма задержки и запросы в обработке
+    по шаблону маршрута (/api/plans/{plan_id}, а не /api/plans/1), чтобы число рядов не росло
+    с числом идентификаторов. Шаблон и ряды метрик для метода и пути вычисляются один раз
+    и запоминаются.
+    """
+
+    def __init__(self, app, settings, metrics: ServiceMetrics):
+        self.app = app
+        self.settings = settings
+        self.metrics = metrics
+        self._paths: Dict[tuple, tuple] = {}
+        self._counters: Dict[tuple, Any] = {}
+
+    def _series(self, scope) -> tuple:
+        """(шаблон маршрута, ряд in-flight, ряд гистограммы задержки) для метода и пути"""
+        key = (scope["method"], scope["path"])
+        series = self._paths.get(key)
+        if series is None:
+            template = route_template(scope)
+            if len(self._paths) >= MAX_ROUTE_TEMPLATES:
+                self._paths.clear()
+            series = self._paths[key] = (
+                template,
+                self.metrics.http_requests_in_flight.labels(scope["method"], template),
+                self.metrics.http_request_duration.labels(scope["method"], template)
+            )
+        return series
+
+    def _counter(self, method: str, route: str, status: int):
+        counter = self._counters.get((method, route, status))
+        if counter is None:
+            counter = self._counters[(method, route, status)] = self.metrics.http_requests.labels(method, route, str(status))
+        return counter
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self.settings.metrics_enabled:
+            await self.app(scope, receive, send)
+            return
+
+        self.metrics.event_loop_monitor.watch()
+        route, in_flight, duration = self._series(scope)
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        in_flight.inc()
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            in_flight.dec()
+            duration.observe(time.perf_counter() - start)
+            self._counter(scope["method"], route, status).inc()
+
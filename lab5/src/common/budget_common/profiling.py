@@ -0,0 +1,332 @@
+import cProfile
+import io
+import logging
+import os
+import pstats
+import time
+from collections import Counter, OrderedDict
+from typing import Any, Callable, Dict, Optional, Tuple
+from urllib.parse import parse_qsl, urlencode
+
+from budget_common.tracing import route_template
+
+logger = logging.getLogger(__name__)
+
+try:
+    from pyinstrument import Profiler as PyinstrumentProfiler
+    from pyinstrument.renderers import ConsoleRenderer, HTMLRenderer
+except ImportError:
+    PyinstrumentProfiler = None
+
+PROFILE_HEADER = b"x-profile"
+PROFILE_QUERY = "profile"
+# Значения X-Profile / ?profile=: профиль вместо ответа (text, html) или сохранение профиля (store)
+PROFILE_MODES = {"1": "text", "true": "text", "text": "text", "html": "html", "store": "store"}
+
+
+def profiler_name(settings) -> str:
+    """pyinstrument (сэмплирующий, учитывает asyncio), если установлен; иначе cProfile"""
+    if settings.profiling_profiler == "cprofile":
+        return "cprofile"
+    if PyinstrumentProfiler is None:
+        if settings.profiling_profiler == "pyinstrument":
+            logger.warning("pyinstrument is not installed, requests are profiled with cProfile")
+        return "cprofile"
+    return "pyinstrument"
+
+
+class _PyinstrumentRun:
+    """Сэмплирующий профиль одного запроса; в async-режиме время ожидания await учитывается как [await]"""
+
+    def __init__(self, settings):
+        self._profiler = PyinstrumentProfiler(interval=settings.profiling_interval, async_mode="enabled")
+        self._session = None
+
+    def start(self) -> None:
+        self._profiler.start()
+
+    def stop(self) -> None:
+        self._session = self._profiler.stop()
+
+    def render(self, output: str) -> Tuple[str, str]:
+        if output == "html":
+            return HTMLRenderer().render(self._session), "text/html"
+        return ConsoleRenderer(unicode=True, color=False, show_all=False).render(self._session), "text/plain"
+
+    def folded(self) -> Counter:
+        """Стеки в формате flamegraph.pl / speedscope: 'f1;f2;f3' -> микросекунды в вершине стека"""
+        stacks = Counter()
+
+        def walk(frame, path):
+            if frame.is_synthetic and frame.function == "[self]":
+                stacks[path] += int(frame.time * 1e6)
+                return
+            label = f"{frame.function} ({frame.file_path_short}:{frame.line_no})" if not frame.is_synthetic else frame.function
+            stack = f"{path};{label.replace(';', ':')}" if path else label.replace(";", ":")
+            if not frame.children:
+                stacks[stack] += int(frame.time * 1e6)
+            for child in frame.children:
+                walk(child, stack)
+
+        root = self._session.root_frame()
+        if root is not None:
+            walk(root, "")
+        return stacks
+
+
+class _CProfileRun:
+    """
+    Детерминированный профиль cProfile. Профилируется весь поток цикла событий, поэтому
+    в профиль попадают и другие запросы, выполнявшиеся одновременно
+    """
+
+    def __init__(self, settings):
+        self.settings = settings
+        self._profiler = cProfile.Profile()
+
+    def start(self) -> None:
+        self._profiler.enable()
+
+    def stop(self) -> None:
+        self._profiler.disable()
+
+    def stats(self) -> pstats.Stats:
+        return pstats.Stats(self._profiler)
+
+    def render(self, output: str) -> Tuple[str, str]:
+        stream = io.StringIO()
+        pstats.Stats(self._profiler, stream=stream).sort_stats("cumulative").print_stats(self.settings.profiling_report_lines)
+        return stream.getvalue(), "text/plain"
+
+
+def _make_run(settings):
+    return _PyinstrumentRun(settings) if profiler_name(settings) == "pyinstrument" else _CProfileRun(settings)
+
+
+class RouteProfile:
+    """Сводный профиль маршрута по сэмплированным запросам: свернутые стеки или статистика cProfile"""
+
+    def __init__(self, settings):
+        self.settings = settings
+        self.samples = 0
+        self.total_ms = 0.0
+        self.stacks: Counter = Counter()
+        self.stats: Optional[pstats.Stats] = None
+
+    def add(self, run, duration_ms: float) -> None:
+        self.samples += 1
+        self.total_ms += duration_ms
+        if isinstance(run, _PyinstrumentRun):
+            for stack, micros in run.folded().items():
+                if stack in self.stacks or len(self.stacks) < self.settings.profiling_max_stacks:
+                    self.stacks[stack] += micros
+                else:
+                    self.stacks["[other]"] += micros
+        elif self.stats is None:
+            self.stats = run.stats()
+        else:
+            self.stats.add(run.stats())
+
+    def render(self) -> Tuple[str, str]:
+        """(текст, формат): folded - строки 'стек микросекунды', pstats - отчет cProfile"""
+        if self.stats is not None:
+            stream = io.StringIO()
+            self.stats.stream = stream
+            self.stats.sort_stats("cumulative").print_stats(self.settings.profiling_report_lines)
+            return stream.getvalue(), "pstats"
+        return "".join(f"{stack} {micros}\n" for stack, micros in self.stacks.most_common()), "folded"
+
+
+class ProfileStore:
+    """Сохраненные профили запросов (X-Profile: store) и сводные профили маршрутов в памяти процесса"""
+
+    def __init__(self, settings):
+        self.settings = settings
+        self.profiles: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self.routes: Dict[str, RouteProfile] = {}
+        self.active = False
+        self.requests = 0
+        self.profiled = 0
+        self.busy = 0
+
+    def save(self, profile_id: str, run, info: Dict[str, Any]) -> None:
+        self.profiles[profile_id] = {**info, "run": run}
+        while len(self.profiles) > self.settings.profiling_store_size:
+            self.profiles.popitem(last=False)
+
+    def get(self, profile_id: str) -> Optional[Dict[str, Any]]:
+        return self.profiles.get(profile_id)
+
+    def add_sample(self, route: str, run, duration_ms: float) -> None:
+        profile = self.routes.get(route)
+        if profile is None:
+            profile = self.routes[route] = RouteProfile(self.settings)
+        profile.add(run, duration_ms)
+
+    def should_sample(self) -> bool:
+        """Каждый PROFILING_SAMPLE_RATE-й запрос, если профилировщик свободен"""
+        if self.settings.profiling_sample_rate <= 0:
+            return False
+        self.requests += 1
+        return self.requests % self.settings.profiling_sample_rate == 0 and not self.active
+
+    def reset(self) -> None:
+        self.profiles.clear()
+        self.routes.clear()
+
+    def summary(self) -> Dict[str, Any]:
+        return {
+            "profiler": profiler_name(self.settings),
+            "sample_rate": self.settings.profiling_sample_rate,
+            "stored": [
+                {key: value for key, value in profile.items() if key != "run"} | {"id": profile_id}
+                for profile_id, profile in reversed(self.profiles.items())
+            ],
+            "routes": [
+                {"route": route, "samples": profile.samples, "avg_ms": round(profile.total_ms / profile.samples, 2)}
+                for route, profile in sorted(self.routes.items(), key=lambda item: -item[1].total_ms)
+            ]
+        }
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "profiler": profiler_name(self.settings),
+            "sample_rate": self.settings.profiling_sample_rate,
+            "profiled": self.profiled,
+            "busy": self.busy,
+            "stored": len(self.profiles),
+            "routes": len(self.routes)
+        }
+
+
+async def _send_json(send, status: int, detail: str) -> None:
+    body = ('{"detail": "%s"}' % detail).encode()
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())]
+    })
+    await send({"type": "http.response.body", "body": body})
+
+
+class ProfilingMiddleware:
+    """
+    ASGI-middleware профилирования по запросу администратора: заголовок X-Profile или параметр
+    ?profile= (text, html - профиль вместо ответа; store - обычный ответ, профиль сохраняется
+    и доступен по X-Profile-Id в /admin/profiles). Флаг убирается из запроса, дальше он не уходит.
+    Дополнительно каждый PROFILING_SAMPLE_RATE-й запрос профилируется и добавляется в сводный
+    профиль своего маршрута. Одновременно профилируется не больше одного запроса.
+    Право на профилирование проверяет is_admin сервиса по заголовкам запроса.
+    """
+
+    def __init__(self, app, settings, store: ProfileStore, is_admin: Callable[[Dict[bytes, bytes]], bool]):
+        self.app = app
+        self.settings = settings
+        self.store = store
+        self.is_admin = is_admin
+
+    @staticmethod
+    def _requested_mode(scope) -> Optional[str]:
+        """Режим профилирования из заголовка или query; флаг удаляется из scope"""
+        mode = None
+        headers = []
+        for name, value in scope["headers"]:
+            if name == PROFILE_HEADER:
+                mode = value.decode("latin-1").strip().lower()
+            else:
+                headers.append((name, value))
+        if mode is not None:
+            scope["headers"] = headers
+
+        if PROFILE_QUERY.encode() in scope["query_string"]:
+            params = parse_qsl(scope["query_string"].decode("latin-1"), keep_blank_values=True)
+            remaining = [(key, value) for key, value in params if key != PROFILE_QUERY]
+            if len(remaining) != len(params):
+                mode = next(value for key, value in params if key == PROFILE_QUERY).lower() or "text"
+                scope["query_string"] = urlencode(remaining).encode("latin-1")
+
+        if mode is None:
+            return None
+        return PROFILE_MODES.get(mode, "text")
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self.settings.profiling_enabled:
+            await self.app(scope, receive, send)
+            return
+
+        mode = self._requested_mode(scope)
+        if mode is not None:
+            if not self.is_admin({name: value for name, value in scope["headers"]}):
+                await _send_json(send, 403, "Profiling is available to admins only")
+                return
+            if self.store.active:
+                self.store.busy += 1
+                await _send_json(send, 409, "Another request is being profiled, retry later")
+                return
+            await self._profile(scope, receive, send, mode)
+        elif self.store.should_sample():
+            await self._sample(scope, receive, send)
+        else:
+            await self.app(scope, receive, send)
+
+    async def _run(self, scope, receive, send):
+        """Выполнение запроса под профилировщиком: (профиль, длительность в мс)"""
+        run = _make_run(self.settings)
+        self.store.active = True
+        start = time.perf_counter()
+        run.start()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            run.stop()
+            self.store.active = False
+            self.store.profiled += 1
+        return run, (time.perf_counter() - start) * 1000
+
+    async def _sample(self, scope, receive, send):
+        run, duration_ms = await self._run(scope, receive, send)
+        self.store.add_sample(route_template(scope), run, duration_ms)
+
+    async def _profile(self, scope, receive, send, mode: str):
+        info = {
+            "method": scope["method"],
+            "path": scope["path"],
+            "route": route_template(scope),
+            "profiler": profiler_name(self.settings),
+            "created_at": time.time()
+        }
+
+        if mode == "store":
+            profile_id = os.urandom(8).hex()
+
+            async def send_with_id(message):
+                if message["type"] == "http.response.start":
+                    message = {**message, "headers": list(message.get("headers", [])) + [(b"x-profile-id", profile_id.encode())]}
+                await send(message)
+
+            run, duration_ms = await self._run(scope, receive, send_with_id)
+            self.store.save(profile_id, run, {**info, "duration_ms": round(duration_ms, 2)})
+            return
+
+        # Ответ приложения заменяется профилем; статус исходного ответа - в X-Profile-Status
+        status = {"code": 500}
+
+        async def capture(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+
+        run, duration_ms = await self._run(scope, receive, capture)
+        body, media_type = run.render(mode)
+        body = body.encode()
+        await send({
+            "type": "http.response.start",
+            "status": 200,
+            "headers": [
+                (b"content-type", f"{media_type}; charset=utf-8".encode()),
+                (b"content-length", str(len(body)).encode()),
+                (b"cache-control", b"no-store"),
+                (b"x-profile-status", str(status["code"]).encode()),
+                (b"x-profile-duration-ms", f"{duration_ms:.2f}".encode())
+            ]
+        })
+        await send({"type": "http.response.body", "body": body})
@@ -0,0 +1,399 @@
+import asyncio
+import functools
+import json
+import logging
+import os
+import random
+import re
+import time
+import urllib.request
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Deque, Dict, Iterator, List, Optional, Tuple
+
+from fastapi.routing import APIRoute
+from starlette.routing import Match
+
+logger = logging.getLogger(__name__)
+
+# Виды span в OTLP
+INTERNAL, SERVER, CLIENT = 1, 2, 3
+
+TRACEPARENT_RE = re.compile(r"^00-([0-9a-f]{32})-([0-9a-f]{16})-([0-9a-f]{2})$")
+REQUEST_ID_RE = re.compile(r"^[A-Za-z0-9._:-]{1,128}$")
+
+
+# Шаблоны маршрутов по приложению, методу и пути; очищаются при переполнении
+_route_templates: Dict[tuple, str] = {}
+MAX_ROUTE_TEMPLATES = 10000
+
+
+def route_template(scope) -> str:
+    """Шаблон маршрута запроса (/plans/{plan_id}) или unmatched; вычисляется один раз на метод и путь"""
+    key = (scope["app"], scope["method"], scope["path"])
+    template = _route_templates.get(key)
+    if template is None:
+        template = "unmatched"
+        for route in scope["app"].router.routes:
+            match, _ = route.matches(scope)
+            if match != Match.NONE:
+                template = getattr(route, "path", "unmatched")
+                break
+        if len(_route_templates) >= MAX_ROUTE_TEMPLATES:
+            _route_templates.clear()
+        _route_templates[key] = template
+    return template
+
+
+def parse_traceparent(value: Optional[str]) -> Optional[Tuple[str, str, bool]]:
+    """(trace_id, parent_span_id, sampled) из заголовка W3C traceparent или None"""
+    match = TRACEPARENT_RE.match((value or "").strip().lower())
+    if match is None or match.group(1) == "0" * 32 or match.group(2) == "0" * 16:
+        return None
+    return match.group(1), match.group(2), bool(int(match.group(3), 16) & 1)
+
+
+class Span:
+    """Операция трассы: имя, родитель, время начала и конца, атрибуты"""
+
+    __slots__ = ("name", "trace", "span_id", "parent_id", "kind", "phase", "attributes",
+                 "start_ns", "end_ns", "error", "_started")
+
+    def __init__(self, name: str, trace: "RequestTrace", parent_id: Optional[str], kind: int,
+                 phase: Optional[str], attributes: Dict[str, Any]):
+        self.name = name
+        self.trace = trace
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent_id
+        self.kind = kind
+        self.phase = phase
+        self.attributes = attributes
+        self.start_ns = time.time_ns()
+        self.end_ns = 0
+        self.error: Optional[str] = None
+        self._started = time.perf_counter_ns()
+
+    def end(self, duration_ns: Optional[int] = None) -> None:
+        if duration_ns is None:
+            duration_ns = time.perf_counter_ns() - self._started
+        self.end_ns = self.start_ns + duration_ns
+        if self.phase is not None:
+            self.trace.add_phase(self.phase, duration_ns / 1e6)
+        if self.trace.sampled and self.trace.exporter is not None:
+            self.trace.exporter.add(self)
+
+
+class RequestTrace:
+    """
+    Трасса одного входящего запроса: идентификаторы, экспорт span сервиса, длительности фаз
+    для Server-Timing, фазы вызванного сервиса из его Server-Timing и момент окончания
+    обработчика маршрута (начало сериализации ответа)
+    """
+
+    __slots__ = ("trace_id", "request_id", "sampled", "exporter", "phases", "remote_phases", "handler_end")
+
+    def __init__(self, trace_id: str, request_id: str, sampled: bool, exporter: Optional["SpanExporter"] = None):
+        self.trace_id = trace_id
+        self.request_id = request_id
+        self.sampled = sampled
+        self.exporter = exporter
+        self.phases: Dict[str, float] = {}
+        self.remote_phases: Dict[str, float] = {}
+        self.handler_end: Optional[int] = None
+
+    def add_phase(self, phase: str, duration_ms: float) -> None:
+        self.phases[phase] = self.phases.get(phase, 0.0) + duration_ms
+
+
+_current_trace: ContextVar[Optional[RequestTrace]] = ContextVar("current_trace", default=None)
+_current_span: ContextVar[Optional[Span]] = ContextVar("current_span", default=None)
+
+
+def current_trace() -> Optional[RequestTrace]:
+    return _current_trace.get()
+
+
+def start_span(name: str, phase: Optional[str] = None, kind: int = INTERNAL, **attributes) -> Optional[Span]:
+    """Span, дочерний текущему; не становится текущим (для событий драйверов). None вне запроса"""
+    trace = _current_trace.get()
+    if trace is None:
+        return None
+    parent = _current_span.get()
+    return Span(name, trace, parent.span_id if parent is not None else None, kind, phase, attributes)
+
+
+@contextmanager
+def span(name: str, phase: Optional[str] = None, kind: int = INTERNAL, **attributes) -> Iterator[Optional[Span]]:
+    """
+    Span на время блока; вложенные span становятся его дочерними.
+    phase - имя фазы в Server-Timing, куда добавляется длительность
+    """
+    current = start_span(name, phase, kind, **attributes)
+    if current is None:
+        yield None
+        return
+    token = _current_span.set(current)
+    try:
+        yield current
+    except BaseException as e:
+        current.error = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        _current_span.reset(token)
+        current.end()
+
+
+def outgoing_headers() -> Dict[str, str]:
+    """traceparent и X-Request-ID для исходящего запроса из текущего span"""
+    trace = _current_trace.get()
+    if trace is None:
+        return {}
+    current = _current_span.get()
+    span_id = current.span_id if current is not None else os.urandom(8).hex()
+    return {
+        "traceparent": f"00-{trace.trace_id}-{span_id}-{'01' if trace.sampled else '00'}",
+        "X-Request-ID": trace.request_id
+    }
+
+
+def parse_server_timing(value: Optional[str]) -> Dict[str, float]:
+    """Длительности метрик из заголовка Server-Timing: 'db;dur=5.1, total;dur=8' -> {'db': 5.1, 'total': 8.0}"""
+    phases = {}
+    for entry in (value or "").split(","):
+        name, *params = [part.strip() for part in entry.split(";")]
+        for param in params:
+            key, _, number = param.partition("=")
+            if name and key.lower() == "dur":
+                try:
+                    phases[name] = phases.get(name, 0.0) + float(number)
+                except ValueError:
+                    pass
+    return phases
+
+
+def record_remote_timing(value: Optional[str], prefix: str) -> None:
+    """Фазы вызванного сервиса из его Server-Timing попадают в Server-Timing ответа с префиксом"""
+    trace = _current_trace.get()
+    if trace is None or not value:
+        return
+    for name, duration in parse_server_timing(value).items():
+        trace.remote_phases[prefix + name] = trace.remote_phases.get(prefix + name, 0.0) + duration
+
+
+def server_timing(trace: RequestTrace, span_id: str, response_start: int, total_ms: float) -> str:
+    """
+    Фазы хранилищ, сериализация, фазы вызванного сервиса, общее время до заголовков ответа
+    и traceparent для поиска трассы
+    """
+    entries = [f"{name};dur={duration:.2f}" for name, duration in trace.phases.items()]
+    if trace.handler_end is not None:
+        entries.append(f"serialize;dur={(response_start - trace.handler_end) / 1e6:.2f}")
+    entries += [f"{name};dur={duration:.2f}" for name, duration in trace.remote_phases.items()]
+    entries.append(f"total;dur={total_ms:.2f}")
+    entries.append(f'traceparent;desc="00-{trace.trace_id}-{span_id}-{"01" if trace.sampled else "00"}"')
+    return ", ".join(entries)
+
+
+class TracedRoute(APIRoute):
+    """
+    Маршрут FastAPI со span обработчика. Конец обработчика отмечается в трассе: время от него
+    до заголовков ответа (проверка response_model, jsonable_encoder, json.dumps) - фаза serialize
+    """
+
+    def get_route_handler(self):
+        endpoint = self.dependant.call
+        if asyncio.iscoroutinefunction(endpoint):
+            @functools.wraps(endpoint)
+            async def traced_endpoint(*args, **kwargs):
+                try:
+                    with span(self.name):
+                        return await endpoint(*args, **kwargs)
+                finally:
+                    trace = _current_trace.get()
+                    if trace is not None:
+                        trace.handler_end = time.perf_counter_ns()
+
+            self.dependant.call = traced_endpoint
+        return super().get_route_handler()
+
+
+def _attribute(key: str, value: Any) -> Dict[str, Any]:
+    if isinstance(value, bool):
+        return {"key": key, "value": {"boolValue": value}}
+    if isinstance(value, int):
+        return {"key": key, "value": {"intValue": str(value)}}
+    if isinstance(value, float):
+        return {"key": key, "value": {"doubleValue": value}}
+    return {"key": key, "value": {"stringValue": str(value)}}
+
+
+def _otlp_span(span: Span) -> Dict[str, Any]:
+    data = {
+        "traceId": span.trace.trace_id,
+        "spanId": span.span_id,
+        "name": span.name,
+        "kind": span.kind,
+        "startTimeUnixNano": str(span.start_ns),
+        "endTimeUnixNano": str(span.end_ns),
+        "attributes": [_attribute(key, value) for key, value in span.attributes.items()],
+        "status": {"code": 2, "message": span.error} if span.error else {"code": 0}
+    }
+    if span.parent_id is not None:
+        data["parentSpanId"] = span.parent_id
+    return data
+
+
+class SpanExporter:
+    """
+    Экспорт завершенных span пачками в фоне: TRACING_EXPORTER=file - строки OTLP/JSON в файл
+    (формат файлового приемника OpenTelemetry Collector), otlp - POST OTLP/HTTP JSON в коллектор.
+    Очередь ограничена TRACING_MAX_QUEUE, при переполнении старые span отбрасываются.
+    """
+
+    def __init__(self, settings):
+        self.settings = settings
+        self._queue: Deque[Span] = deque()
+        self._task: Optional[asyncio.Task] = None
+        self.exported = 0
+        self.dropped = 0
+        self.failed = 0
+
+    def add(self, span: Span) -> None:
+        if self.settings.tracing_exporter == "none":
+            return
+        if len(self._queue) >= self.settings.tracing_max_queue:
+            self._queue.popleft()
+            self.dropped += 1
+        self._queue.append(span)
+
+    def _payload(self, spans: List[Span]) -> bytes:
+        return json.dumps({
+            "resourceSpans": [{
+                "resource": {"attributes": [_attribute("service.name", self.settings.tracing_service_name)]},
+                "scopeSpans": [{"scope": {"name": __name__}, "spans": [_otlp_span(span) for span in spans]}]
+            }]
+        }, separators=(",", ":")).encode()
+
+    def _write(self, payload: bytes) -> None:
+        if self.settings.tracing_exporter == "file":
+            directory = os.path.dirname(self.settings.tracing_file_path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            with open(self.settings.tracing_file_path, "ab") as file:
+                file.write(payload + b"\n")
+        elif self.settings.tracing_exporter == "otlp":
+            request = urllib.request.Request(
+                self.settings.tracing_otlp_endpoint, data=payload, headers={"Content-Type": "application/json"}
+            )
+            with urllib.request.urlopen(request, timeout=5):
+                pass
+
+    async def flush(self) -> None:
+        if not self._queue:
+            return
+        spans = list(self._queue)
+        self._queue.clear()
+        try:
+            # Запись файла и HTTP-запрос блокируют, поэтому выполняются вне цикла событий
+            await asyncio.to_thread(self._write, self._payload(spans))
+            self.exported += len(spans)
+        except Exception as e:
+            self.failed += len(spans)
+            logger.warning(f"Span export failed: {e}")
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.settings.tracing_export_interval)
+            await self.flush()
+
+    async def start(self) -> None:
+        if self.settings.tracing_enabled and self.settings.tracing_exporter != "none" and self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def close(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "exporter": self.settings.tracing_exporter,
+            "queued": len(self._queue),
+            "exported": self.exported,
+            "dropped": self.dropped,
+            "failed": self.failed
+        }
+
+
+class TracingMiddleware:
+    """
+    ASGI-middleware трассировки: X-Request-ID и W3C traceparent входящего запроса
+    (или новые), серверный span запроса и заголовок Server-Timing с длительностями фаз
+    до отправки заголовков ответа. Трасса доступна обработчикам через contextvars.
+    """
+
+    def __init__(self, app, settings, exporter: SpanExporter):
+        self.app = app
+        self.settings = settings
+        self.exporter = exporter
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self.settings.tracing_enabled:
+            await self.app(scope, receive, send)
+            return
+
+        request_id, traceparent = "", ""
+        for name, value in scope["headers"]:
+            if name == b"x-request-id":
+                request_id = value.decode("latin-1")
+            elif name == b"traceparent":
+                traceparent = value.decode("latin-1")
+        parent = parse_traceparent(traceparent)
+        if parent is not None:
+            trace_id, parent_id, sampled = parent
+        else:
+            trace_id, parent_id = os.urandom(16).hex(), None
+            sampled = random.random() < self.settings.tracing_sample_ratio
+        if not REQUEST_ID_RE.match(request_id):
+            # Без X-Request-ID клиента идентификатором запроса служит идентификатор трассы
+            request_id = trace_id
+
+        trace = RequestTrace(trace_id, request_id, sampled, self.exporter)
+        trace_token = _current_trace.set(trace)
+        server_span = Span(
+            f"{scope['method']} {route_template(scope)}", trace, parent_id, SERVER, None,
+            {"http.method": scope["method"], "http.target": scope["path"], "http.request_id": request_id}
+        )
+        span_token = _current_span.set(server_span)
+        status = 500
+
+        async def send_with_timing(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                extra = [(b"x-request-id", request_id.encode("latin-1"))]
+                if self.settings.tracing_server_timing:
+                    now = time.perf_counter_ns()
+                    timing = server_timing(trace, server_span.span_id, now, (now - server_span._started) / 1e6)
+                    extra.append((b"server-timing", timing.encode("latin-1")))
+                message = {**message, "headers": list(message.get("headers", [])) + extra}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        except BaseException as e:
+            server_span.error = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            server_span.attributes["http.status_code"] = status
+            if status >= 500 and server_span.error is None:
+                server_span.error = f"HTTP {status}"
+            _current_span.reset(span_token)
+            _current_trace.reset(trace_token)
+            server_span.end()
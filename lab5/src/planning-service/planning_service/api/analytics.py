@@ -3,8 +3,9 @@ from fastapi import APIRouter, Depends, HTTPException
 from planning_service.models.pydantic_models import AnalyticsResponse
 from planning_service.services import analytics_service
 from planning_service.dependencies import get_current_user
+from planning_service.tracing import TracedRoute
 
-router = APIRouter(prefix="/plans", tags=["analytics"])
+router = APIRouter(prefix="/plans", tags=["analytics"], route_class=TracedRoute)
 
 
 @router.get("/{plan_id}/analytics", response_model=AnalyticsResponse)
@@ -3,8 +3,9 @@ from planning_service.services.cache_service import cache_service
 from planning_service.database.redis import redis_manager
 from planning_service.dependencies import get_current_user
 import time
+from planning_service.tracing import TracedRoute
 
-router = APIRouter(prefix="/cache", tags=["cache"])
+router = APIRouter(prefix="/cache", tags=["cache"], route_class=TracedRoute)
 
 @router.get("/health")
 async def cache_health():
@@ -4,8 +4,9 @@ from typing import List
 from planning_service.models.pydantic_models import BudgetPlanResponse, BudgetPlanCreate, BudgetPlanUpdate
 from planning_service.services import plans_service
 from planning_service.dependencies import get_current_user
+from planning_service.tracing import TracedRoute
 
-router = APIRouter(prefix="/plans", tags=["plans"])
+router = APIRouter(prefix="/plans", tags=["plans"], route_class=TracedRoute)
 
 
 @router.get("", response_model=List[BudgetPlanResponse])
@@ -0,0 +1,89 @@
+from typing import Optional
+
+from fastapi import APIRouter, Depends, HTTPException, Query, status
+from fastapi.responses import HTMLResponse, PlainTextResponse
+
+from planning_service.dependencies import get_profiling_admin
+from planning_service.profiling import profile_store
+from planning_service.tracing import TracedRoute
+
+router = APIRouter(prefix="/admin/profiles", tags=["admin"], route_class=TracedRoute)
+
+
+@router.get("")
+async def list_profiles(current_user: str = Depends(get_profiling_admin)):
+    """
+    List stored request profiles and per-route sampled profiles
+
+    A request is profiled on demand when it comes with `X-User` from `PROFILING_ADMIN_USERS`
+    and `X-Profile: text|html|store` (or `?profile=...`); with `PROFILING_SAMPLE_RATE=N` every N-th request is profiled
+    and added to the aggregate of its route.
+
+    Example response:
+    ```json
+    {
+        "profiler": "pyinstrument",
+        "sample_rate": 100,
+        "stored": [
+            {"id": "3f1c9a0b7d2e4c51", "method": "GET", "path": "/plans/1", "route": "/plans/{plan_id}",
+             "profiler": "pyinstrument", "created_at": 1760870400.0, "duration_ms": 12.4}
+        ],
+        "routes": [
+            {"route": "/plans", "samples": 42, "avg_ms": 6.1}
+        ]
+    }
+    ```
+    """
+    return profile_store.summary()
+
+
+@router.get("/aggregate", response_class=PlainTextResponse)
+async def get_route_profile(
+    route: str = Query(..., description="Route template, e.g. /plans/{plan_id}"),
+    current_user: str = Depends(get_profiling_admin)
+):
+    """
+    Aggregated profile of a route's sampled requests
+
+    pyinstrument aggregates are returned as folded stacks (`frame;frame;frame microseconds`
+    per line), ready for flamegraph.pl or speedscope; cProfile aggregates as a pstats report.
+    The format is given in the `X-Profile-Format` header (`folded` or `pstats`).
+
+    Example response:
+    ```
+    Starlette.__call__ (starlette/applications.py:116);...;get_plans (planning_service/api/plans.py:13) 4180
+    ```
+    """
+    profile = profile_store.routes.get(route)
+    if profile is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="No samples for this route")
+    body, profile_format = profile.render()
+    return PlainTextResponse(body, headers={"X-Profile-Format": profile_format})
+
+
+@router.get("/{profile_id}")
+async def get_profile(
+    profile_id: str,
+    format: Optional[str] = Query("html", pattern="^(html|text)$"),
+    current_user: str = Depends(get_profiling_admin)
+):
+    """
+    Stored profile of a request sent with `X-Profile: store`
+
+    The profile id is returned in the `X-Profile-Id` response header of that request.
+    `format=html` renders the pyinstrument HTML view, `format=text` a text call tree
+    (cProfile profiles are always text).
+    """
+    profile = profile_store.get(profile_id)
+    if profile is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Profile not found")
+    body, media_type = profile["run"].render(format)
+    if media_type == "text/html":
+        return HTMLResponse(body)
+    return PlainTextResponse(body)
+
+
+@router.delete("", status_code=status.HTTP_204_NO_CONTENT)
+async def reset_profiles(current_user: str = Depends(get_profiling_admin)):
+    """Drop stored profiles and per-route aggregates"""
+    profile_store.reset()
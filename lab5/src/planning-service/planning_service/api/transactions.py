@@ -4,8 +4,9 @@ from typing import List, Optional
 from planning_service.models.pydantic_models import TransactionResponse, TransactionCreate
 from planning_service.services import transactions_service
 from planning_service.dependencies import get_current_user
+from planning_service.tracing import TracedRoute
 
-router = APIRouter(prefix="/transactions", tags=["transactions"])
+router = APIRouter(prefix="/transactions", tags=["transactions"], route_class=TracedRoute)
 
 
 @router.get("", response_model=List[TransactionResponse])
@@ -1,4 +1,5 @@
-from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi import APIRouter, Depends, HTTPException, Query, Response
+from fastapi.responses import StreamingResponse
 from typing import List, Optional
 from datetime import datetime
 
@@ -7,16 +8,20 @@ from planning_service.models.mongodb_models import (
     TransactionCreateMongo,
     TransactionUpdateMongo,
     TransactionFilter,
-    TransactionType
+    TransactionType,
+    ExportFormat
 )
 from planning_service.services.transaction_mongo_service import transaction_mongo_service
-from planning_service.dependencies import get_current_user
+from planning_service.dependencies import get_current_admin, get_current_user
+from planning_service.config import settings
+from planning_service.tracing import TracedRoute
 
-router = APIRouter(prefix="/transactions-mongo", tags=["transactions-mongo"])
+router = APIRouter(prefix="/transactions-mongo", tags=["transactions-mongo"], route_class=TracedRoute)
 
 
 @router.get("", response_model=List[TransactionMongo])
 async def get_transactions_mongo(
+    response: Response,
     current_user: str = Depends(get_current_user),
     plan_id: Optional[int] = Query(None, description="Filter by plan ID"),
     transaction_type: Optional[TransactionType] = Query(None, description="Filter by transaction type"),
@@ -25,8 +30,11 @@ async def get_transactions_mongo(
     max_amount: Optional[float] = Query(None, ge=0, description="Maximum amount filter"),
     start_date: Optional[datetime] = Query(None, description="Start date filter (ISO format)"),
     end_date: Optional[datetime] = Query(None, description="End date filter (ISO format)"),
-    skip: int = Query(0, ge=0, description="Number of transactions to skip"),
-    limit: int = Query(100, ge=1, le=1000, description="Maximum number of transactions to return")
+    cursor: Optional[str] = Query(None, description="Continuation token from the X-Next-Cursor header"),
+    skip: int = Query(0, ge=0, description="Number of transactions to skip (deprecated, use cursor)"),
+    limit: int = Query(100, ge=1, le=1000, description="Maximum number of transactions to return"),
+    fields: Optional[str] = Query(None, description="Comma-separated list of fields to return"),
+    lean: bool = Query(False, description="Skip per-document validation and serialize directly to JSON")
 ):
     """
     Get transactions from MongoDB with advanced filtering
@@ -41,8 +49,18 @@ async def get_transactions_mongo(
     - `max_amount`: Maximum transaction amount
     - `start_date`: Filter transactions after this date
     - `end_date`: Filter transactions before this date
-    - `skip`: Pagination offset
+    - `cursor`: Continuation token returned in the `X-Next-Cursor` header of the previous page
+    - `skip`: Pagination offset (kept for backward compatibility, capped on the server)
     - `limit`: Number of results to return (max 1000)
+    - `fields`: Comma-separated subset of fields to return, e.g. `id,amount,created_at`
+    - `lean`: Return store documents without per-document model validation
+    
+    Transactions are ordered by `created_at` (newest first). When more results are
+    available, the response carries an `X-Next-Cursor` header; pass its value as
+    `cursor` to fetch the next page. Cursor pages cost the same regardless of depth.
+    
+    `fields` and `lean` are only available with cursor pagination. In these modes the
+    documents are projected in MongoDB and serialized straight to JSON bytes.
     
     Example response:
     ```json
@@ -71,16 +89,116 @@ async def get_transactions_mongo(
         user_id=current_user
     )
     
-    transactions = await transaction_mongo_service.get_transactions(
-        user_id=current_user,
-        filters=filters,
-        skip=skip,
-        limit=limit
-    )
+    if cursor is not None and skip:
+        raise HTTPException(status_code=400, detail="Use either cursor or skip, not both")
+    if skip > settings.mongo_max_skip:
+        raise HTTPException(
+            status_code=400,
+            detail=f"skip must not exceed {settings.mongo_max_skip}, use cursor pagination instead"
+        )
+    
+    if skip and (fields or lean):
+        raise HTTPException(status_code=400, detail="fields and lean require cursor pagination")
+    
+    if fields or lean:
+        try:
+            content, next_cursor = await transaction_mongo_service.get_transactions_page_json(
+                user_id=current_user,
+                filters=filters,
+                limit=limit,
+                cursor=cursor,
+                fields=fields
+            )
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        
+        headers = {"X-Next-Cursor": next_cursor} if next_cursor else None
+        return Response(content=content, media_type="application/json", headers=headers)
+    
+    if skip:
+        return await transaction_mongo_service.get_transactions(
+            user_id=current_user,
+            filters=filters,
+            skip=skip,
+            limit=limit
+        )
+    
+    try:
+        transactions, next_cursor = await transaction_mongo_service.get_transactions_page(
+            user_id=current_user,
+            filters=filters,
+            limit=limit,
+            cursor=cursor
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
     
     return transactions
 
 
+@router.get("/export")
+async def export_transactions_mongo(
+    current_user: str = Depends(get_current_user),
+    export_format: ExportFormat = Query(ExportFormat.ndjson, alias="format", description="Export format: ndjson or csv"),
+    plan_id: Optional[int] = Query(None, description="Filter by plan ID"),
+    transaction_type: Optional[TransactionType] = Query(None, description="Filter by transaction type"),
+    category: Optional[str] = Query(None, description="Filter by category"),
+    start_date: Optional[datetime] = Query(None, description="Start date filter (ISO format)"),
+    end_date: Optional[datetime] = Query(None, description="End date filter (ISO format)"),
+    fields: Optional[str] = Query(None, description="Comma-separated list of fields to export")
+):
+    """
+    Stream the full transaction history of the current user
+    
+    The response is streamed straight from a MongoDB cursor in batches, so memory usage
+    stays constant regardless of the number of exported transactions.
+    
+    **Query Parameters:**
+    - `format`: `ndjson` (one JSON object per line, default) or `csv` (with header row)
+    - `plan_id`, `transaction_type`, `category`: Optional filters
+    - `start_date`, `end_date`: Date range filter (ISO format)
+    - `fields`: Comma-separated subset of fields, e.g. `id,amount,created_at`
+    
+    Example response (`format=ndjson`):
+    ```
+    {"_id":"507f1f77bcf86cd799439011","plan_id":1,"type":"expense","amount":150.0,...}
+    {"_id":"507f1f77bcf86cd799439012","plan_id":1,"type":"income","amount":2500.0,...}
+    ```
+    """
+    filters = TransactionFilter(
+        plan_id=plan_id,
+        type=transaction_type,
+        category=category,
+        start_date=start_date,
+        end_date=end_date,
+        user_id=current_user
+    )
+    
+    try:
+        chunks = transaction_mongo_service.export_transactions(
+            user_id=current_user,
+            filters=filters,
+            export_format=export_format,
+            fields=fields
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=503, detail=f"MongoDB unavailable: {e}")
+    
+    media_type = "text/csv" if export_format == ExportFormat.csv else "application/x-ndjson"
+    filename = f"transactions.{export_format.value}"
+    
+    return StreamingResponse(
+        chunks,
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+    )
+
+
 @router.post("", response_model=TransactionMongo)
 async def create_transaction_mongo(
     transaction: TransactionCreateMongo,
@@ -259,6 +377,53 @@ async def get_plan_analytics_mongo(
     return analytics
 
 
+@router.get("/plan/{plan_id}/dashboard")
+async def get_plan_dashboard_mongo(
+    plan_id: int,
+    current_user: str = Depends(get_current_user),
+    latest: int = Query(10, ge=0, le=100, description="Number of latest transactions to include"),
+    top: int = Query(5, ge=1, le=50, description="Number of top categories to include")
+):
+    """
+    Get everything a plan dashboard needs in one request
+    
+    Totals by type, top categories, a monthly series and the latest transactions are
+    computed in a single MongoDB `$facet` aggregation. The result is cached per plan and
+    invalidated whenever a transaction of that plan is created, updated or deleted.
+    
+    **Path Parameters:**
+    - `plan_id`: ID of the budget plan
+    
+    Example response:
+    ```json
+    {
+        "plan_id": 1,
+        "totals": {
+            "total_income": 5500.0,
+            "total_expenses": 1630.0,
+            "transaction_count": 5,
+            "balance": 3870.0
+        },
+        "top_categories": [
+            {"category": "salary", "type": "income", "total_amount": 5000.0, "transaction_count": 1}
+        ],
+        "monthly": [
+            {"month": "2024-01", "total_income": 5500.0, "total_expenses": 1630.0, "transaction_count": 5, "balance": 3870.0}
+        ],
+        "latest_transactions": [
+            {"_id": "507f1f77bcf86cd799439011", "plan_id": 1, "type": "income", "amount": 500.0, "...": "..."}
+        ]
+    }
+    ```
+    """
+    dashboard = await transaction_mongo_service.get_plan_dashboard(plan_id, current_user, latest, top)
+    
+    if dashboard is None:
+        raise HTTPException(status_code=503, detail="Failed to build dashboard")
+    
+    return dashboard
+
+
 @router.get("/analytics/user")
 async def get_user_analytics_mongo(
     current_user: str = Depends(get_current_user)
@@ -280,4 +445,81 @@ async def get_user_analytics_mongo(
     ```
     """
     analytics = await transaction_mongo_service.get_user_analytics(current_user)
-    return analytics 
\ No newline at end of file
+    return analytics 
+
+@router.get("/analytics/monthly")
+async def get_monthly_analytics_mongo(
+    current_user: str = Depends(get_current_user),
+    plan_id: Optional[int] = Query(None, description="Restrict to a single plan")
+):
+    """
+    Get a per-month breakdown of income and expenses for the current user
+    
+    Read from the pre-aggregated daily rollups, so the cost does not grow with history.
+    
+    Example response:
+    ```json
+    [
+        {
+            "month": "2024-01",
+            "total_income": 7500.0,
+            "total_expenses": 1825.0,
+            "transaction_count": 8,
+            "balance": 5675.0
+        }
+    ]
+    ```
+    """
+    return await transaction_mongo_service.get_monthly_analytics(current_user, plan_id)
+
+
+@router.get("/analytics/categories")
+async def get_category_analytics_mongo(
+    current_user: str = Depends(get_current_user),
+    plan_id: Optional[int] = Query(None, description="Restrict to a single plan")
+):
+    """
+    Get a per-category breakdown for the current user, largest totals first
+    
+    Read from the pre-aggregated daily rollups.
+    
+    Example response:
+    ```json
+    [
+        {
+            "category": "salary",
+            "type": "income",
+            "total_amount": 5000.0,
+            "transaction_count": 1
+        }
+    ]
+    ```
+    """
+    return await transaction_mongo_service.get_category_analytics(current_user, plan_id)
+
+
+@router.post("/rollups/rebuild")
+async def rebuild_rollups_mongo(
+    current_user: str = Depends(get_current_admin),
+    user_id: Optional[str] = Query(None, description="Rebuild only this user's rollups")
+):
+    """
+    Rebuild daily analytics rollups from raw transactions (admin only)
+    
+    Rollups are maintained incrementally on every write; rebuild after bulk imports
+    or to repair drift. Without `user_id` the whole rollup collection is replaced.
+    
+    Example response:
+    ```json
+    {
+        "message": "Rollups rebuilt",
+        "rollups": 8
+    }
+    ```
+    """
+    try:
+        count = await transaction_mongo_service.rebuild_rollups(user_id)
+    except Exception as e:
+        raise HTTPException(status_code=503, detail=f"Failed to rebuild rollups: {e}")
+    
+    return {"message": "Rollups rebuilt", "rollups": count}
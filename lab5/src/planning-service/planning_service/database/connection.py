@@ -3,12 +3,46 @@ from sqlalchemy import create_engine, MetaData
 from sqlalchemy.orm import declarative_base
 
 from planning_service.config import settings
+from planning_service.metrics import observe_store
 
 # Database setup
 DATABASE_URL = settings.database_url
 
+
+class InstrumentedDatabase(databases.Database):
+    """databases.Database с гистограммой длительности запросов к PostgreSQL"""
+
+    async def fetch_all(self, query, values=None):
+        with observe_store("postgres", "fetch_all"):
+            return await super().fetch_all(query, values)
+
+    async def fetch_one(self, query, values=None):
+        with observe_store("postgres", "fetch_one"):
+            return await super().fetch_one(query, values)
+
+    async def fetch_val(self, query, values=None, column=0):
+        with observe_store("postgres", "fetch_val"):
+            return await super().fetch_val(query, values, column=column)
+
+    async def execute(self, query, values=None):
+        with observe_store("postgres", "execute"):
+            return await super().execute(query, values)
+
+    async def execute_many(self, query, values):
+        with observe_store("postgres", "execute_many"):
+            return await super().execute_many(query, values)
+
+    def pool_usage(self):
+        """Занятые и свободные соединения пула asyncpg для метрик Prometheus"""
+        pool = getattr(self._backend, "_pool", None)
+        if not self.is_connected or pool is None:
+            return None
+        idle = pool.get_idle_size()
+        return {"in_use": pool.get_size() - idle, "idle": idle, "max": pool.get_max_size()}
+
+
 metadata = MetaData()
-database = databases.Database(DATABASE_URL)
+database = InstrumentedDatabase(DATABASE_URL)
 engine = create_engine(DATABASE_URL.replace("postgresql://", "postgresql+psycopg2://"))
 
 # SQLAlchemy Base class for models
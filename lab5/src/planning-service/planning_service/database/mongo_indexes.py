@@ -0,0 +1,202 @@
+"""
+Управление индексами MongoDB по реальной нагрузке.
+
+Набор индексов объявлен по правилу ESR (equality, sort, range) из фактических
+форм запросов TransactionMongoService: равенство по user_id (и plan_id/category),
+сортировка по (created_at, _id), диапазоны по created_at/amount.
+
+Запуск:
+    python -m planning_service.database.mongo_indexes report
+    python -m planning_service.database.mongo_indexes apply [--drop]
+"""
+
+from typing import Dict, List, Optional
+from pymongo import ASCENDING, DESCENDING, IndexModel
+from pymongo.errors import OperationFailure
+import argparse
+import json
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Сортировка списка транзакций; совпадает с TRANSACTIONS_SORT
+_SEEK = [("created_at", DESCENDING), ("_id", DESCENDING)]
+
+DECLARED_INDEXES: Dict[str, List[IndexModel]] = {
+    "transactions": [
+        # E: user_id; S: created_at, _id; R: created_at/amount.
+        # Список и seek-пагинация пользователя, аналитика пользователя, выгрузка
+        IndexModel([("user_id", ASCENDING)] + _SEEK, name="user_id_1_created_at_-1__id_-1"),
+        # E: user_id, plan_id; S: created_at, _id.
+        # Список по плану, аналитика и дашборд плана ($match по user_id + plan_id)
+        IndexModel([("user_id", ASCENDING), ("plan_id", ASCENDING)] + _SEEK, name="user_id_1_plan_id_1_created_at_-1__id_-1"),
+        # E: user_id, category; S: created_at, _id.
+        # Фильтр по категории; type не индексируется - два значения, фильтруется по ходу чтения
+        IndexModel([("user_id", ASCENDING), ("category", ASCENDING)] + _SEEK, name="user_id_1_category_1_created_at_-1__id_-1"),
+    ],
+    "transaction_rollups": [
+        # Ключ $inc-апсерта агрегата; префикс user_id[, plan_id] обслуживает чтение аналитики
+        IndexModel(
+            [("user_id", ASCENDING), ("plan_id", ASCENDING), ("day", ASCENDING), ("type", ASCENDING), ("category", ASCENDING)],
+            name="user_id_1_plan_id_1_day_1_type_1_category_1",
+            unique=True
+        ),
+    ],
+}
+
+
+def _key(index: dict) -> List[tuple]:
+    """Ключ индекса как список пар (поле, направление); index_information отдает список, IndexModel - SON"""
+    key = index["key"]
+    pairs = key.items() if hasattr(key, "items") else key
+    return [(field, int(direction) if isinstance(direction, (int, float)) else direction) for field, direction in pairs]
+
+
+def is_prefix(shorter: List[tuple], longer: List[tuple]) -> bool:
+    """Является ли ключ shorter строгим префиксом ключа longer"""
+    return len(shorter) < len(longer) and longer[:len(shorter)] == shorter
+
+
+def index_usage(collection) -> Optional[Dict[str, dict]]:
+    """
+    Счетчики использования индексов из $indexStats: {name: {"ops": int, "since": datetime}}.
+    None, если сервер не поддерживает $indexStats.
+    """
+    try:
+        return {
+            stat["name"]: {"ops": int(stat["accesses"]["ops"]), "since": stat["accesses"]["since"]}
+            for stat in collection.aggregate([{"$indexStats": {}}])
+        }
+    except OperationFailure as e:
+        logger.warning(f"$indexStats unavailable for {collection.name}: {e}")
+        return None
+
+
+def find_redundant(indexes: Dict[str, dict]) -> Dict[str, str]:
+    """
+    Избыточные индексы: ключ является префиксом ключа другого индекса.
+    Уникальные, частичные и TTL-индексы не считаются избыточными - у них своя семантика.
+    Возвращает {избыточный: покрывающий}.
+    """
+    redundant = {}
+    for name, index in indexes.items():
+        if name == "_id_" or any(option in index for option in ("unique", "partialFilterExpression", "expireAfterSeconds")):
+            continue
+        for other_name, other in indexes.items():
+            if other_name != name and is_prefix(_key(index), _key(other)):
+                redundant[name] = other_name
+                break
+    return redundant
+
+
+def _signature(index: dict) -> tuple:
+    """Ключ и уникальность индекса - то, что определяет его соответствие объявлению"""
+    return tuple(_key(index)), bool(index.get("unique"))
+
+
+def build_report(collection, declared: List[IndexModel]) -> dict:
+    """Сравнение объявленного набора с индексами коллекции и статистикой их использования"""
+    existing = collection.index_information()
+    declared_docs = {model.document["name"]: model.document for model in declared}
+    usage = index_usage(collection)
+
+    # Соответствие ищется по ключу, а не по имени: индекс, созданный вручную под другим
+    # именем, считается существующим и повторно не создается
+    existing_signatures = {_signature(index): name for name, index in existing.items()}
+    declared_signatures = {_signature(doc) for doc in declared_docs.values()}
+
+    # Объявленное имя занято индексом с другим ключом или опциями - его нужно пересоздать
+    changed = [
+        name for name, doc in declared_docs.items()
+        if name in existing and _signature(existing[name]) != _signature(doc)
+    ]
+    missing = [
+        name for name, doc in declared_docs.items()
+        if _signature(doc) not in existing_signatures and name not in changed
+    ]
+
+    return {
+        "collection": collection.name,
+        "existing": sorted(existing),
+        "missing": sorted(missing),
+        "changed": sorted(changed),
+        "undeclared": sorted(
+            name for name, index in existing.items()
+            if name != "_id_" and name not in changed and _signature(index) not in declared_signatures
+        ),
+        "unused": None if usage is None else sorted(
+            name for name, stat in usage.items() if name != "_id_" and stat["ops"] == 0
+        ),
+        "redundant": find_redundant(existing),
+        "usage": None if usage is None else {name: stat["ops"] for name, stat in sorted(usage.items())},
+    }
+
+
+def apply_indexes(collection, declared: List[IndexModel], drop: bool = False) -> dict:
+    """
+    Идемпотентное приведение индексов коллекции к объявленному набору.
+    Создаются недостающие и пересоздаются измененные индексы; необъявленные удаляются только при drop=True.
+    Повторный запуск не выполняет никаких изменений.
+    """
+    report = build_report(collection, declared)
+    by_name = {model.document["name"]: model for model in declared}
+
+    for name in report["changed"]:
+        collection.drop_index(name)
+
+    to_create = [by_name[name] for name in report["missing"] + report["changed"]]
+    if to_create:
+        collection.create_indexes(to_create)
+
+    dropped = []
+    if drop:
+        for name in report["undeclared"]:
+            collection.drop_index(name)
+            dropped.append(name)
+
+    return {
+        "collection": collection.name,
+        "created": sorted(report["missing"]),
+        "recreated": report["changed"],
+        "dropped": dropped,
+    }
+
+
+def ensure_declared_indexes(database) -> None:
+    """Создание недостающих объявленных индексов при старте сервиса (без удаления)"""
+    for collection_name, declared in DECLARED_INDEXES.items():
+        try:
+            result = apply_indexes(database[collection_name], declared)
+            if result["created"] or result["recreated"]:
+                logger.info(f"MongoDB indexes applied: {result}")
+        except Exception as e:
+            logger.error(f"Error ensuring indexes for {collection_name}: {e}")
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="MongoDB index management for the transactions collections")
+    parser.add_argument("command", choices=["report", "apply"], help="report - compare with $indexStats, apply - create/update declared indexes")
+    parser.add_argument("--drop", action="store_true", help="apply: also drop undeclared indexes")
+    args = parser.parse_args(argv)
+
+    from planning_service.database.mongodb import mongodb
+    if not mongodb.connect():
+        print("MongoDB connection failed")
+        return 1
+
+    try:
+        results = []
+        for collection_name, declared in DECLARED_INDEXES.items():
+            collection = mongodb.database[collection_name]
+            if args.command == "report":
+                results.append(build_report(collection, declared))
+            else:
+                results.append(apply_indexes(collection, declared, drop=args.drop))
+        print(json.dumps(results, indent=2, ensure_ascii=False))
+    finally:
+        mongodb.disconnect()
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
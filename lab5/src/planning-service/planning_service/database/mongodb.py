@@ -1,14 +1,90 @@
-from pymongo import MongoClient
+from pymongo import MongoClient, monitoring
 from planning_service.config import settings
+from planning_service.metrics import store_operation_duration
+from planning_service.tracing import CLIENT, start_span
 import logging
 
 logger = logging.getLogger(__name__)
 
 
+class MongoCommandMetrics(monitoring.CommandListener):
+    """
+    Длительность команд MongoDB (find, aggregate, insert, ...) по событиям драйвера
+    и span команд в трассе запроса (PyMongo синхронный: события приходят в потоке вызова)
+    """
+
+    def __init__(self):
+        self._spans = {}
+
+    def started(self, event):
+        command_span = start_span(
+            f"mongodb {event.command_name}", phase="mongodb", kind=CLIENT,
+            **{"db.system": "mongodb", "db.operation": event.command_name, "db.name": event.database_name}
+        )
+        if command_span is not None:
+            self._spans[(event.connection_id, event.request_id)] = command_span
+
+    def _finish(self, event, error=None):
+        store_operation_duration.labels("mongodb", event.command_name).observe(event.duration_micros / 1e6)
+        command_span = self._spans.pop((event.connection_id, event.request_id), None)
+        if command_span is not None:
+            command_span.error = error
+            command_span.end(event.duration_micros * 1000)
+
+    def succeeded(self, event):
+        self._finish(event)
+
+    def failed(self, event):
+        self._finish(event, str(event.failure.get("errmsg", event.failure)))
+
+
+class MongoPoolMetrics(monitoring.ConnectionPoolListener):
+    """Открытые и выданные соединения пулов MongoClient (суммарно по серверам)"""
+
+    def __init__(self):
+        self.open = 0
+        self.in_use = 0
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        pass
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_created(self, event):
+        self.open += 1
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        self.open -= 1
+
+    def connection_check_out_started(self, event):
+        pass
+
+    def connection_check_out_failed(self, event):
+        pass
+
+    def connection_checked_out(self, event):
+        self.in_use += 1
+
+    def connection_checked_in(self, event):
+        self.in_use -= 1
+
+
 class MongoDB:
     _instance = None
     _client = None
     _database = None
+    command_metrics = MongoCommandMetrics()
+    pool_metrics = MongoPoolMetrics()
     
     def __new__(cls):
         if cls._instance is None:
@@ -17,10 +93,15 @@ class MongoDB:
     
     def connect(self):
         try:
-            self._client = MongoClient(settings.mongodb_url)
+            if settings.mongodb_url.startswith("mongomock://"):
+                # MongoDB в памяти процесса для прогонов без сервера (пакет mongomock)
+                import mongomock
+                self._client = mongomock.MongoClient()
+            else:
+                self._client = MongoClient(settings.mongodb_url, event_listeners=[self.command_metrics, self.pool_metrics])
             self._database = self._client[settings.mongodb_database]
             # Проверяем подключение
-            self._client.admin.command('ismaster')
+            self._ping()
             logger.info("MongoDB connected successfully")
             return True
         except Exception as e:
@@ -42,10 +123,30 @@ class MongoDB:
     def transactions_collection(self):
         return self.database.transactions
     
+    @property
+    def rollups_collection(self):
+        return self.database.transaction_rollups
+    
+    def pool_usage(self):
+        """Занятые и свободные соединения для метрик Prometheus"""
+        if not isinstance(self._client, MongoClient):
+            return None
+        in_use = self.pool_metrics.in_use
+        return {
+            "in_use": in_use,
+            "idle": max(0, self.pool_metrics.open - in_use),
+            "max": self._client.options.pool_options.max_pool_size
+        }
+    
+    def _ping(self):
+        # mongomock не поддерживает команды сервера; клиент в памяти всегда доступен
+        if isinstance(self._client, MongoClient):
+            self._client.admin.command('ismaster')
+    
     def is_connected(self):
         try:
             if self._client:
-                self._client.admin.command('ismaster')
+                self._ping()
                 return True
         except:
             pass
@@ -1,15 +1,61 @@
 import json
 import aioredis
-from typing import Optional, Any
+from typing import Optional, Any, List
 from planning_service.config import settings
+from planning_service.metrics import observe_store
 import logging
 
 logger = logging.getLogger(__name__)
 
+# Префикс счетчиков поколений тегов; вне паттернов ключей и тегов, чтобы не удаляться вместе с ними
+GENERATION_PREFIX = "gen:"
+
+# Инвалидация тегов одним атомарным вызовом: ключи тегов, сами теги и увеличение их поколений.
+# KEYS - теги, затем их счетчики поколений; ARGV - время жизни счетчиков.
+# Счетчики без новых инвалидаций истекают (отсутствующий читается как 0) и живут не меньше
+# наибольшего TTL кеша - намного дольше любого чтения из источника, которое они защищают
+DELETE_TAGS_SCRIPT = """
+local count = #KEYS / 2
+local tags = {unpack(KEYS, 1, count)}
+local keys = redis.call('SUNION', unpack(tags))
+for i = 1, #keys, 1000 do
+    redis.call('DEL', unpack(keys, i, math.min(i + 999, #keys)))
+end
+redis.call('DEL', unpack(tags))
+for i = count + 1, #KEYS do
+    redis.call('INCR', KEYS[i])
+    redis.call('EXPIRE', KEYS[i], ARGV[1])
+end
+return #keys
+"""
+
+# Запись ключа с тегами, только если поколения тегов не изменились с момента чтения из источника.
+# KEYS - ключ, теги, счетчики поколений; ARGV - значение, ttl, ожидаемые поколения
+SET_WITH_TAGS_SCRIPT = """
+local count = (#KEYS - 1) / 2
+for i = 1, count do
+    if (redis.call('GET', KEYS[1 + count + i]) or '0') ~= ARGV[2 + i] then
+        return 0
+    end
+end
+redis.call('SETEX', KEYS[1], ARGV[2], ARGV[1])
+for i = 2, count + 1 do
+    -- Тег живет не меньше любого своего ключа
+    redis.call('SADD', KEYS[i], KEYS[1])
+    redis.call('EXPIRE', KEYS[i], ARGV[2])
+end
+return 1
+"""
+
+
 class RedisManager:
     def __init__(self):
         self.redis_client: Optional[aioredis.Redis] = None
         self.connected = False
+        self._delete_tags_script = None
+        self._set_with_tags_script = None
+        # Наибольший TTL ключей с тегами: счетчики поколений живут не меньше
+        self.max_tagged_ttl = settings.redis_ttl
 
     async def connect(self):
         """Подключение к Redis"""
@@ -18,11 +64,19 @@ class RedisManager:
             return False
             
         try:
-            self.redis_client = aioredis.from_url(
-                settings.redis_url,
-                encoding="utf-8",
-                decode_responses=True
-            )
+            if settings.redis_url.startswith("fakeredis://"):
+                # Redis в памяти процесса для прогонов без сервера (пакет fakeredis)
+                import fakeredis
+                self.redis_client = fakeredis.FakeAsyncRedis(decode_responses=True)
+            else:
+                self.redis_client = aioredis.from_url(
+                    settings.redis_url,
+                    encoding="utf-8",
+                    decode_responses=True
+                )
+            # Скрипты вызываются через EVALSHA и загружаются при первом вызове
+            self._delete_tags_script = self.redis_client.register_script(DELETE_TAGS_SCRIPT)
+            self._set_with_tags_script = self.redis_client.register_script(SET_WITH_TAGS_SCRIPT)
             # Проверяем подключение
             await self.redis_client.ping()
             self.connected = True
@@ -40,6 +94,16 @@ class RedisManager:
             self.connected = False
             logger.info("Redis disconnected")
 
+    @staticmethod
+    def encode(value: Any) -> str:
+        """Сериализация значения для кеша; default=str для обработки datetime"""
+        return json.dumps(value, default=str)
+
+    @staticmethod
+    def decode(data: str) -> Any:
+        """Десериализация значения из кеша"""
+        return json.loads(data)
+
     def is_connected(self) -> bool:
         """Проверка подключения к Redis"""
         return self.connected and self.redis_client is not None
@@ -50,9 +114,10 @@ class RedisManager:
             return None
             
         try:
-            data = await self.redis_client.get(key)
+            with observe_store("redis", "get"):
+                data = await self.redis_client.get(key)
             if data:
-                return json.loads(data)
+                return self.decode(data)
             return None
         except Exception as e:
             logger.error(f"Redis get error for key {key}: {e}")
@@ -65,8 +130,9 @@ class RedisManager:
             
         try:
             ttl = ttl or settings.redis_ttl
-            data = json.dumps(value, default=str)  # default=str для обработки datetime
-            await self.redis_client.setex(key, ttl, data)
+            data = self.encode(value)
+            with observe_store("redis", "setex"):
+                await self.redis_client.setex(key, ttl, data)
             return True
         except Exception as e:
             logger.error(f"Redis set error for key {key}: {e}")
@@ -78,7 +144,8 @@ class RedisManager:
             return False
             
         try:
-            await self.redis_client.delete(key)
+            with observe_store("redis", "delete"):
+                await self.redis_client.delete(key)
             return True
         except Exception as e:
             logger.error(f"Redis delete error for key {key}: {e}")
@@ -90,25 +157,127 @@ class RedisManager:
             return False
             
         try:
-            keys = await self.redis_client.keys(pattern)
-            if keys:
-                await self.redis_client.delete(*keys)
+            with observe_store("redis", "delete_pattern"):
+                keys = await self.redis_client.keys(pattern)
+                if keys:
+                    await self.redis_client.delete(*keys)
             return True
         except Exception as e:
             logger.error(f"Redis delete pattern error for pattern {pattern}: {e}")
             return False
 
+    @staticmethod
+    def generation_keys(tags: List[str]) -> List[str]:
+        """Ключи счетчиков поколений тегов"""
+        return [GENERATION_PREFIX + tag for tag in tags]
+
+    async def get_generations(self, tags: List[str]) -> Optional[List[str]]:
+        """Текущие поколения тегов; каждая инвалидация тега увеличивает его поколение"""
+        if not self.is_connected():
+            return None
+            
+        try:
+            with observe_store("redis", "get_generations"):
+                generations = await self.redis_client.mget(self.generation_keys(tags))
+            return [generation or "0" for generation in generations]
+        except Exception as e:
+            logger.error(f"Redis get generations error for tags {tags}: {e}")
+            return None
+
+    async def set_with_tags(
+        self,
+        key: str,
+        value: Any,
+        tags: List[str],
+        ttl: Optional[int] = None,
+        generations: Optional[List[str]] = None
+    ) -> bool:
+        """
+        Сохранение данных в кеш с регистрацией ключа в наборах тегов.
+        С generations запись выполняется, только если теги не инвалидировались после их чтения.
+        """
+        if not self.is_connected():
+            return False
+            
+        try:
+            ttl = ttl or settings.redis_ttl
+            self.max_tagged_ttl = max(self.max_tagged_ttl, ttl)
+            data = self.encode(value)
+            with observe_store("redis", "set_with_tags"):
+                if generations is None:
+                    async with self.redis_client.pipeline(transaction=True) as pipe:
+                        pipe.setex(key, ttl, data)
+                        for tag in tags:
+                            # Тег живет не меньше любого своего ключа
+                            pipe.sadd(tag, key)
+                            pipe.expire(tag, ttl)
+                        await pipe.execute()
+                    return True
+                stored = await self._set_with_tags_script(
+                    keys=[key, *tags, *self.generation_keys(tags)],
+                    args=[data, ttl, *generations]
+                )
+            return bool(stored)
+        except Exception as e:
+            logger.error(f"Redis set error for key {key}: {e}")
+            return False
+
+    async def delete_tags(self, tags: List[str]) -> bool:
+        """Атомарное удаление всех ключей, зарегистрированных в тегах, вместе с самими тегами"""
+        if not self.is_connected():
+            return False
+        if not tags:
+            return True
+            
+        try:
+            with observe_store("redis", "delete_tags"):
+                await self._delete_tags_script(
+                    keys=[*tags, *self.generation_keys(tags)], args=[max(self.max_tagged_ttl, settings.redis_ttl)]
+                )
+            return True
+        except Exception as e:
+            logger.error(f"Redis delete tags error for tags {tags}: {e}")
+            return False
+
+    async def delete_tag_pattern(self, pattern: str) -> bool:
+        """Удаление ключей всех тегов, имена которых подходят под паттерн"""
+        if not self.is_connected():
+            return False
+            
+        try:
+            with observe_store("redis", "delete_tag_pattern"):
+                tags = set(await self.redis_client.keys(pattern))
+                # Теги без ключей уже удалены, но их поколения нужно увеличить для чтений в процессе
+                generations = await self.redis_client.keys(GENERATION_PREFIX + pattern)
+                tags.update(generation[len(GENERATION_PREFIX):] for generation in generations)
+        except Exception as e:
+            logger.error(f"Redis delete tag pattern error for pattern {pattern}: {e}")
+            return False
+        return await self.delete_tags(sorted(tags))
+
     async def exists(self, key: str) -> bool:
         """Проверка существования ключа"""
         if not self.is_connected():
             return False
             
         try:
-            return await self.redis_client.exists(key) > 0
+            with observe_store("redis", "exists"):
+                return await self.redis_client.exists(key) > 0
         except Exception as e:
             logger.error(f"Redis exists error for key {key}: {e}")
             return False
 
+    def pool_usage(self) -> Optional[dict]:
+        """Занятые и свободные соединения пула aioredis для метрик Prometheus"""
+        if not self.is_connected():
+            return None
+        pool = self.redis_client.connection_pool
+        return {
+            "in_use": len(pool._in_use_connections),
+            "idle": len(pool._available_connections),
+            "max": pool.max_connections
+        }
+
     def make_cache_key(self, prefix: str, *args) -> str:
         """Создание ключа кеша"""
         parts = [prefix] + [str(arg) for arg in args]
@@ -1,7 +1,23 @@
-from fastapi import Header, HTTPException
+from fastapi import Depends, Header, HTTPException
+
+from planning_service.config import settings
 
 
 async def get_current_user(x_user: str = Header(..., alias="X-User")) -> str:
     if not x_user or x_user.strip() == "":
         raise HTTPException(status_code=422, detail="X-User header cannot be empty")
-    return x_user 
\ No newline at end of file
+    return x_user 
+
+
+def _require_admin(current_user: str, admin_users) -> str:
+    if current_user not in admin_users:
+        raise HTTPException(status_code=403, detail="Admin privileges required")
+    return current_user
+
+
+async def get_current_admin(current_user: str = Depends(get_current_user)) -> str:
+    return _require_admin(current_user, settings.admin_users)
+
+
+async def get_profiling_admin(current_user: str = Depends(get_current_user)) -> str:
+    return _require_admin(current_user, settings.profiling_admin_users)
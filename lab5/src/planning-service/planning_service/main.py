@@ -1,28 +1,39 @@
-from fastapi import FastAPI
+from fastapi import Depends, FastAPI
 from contextlib import asynccontextmanager
 
 from planning_service.config import settings
-from planning_service.database import connect_db, disconnect_db, create_tables
+from planning_service.metrics import MetricsMiddleware, event_loop_monitor, metrics_response, state_collector
+from planning_service.tracing import TracingMiddleware, span_exporter
+from planning_service.profiling import ProfilingMiddleware, profile_store
+from planning_service.dependencies import get_current_admin
+from planning_service.database import database, connect_db, disconnect_db, create_tables
 from planning_service.database.mongodb import mongodb
+from planning_service.database.mongo_indexes import ensure_declared_indexes
 from planning_service.database.redis import redis_manager
 from planning_service.api import plans_router, transactions_router, analytics_router
 from planning_service.api.transactions_mongo import router as transactions_mongo_router
 from planning_service.api.cache import router as cache_router
+from planning_service.api.profiling import router as profiling_router
+from planning_service.services.compression import CompressionMiddleware, compression_stats
+from planning_service.services.cache_service import cache_service
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # Подключение к PostgreSQL
     postgres_connected = False
-    try:
-        await connect_db()
-        create_tables()
-        postgres_connected = True
-        print("PostgreSQL connected and tables created")
-    except Exception as e:
-        print(f"PostgreSQL connection failed: {e}")
-        print("Falling back to in-memory mode for plans")
-        settings.use_in_memory = True
+    if settings.use_in_memory:
+        print("In-memory mode for plans, PostgreSQL is not used")
+    else:
+        try:
+            await connect_db()
+            create_tables()
+            postgres_connected = True
+            print("PostgreSQL connected and tables created")
+        except Exception as e:
+            print(f"PostgreSQL connection failed: {e}")
+            print("Falling back to in-memory mode for plans")
+            settings.use_in_memory = True
     
     # Подключение к MongoDB
     mongodb_connected = False
@@ -30,6 +41,8 @@ async def lifespan(app: FastAPI):
         mongodb_connected = mongodb.connect()
         if mongodb_connected:
             print("MongoDB connected successfully")
+            if settings.mongo_ensure_indexes:
+                ensure_declared_indexes(mongodb.database)
         else:
             print("MongoDB connection failed")
     except Exception as e:
@@ -46,8 +59,14 @@ async def lifespan(app: FastAPI):
     except Exception as e:
         print(f"Redis connection error: {e}")
     
+    await event_loop_monitor.start()
+    await span_exporter.start()
+    
     yield
     
+    await span_exporter.close()
+    await event_loop_monitor.close()
+    
     # Отключение от баз данных
     if postgres_connected and not settings.use_in_memory:
         await disconnect_db()
@@ -69,11 +88,26 @@ app = FastAPI(
     lifespan=lifespan
 )
 
+# Крупные JSON-ответы сжимаются здесь; шлюз передает их клиенту без распаковки
+app.add_middleware(CompressionMiddleware)
+# Метрики HTTP по шаблонам маршрутов; время сжатия входит в задержку
+app.add_middleware(MetricsMiddleware)
+# Трасса продолжает traceparent шлюза; Server-Timing с фазами хранилищ уходит шлюзу
+app.add_middleware(TracingMiddleware)
+# Профилирование снаружи всех middleware: в профиль запроса попадает вся его обработка
+app.add_middleware(ProfilingMiddleware)
+
+state_collector.add_cache("redis", cache_service.stats)
+state_collector.add_pool("postgres", database.pool_usage)
+state_collector.add_pool("mongodb", mongodb.pool_usage)
+state_collector.add_pool("redis", redis_manager.pool_usage)
+
 app.include_router(plans_router)
 app.include_router(transactions_router)
 app.include_router(transactions_mongo_router)
 app.include_router(analytics_router)
 app.include_router(cache_router)
+app.include_router(profiling_router)
 
 
 @app.get("/health")
@@ -87,10 +121,20 @@ async def health_check():
         "database_mode": "in-memory" if settings.use_in_memory else "postgresql",
         "mongodb_status": mongodb_status,
         "redis_status": redis_status,
-        "cache_enabled": settings.enable_cache
+        "cache_enabled": settings.enable_cache,
+        "compression": compression_stats.stats(),
+        "event_loop": event_loop_monitor.stats(),
+        "tracing": span_exporter.stats(),
+        "profiling": profile_store.stats()
     }
 
 
+@app.get("/health/live")
+async def liveness_check():
+    """Проверка живости процесса без обращения к хранилищам (активные проверки шлюза)"""
+    return {"status": "ok"}
+
+
 @app.get("/db/health")
 async def db_health_check():
     """Проверка состояния баз данных"""
@@ -105,6 +149,42 @@ async def db_health_check():
     }
 
 
+@app.get("/metrics", include_in_schema=False)
+async def metrics():
+    """Метрики в формате Prometheus"""
+    return metrics_response()
+
+
+@app.get("/admin/event-loop", tags=["admin"])
+async def event_loop_stalls(current_user: str = Depends(get_current_admin)):
+    """
+    Event loop lag and the latest stalls longer than METRICS_EVENT_LOOP_STALL_MS
+
+    Each stall carries the task and the stack of the loop thread captured while it was blocked.
+
+    Example response:
+    ```json
+    {
+        "lag_ms": 0.4,
+        "max_lag_ms": 212.7,
+        "stall_threshold_ms": 100,
+        "stalls": 1,
+        "max_stall_ms": 208.3,
+        "recent": [
+            {
+                "at": 1760870400.0,
+                "duration_ms": 208.3,
+                "task": "Task-42",
+                "coroutine": "RequestResponseCycle.run_asgi",
+                "stack": ["  File \"planning_service/services/transaction_mongo_service.py\", line 207, in fetch", "..."]
+            }
+        ]
+    }
+    ```
+    """
+    return {**event_loop_monitor.stats(), "recent": event_loop_monitor.recent_stalls()}
+
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(
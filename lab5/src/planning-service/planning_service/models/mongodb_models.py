@@ -1,5 +1,5 @@
-from pydantic import BaseModel, Field
-from typing import Optional
+from pydantic import BaseModel, Field, TypeAdapter
+from typing import Any, Dict, Iterable, Iterator, List, Optional
 from datetime import datetime
 from bson import ObjectId
 from enum import Enum
@@ -10,6 +10,11 @@ class TransactionType(str, Enum):
     expense = "expense"
 
 
+class ExportFormat(str, Enum):
+    ndjson = "ndjson"
+    csv = "csv"
+
+
 class TransactionMongo(BaseModel):
     """MongoDB модель для транзакции"""
     id: Optional[str] = Field(None, alias="_id")
@@ -55,6 +60,34 @@ class TransactionMongo(BaseModel):
         return data
 
 
+# Адаптер для сериализации документов MongoDB как есть, без построения моделей
+documents_adapter = TypeAdapter(List[Dict[str, Any]])
+
+# То же для одного документа: строки NDJSON выгрузки
+document_adapter = TypeAdapter(Dict[str, Any])
+
+
+def _lean_documents(docs: Iterable[dict]) -> Iterator[dict]:
+    """Документы MongoDB с ObjectId, приведенным к строке"""
+    for doc in docs:
+        if "_id" in doc:
+            doc["_id"] = str(doc["_id"])
+        yield doc
+
+
+def dump_transactions_json(docs: Iterable[dict]) -> bytes:
+    """
+    Сериализация доверенных документов MongoDB сразу в JSON без валидации и без моделей.
+    Документы могут быть неполными (проекция): выводятся только присутствующие поля.
+    """
+    return documents_adapter.dump_json(list(_lean_documents(docs)))
+
+
+def dump_transactions_ndjson(docs: Iterable[dict]) -> bytes:
+    """Те же документы в NDJSON: по одному JSON-объекту на строку"""
+    return b"".join(document_adapter.dump_json(doc) + b"\n" for doc in _lean_documents(docs))
+
+
 class TransactionCreateMongo(BaseModel):
     """Модель для создания транзакции в MongoDB"""
     plan_id: int = Field(..., description="ID бюджетного плана")
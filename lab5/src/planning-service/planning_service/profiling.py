@@ -0,0 +1,20 @@
+from typing import Dict
+
+from budget_common import profiling
+
+from planning_service.config import settings
+
+# Глобальный экземпляр хранилища профилей
+profile_store = profiling.ProfileStore(settings)
+
+
+def _is_admin(headers: Dict[bytes, bytes]) -> bool:
+    """X-User выставляет шлюз после проверки токена"""
+    return headers.get(b"x-user", b"").decode("latin-1").strip() in settings.profiling_admin_users
+
+
+class ProfilingMiddleware(profiling.ProfilingMiddleware):
+    """Профилирование запросов Planning Service; профилировать могут PROFILING_ADMIN_USERS"""
+
+    def __init__(self, app):
+        super().__init__(app, settings, profile_store, _is_admin)
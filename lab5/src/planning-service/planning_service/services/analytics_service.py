@@ -1,4 +1,4 @@
-from typing import Optional
+from typing import List, Optional
 from planning_service.models.pydantic_models import AnalyticsResponse
 from planning_service.services.plans_service import get_plan
 from planning_service.services.transactions_service import get_transactions
@@ -10,7 +10,11 @@ async def get_plan_analytics(plan_id: int, user_id: str) -> Optional[AnalyticsRe
         return None
     
     transactions = await get_transactions(user_id, plan_id)
-    
+    return summarize_plan(plan_id, plan, transactions)
+
+
+def summarize_plan(plan_id: int, plan: dict, transactions: List[dict]) -> AnalyticsResponse:
+    """Итоги плана по списку транзакций: доходы, расходы, баланс и процент от плана"""
     total_income = sum(t["amount"] for t in transactions if t["type"] == "income")
     total_expenses = sum(t["amount"] for t in transactions if t["type"] == "expense")
     balance = total_income - total_expenses
@@ -30,4 +34,4 @@ async def get_plan_analytics(plan_id: int, user_id: str) -> Optional[AnalyticsRe
         planned_expenses=planned_expenses,
         income_vs_planned=income_vs_planned,
         expenses_vs_planned=expenses_vs_planned
-    ) 
\ No newline at end of file
+    )
@@ -1,6 +1,7 @@
 from typing import Optional, Any, Callable, List
 from planning_service.database.redis import redis_manager
 from planning_service.config import settings
+from planning_service.tracing import span
 import logging
 import hashlib
 import json
@@ -12,6 +13,8 @@ class CacheService:
     
     def __init__(self):
         self.enabled = settings.enable_cache
+        self.hits = 0
+        self.misses = 0
     
     def _make_key(self, prefix: str, *args) -> str:
         """Создание ключа кеша с хешированием длинных значений"""
@@ -31,34 +34,52 @@ class CacheService:
         fetch_function: Callable,
         ttl: Optional[int] = None,
         *args,
+        tags: Optional[List[str]] = None,
         **kwargs
     ) -> Any:
         """
         Паттерн сквозного чтения (Read-Through)
         1. Проверяем кеш
         2. Если данных нет, получаем из источника
-        3. Сохраняем в кеш
+        3. Сохраняем в кеш (с тегами, если они заданы и не инвалидированы во время чтения)
         4. Возвращаем данные
         """
         if not self.enabled:
             return await fetch_function(*args, **kwargs)
         
-        # Пытаемся получить из кеша
-        cached_data = await redis_manager.get(cache_key)
-        if cached_data is not None:
-            logger.debug(f"Cache HIT for key: {cache_key}")
-            return cached_data
-        
-        # Кеш промах - получаем данные из источника
-        logger.debug(f"Cache MISS for key: {cache_key}")
-        data = await fetch_function(*args, **kwargs)
-        
-        # Сохраняем в кеш, если данные получены
-        if data is not None:
-            await redis_manager.set(cache_key, data, ttl)
-            logger.debug(f"Data cached for key: {cache_key}")
-        
-        return data
+        with span("cache.read_through", **{"cache.key": cache_key}) as operation:
+            # Пытаемся получить из кеша
+            cached_data = await redis_manager.get(cache_key)
+            if operation is not None:
+                operation.attributes["cache.hit"] = cached_data is not None
+            if cached_data is not None:
+                self.hits += 1
+                logger.debug(f"Cache HIT for key: {cache_key}")
+                return cached_data
+            
+            # Кеш промах - получаем данные из источника
+            self.misses += 1
+            logger.debug(f"Cache MISS for key: {cache_key}")
+            if tags:
+                # Поколения тегов до чтения: инвалидация во время чтения их увеличит,
+                # и прочитанные до нее данные не попадут в кеш
+                generations = await redis_manager.get_generations(tags)
+            data = await fetch_function(*args, **kwargs)
+            
+            # Сохраняем в кеш, если данные получены
+            if data is not None:
+                if tags:
+                    if generations is None:
+                        return data
+                    cached = await redis_manager.set_with_tags(cache_key, data, tags, ttl, generations=generations)
+                else:
+                    cached = await redis_manager.set(cache_key, data, ttl)
+                if cached:
+                    logger.debug(f"Data cached for key: {cache_key}")
+                else:
+                    logger.debug(f"Data not cached for key: {cache_key}")
+            
+            return data
     
     async def write_through(
         self,
@@ -78,15 +99,16 @@ class CacheService:
         if not self.enabled:
             return await write_function(*args, **kwargs)
         
-        # Записываем в основное хранилище
-        result = await write_function(*args, **kwargs)
-        
-        # Если запись успешна, обновляем кеш
-        if result is not None:
-            await redis_manager.set(cache_key, result, ttl)
-            logger.debug(f"Cache updated for key: {cache_key}")
-        
-        return result
+        with span("cache.write_through", **{"cache.key": cache_key}):
+            # Записываем в основное хранилище
+            result = await write_function(*args, **kwargs)
+            
+            # Если запись успешна, обновляем кеш
+            if result is not None:
+                await redis_manager.set(cache_key, result, ttl)
+                logger.debug(f"Cache updated for key: {cache_key}")
+            
+            return result
     
     async def write_behind(
         self,
@@ -101,7 +123,8 @@ class CacheService:
         if not self.enabled:
             return False
         
-        success = await redis_manager.set(cache_key, data, ttl)
+        with span("cache.write_behind", **{"cache.key": cache_key}):
+            success = await redis_manager.set(cache_key, data, ttl)
         if success:
             logger.debug(f"Write-behind cache update for key: {cache_key}")
         
@@ -112,7 +135,8 @@ class CacheService:
         if not self.enabled:
             return True
         
-        success = await redis_manager.delete(cache_key)
+        with span("cache.invalidate", **{"cache.key": cache_key}):
+            success = await redis_manager.delete(cache_key)
         logger.debug(f"Cache invalidated for key: {cache_key}")
         return success
     
@@ -121,16 +145,31 @@ class CacheService:
         if not self.enabled:
             return True
         
-        success = await redis_manager.delete_pattern(pattern)
+        with span("cache.invalidate_pattern", **{"cache.pattern": pattern}):
+            success = await redis_manager.delete_pattern(pattern)
         logger.debug(f"Cache invalidated for pattern: {pattern}")
         return success
     
+    async def invalidate_tags(self, *tags: str) -> bool:
+        """Инвалидация всех ключей, помеченных хотя бы одним из тегов"""
+        if not self.enabled:
+            return True
+        
+        with span("cache.invalidate_tags", **{"cache.tags": ",".join(tags)}):
+            success = await redis_manager.delete_tags(list(tags))
+        logger.debug(f"Cache invalidated for tags: {tags}")
+        return success
+    
     async def exists(self, cache_key: str) -> bool:
         """Проверка существования ключа в кеше"""
         if not self.enabled:
             return False
         
-        return await redis_manager.exists(cache_key)
+        with span("cache.exists", **{"cache.key": cache_key}):
+            return await redis_manager.exists(cache_key)
+    
+    def stats(self) -> dict:
+        return {"enabled": self.enabled, "hits": self.hits, "misses": self.misses}
     
     # Вспомогательные методы для работы с планами
     def make_user_plans_key(self, user_id: str) -> str:
@@ -145,12 +184,78 @@ class CacheService:
         """Ключ для пользователя"""
         return self._make_key("user", user_id)
     
+    # Вспомогательные методы для транзакций MongoDB
+    def make_transactions_query_key(self, user_id: str, filters: dict, **params) -> str:
+        """
+        Ключ для выборки транзакций: хеш нормализованных фильтров и параметров страницы.
+        Пустые фильтры отбрасываются, порядок полей не влияет на ключ.
+        """
+        normalized = json.dumps(
+            {
+                "filters": {name: value for name, value in filters.items() if value is not None},
+                "params": params
+            },
+            sort_keys=True,
+            separators=(",", ":"),
+            default=str
+        )
+        digest = hashlib.sha1(normalized.encode()).hexdigest()
+        return self._make_key("mongo:transactions", user_id, digest)
+    
+    def make_user_analytics_key(self, user_id: str) -> str:
+        """Ключ для общей аналитики пользователя по MongoDB"""
+        return self._make_key("mongo:analytics:user", user_id)
+    
+    def make_plan_dashboard_key(self, user_id: str, plan_id: int, latest: int, top: int) -> str:
+        """Ключ для дашборда плана по транзакциям MongoDB"""
+        return self._make_key("mongo:dashboard", user_id, plan_id, latest, top)
+    
+    def make_transactions_user_tag(self, user_id: str) -> str:
+        """Тег записей, охватывающих все планы пользователя"""
+        return self._make_key("mongo:tag:user", user_id)
+    
+    def make_transactions_plan_tag(self, user_id: str, plan_id: int) -> str:
+        """Тег записей, ограниченных одним планом пользователя"""
+        return self._make_key("mongo:tag:plan", user_id, plan_id)
+    
+    async def invalidate_transactions(self, user_id: str, *plan_ids: int) -> bool:
+        """
+        Инвалидация кеша после записи транзакций в планы plan_ids:
+        записи по всем планам пользователя и записи затронутых планов.
+        Записи других планов остаются в кеше.
+        """
+        tags = [self.make_transactions_user_tag(user_id)]
+        tags += [self.make_transactions_plan_tag(user_id, plan_id) for plan_id in dict.fromkeys(plan_ids)]
+        return await self.invalidate_tags(*tags)
+    
+    async def invalidate_rollups(self, user_id: Optional[str] = None) -> bool:
+        """
+        Инвалидация после перестроения агрегатов: все записи транзакций пользователя
+        (без user_id - всех пользователей), найденные по их тегам
+        """
+        if not self.enabled:
+            return True
+        
+        user = "*" if user_id is None else user_id
+        success = True
+        for pattern in (f"mongo:tag:user:{user}", f"mongo:tag:plan:{user}:*"):
+            with span("cache.invalidate_tag_pattern", **{"cache.pattern": pattern}):
+                pattern_success = await redis_manager.delete_tag_pattern(pattern)
+            success = success and pattern_success
+        
+        return success
+    
     async def invalidate_user_cache(self, user_id: str) -> bool:
         """Инвалидация всего кеша пользователя"""
         patterns = [
             f"plans:user:{user_id}",
             f"plan:*:{user_id}",
-            f"user:{user_id}"
+            f"user:{user_id}",
+            f"mongo:dashboard:{user_id}:*",
+            f"mongo:transactions:{user_id}:*",
+            f"mongo:analytics:user:{user_id}",
+            f"mongo:tag:user:{user_id}",
+            f"mongo:tag:plan:{user_id}:*"
         ]
         
         success = True
@@ -0,0 +1,13 @@
+from budget_common import compression
+
+from planning_service.config import settings
+
+# Глобальный экземпляр счетчиков сжатия
+compression_stats = compression.CompressionStats(settings)
+
+
+class CompressionMiddleware(compression.CompressionMiddleware):
+    """Сжатие ответов Planning Service по настройкам COMPRESSION_*"""
+
+    def __init__(self, app):
+        super().__init__(app, settings, compression_stats)
@@ -0,0 +1,229 @@
+from datetime import datetime
+from typing import List, Optional
+from pymongo import ReplaceOne
+from pymongo.errors import PyMongoError
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Ключ дневного агрегата; совпадает с уникальным индексом коллекции transaction_rollups
+ROLLUP_KEY_FIELDS = ("user_id", "plan_id", "day", "type", "category")
+
+DAY_FORMAT = "%Y-%m-%d"
+
+# Суффикс временной коллекции полного перестроения
+REBUILD_COLLECTION_SUFFIX = "_rebuild"
+
+
+def rollup_key(doc: dict) -> dict:
+    """Ключ дневного агрегата для документа транзакции"""
+    return {
+        "user_id": doc["user_id"],
+        "plan_id": doc["plan_id"],
+        "day": doc["created_at"].strftime(DAY_FORMAT),
+        "type": doc["type"],
+        "category": doc.get("category")
+    }
+
+
+def rollup_pipeline(match: dict) -> List[dict]:
+    """Агрегация сырых транзакций в дневные агрегаты (для перестроения)"""
+    return [
+        {"$match": match},
+        {
+            "$group": {
+                "_id": {
+                    "user_id": "$user_id",
+                    "plan_id": "$plan_id",
+                    "day": {"$dateToString": {"format": DAY_FORMAT, "date": "$created_at"}},
+                    "type": "$type",
+                    "category": "$category"
+                },
+                "total_amount": {"$sum": "$amount"},
+                "count": {"$sum": 1}
+            }
+        },
+        {
+            "$project": {
+                "_id": 0,
+                "user_id": "$_id.user_id",
+                "plan_id": "$_id.plan_id",
+                "day": "$_id.day",
+                "type": "$_id.type",
+                "category": "$_id.category",
+                "total_amount": 1,
+                "count": 1
+            }
+        }
+    ]
+
+
+def build_monthly_series(results) -> List[dict]:
+    """Помесячный ряд из результатов группировки по {month, type}"""
+    months = {}
+    for result in results:
+        month = result["_id"]["month"]
+        entry = months.setdefault(month, {
+            "month": month,
+            "total_income": 0.0,
+            "total_expenses": 0.0,
+            "transaction_count": 0,
+            "balance": 0.0
+        })
+        entry["transaction_count"] += result["count"]
+        if result["_id"]["type"] == "income":
+            entry["total_income"] += result["total_amount"]
+        elif result["_id"]["type"] == "expense":
+            entry["total_expenses"] += result["total_amount"]
+
+    for entry in months.values():
+        entry["balance"] = entry["total_income"] - entry["total_expenses"]
+
+    return [months[month] for month in sorted(months)]
+
+
+class TransactionRollupService:
+    """
+    Сервис дневных агрегатов транзакций в MongoDB.
+    Агрегаты обновляются $inc-апсертами при каждой записи транзакции, поэтому аналитика
+    читает небольшие предагрегированные документы вместо сканирования всей истории.
+    """
+
+    def __init__(self):
+        self._collection = None
+
+    @property
+    def collection(self):
+        """Получение коллекции агрегатов с ленивой инициализацией"""
+        if self._collection is None:
+            from planning_service.database.mongodb import mongodb
+            if mongodb.is_connected():
+                self._collection = mongodb.rollups_collection
+            else:
+                raise Exception("MongoDB not connected")
+        return self._collection
+
+    def apply(self, doc: dict, sign: int = 1) -> None:
+        """Учет транзакции в агрегате (sign=1) или ее исключение (sign=-1)"""
+        key = rollup_key(doc)
+        try:
+            self.collection.update_one(
+                key,
+                {"$inc": {"total_amount": sign * doc["amount"], "count": sign}},
+                upsert=True
+            )
+            if sign < 0:
+                # Пустые агрегаты не храним
+                self.collection.delete_one({**key, "count": {"$lte": 0}})
+        except PyMongoError as e:
+            # Расхождение исправляется перестроением агрегатов
+            logger.error(f"Error updating rollup {key}: {e}")
+
+    def _upsert(self, rollups: List[dict], stamp: datetime) -> None:
+        """Запись пересчитанных агрегатов заменой по ключу с отметкой перестроения"""
+        if not rollups:
+            return
+        self.collection.bulk_write(
+            [
+                ReplaceOne(
+                    {field: rollup[field] for field in ROLLUP_KEY_FIELDS},
+                    {**rollup, "rebuilt_at": stamp},
+                    upsert=True
+                )
+                for rollup in rollups
+            ],
+            ordered=False
+        )
+
+    def _swap_in(self, transactions_collection) -> None:
+        """Сборка всех агрегатов во временной коллекции и атомарная подмена текущей"""
+        from planning_service.database.mongo_indexes import DECLARED_INDEXES
+
+        staging = self.collection.database[self.collection.name + REBUILD_COLLECTION_SUFFIX]
+        staging.drop()
+        # $out сохраняет индексы существующей коллекции, поэтому уникальный ключ создается заранее
+        staging.create_indexes(DECLARED_INDEXES[self.collection.name])
+        transactions_collection.aggregate(rollup_pipeline({}) + [{"$out": staging.name}])
+        staging.rename(self.collection.name, dropTarget=True)
+
+    def rebuild(self, transactions_collection, user_id: Optional[str] = None) -> int:
+        """
+        Перестроение агрегатов по сырым транзакциям. Синхронный вызов PyMongo - выполнять в потоке.
+        Без user_id коллекция собирается заново во временной и подменяет текущую переименованием,
+        иначе агрегаты пользователя заменяются по ключу, а лишние удаляются. Чтение аналитики
+        все время видит полный набор агрегатов.
+        $inc транзакций, записанных во время перестроения, может потеряться, поэтому в конце
+        дни начиная с дня старта пересчитываются еще раз. Изменения более старых транзакций
+        во время перестроения исправляет повторный запуск. Возвращает количество агрегатов.
+        """
+        # Отметка с точностью BSON datetime (миллисекунды), чтобы сравнение с сохраненной было точным
+        started = datetime.utcnow()
+        started = started.replace(microsecond=started.microsecond // 1000 * 1000)
+        if user_id is None:
+            match = {}
+            self._swap_in(transactions_collection)
+        else:
+            match = {"user_id": user_id}
+            self._upsert(list(transactions_collection.aggregate(rollup_pipeline(match))), started)
+            self.collection.delete_many({**match, "rebuilt_at": {"$ne": started}})
+
+        since = datetime(started.year, started.month, started.day)
+        recent = transactions_collection.aggregate(rollup_pipeline({**match, "created_at": {"$gte": since}}))
+        self._upsert(list(recent), started)
+        return self.collection.count_documents(match)
+
+    def totals_by_type(self, match: dict) -> List[dict]:
+        """Суммы и количества по типу транзакции"""
+        pipeline = [
+            {"$match": match},
+            {
+                "$group": {
+                    "_id": "$type",
+                    "total_amount": {"$sum": "$total_amount"},
+                    "count": {"$sum": "$count"}
+                }
+            }
+        ]
+        return list(self.collection.aggregate(pipeline))
+
+    def monthly(self, match: dict) -> List[dict]:
+        """Помесячная разбивка доходов и расходов"""
+        pipeline = [
+            {"$match": match},
+            {
+                "$group": {
+                    "_id": {"month": {"$substr": ["$day", 0, 7]}, "type": "$type"},
+                    "total_amount": {"$sum": "$total_amount"},
+                    "count": {"$sum": "$count"}
+                }
+            }
+        ]
+
+        return build_monthly_series(self.collection.aggregate(pipeline))
+
+    def by_category(self, match: dict) -> List[dict]:
+        """Разбивка по категориям и типам, по убыванию суммы"""
+        pipeline = [
+            {"$match": match},
+            {
+                "$group": {
+                    "_id": {"category": "$category", "type": "$type"},
+                    "total_amount": {"$sum": "$total_amount"},
+                    "count": {"$sum": "$count"}
+                }
+            },
+            {"$sort": {"total_amount": -1}}
+        ]
+        return [
+            {
+                "category": result["_id"]["category"],
+                "type": result["_id"]["type"],
+                "total_amount": result["total_amount"],
+                "transaction_count": result["count"]
+            }
+            for result in self.collection.aggregate(pipeline)
+        ]
+
+
+# Глобальный экземпляр сервиса
+transaction_rollup_service = TransactionRollupService()
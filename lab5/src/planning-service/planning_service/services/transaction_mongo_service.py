@@ -1,18 +1,83 @@
-from typing import List, Optional
+from typing import Iterator, List, Optional, Tuple
 from bson import ObjectId
+from bson.errors import InvalidId
+from pymongo import DESCENDING, ReturnDocument
 from pymongo.errors import PyMongoError
 from datetime import datetime
+import asyncio
+import base64
+import csv
+import io
+import json
 import logging
 
+from planning_service.config import settings
+
 from planning_service.models.mongodb_models import (
     TransactionMongo,
     TransactionCreateMongo,
     TransactionUpdateMongo,
-    TransactionFilter
+    TransactionFilter,
+    ExportFormat,
+    dump_transactions_json,
+    dump_transactions_ndjson
 )
+from planning_service.services.rollup_service import transaction_rollup_service, build_monthly_series
+from planning_service.services.cache_service import cache_service
 
 logger = logging.getLogger(__name__)
 
+# Порядок выдачи транзакций; совпадает с индексом {user_id: 1, created_at: -1, _id: -1}
+TRANSACTIONS_SORT = [("created_at", DESCENDING), ("_id", DESCENDING)]
+
+
+def encode_cursor(created_at: datetime, object_id: ObjectId) -> str:
+    """Кодирование позиции последнего документа страницы в непрозрачный токен"""
+    payload = json.dumps({"c": created_at.isoformat(), "i": str(object_id)}, separators=(",", ":"))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, ObjectId]:
+    """Декодирование токена продолжения; ValueError для некорректного токена"""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        return datetime.fromisoformat(payload["c"]), ObjectId(payload["i"])
+    except (ValueError, KeyError, TypeError, InvalidId) as e:
+        raise ValueError(f"Invalid cursor: {cursor}") from e
+
+
+def build_projection(fields: Optional[str]) -> Optional[dict]:
+    """Преобразование списка полей через запятую в проекцию MongoDB; ValueError для неизвестных полей"""
+    if not fields:
+        return None
+    
+    requested = {field.strip() for field in fields.split(",") if field.strip()}
+    unknown = requested - set(TransactionMongo.model_fields)
+    if unknown:
+        raise ValueError(f"Unknown fields: {', '.join(sorted(unknown))}")
+    
+    projection = {("_id" if field == "id" else field): 1 for field in requested}
+    projection.setdefault("_id", 0)
+    return projection
+
+
+def export_columns(fields: Optional[str]) -> List[str]:
+    """Порядок колонок выгрузки: запрошенные поля или все поля модели"""
+    if not fields:
+        return list(TransactionMongo.model_fields)
+    return [field.strip() for field in fields.split(",") if field.strip()]
+
+
+def seek_filter(created_at: datetime, object_id: ObjectId) -> dict:
+    """Условие «строго после позиции курсора» в порядке TRANSACTIONS_SORT"""
+    return {
+        "$or": [
+            {"created_at": {"$lt": created_at}},
+            {"created_at": created_at, "_id": {"$lt": object_id}}
+        ]
+    }
+
 
 class TransactionMongoService:
     """Сервис для работы с транзакциями в MongoDB"""
@@ -40,6 +105,8 @@ class TransactionMongoService:
             
             # Вставляем в MongoDB
             result = self.collection.insert_one(transaction_dict)
+            transaction_rollup_service.apply(transaction_dict)
+            await cache_service.invalidate_transactions(transaction_dict["user_id"], transaction_dict["plan_id"])
             
             # Получаем созданный документ
             created_doc = self.collection.find_one({"_id": result.inserted_id})
@@ -73,6 +140,55 @@ class TransactionMongoService:
             logger.error(f"Error getting transaction by id {transaction_id}: {e}")
             return None
     
+    def _build_query(self, user_id: str, filters: Optional[TransactionFilter] = None) -> dict:
+        """Построение MongoDB фильтра из параметров запроса"""
+        # Базовый фильтр по пользователю
+        query = {"user_id": user_id}
+        
+        # Добавляем дополнительные фильтры
+        if filters:
+            if filters.plan_id is not None:
+                query["plan_id"] = filters.plan_id
+            
+            if filters.type is not None:
+                query["type"] = filters.type
+            
+            if filters.category is not None:
+                query["category"] = filters.category
+            
+            # Фильтры по сумме
+            amount_filter = {}
+            if filters.min_amount is not None:
+                amount_filter["$gte"] = filters.min_amount
+            if filters.max_amount is not None:
+                amount_filter["$lte"] = filters.max_amount
+            if amount_filter:
+                query["amount"] = amount_filter
+            
+            # Фильтры по дате
+            date_filter = {}
+            if filters.start_date is not None:
+                date_filter["$gte"] = filters.start_date
+            if filters.end_date is not None:
+                date_filter["$lte"] = filters.end_date
+            if date_filter:
+                query["created_at"] = date_filter
+        
+        return query
+    
+    @staticmethod
+    def _query_cache_key(user_id: str, filters: Optional[TransactionFilter], **params) -> str:
+        """Ключ кеша выборки по нормализованным фильтрам и параметрам страницы"""
+        filter_values = filters.model_dump(mode="json", exclude={"user_id"}) if filters else {}
+        return cache_service.make_transactions_query_key(user_id, filter_values, **params)
+    
+    @staticmethod
+    def _query_cache_tags(user_id: str, filters: Optional[TransactionFilter]) -> List[str]:
+        """Теги кеша выборки: план, если выборка ограничена планом, иначе все планы пользователя"""
+        if filters and filters.plan_id is not None:
+            return [cache_service.make_transactions_plan_tag(user_id, filters.plan_id)]
+        return [cache_service.make_transactions_user_tag(user_id)]
+    
     async def get_transactions(
         self,
         user_id: str,
@@ -80,57 +196,218 @@ class TransactionMongoService:
         skip: int = 0,
         limit: int = 100
     ) -> List[TransactionMongo]:
-        """Получение списка транзакций с фильтрацией"""
-        try:
-            # Базовый фильтр по пользователю
-            query = {"user_id": user_id}
-            
-            # Добавляем дополнительные фильтры
-            if filters:
-                if filters.plan_id is not None:
-                    query["plan_id"] = filters.plan_id
+        """Получение списка транзакций с фильтрацией (offset-пагинация, оставлена для совместимости)"""
+        # Глубокий skip стоит O(skip) на сервере, поэтому ограничиваем его
+        skip = min(skip, settings.mongo_max_skip)
+        
+        async def fetch() -> Optional[List[dict]]:
+            try:
+                query = self._build_query(user_id, filters)
                 
-                if filters.type is not None:
-                    query["type"] = filters.type
+                # Выполняем запрос с пагинацией и сортировкой
+                cursor = self.collection.find(query).sort(TRANSACTIONS_SORT).skip(skip).limit(limit)
+                return [TransactionMongo.from_mongo(doc).model_dump(mode="json", by_alias=True) for doc in cursor]
                 
-                if filters.category is not None:
-                    query["category"] = filters.category
-                
-                # Фильтры по сумме
-                amount_filter = {}
-                if filters.min_amount is not None:
-                    amount_filter["$gte"] = filters.min_amount
-                if filters.max_amount is not None:
-                    amount_filter["$lte"] = filters.max_amount
-                if amount_filter:
-                    query["amount"] = amount_filter
-                
-                # Фильтры по дате
-                date_filter = {}
-                if filters.start_date is not None:
-                    date_filter["$gte"] = filters.start_date
-                if filters.end_date is not None:
-                    date_filter["$lte"] = filters.end_date
-                if date_filter:
-                    query["created_at"] = date_filter
-            
-            # Выполняем запрос с пагинацией и сортировкой
-            cursor = self.collection.find(query).sort("created_at", -1).skip(skip).limit(limit)
+            except PyMongoError as e:
+                logger.error(f"Error getting transactions: {e}")
+                return None
+            except Exception as e:
+                logger.error(f"MongoDB connection error: {e}")
+                return None
+        
+        items = await cache_service.read_through(
+            cache_key=self._query_cache_key(user_id, filters, mode="offset", skip=skip, limit=limit),
+            fetch_function=fetch,
+            tags=self._query_cache_tags(user_id, filters)
+        )
+        
+        return [TransactionMongo(**item) for item in items or []]
+    
+    def _find_page(
+        self,
+        query: dict,
+        limit: int,
+        cursor: Optional[str] = None,
+        projection: Optional[dict] = None
+    ) -> Tuple[List[dict], Optional[str]]:
+        """Выборка одной страницы документов seek-пагинацией; ValueError для некорректного токена"""
+        if cursor is not None:
+            created_at, object_id = decode_cursor(cursor)
+            query = {"$and": [query, seek_filter(created_at, object_id)]}
+        
+        # Поля курсора нужны для токена следующей страницы, даже если их нет в проекции
+        find_projection = None
+        if projection is not None:
+            find_projection = {**projection, "_id": 1, "created_at": 1}
+        
+        # Запрашиваем на один документ больше, чтобы узнать, есть ли следующая страница
+        docs = list(self.collection.find(query, find_projection).sort(TRANSACTIONS_SORT).limit(limit + 1))
+        
+        next_cursor = None
+        if len(docs) > limit:
+            docs = docs[:limit]
+            last = docs[-1]
+            next_cursor = encode_cursor(last["created_at"], last["_id"])
+        
+        if projection is not None:
+            for field in ("_id", "created_at"):
+                if not projection.get(field):
+                    for doc in docs:
+                        doc.pop(field, None)
+        
+        return docs, next_cursor
+    
+    async def get_transactions_page(
+        self,
+        user_id: str,
+        filters: Optional[TransactionFilter] = None,
+        limit: int = 100,
+        cursor: Optional[str] = None
+    ) -> Tuple[List[TransactionMongo], Optional[str]]:
+        """
+        Получение страницы транзакций seek-пагинацией по (created_at, _id).
+        Возвращает транзакции и токен следующей страницы (None, если страница последняя).
+        Некорректный токен приводит к ValueError.
+        """
+        query = self._build_query(user_id, filters)
+        
+        async def fetch() -> Optional[dict]:
+            try:
+                docs, next_cursor = self._find_page(query, limit, cursor)
+            except PyMongoError as e:
+                logger.error(f"Error getting transactions page: {e}")
+                return None
+            except ValueError:
+                raise
+            except Exception as e:
+                logger.error(f"MongoDB connection error: {e}")
+                return None
             
-            transactions = []
+            return {
+                "items": [TransactionMongo.from_mongo(doc).model_dump(mode="json", by_alias=True) for doc in docs],
+                "next_cursor": next_cursor
+            }
+        
+        page = await cache_service.read_through(
+            cache_key=self._query_cache_key(user_id, filters, mode="page", cursor=cursor, limit=limit),
+            fetch_function=fetch,
+            tags=self._query_cache_tags(user_id, filters)
+        )
+        
+        if page is None:
+            return [], None
+        
+        return [TransactionMongo(**item) for item in page["items"]], page["next_cursor"]
+    
+    async def get_transactions_page_json(
+        self,
+        user_id: str,
+        filters: Optional[TransactionFilter] = None,
+        limit: int = 100,
+        cursor: Optional[str] = None,
+        fields: Optional[str] = None
+    ) -> Tuple[bytes, Optional[str]]:
+        """
+        Облегченный режим: страница транзакций сразу в JSON без валидации каждого документа.
+        Документы из собственной коллекции считаются доверенными; fields задает проекцию.
+        Некорректный токен или неизвестное поле приводят к ValueError.
+        """
+        query = self._build_query(user_id, filters)
+        projection = build_projection(fields)
+        
+        async def fetch() -> Optional[dict]:
+            try:
+                docs, next_cursor = self._find_page(query, limit, cursor, projection)
+            except PyMongoError as e:
+                logger.error(f"Error getting transactions page: {e}")
+                return None
+            except ValueError:
+                raise
+            except Exception as e:
+                logger.error(f"MongoDB connection error: {e}")
+                return None
+            
+            return {"body": dump_transactions_json(docs).decode(), "next_cursor": next_cursor}
+        
+        page = await cache_service.read_through(
+            cache_key=self._query_cache_key(user_id, filters, mode="json", cursor=cursor, limit=limit, fields=fields),
+            fetch_function=fetch,
+            tags=self._query_cache_tags(user_id, filters)
+        )
+        
+        if page is None:
+            return b"[]", None
+        
+        return page["body"].encode(), page["next_cursor"]
+    
+    def export_transactions(
+        self,
+        user_id: str,
+        filters: Optional[TransactionFilter] = None,
+        export_format: ExportFormat = ExportFormat.ndjson,
+        fields: Optional[str] = None
+    ) -> Iterator[bytes]:
+        """
+        Потоковая выгрузка транзакций в NDJSON или CSV напрямую из курсора MongoDB.
+        Генератор синхронный: StreamingResponse выполняет его в пуле потоков, поэтому
+        блокирующие вызовы PyMongo не занимают event loop. В памяти находится не больше
+        одного батча документов. Неизвестное поле приводит к ValueError.
+        """
+        query = self._build_query(user_id, filters)
+        projection = build_projection(fields)
+        columns = export_columns(fields)
+        batch_size = settings.mongo_export_batch_size
+        
+        # Курсор ленивый: запрос к MongoDB уходит только при первой итерации
+        cursor = self.collection.find(query, projection, batch_size=batch_size).sort(TRANSACTIONS_SORT)
+        
+        if export_format == ExportFormat.csv:
+            return self._iter_csv(cursor, columns, batch_size)
+        return self._iter_ndjson(cursor, batch_size)
+    
+    @staticmethod
+    def _iter_ndjson(cursor, batch_size: int) -> Iterator[bytes]:
+        """Чанки NDJSON: по одному JSON-объекту на строку"""
+        try:
+            batch = []
             for doc in cursor:
-                transaction = TransactionMongo.from_mongo(doc)
-                if transaction:
-                    transactions.append(transaction)
-            
-            return transactions
-            
-        except PyMongoError as e:
-            logger.error(f"Error getting transactions: {e}")
-            return []
-        except Exception as e:
-            logger.error(f"MongoDB connection error: {e}")
-            return []
+                batch.append(doc)
+                if len(batch) >= batch_size:
+                    yield dump_transactions_ndjson(batch)
+                    batch = []
+            if batch:
+                yield dump_transactions_ndjson(batch)
+        finally:
+            cursor.close()
+    
+    @staticmethod
+    def _iter_csv(cursor, columns: List[str], batch_size: int) -> Iterator[bytes]:
+        """Чанки CSV с заголовком в первой строке"""
+        keys = ["_id" if column == "id" else column for column in columns]
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(columns)
+        
+        try:
+            rows = 0
+            for doc in cursor:
+                row = []
+                for key in keys:
+                    value = doc.get(key)
+                    if isinstance(value, datetime):
+                        value = value.isoformat()
+                    row.append("" if value is None else value)
+                writer.writerow(row)
+                rows += 1
+                if rows >= batch_size:
+                    yield buffer.getvalue().encode()
+                    buffer.seek(0)
+                    buffer.truncate()
+                    rows = 0
+            if buffer.tell():
+                yield buffer.getvalue().encode()
+        finally:
+            cursor.close()
     
     async def update_transaction(
         self,
@@ -149,16 +426,25 @@ class TransactionMongoService:
                 # Если нечего обновлять, возвращаем текущую транзакцию
                 return await self.get_transaction_by_id(transaction_id, user_id)
             
-            # Обновляем документ
-            result = self.collection.update_one(
+            # Обновляем документ, получая прежнюю версию для корректировки агрегатов
+            before = self.collection.find_one_and_update(
                 {"_id": object_id, "user_id": user_id},
-                {"$set": update_dict}
+                {"$set": update_dict},
+                return_document=ReturnDocument.BEFORE
             )
             
-            if result.modified_count > 0:
-                return await self.get_transaction_by_id(transaction_id, user_id)
+            if before is None:
+                return None
             
-            return None
+            after = {**before, **update_dict}
+            if after == before:
+                return None
+            
+            transaction_rollup_service.apply(before, sign=-1)
+            transaction_rollup_service.apply(after)
+            await cache_service.invalidate_transactions(user_id, before["plan_id"])
+            
+            return TransactionMongo.from_mongo(after)
             
         except Exception as e:
             logger.error(f"Error updating transaction {transaction_id}: {e}")
@@ -169,12 +455,17 @@ class TransactionMongoService:
         try:
             object_id = ObjectId(transaction_id)
             
-            result = self.collection.delete_one({
+            deleted = self.collection.find_one_and_delete({
                 "_id": object_id,
                 "user_id": user_id
             })
             
-            return result.deleted_count > 0
+            if deleted is None:
+                return False
+            
+            transaction_rollup_service.apply(deleted, sign=-1)
+            await cache_service.invalidate_transactions(user_id, deleted["plan_id"])
+            return True
             
         except Exception as e:
             logger.error(f"Error deleting transaction {transaction_id}: {e}")
@@ -185,105 +476,205 @@ class TransactionMongoService:
         filters = TransactionFilter(plan_id=plan_id, user_id=user_id)
         return await self.get_transactions(user_id, filters, limit=1000)
     
+    def _totals_by_type(self, match: dict) -> List[dict]:
+        """Суммы по типу транзакции: из дневных агрегатов или сканированием транзакций"""
+        if settings.use_transaction_rollups:
+            return transaction_rollup_service.totals_by_type(match)
+        
+        pipeline = [
+            {"$match": match},
+            {
+                "$group": {
+                    "_id": "$type",
+                    "total_amount": {"$sum": "$amount"},
+                    "count": {"$sum": 1}
+                }
+            }
+        ]
+        return list(self.collection.aggregate(pipeline))
+    
+    @staticmethod
+    def _fill_totals(analytics: dict, results: List[dict]) -> dict:
+        """Заполнение итогов аналитики по результатам группировки"""
+        for result in results:
+            transaction_type = result["_id"]
+            total_amount = result["total_amount"]
+            count = result["count"]
+            
+            analytics["transaction_count"] += count
+            
+            if transaction_type == "income":
+                analytics["total_income"] = total_amount
+            elif transaction_type == "expense":
+                analytics["total_expenses"] = total_amount
+        
+        analytics["balance"] = analytics["total_income"] - analytics["total_expenses"]
+        
+        return analytics
+    
     async def get_plan_analytics(self, plan_id: int, user_id: str) -> dict:
         """Получение аналитики по плану"""
+        analytics = {
+            "plan_id": plan_id,
+            "total_income": 0.0,
+            "total_expenses": 0.0,
+            "transaction_count": 0,
+            "balance": 0.0
+        }
+        
         try:
-            pipeline = [
-                {"$match": {"plan_id": plan_id, "user_id": user_id}},
-                {
-                    "$group": {
-                        "_id": "$type",
-                        "total_amount": {"$sum": "$amount"},
-                        "count": {"$sum": 1}
-                    }
-                }
-            ]
-            
-            results = list(self.collection.aggregate(pipeline))
-            
-            analytics = {
-                "plan_id": plan_id,
-                "total_income": 0.0,
-                "total_expenses": 0.0,
-                "transaction_count": 0,
-                "balance": 0.0
-            }
-            
-            for result in results:
-                transaction_type = result["_id"]
-                total_amount = result["total_amount"]
-                count = result["count"]
-                
-                analytics["transaction_count"] += count
-                
-                if transaction_type == "income":
-                    analytics["total_income"] = total_amount
-                elif transaction_type == "expense":
-                    analytics["total_expenses"] = total_amount
-            
-            analytics["balance"] = analytics["total_income"] - analytics["total_expenses"]
-            
-            return analytics
-            
+            results = self._totals_by_type({"plan_id": plan_id, "user_id": user_id})
+            return self._fill_totals(analytics, results)
         except Exception as e:
             logger.error(f"Error getting plan analytics for plan {plan_id}: {e}")
-            return {
-                "plan_id": plan_id,
-                "total_income": 0.0,
-                "total_expenses": 0.0,
-                "transaction_count": 0,
-                "balance": 0.0
-            }
+            return analytics
     
     async def get_user_analytics(self, user_id: str) -> dict:
-        """Получение общей аналитики пользователя"""
+        """Получение общей аналитики пользователя с кешированием (сквозное чтение)"""
+        analytics = {
+            "user_id": user_id,
+            "total_income": 0.0,
+            "total_expenses": 0.0,
+            "transaction_count": 0,
+            "balance": 0.0
+        }
+        
+        async def fetch() -> Optional[dict]:
+            try:
+                results = self._totals_by_type({"user_id": user_id})
+                return self._fill_totals(dict(analytics), results)
+            except Exception as e:
+                logger.error(f"Error getting user analytics for user {user_id}: {e}")
+                return None
+        
+        cached = await cache_service.read_through(
+            cache_key=cache_service.make_user_analytics_key(user_id),
+            fetch_function=fetch,
+            tags=[cache_service.make_transactions_user_tag(user_id)]
+        )
+        return cached if cached is not None else analytics
+    
+    async def get_monthly_analytics(self, user_id: str, plan_id: Optional[int] = None) -> List[dict]:
+        """Помесячная аналитика пользователя (или плана) по дневным агрегатам"""
+        match = {"user_id": user_id}
+        if plan_id is not None:
+            match["plan_id"] = plan_id
+        
         try:
-            pipeline = [
-                {"$match": {"user_id": user_id}},
+            return transaction_rollup_service.monthly(match)
+        except Exception as e:
+            logger.error(f"Error getting monthly analytics for user {user_id}: {e}")
+            return []
+    
+    async def get_category_analytics(self, user_id: str, plan_id: Optional[int] = None) -> List[dict]:
+        """Аналитика по категориям пользователя (или плана) по дневным агрегатам"""
+        match = {"user_id": user_id}
+        if plan_id is not None:
+            match["plan_id"] = plan_id
+        
+        try:
+            return transaction_rollup_service.by_category(match)
+        except Exception as e:
+            logger.error(f"Error getting category analytics for user {user_id}: {e}")
+            return []
+    
+    def _get_plan_dashboard_from_db(self, plan_id: int, user_id: str, latest: int, top: int) -> dict:
+        """Все данные дашборда плана одним $facet-запросом"""
+        pipeline = [
+            {"$match": {"user_id": user_id, "plan_id": plan_id}},
+            {
+                "$facet": {
+                    "totals": [
+                        {
+                            "$group": {
+                                "_id": "$type",
+                                "total_amount": {"$sum": "$amount"},
+                                "count": {"$sum": 1}
+                            }
+                        }
+                    ],
+                    "top_categories": [
+                        {
+                            "$group": {
+                                "_id": {"category": "$category", "type": "$type"},
+                                "total_amount": {"$sum": "$amount"},
+                                "count": {"$sum": 1}
+                            }
+                        },
+                        {"$sort": {"total_amount": -1}},
+                        {"$limit": top}
+                    ],
+                    "monthly": [
+                        {
+                            "$group": {
+                                "_id": {
+                                    "month": {"$dateToString": {"format": "%Y-%m", "date": "$created_at"}},
+                                    "type": "$type"
+                                },
+                                "total_amount": {"$sum": "$amount"},
+                                "count": {"$sum": 1}
+                            }
+                        }
+                    ],
+                    "latest": [
+                        {"$sort": {"created_at": -1, "_id": -1}},
+                        {"$limit": latest}
+                    ]
+                }
+            }
+        ]
+        
+        facets = next(self.collection.aggregate(pipeline))
+        
+        totals = {
+            "total_income": 0.0,
+            "total_expenses": 0.0,
+            "transaction_count": 0,
+            "balance": 0.0
+        }
+        
+        # Результат сразу приводится к JSON-виду, чтобы кешированный ответ совпадал с первым
+        return {
+            "plan_id": plan_id,
+            "totals": self._fill_totals(totals, facets["totals"]),
+            "top_categories": [
                 {
-                    "$group": {
-                        "_id": "$type",
-                        "total_amount": {"$sum": "$amount"},
-                        "count": {"$sum": 1}
-                    }
+                    "category": result["_id"].get("category"),
+                    "type": result["_id"]["type"],
+                    "total_amount": result["total_amount"],
+                    "transaction_count": result["count"]
                 }
+                for result in facets["top_categories"]
+            ],
+            "monthly": build_monthly_series(facets["monthly"]),
+            "latest_transactions": [
+                TransactionMongo.from_mongo(doc).model_dump(mode="json", by_alias=True)
+                for doc in facets["latest"]
             ]
-            
-            results = list(self.collection.aggregate(pipeline))
-            
-            analytics = {
-                "user_id": user_id,
-                "total_income": 0.0,
-                "total_expenses": 0.0,
-                "transaction_count": 0,
-                "balance": 0.0
-            }
-            
-            for result in results:
-                transaction_type = result["_id"]
-                total_amount = result["total_amount"]
-                count = result["count"]
-                
-                analytics["transaction_count"] += count
-                
-                if transaction_type == "income":
-                    analytics["total_income"] = total_amount
-                elif transaction_type == "expense":
-                    analytics["total_expenses"] = total_amount
-            
-            analytics["balance"] = analytics["total_income"] - analytics["total_expenses"]
-            
-            return analytics
-            
-        except Exception as e:
-            logger.error(f"Error getting user analytics for user {user_id}: {e}")
-            return {
-                "user_id": user_id,
-                "total_income": 0.0,
-                "total_expenses": 0.0,
-                "transaction_count": 0,
-                "balance": 0.0
-            }
+        }
+    
+    async def get_plan_dashboard(self, plan_id: int, user_id: str, latest: int = 10, top: int = 5) -> Optional[dict]:
+        """Дашборд плана с кешированием (сквозное чтение), сбрасывается при записи в план по тегу плана"""
+        cache_key = cache_service.make_plan_dashboard_key(user_id, plan_id, latest, top)
+        
+        async def fetch() -> Optional[dict]:
+            try:
+                return self._get_plan_dashboard_from_db(plan_id, user_id, latest, top)
+            except Exception as e:
+                logger.error(f"Error getting dashboard for plan {plan_id}: {e}")
+                return None
+        
+        return await cache_service.read_through(
+            cache_key=cache_key,
+            fetch_function=fetch,
+            tags=[cache_service.make_transactions_plan_tag(user_id, plan_id)]
+        )
+    
+    async def rebuild_rollups(self, user_id: Optional[str] = None) -> int:
+        """Перестроение дневных агрегатов по сырым транзакциям с инвалидацией аналитики в кеше"""
+        count = await asyncio.to_thread(transaction_rollup_service.rebuild, self.collection, user_id)
+        await cache_service.invalidate_rollups(user_id)
+        return count
 
 
 # Глобальный экземпляр сервиса
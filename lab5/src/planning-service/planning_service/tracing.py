@@ -0,0 +1,14 @@
+from budget_common import tracing
+from budget_common.tracing import CLIENT, RequestTrace, TracedRoute, _current_trace, span, start_span  # noqa: F401
+
+from planning_service.config import settings
+
+# Глобальный экземпляр экспорта span
+span_exporter = tracing.SpanExporter(settings)
+
+
+class TracingMiddleware(tracing.TracingMiddleware):
+    """Трассировка запросов Planning Service с экспортом span через span_exporter"""
+
+    def __init__(self, app):
+        super().__init__(app, settings, span_exporter)
@@ -5,6 +5,41 @@ import time
 from typing import Generator, Dict
 
 
+def pytest_addoption(parser):
+    parser.addoption(
+        "--fail-on-loop-block", type=float, default=0, metavar="MS",
+        help="Fail a test when the planning service event loop is blocked longer than MS milliseconds"
+    )
+
+
+@pytest.fixture(autouse=True)
+def fail_on_loop_block(request):
+    """Fail the test if a planning service handler blocked the event loop (--fail-on-loop-block=MS)"""
+    threshold_ms = request.config.getoption("--fail-on-loop-block")
+    if not threshold_ms or request.node.get_closest_marker("allow_loop_block"):
+        yield
+        return
+
+    from planning_service.config import settings
+    from planning_service.metrics import event_loop_monitor
+
+    previous = settings.metrics_event_loop_stall_ms
+    settings.metrics_event_loop_stall_ms = threshold_ms
+    stall_count = event_loop_monitor.stall_count
+    try:
+        yield
+    finally:
+        settings.metrics_event_loop_stall_ms = previous
+    stalls = event_loop_monitor.recent_stalls()[:event_loop_monitor.stall_count - stall_count]
+    if stalls:
+        stall = stalls[-1]
+        pytest.fail(
+            f"Event loop blocked for {stall['duration_ms']} ms (threshold {threshold_ms} ms, {len(stalls)} stalls):\n"
+            + "\n".join(stall["stack"]),
+            pytrace=False
+        )
+
+
 @pytest.fixture(scope="session")
 def event_loop():
     """Create an instance of the default event loop for the test session."""
@@ -217,6 +252,9 @@ def pytest_configure(config):
     config.addinivalue_line(
         "markers", "api: mark test as API endpoint test"
     )
+    config.addinivalue_line(
+        "markers", "allow_loop_block: the test blocks the event loop on purpose"
+    )
 
 
 # Custom pytest hooks
@@ -6,11 +6,47 @@ import json
 from fastapi import HTTPException
 
 from api_gateway.main import app
-from api_gateway.models.auth import UserResponse
+from api_gateway.models.auth import UserInDB, UserResponse
+from api_gateway.services.upstream_client import upstream_client
+from api_gateway.services.token_cache import VerifiedTokenCache
+from api_gateway.services.response_cache import (
+    STORE_SCRIPT,
+    ResponseCacheMiddleware,
+    response_cache,
+    response_ttl,
+    route_ttl
+)
+from api_gateway.services.rate_limiter import MemoryTokenBucketBackend, rate_limiter
+from api_gateway.services.concurrency_limiter import AdaptiveConcurrencyLimiter, UpstreamOverloaded, concurrency_limiter
+from api_gateway.services.upstream_policy import UpstreamDeadlineExceeded, UpstreamPolicy
+from api_gateway.services.upstream_pool import UpstreamPool, upstream_pool
+from budget_common.compression import negotiate
+from api_gateway.services.circuit_breaker import CircuitBreaker, CircuitOpen, circuit_breakers, last_known_good
+from api_gateway.services.credential_store import CredentialStore, credential_store
+from passlib.context import CryptContext
+from api_gateway.config import settings
+from api_gateway.metrics import http_requests_in_flight, observe_store, registry
+from api_gateway.tracing import parse_traceparent, span_exporter
+from api_gateway.profiling import profile_store
+from budget_common.profiling import PyinstrumentProfiler, RouteProfile, _PyinstrumentRun
+import asyncio
+import gzip
+import itertools
+import threading
+import time
 
 client = TestClient(app)
 
 
+@pytest.fixture(autouse=True)
+def reset_circuit_breakers():
+    """Upstream failures simulated by one test must not open circuits for the next ones"""
+    circuit_breakers.reset()
+    yield
+    circuit_breakers.reset()
+    last_known_good.clear()
+
+
 class TestAuthentication:
     """Test authentication endpoints"""
 
@@ -228,16 +264,187 @@ class TestProxyEndpoints:
             response = client.get(endpoint)
             assert response.status_code == 403
 
-    @patch('api_gateway.services.proxy_service.httpx.AsyncClient')
-    def test_service_unavailable(self, mock_client, auth_headers):
+    def test_service_unavailable(self, auth_headers):
         """Test handling of service unavailable scenarios"""
-        mock_client.return_value.__aenter__.return_value.request.side_effect = httpx.RequestError("Connection failed")
+        def handler(request):
+            raise httpx.ConnectError("Connection failed")
         
-        response = client.get("/api/plans", headers=auth_headers)
+        with patch.object(upstream_client, "_client", httpx.AsyncClient(transport=httpx.MockTransport(handler))):
+            response = client.get("/api/plans", headers=auth_headers)
         assert response.status_code == 503
         assert "Service unavailable" in response.json()["detail"]
 
 
+class TestStreamingProxy:
+    """Test streaming pass-through of gateway proxy routes"""
+
+    @pytest.fixture
+    def auth_headers(self):
+        login_response = client.post(
+            "/auth/login",
+            json={"username": "admin", "password": "secret"}
+        )
+        token = login_response.json()["access_token"]
+        return {"Authorization": f"Bearer {token}"}
+
+    @staticmethod
+    def _upstream(handler):
+        return patch.object(upstream_client, "_client", httpx.AsyncClient(transport=httpx.MockTransport(handler)))
+
+    @staticmethod
+    def _streamed(status_code, body=b"", headers=None):
+        """Upstream response with a streamed body, as a real network transport returns it"""
+        async def stream():
+            yield body
+
+        return httpx.Response(status_code, headers=headers, content=stream())
+
+    @staticmethod
+    def _streamed_json(status_code, data):
+        """Streamed upstream response with a JSON body"""
+        body = json.dumps(data).encode()
+        headers = {"content-type": "application/json", "content-length": str(len(body))}
+        return TestStreamingProxy._streamed(status_code, body, headers)
+
+    def test_typed_routes_stream_without_parsing(self, auth_headers):
+        """Test that plan routes pass upstream status, headers and body bytes through unparsed"""
+        def handler(request):
+            if request.url.path == "/plans/999":
+                return self._streamed(404, b'{"detail":"Plan not found"}', {"content-type": "application/json"})
+            assert json.loads(request.content) == {"title": "New Plan"}
+            body = b'{"id":7,"title":"New Plan"}'
+            headers = {"content-type": "application/json", "content-length": str(len(body)), "etag": '"v7"'}
+            return self._streamed(201, body, headers)
+
+        with self._upstream(handler), patch.object(httpx.Response, "json") as parse:
+            created = client.post("/api/plans", json={"title": "New Plan"}, headers=auth_headers)
+            missing = client.get("/api/plans/999", headers=auth_headers)
+            parse.assert_not_called()
+
+        assert created.status_code == 201
+        assert created.headers["etag"] == '"v7"'
+        assert created.content == b'{"id":7,"title":"New Plan"}'
+        assert missing.status_code == 404
+        assert missing.content == b'{"detail":"Plan not found"}'
+
+    def test_export_streams_upstream_body(self, auth_headers):
+        """Test that export chunks and headers are passed through unchanged"""
+        async def body():
+            yield b'{"amount":1.0}\n'
+            yield b'{"amount":2.0}\n'
+
+        def handler(request):
+            assert request.headers["X-User"] == "admin"
+            assert request.url.path == "/transactions-mongo/export"
+            assert request.url.params["format"] == "ndjson"
+            return httpx.Response(
+                200,
+                headers={
+                    "content-type": "application/x-ndjson",
+                    "content-disposition": 'attachment; filename="transactions.ndjson"'
+                },
+                content=body()
+            )
+
+        with self._upstream(handler):
+            response = client.get("/api/transactions-mongo/export?format=ndjson", headers=auth_headers)
+
+        assert response.status_code == 200
+        assert response.headers["content-type"] == "application/x-ndjson"
+        assert "transactions.ndjson" in response.headers["content-disposition"]
+        assert response.content == b'{"amount":1.0}\n{"amount":2.0}\n'
+
+    def test_export_upstream_error(self, auth_headers):
+        """Test that upstream errors are returned before streaming starts"""
+        def handler(request):
+            return self._streamed(400, b'{"detail":"Unknown fields: zzz"}', {"content-type": "application/json"})
+
+        with self._upstream(handler):
+            response = client.get("/api/transactions-mongo/export?fields=zzz", headers=auth_headers)
+
+        assert response.status_code == 400
+        assert response.json() == {"detail": "Unknown fields: zzz"}
+
+    def test_status_and_headers_preserved(self, auth_headers):
+        """Test that upstream status and caching/encoding headers reach the client unchanged"""
+        def handler(request):
+            assert request.headers["If-None-Match"] == '"v1"'
+            return self._streamed(
+                304,
+                headers=[
+                    ("ETag", '"v1"'),
+                    ("Cache-Control", "private, max-age=60"),
+                    ("X-Next-Cursor", "abc"),
+                    ("Set-Cookie", "a=1"),
+                    ("Set-Cookie", "b=2")
+                ]
+            )
+
+        with self._upstream(handler):
+            response = client.get(
+                "/api/transactions-mongo?limit=10",
+                headers={**auth_headers, "If-None-Match": '"v1"'}
+            )
+
+        assert response.status_code == 304
+        assert response.headers["etag"] == '"v1"'
+        assert response.headers["cache-control"] == "private, max-age=60"
+        assert response.headers["x-next-cursor"] == "abc"
+        assert response.headers.get_list("set-cookie") == ["a=1", "b=2"]
+
+    def test_encoded_body_passed_raw(self, auth_headers):
+        """Test that compressed upstream bodies are forwarded without decoding"""
+        import gzip
+        payload = gzip.compress(b'[{"amount":1.0}]')
+
+        def handler(request):
+            return self._streamed(200, payload, {"content-type": "application/json", "content-encoding": "gzip"})
+
+        with self._upstream(handler):
+            response = client.get("/api/transactions-mongo", headers=auth_headers)
+
+        assert response.headers["content-encoding"] == "gzip"
+        assert response.json() == [{"amount": 1.0}]
+
+    def test_request_body_and_identity_forwarded(self, auth_headers):
+        """Test that request bodies are streamed and the gateway identity replaces client credentials"""
+        def handler(request):
+            assert request.method == "POST"
+            assert request.headers["X-User"] == "admin"
+            assert "authorization" not in request.headers
+            assert json.loads(request.read()) == {"plan_id": 1, "type": "income", "amount": 10.0}
+            return self._streamed(201, b'{"_id":"1"}', {"content-type": "application/json"})
+
+        with self._upstream(handler):
+            response = client.post(
+                "/api/transactions-mongo",
+                json={"plan_id": 1, "type": "income", "amount": 10.0},
+                headers={**auth_headers, "X-User": "intruder"}
+            )
+
+        assert response.status_code == 201
+        assert response.json() == {"_id": "1"}
+
+    def test_upstream_failure_mid_body_releases_stream(self, auth_headers):
+        """Test that a body broken after the first chunk still returns the connection and in-flight slots"""
+        async def body():
+            yield b'{"amount":1.0}\n'
+            raise httpx.ReadError("connection reset")
+
+        def handler(request):
+            return httpx.Response(200, headers={"content-type": "application/x-ndjson"}, content=body())
+
+        limiter_in_flight = concurrency_limiter.in_flight
+        with self._upstream(handler):
+            for _ in range(3):
+                with pytest.raises(httpx.ReadError):
+                    client.get("/api/transactions-mongo/export?format=ndjson", headers=auth_headers)
+
+        assert upstream_client.in_flight == 0
+        assert concurrency_limiter.in_flight == limiter_in_flight
+        assert all(count == 0 for count in upstream_client.outstanding.values())
+
+
 class TestErrorHandling:
     """Test error handling scenarios"""
 
@@ -283,6 +490,1225 @@ class TestErrorHandling:
         assert response.status_code == 404
 
 
+class TestUpstreamClient:
+    """Test the shared upstream connection pool"""
+
+    def test_requests_reuse_one_client(self, monkeypatch):
+        """Test that consecutive proxied requests go through the same pooled client"""
+        clients = []
+
+        def handler(request):
+            return TestStreamingProxy._streamed_json(200, [])
+
+        pooled = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+        original_send = pooled.send
+
+        async def tracking_send(*args, **kwargs):
+            clients.append(upstream_client.client)
+            return await original_send(*args, **kwargs)
+
+        monkeypatch.setattr(pooled, "send", tracking_send)
+        login_response = client.post("/auth/login", json={"username": "admin", "password": "secret"})
+        headers = {"Authorization": f"Bearer {login_response.json()['access_token']}"}
+
+        with patch.object(upstream_client, "_client", pooled):
+            before = upstream_client.requests_total
+            client.get("/api/plans", headers=headers)
+            client.get("/api/plans", headers=headers)
+
+        assert clients == [pooled, pooled]
+        assert upstream_client.requests_total - before == 2
+        assert upstream_client.in_flight == 0
+
+    def test_lifespan_opens_and_closes_pool(self):
+        """Test that the pool is opened on startup and closed on shutdown"""
+        with TestClient(app) as lifespan_client:
+            assert upstream_client._client is not None
+            pool = lifespan_client.get("/health").json()["upstream_pool"]
+            assert pool["started"] is True
+            assert pool["max_connections"] > 0
+            assert pool["in_flight"] == 0
+
+        assert upstream_client._client is None
+
+
+class TestTokenCache:
+    """Test the verified-token cache of the auth dependency"""
+
+    @staticmethod
+    def _token():
+        response = client.post("/auth/login", json={"username": "admin", "password": "secret"})
+        return response.json()["access_token"]
+
+    def test_repeated_requests_skip_jwt_decode(self):
+        """Test that a verified token is served from the cache"""
+        token = self._token()
+        headers = {"Authorization": f"Bearer {token}"}
+        assert client.get("/auth/me", headers=headers).status_code == 200
+
+        with patch('api_gateway.services.auth_service.jwt.decode') as mock_decode:
+            response = client.get("/auth/me", headers=headers)
+
+        assert response.status_code == 200
+        assert response.json()["username"] == "admin"
+        mock_decode.assert_not_called()
+
+    def test_entry_expires_with_token(self):
+        """Test that cache entries live until the token exp and are bounded in size"""
+        cache = VerifiedTokenCache(max_size=2)
+        user = UserResponse(id=1, username="admin", is_admin=True)
+
+        cache.put("expired", user, time.time() - 1)
+        cache.put("a", user, time.time() + 60)
+        cache.put("b", user, time.time() + 60)
+        cache.get("a")
+        cache.put("c", user, time.time() + 60)
+
+        assert cache.get("expired") is None
+        assert cache.get("b") is None
+        assert cache.get("a") == user
+        assert cache.get("c") == user
+
+        with patch('api_gateway.services.token_cache.time.time', return_value=time.time() + 120):
+            assert cache.get("a") is None
+
+    def test_logout_revokes_only_that_token(self):
+        """Test that a revoked token is rejected even though it is cached and correctly signed"""
+        token, other_token = self._token(), self._token()
+        headers = {"Authorization": f"Bearer {token}"}
+        assert token != other_token
+        assert client.get("/auth/me", headers=headers).status_code == 200
+
+        assert client.post("/auth/logout", headers=headers).status_code == 200
+
+        assert client.get("/auth/me", headers=headers).status_code == 401
+        assert client.get("/auth/me", headers={"Authorization": f"Bearer {other_token}"}).status_code == 200
+
+    @pytest.fixture
+    def tester(self):
+        credential_store.users["tester"] = UserInDB(id=2, username="tester", hashed_password="")
+        credential_store.set_password("tester", "old-password")
+        response = client.post("/auth/login", json={"username": "tester", "password": "old-password"})
+        yield {"Authorization": f"Bearer {response.json()['access_token']}"}
+        credential_store.remove_user("tester")
+
+    def test_password_change_rejects_cached_token(self, tester):
+        """Test that a token cached before a password change is rejected, new logins work"""
+        assert client.get("/auth/me", headers=tester).status_code == 200
+
+        credential_store.set_password("tester", "new-password")
+
+        assert client.get("/auth/me", headers=tester).status_code == 401
+        response = client.post("/auth/login", json={"username": "tester", "password": "new-password"})
+        new_headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+        assert client.get("/auth/me", headers=new_headers).status_code == 200
+
+    def test_rights_change_and_removal_drop_cached_entries(self, tester):
+        """Test that cached verifications follow admin flag changes and user removal"""
+        assert client.get("/auth/me", headers=tester).json()["is_admin"] is False
+
+        credential_store.set_admin("tester", True)
+        assert client.get("/auth/me", headers=tester).json()["is_admin"] is True
+
+        credential_store.remove_user("tester")
+        assert client.get("/auth/me", headers=tester).status_code == 401
+
+
+class TestCredentialStore:
+    """Test hashed credentials verified off the event loop"""
+
+    def test_passwords_stored_as_hashes(self):
+        """Test that the store keeps only hashes and login still works"""
+        admin = credential_store.users["admin"]
+        assert not hasattr(admin, "password")
+        assert admin.hashed_password.startswith("$")
+        assert "secret" not in admin.hashed_password
+
+        response = client.post("/auth/login", json={"username": "admin", "password": "secret"})
+        assert response.status_code == 200
+
+    @pytest.mark.parametrize("legacy", [
+        CryptContext(schemes=["bcrypt"], bcrypt__rounds=4),
+        CryptContext(schemes=["argon2"], argon2__memory_cost=8192, argon2__time_cost=1)
+    ])
+    def test_rehash_on_login(self, legacy):
+        """Test that hashes with an old scheme or weaker parameters are upgraded on successful login"""
+        store = CredentialStore({"user": UserInDB(id=2, username="user", hashed_password=legacy.hash("pw"))})
+        old_hash = store.users["user"].hashed_password
+
+        assert asyncio.run(store.authenticate("user", "wrong")) is None
+        assert store.users["user"].hashed_password == old_hash
+
+        assert asyncio.run(store.authenticate("user", "pw")) is not None
+        new_hash = store.users["user"].hashed_password
+        assert new_hash.startswith("$argon2id$v=19$m=19456,t=2,p=1$")
+        assert store.rehashed == 1
+
+        assert asyncio.run(store.authenticate("user", "pw")) is not None
+        assert store.users["user"].hashed_password == new_hash
+        assert store.rehashed == 1
+        store.close()
+
+    def test_verification_runs_in_thread_pool(self):
+        """Test that hashes are verified outside the event loop thread, unknown users included"""
+        store = CredentialStore({"user": UserInDB(id=2, username="user", hashed_password="")})
+        store.set_password("user", "pw")
+        threads = []
+        verify_and_update = store.context.verify_and_update
+
+        def recording(*args):
+            threads.append(threading.current_thread().name)
+            return verify_and_update(*args)
+
+        with patch.object(store.context, "verify_and_update", recording):
+            assert asyncio.run(store.authenticate("user", "pw")) is not None
+        assert asyncio.run(store.authenticate("nobody", "pw")) is None
+
+        assert threads and threads[0].startswith("password-hash")
+        assert store.stats()["rejected"] == 1
+        store.close()
+
+    def test_login_rejected_when_queue_full(self, monkeypatch):
+        """Test that logins beyond the pending limit get 503 instead of queueing"""
+        monkeypatch.setattr(settings, "password_hash_max_pending", 0)
+        response = client.post("/auth/login", json={"username": "admin", "password": "secret"})
+
+        assert response.status_code == 503
+        assert response.headers["retry-after"] == "1"
+
+
+class TestResponseCache:
+    """Test the gateway response cache for GET routes"""
+
+    @pytest.fixture
+    def memory_cache(self, monkeypatch):
+        monkeypatch.setattr(settings, "response_cache_backend", "memory")
+        yield response_cache
+        asyncio.run(response_cache.close())
+
+    @pytest.fixture
+    def auth_headers(self):
+        login_response = client.post("/auth/login", json={"username": "admin", "password": "secret"})
+        return {"Authorization": f"Bearer {login_response.json()['access_token']}"}
+
+    @staticmethod
+    def _upstream(calls, headers=None):
+        def handler(request):
+            calls.append((request.method, request.url.path))
+            if request.method == "GET":
+                body = json.dumps([{"id": len(calls)}]).encode()
+                return TestStreamingProxy._streamed(200, body, {"content-type": "application/json", **(headers or {})})
+            return TestStreamingProxy._streamed(201, b'{"id": "new"}', {"content-type": "application/json"})
+
+        return patch.object(upstream_client, "_client", httpx.AsyncClient(transport=httpx.MockTransport(handler)))
+
+    def test_route_ttl_and_cache_control(self):
+        """Test per-route TTL lookup and upstream Cache-Control handling"""
+        with patch.object(settings, "response_cache_routes", {"/api/plans": 30, "/api/transactions-mongo": 20, "/api/transactions-mongo/export": 0}):
+            assert route_ttl("/api/plans") == 30
+            assert route_ttl("/api/plans/1/analytics") == 30
+            assert route_ttl("/api/plansx") == 0
+            assert route_ttl("/api/transactions-mongo/analytics/user") == 20
+            assert route_ttl("/api/transactions-mongo/export") == 0
+
+        assert response_ttl(30, None) == 30
+        assert response_ttl(30, "private, max-age=10") == 10
+        assert response_ttl(30, "max-age=600") == 30
+        assert response_ttl(30, "no-store") == 0
+        assert response_ttl(30, "no-cache") == 0
+
+    def test_get_served_from_cache_with_etag(self, memory_cache, auth_headers):
+        """Test that a repeated GET does not reach the planning service and supports If-None-Match"""
+        calls = []
+        with self._upstream(calls):
+            first = client.get("/api/plans", headers=auth_headers)
+            second = client.get("/api/plans", headers=auth_headers)
+            not_modified = client.get("/api/plans", headers={**auth_headers, "If-None-Match": second.headers["etag"]})
+
+        assert len(calls) == 1
+        assert first.headers["x-cache"] == "MISS"
+        assert second.headers["x-cache"] == "HIT"
+        assert second.json() == first.json()
+        assert first.headers["etag"] == second.headers["etag"]
+        assert not_modified.status_code == 304
+
+    def test_miss_etag_revalidates(self, memory_cache, auth_headers):
+        """Test that the ETag returned on a miss is accepted by the next conditional request"""
+        calls = []
+        with self._upstream(calls):
+            first = client.get("/api/plans/1/analytics", headers=auth_headers)
+            not_modified = client.get("/api/plans/1/analytics", headers={**auth_headers, "If-None-Match": first.headers["etag"]})
+
+        assert first.headers["etag"].startswith('W/"')
+        assert not_modified.status_code == 304
+        assert len(calls) == 1
+
+    def test_write_invalidates_user_entries(self, memory_cache, auth_headers):
+        """Test that a write through the gateway drops the user's cached responses"""
+        calls = []
+        with self._upstream(calls):
+            client.get("/api/transactions-mongo?limit=5", headers=auth_headers)
+            client.post("/api/transactions-mongo", json={"plan_id": 1, "type": "income", "amount": 1.0}, headers=auth_headers)
+            after_write = client.get("/api/transactions-mongo?limit=5", headers=auth_headers)
+
+        assert [method for method, _ in calls] == ["GET", "POST", "GET"]
+        assert after_write.headers["x-cache"] == "MISS"
+
+    def test_write_invalidates_before_response_start(self, memory_cache, auth_headers):
+        """Test that a GET sent as soon as the write response starts is not served the pre-write entry"""
+        reads = []
+
+        async def app(scope, receive, send):
+            if scope["method"] == "GET":
+                reads.append(scope["path"])
+            status = 200 if scope["method"] == "GET" else 201
+            await send({"type": "http.response.start", "status": status, "headers": [(b"content-type", b"application/json")]})
+            await send({"type": "http.response.body", "body": json.dumps({"reads": len(reads)}).encode()})
+
+        middleware = ResponseCacheMiddleware(app)
+        headers = [(b"authorization", auth_headers["Authorization"].encode())]
+
+        async def receive():
+            return {"type": "http.request", "body": b"", "more_body": False}
+
+        async def request(method, send):
+            scope = {"type": "http", "method": method, "path": "/api/plans", "query_string": b"", "headers": headers}
+            await middleware(scope, receive, send)
+
+        async def get():
+            messages = []
+
+            async def collect(message):
+                messages.append(message)
+
+            await request("GET", collect)
+            return dict(messages[0]["headers"])[b"x-cache"]
+
+        async def scenario():
+            follow_up = []
+
+            async def send(message):
+                if message["type"] == "http.response.start":
+                    follow_up.append(await get())
+
+            assert await get() == b"MISS"
+            assert await get() == b"HIT"
+            await request("POST", send)
+            return follow_up
+
+        assert asyncio.run(scenario()) == [b"MISS"]
+        assert len(reads) == 2
+
+    def test_invalidation_during_miss_is_not_overwritten(self, memory_cache, auth_headers):
+        """Test that a GET started before a write's invalidation does not store its response"""
+        calls = []
+
+        async def handler(request):
+            calls.append((request.method, request.url.path))
+            if len(calls) == 1:
+                # A write for the same user completes while this GET is still being served
+                await response_cache.invalidate_user("admin")
+            return TestStreamingProxy._streamed(200, json.dumps({"read": len(calls)}).encode(), {"content-type": "application/json"})
+
+        with patch.object(upstream_client, "_client", httpx.AsyncClient(transport=httpx.MockTransport(handler))):
+            first = client.get("/api/plans", headers=auth_headers)
+            second = client.get("/api/plans", headers=auth_headers)
+            third = client.get("/api/plans", headers=auth_headers)
+
+        assert first.json() == {"read": 1}
+        assert second.headers["x-cache"] == "MISS" and second.json() == {"read": 2}
+        assert third.headers["x-cache"] == "HIT" and third.json() == {"read": 2}
+
+    def test_redis_backend_generation_guard(self):
+        """Test that the Redis backend rejects a store after the user's entries were invalidated"""
+        fakeredis = pytest.importorskip("fakeredis")
+        from api_gateway.services.response_cache import RedisResponseCacheBackend
+
+        async def scenario():
+            backend = RedisResponseCacheBackend("redis://localhost:6379/0", max_ttl=30)
+            backend.client = fakeredis.FakeAsyncRedis()
+            backend._store = backend.client.register_script(STORE_SCRIPT)
+
+            generation = await backend.generation("admin")
+            assert await backend.set("admin", "/api/plans?|", b"{}\nfirst", 30, generation)
+            await backend.invalidate_user("admin")
+            assert await backend.get("admin", "/api/plans?|") is None
+            assert not await backend.set("admin", "/api/plans?|", b"{}\nstale", 30, generation)
+            assert await backend.set("admin", "/api/plans?|", b"{}\nfresh", 30, await backend.generation("admin"))
+
+        asyncio.run(scenario())
+
+    def test_large_body_streamed_uncached(self, memory_cache, auth_headers, monkeypatch):
+        """Test that a body over the size limit reaches the client intact and is not cached"""
+        monkeypatch.setattr(settings, "response_cache_max_body_bytes", 4)
+        calls = []
+        with self._upstream(calls):
+            first = client.get("/api/plans", headers=auth_headers)
+            second = client.get("/api/plans", headers=auth_headers)
+
+        assert first.json() == [{"id": 1}]
+        assert "etag" not in first.headers
+        assert second.headers["x-cache"] == "MISS"
+        assert len(calls) == 2
+
+    def test_upstream_no_store_is_not_cached(self, memory_cache, auth_headers):
+        """Test that upstream Cache-Control: no-store is honored"""
+        calls = []
+        with self._upstream(calls, headers={"Cache-Control": "no-store"}):
+            client.get("/api/transactions-mongo", headers=auth_headers)
+            client.get("/api/transactions-mongo", headers=auth_headers)
+
+        assert len(calls) == 2
+
+
+class TestBatch:
+    """Test POST /api/batch"""
+
+    @pytest.fixture
+    def auth_headers(self):
+        login_response = client.post("/auth/login", json={"username": "admin", "password": "secret"})
+        return {"Authorization": f"Bearer {login_response.json()['access_token']}"}
+
+    @staticmethod
+    def _upstream(calls, delay=0.0):
+        state = {"active": 0, "max_active": 0}
+
+        async def handler(request):
+            calls.append((request.method, request.url.path, request.headers.get("x-user")))
+            state["active"] += 1
+            state["max_active"] = max(state["max_active"], state["active"])
+            await asyncio.sleep(delay)
+            state["active"] -= 1
+
+            path = request.url.path
+            if path == "/plans":
+                return httpx.Response(200, json=[{"id": plan_id} for plan_id in range(1, 7)])
+            if path.endswith("/analytics"):
+                return httpx.Response(200, json={"plan_id": int(path.split("/")[2])})
+            return httpx.Response(404, json={"detail": "Plan not found"})
+
+        mock = patch.object(upstream_client, "_client", httpx.AsyncClient(transport=httpx.MockTransport(handler)))
+        return mock, state
+
+    def test_fan_out_over_earlier_result(self, auth_headers):
+        """Test that an item iterates over plan IDs from an earlier item"""
+        calls = []
+        mock, _ = self._upstream(calls)
+        with mock:
+            response = client.post("/api/batch", json={"requests": [
+                {"id": "plans", "path": "/api/plans"},
+                {"id": "analytics", "path": "/api/plans/{plans.*.id}/analytics"},
+                {"id": "first", "path": "/api/plans/{plans.0.id}/analytics"}
+            ]}, headers=auth_headers)
+
+        assert response.status_code == 200
+        plans, analytics, first = response.json()["results"]
+        assert plans["status"] == 200 and len(plans["body"]) == 6
+        assert analytics["status"] == 200
+        assert [item["body"]["plan_id"] for item in analytics["items"]] == [1, 2, 3, 4, 5, 6]
+        assert first["body"] == {"plan_id": 1}
+        assert len(calls) == 8
+        assert all(user == "admin" for _, _, user in calls)
+
+    def test_per_item_status_and_failed_dependency(self, auth_headers):
+        """Test that failures are reported per item and dependents get 424"""
+        calls = []
+        mock, _ = self._upstream(calls)
+        with mock:
+            response = client.post("/api/batch", json={"requests": [
+                {"id": "missing", "path": "/api/plans/999"},
+                {"id": "dependent", "path": "/api/plans/{missing.id}/analytics"},
+                {"id": "unknown", "path": "/auth/me"},
+                {"id": "plans", "path": "/api/plans"}
+            ]}, headers=auth_headers)
+
+        statuses = {item["id"]: item["status"] for item in response.json()["results"]}
+        assert statuses == {"missing": 404, "dependent": 424, "unknown": 404, "plans": 200}
+        assert len(calls) == 2
+
+    def test_concurrency_cap(self, auth_headers):
+        """Test that concurrent upstream calls are limited by BATCH_MAX_CONCURRENCY"""
+        calls = []
+        mock, state = self._upstream(calls, delay=0.02)
+        with mock, patch.object(settings, "batch_max_concurrency", 2):
+            response = client.post("/api/batch", json={"requests": [
+                {"id": "plans", "path": "/api/plans"},
+                {"id": "analytics", "path": "/api/plans/{plans.*.id}/analytics"}
+            ]}, headers=auth_headers)
+
+        assert response.status_code == 200
+        assert len(calls) == 7
+        assert state["max_active"] == 2
+
+    @pytest.mark.parametrize("requests", [
+        [{"id": "a", "path": "/api/plans/{b.id}"}, {"id": "b", "path": "/api/plans"}],
+        [{"id": "a", "path": "/api/plans"}, {"id": "a", "path": "/api/plans"}],
+        [{"id": "a", "path": "/api/plans"}, {"id": "b", "path": "/api/plans/{a.*.id}", "params": {"x": "{a.*.name}"}}]
+    ])
+    def test_invalid_batch_rejected(self, auth_headers, requests):
+        """Test forward references, duplicate IDs and several iterated references"""
+        response = client.post("/api/batch", json={"requests": requests}, headers=auth_headers)
+        assert response.status_code == 400
+
+    def test_dot_segments_rejected(self, auth_headers):
+        """Test that . and .. segments, literal or substituted, cannot leave the allowed routes"""
+        calls = []
+
+        async def handler(request):
+            calls.append(request.url.path)
+            return httpx.Response(200, json=[{"id": ".."}])
+
+        with patch.object(upstream_client, "_client", httpx.AsyncClient(transport=httpx.MockTransport(handler))):
+            response = client.post("/api/batch", json={"requests": [
+                {"id": "literal", "path": "/api/plans/../cache/clear", "method": "POST"},
+                {"id": "encoded", "path": "/api/plans/%2e%2e/cache/clear", "method": "POST"},
+                {"id": "plans", "path": "/api/plans"},
+                {"id": "substituted", "path": "/api/plans/{plans.0.id}/cache/clear", "method": "POST"}
+            ]}, headers=auth_headers)
+
+        statuses = {item["id"]: item["status"] for item in response.json()["results"]}
+        assert statuses == {"literal": 400, "encoded": 400, "plans": 200, "substituted": 400}
+        assert calls == ["/plans"]
+
+    def test_batch_requires_auth(self):
+        """Test that the batch endpoint requires a token"""
+        response = client.post("/api/batch", json={"requests": [{"id": "plans", "path": "/api/plans"}]})
+        assert response.status_code == 403
+
+
+class TestRateLimiting:
+    """Test per-user token buckets and the adaptive concurrency limiter"""
+
+    @pytest.fixture
+    def memory_limits(self, monkeypatch):
+        monkeypatch.setattr(settings, "rate_limit_backend", "memory")
+        monkeypatch.setattr(settings, "rate_limit_routes", {"/api/transactions-mongo": (1.0, 2)})
+        yield rate_limiter
+        asyncio.run(rate_limiter.close())
+
+    @pytest.fixture
+    def auth_headers(self):
+        login_response = client.post("/auth/login", json={"username": "admin", "password": "secret"})
+        return {"Authorization": f"Bearer {login_response.json()['access_token']}"}
+
+    @staticmethod
+    def _upstream():
+        def handler(request):
+            return TestStreamingProxy._streamed(200, b"[]", {"content-type": "application/json"})
+
+        return patch.object(upstream_client, "_client", httpx.AsyncClient(transport=httpx.MockTransport(handler)))
+
+    def test_route_bucket_returns_429(self, memory_limits, auth_headers):
+        """Test that an exhausted route bucket rejects the user with Retry-After"""
+        with self._upstream():
+            statuses = [client.get("/api/transactions-mongo", headers=auth_headers).status_code for _ in range(3)]
+            limited = client.get("/api/transactions-mongo", headers=auth_headers)
+            other_route = client.get("/api/plans", headers=auth_headers)
+
+        assert statuses == [200, 200, 429]
+        assert limited.status_code == 429
+        assert int(limited.headers["retry-after"]) >= 1
+        assert other_route.status_code == 200
+
+    def test_buckets_are_taken_all_or_nothing(self):
+        """Test that a rejected request does not consume tokens from the other buckets"""
+        backend = MemoryTokenBucketBackend()
+        user_bucket, route_bucket = ("user:u", 0.001, 2), ("route:u:/api/x", 0.001, 1)
+
+        assert asyncio.run(backend.take([user_bucket, route_bucket])) == 0
+        assert asyncio.run(backend.take([user_bucket, route_bucket])) > 0
+        assert asyncio.run(backend.take([user_bucket])) == 0
+        assert asyncio.run(backend.take([user_bucket])) > 0
+
+    def test_adaptive_limit_decreases_and_recovers(self):
+        """Test AIMD: slow responses shrink the limit, fast ones grow it back"""
+        limiter = AdaptiveConcurrencyLimiter(initial_limit=10, min_limit=2, max_limit=20, latency_target_ms=100, backoff=0.5)
+
+        limiter.observe(0.5, ok=True)
+        assert int(limiter.limit) == 5
+        limiter.observe(0.5, ok=False)
+        assert int(limiter.limit) == 5  # not more often than once per target latency
+
+        limiter.in_flight = 5
+        for _ in range(20):
+            limiter.observe(0.01, ok=True)
+        assert int(limiter.limit) > 5
+
+        limiter.in_flight = int(limiter.limit)
+        with pytest.raises(UpstreamOverloaded):
+            limiter.acquire()
+        assert limiter.rejected == 1
+
+    def test_overloaded_upstream_returns_503(self, auth_headers):
+        """Test that requests over the concurrency limit are shed with 503 and Retry-After"""
+        with self._upstream(), patch.object(concurrency_limiter, "limit", 0.0):
+            response = client.get("/api/plans", headers=auth_headers)
+
+        assert response.status_code == 503
+        assert response.headers["retry-after"] == "1"
+        assert concurrency_limiter.in_flight == 0
+
+    def test_limiter_state_in_health(self, memory_limits, auth_headers):
+        """Test that limiter state is reported on /health"""
+        with self._upstream():
+            client.get("/api/plans", headers=auth_headers)
+        data = client.get("/health").json()
+
+        assert data["rate_limiter"]["allowed"] >= 1
+        assert data["rate_limiter"]["buckets"] == 1
+        assert {"limit", "in_flight", "rejected"} <= set(data["concurrency_limiter"])
+
+
+class TestUpstreamPolicy:
+    """Test deadlines, retries with a budget and hedged requests"""
+
+    @staticmethod
+    def _send(responses, calls, delays=None):
+        """Upstream attempts: each call returns the next status after its delay"""
+        async def send(url):
+            index = len(calls)
+            calls.append(url)
+            await asyncio.sleep((delays or {}).get(index, 0))
+            return httpx.Response(responses[min(index, len(responses) - 1)])
+
+        return send
+
+    def test_get_retried_after_503(self):
+        """Test that an idempotent GET is retried and the failed response is closed"""
+        policy, calls, closed = UpstreamPolicy(), [], []
+
+        async def close(response):
+            closed.append(response.status_code)
+
+        with patch.object(settings, "upstream_retry_base_delay_ms", 1.0):
+            response = asyncio.run(policy.call("GET", "/plans", self._send([503, 200], calls), close))
+
+        assert response.status_code == 200
+        assert len(calls) == 2
+        assert closed == [503]
+        assert policy.retries == 1
+
+    def test_writes_are_not_retried(self):
+        """Test that non-idempotent calls get a single attempt"""
+        policy, calls = UpstreamPolicy(), []
+        response = asyncio.run(policy.call("POST", "/plans", self._send([503, 200], calls)))
+
+        assert response.status_code == 503
+        assert len(calls) == 1
+
+    def test_retry_budget_exhausted(self):
+        """Test that retries stop when the global budget is spent"""
+        policy, calls = UpstreamPolicy(), []
+        policy.budget.balance = 0.0
+        policy.budget.min_per_second = 0.0
+        policy.budget.ratio = 0.0
+
+        response = asyncio.run(policy.call("GET", "/plans", self._send([503, 200], calls)))
+
+        assert response.status_code == 503
+        assert len(calls) == 1
+        assert policy.budget_exhausted == 1
+
+    def test_deadline_exceeded(self):
+        """Test that a slow upstream is cut off at the route deadline"""
+        policy, calls = UpstreamPolicy(), []
+        with patch.object(settings, "upstream_route_deadlines", {"/api/plans": 0.05}):
+            start = time.perf_counter()
+            with pytest.raises(UpstreamDeadlineExceeded):
+                asyncio.run(policy.call("GET", "/plans/1", self._send([200], calls, delays={0: 1.0})))
+
+        assert time.perf_counter() - start < 0.5
+        assert policy.deadline_exceeded == 1
+
+    def test_hedge_wins_over_slow_attempt(self):
+        """Test that a second attempt is sent after the p95 delay and the first answer is used"""
+        policy, calls = UpstreamPolicy(), []
+        for _ in range(40):
+            policy.latency.record("/plans/{id}", 0.01)
+
+        start = time.perf_counter()
+        response = asyncio.run(policy.call("GET", "/plans/7", self._send([200], calls, delays={0: 1.0})))
+
+        assert response.status_code == 200
+        assert time.perf_counter() - start < 0.5
+        assert len(calls) == 2
+        assert policy.hedges == 1 and policy.hedges_won == 1
+
+    def test_gateway_returns_504_on_deadline(self):
+        """Test that the gateway maps an exceeded deadline to 504"""
+        login_response = client.post("/auth/login", json={"username": "admin", "password": "secret"})
+        headers = {"Authorization": f"Bearer {login_response.json()['access_token']}"}
+
+        async def handler(request):
+            await asyncio.sleep(1.0)
+            return TestStreamingProxy._streamed_json(200, [])
+
+        mock_client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+        with patch.object(upstream_client, "_client", mock_client), \
+                patch.object(settings, "upstream_route_deadlines", {"/api/plans": 0.05}):
+            response = client.get("/api/plans", headers=headers)
+
+        assert response.status_code == 504
+
+
+class TestUpstreamPool:
+    """Test planning service replicas: balancing, health checks and outlier ejection"""
+
+    REPLICAS = ["http://ps-1:8080", "http://ps-2:8080", "http://ps-3:8080"]
+
+    @pytest.fixture
+    def replicas(self, monkeypatch):
+        monkeypatch.setattr(settings, "planning_service_urls", self.REPLICAS)
+        return UpstreamPool()
+
+    def test_round_robin(self, replicas):
+        """Test that round robin cycles through all replicas"""
+        chosen = [replicas.choose().url for _ in range(6)]
+        assert sorted(chosen[:3]) == self.REPLICAS
+        assert chosen[:3] == chosen[3:]
+
+    def test_least_outstanding(self, replicas, monkeypatch):
+        """Test that the replica with the fewest open requests is chosen"""
+        monkeypatch.setattr(settings, "upstream_balancing", "least_outstanding")
+        monkeypatch.setattr(upstream_client, "outstanding", {"http://ps-1:8080": 4, "http://ps-2:8080": 1, "http://ps-3:8080": 2})
+        assert {replicas.choose().url for _ in range(10)} == {"http://ps-2:8080"}
+
+    def test_consistent_hash_by_user(self, replicas, monkeypatch):
+        """Test that a user sticks to one replica and moves only when it becomes unavailable"""
+        monkeypatch.setattr(settings, "upstream_balancing", "consistent_hash")
+        users = [f"user{i}" for i in range(200)]
+        before = {user: replicas.choose(user).url for user in users}
+
+        assert all(replicas.choose(user).url == before[user] for user in users)
+        assert len(set(before.values())) == 3
+
+        replicas.upstreams["http://ps-1:8080"].healthy = False
+        after = {user: replicas.choose(user).url for user in users}
+        moved = [user for user in users if after[user] != before[user]]
+        assert moved and all(before[user] == "http://ps-1:8080" for user in moved)
+
+    def test_outlier_ejection(self, replicas):
+        """Test passive ejection after consecutive failures, capped by the max ejection percent"""
+        first, second = replicas.upstreams["http://ps-1:8080"], replicas.upstreams["http://ps-2:8080"]
+        for _ in range(settings.upstream_outlier_consecutive_failures):
+            replicas.report(first, ok=False)
+            replicas.report(second, ok=False)
+
+        assert first.ejected and not second.ejected
+        assert "http://ps-1:8080" not in {replicas.choose().url for _ in range(6)}
+
+    def test_active_health_check(self, replicas):
+        """Test that a replica failing health checks is taken out and returns after recovery"""
+        statuses = {"ps-1": 500, "ps-2": 200, "ps-3": 200}
+
+        def handler(request):
+            return httpx.Response(statuses[request.url.host])
+
+        with patch.object(upstream_client, "_client", httpx.AsyncClient(transport=httpx.MockTransport(handler))):
+            for _ in range(settings.upstream_unhealthy_threshold):
+                asyncio.run(replicas.check_health())
+            assert not replicas.upstreams["http://ps-1:8080"].healthy
+
+            statuses["ps-1"] = 200
+            asyncio.run(replicas.check_health())
+            assert replicas.upstreams["http://ps-1:8080"].healthy
+
+    def test_gateway_spreads_requests_and_hedges_to_another_replica(self, monkeypatch):
+        """Test that gateway calls go to different replicas and a hedge avoids the slow one"""
+        monkeypatch.setattr(settings, "planning_service_urls", self.REPLICAS[:2])
+        hosts = []
+
+        async def handler(request):
+            hosts.append(request.url.host)
+            if request.url.path == "/plans/1" and request.url.host == "ps-1":
+                await asyncio.sleep(1.0)
+            return TestStreamingProxy._streamed_json(200, [])
+
+        login_response = client.post("/auth/login", json={"username": "admin", "password": "secret"})
+        headers = {"Authorization": f"Bearer {login_response.json()['access_token']}"}
+        policy = UpstreamPolicy()
+        for _ in range(40):
+            policy.latency.record("/plans/{id}", 0.01)
+
+        with patch.object(upstream_client, "_client", httpx.AsyncClient(transport=httpx.MockTransport(handler))):
+            for _ in range(4):
+                client.get("/api/plans", headers=headers)
+            assert sorted(set(hosts)) == ["ps-1", "ps-2"]
+
+            hosts.clear()
+            upstream_pool.choose()  # sync the global pool with the patched replicas
+            upstream_pool._round_robin = itertools.count()  # primary attempt goes to ps-1
+            start = time.perf_counter()
+            response = asyncio.run(policy.call("GET", "/plans/1", lambda url: upstream_client.request("GET", url)))
+
+        assert response.status_code == 200
+        assert time.perf_counter() - start < 0.5
+        assert hosts == ["ps-1", "ps-2"]
+
+
+class TestCompression:
+    """Test response compression negotiated via Accept-Encoding"""
+
+    @pytest.fixture
+    def auth_headers(self):
+        login_response = client.post("/auth/login", json={"username": "admin", "password": "secret"})
+        return {"Authorization": f"Bearer {login_response.json()['access_token']}"}
+
+    @staticmethod
+    def _plans(count):
+        return [{"id": i, "title": f"Plan {i}", "description": "Monthly budget"} for i in range(count)]
+
+    def test_negotiate_respects_q_values(self):
+        """Test that the highest q wins and server preference breaks ties"""
+        available = ["zstd", "br", "gzip"]
+        assert negotiate("gzip, br", available) == "br"
+        assert negotiate("gzip;q=1.0, br;q=0.5", available) == "gzip"
+        assert negotiate("*", ["gzip"]) == "gzip"
+        assert negotiate("gzip;q=0, identity", ["gzip"]) is None
+        assert negotiate("deflate", available) is None
+
+    def test_large_response_compressed_once(self, auth_headers):
+        """Test that typed routes ask upstream for identity and compress the body for the client"""
+        seen = []
+
+        def handler(request):
+            seen.append(request.headers["accept-encoding"])
+            return TestStreamingProxy._streamed_json(200, self._plans(100))
+
+        with patch.object(upstream_client, "_client", httpx.AsyncClient(transport=httpx.MockTransport(handler))):
+            response = client.get("/api/plans", headers={**auth_headers, "Accept-Encoding": "gzip"})
+
+        assert seen == ["identity"]
+        assert response.headers["content-encoding"] == "gzip"
+        assert "accept-encoding" in response.headers["vary"].lower()
+        assert response.num_bytes_downloaded < len(json.dumps(self._plans(100)))
+        assert response.json() == self._plans(100)
+
+    def test_small_or_unaccepted_response_not_compressed(self, auth_headers):
+        """Test that bodies under the threshold and clients without Accept-Encoding get identity"""
+        def handler(request):
+            count = 1 if request.url.path == "/plans/1" else 100
+            return TestStreamingProxy._streamed_json(200, self._plans(count))
+
+        with patch.object(upstream_client, "_client", httpx.AsyncClient(transport=httpx.MockTransport(handler))):
+            small = client.get("/api/plans/1", headers={**auth_headers, "Accept-Encoding": "gzip"})
+            unaccepted = client.get("/api/plans", headers={**auth_headers, "Accept-Encoding": "identity"})
+
+        assert "content-encoding" not in small.headers
+        assert "content-encoding" not in unaccepted.headers
+        assert unaccepted.json() == self._plans(100)
+
+    def test_passthrough_keeps_upstream_encoding(self, auth_headers):
+        """Test that streamed routes forward Accept-Encoding and never recompress upstream bodies"""
+        payload = gzip.compress(json.dumps(self._plans(100)).encode())
+        seen = []
+
+        def handler(request):
+            seen.append(request.headers["accept-encoding"])
+            return TestStreamingProxy._streamed(200, payload, {"content-type": "application/json", "content-encoding": "gzip"})
+
+        with patch.object(upstream_client, "_client", httpx.AsyncClient(transport=httpx.MockTransport(handler))):
+            compressed = client.get("/api/transactions-mongo", headers={**auth_headers, "Accept-Encoding": "gzip"})
+            with client.stream("GET", "/api/transactions-mongo", headers={**auth_headers, "Accept-Encoding": "gzip"}) as raw:
+                raw_body = b"".join(raw.iter_raw())
+
+        assert seen == ["gzip", "gzip"]
+        assert compressed.headers["content-encoding"] == "gzip"
+        assert compressed.json() == self._plans(100)
+        assert raw_body == payload
+
+    def test_streamed_response_compressed_per_chunk(self, auth_headers):
+        """Test that chunked upstream bodies are compressed as a stream without Content-Length"""
+        rows = [json.dumps({"amount": float(i), "description": "Groceries"}).encode() + b"\n" for i in range(200)]
+
+        async def body():
+            for i in range(0, len(rows), 50):
+                yield b"".join(rows[i:i + 50])
+
+        def handler(request):
+            return httpx.Response(200, headers={"content-type": "application/x-ndjson"}, content=body())
+
+        with patch.object(upstream_client, "_client", httpx.AsyncClient(transport=httpx.MockTransport(handler))):
+            response = client.get("/api/transactions-mongo/export", headers={**auth_headers, "Accept-Encoding": "gzip"})
+
+        assert response.headers["content-encoding"] == "gzip"
+        assert "content-length" not in response.headers
+        assert response.content == b"".join(rows)
+
+
+class TestCircuitBreaker:
+    """Test the per route group circuit breaker and last-known-good fallback"""
+
+    @pytest.fixture
+    def small_window(self, monkeypatch):
+        monkeypatch.setattr(settings, "circuit_breaker_window_size", 4)
+        monkeypatch.setattr(settings, "circuit_breaker_minimum_calls", 4)
+        monkeypatch.setattr(settings, "circuit_breaker_half_open_calls", 2)
+        monkeypatch.setattr(settings, "upstream_retry_attempts", 0)
+        monkeypatch.setattr(settings, "upstream_hedge_enabled", False)
+
+    @pytest.fixture
+    def auth_headers(self):
+        login_response = client.post("/auth/login", json={"username": "admin", "password": "secret"})
+        return {"Authorization": f"Bearer {login_response.json()['access_token']}"}
+
+    def test_failure_rate_opens_and_probes_close(self, small_window, monkeypatch):
+        """Test closed -> open -> half-open -> closed transitions"""
+        breaker = CircuitBreaker("/plans")
+        for ok in (True, False, True, False):
+            breaker.acquire()
+            breaker.record(0.01, ok)
+        assert breaker.state == CircuitBreaker.OPEN
+
+        with pytest.raises(CircuitOpen) as exc_info:
+            breaker.acquire()
+        assert exc_info.value.retry_after > 0
+
+        monkeypatch.setattr(settings, "circuit_breaker_open_seconds", 0)
+        breaker.acquire()
+        breaker.acquire()
+        assert breaker.state == CircuitBreaker.HALF_OPEN
+        with pytest.raises(CircuitOpen):
+            breaker.acquire()  # only two probes at a time
+
+        breaker.record(0.01, True)
+        breaker.record(0.01, True)
+        assert breaker.state == CircuitBreaker.CLOSED
+        assert breaker.stats()["rejected"] == 2
+
+    def test_slow_calls_open_and_failed_probe_reopens(self, small_window, monkeypatch):
+        """Test that slow successful calls open the circuit and a failed probe opens it again"""
+        monkeypatch.setattr(settings, "circuit_breaker_slow_call_duration_ms", 100)
+        breaker = CircuitBreaker("/plans")
+        for _ in range(4):
+            breaker.acquire()
+            breaker.record(0.2, True)
+        assert breaker.state == CircuitBreaker.OPEN
+
+        monkeypatch.setattr(settings, "circuit_breaker_open_seconds", 0)
+        breaker.acquire()
+        breaker.record(0.01, False)
+        assert breaker.state == CircuitBreaker.OPEN
+        assert breaker.opened == 2
+
+    def test_open_circuit_fails_fast_without_upstream(self, small_window, auth_headers):
+        """Test that an open circuit rejects requests of its group without calling upstream"""
+        calls = []
+
+        def handler(request):
+            calls.append(request.url.path)
+            if request.url.path.startswith("/plans"):
+                raise httpx.ConnectError("Connection refused")
+            return TestStreamingProxy._streamed_json(200, [])
+
+        with patch.object(upstream_client, "_client", httpx.AsyncClient(transport=httpx.MockTransport(handler))):
+            for _ in range(4):
+                assert client.get("/api/plans", headers=auth_headers).status_code == 503
+            calls.clear()
+
+            response = client.get("/api/plans/1", headers=auth_headers)
+            other_group = client.get("/api/transactions", headers=auth_headers)
+            health = client.get("/health").json()
+
+        assert response.status_code == 503
+        assert response.json() == {"detail": "Service unavailable (circuit open)"}
+        assert int(response.headers["retry-after"]) >= 1
+        assert calls == ["/transactions"]
+        assert other_group.status_code == 200
+        assert health["circuit_breakers"]["/plans"]["state"] == "open"
+        assert health["circuit_breakers"]["/transactions"]["state"] == "closed"
+
+    def test_last_known_good_fallback(self, small_window, auth_headers, monkeypatch):
+        """Test that GETs fall back to the last successful response while upstream fails"""
+        monkeypatch.setattr(settings, "circuit_breaker_fallback_enabled", True)
+        available = [True]
+
+        def handler(request):
+            if not available[0]:
+                return TestStreamingProxy._streamed_json(503, {"detail": "down"})
+            return TestStreamingProxy._streamed_json(200, [{"id": 1, "title": "Monthly Budget"}])
+
+        with patch.object(upstream_client, "_client", httpx.AsyncClient(transport=httpx.MockTransport(handler))):
+            assert client.get("/api/plans", headers=auth_headers).status_code == 200
+            available[0] = False
+            stale = client.get("/api/plans", headers=auth_headers)
+            missing = client.get("/api/plans/2", headers=auth_headers)
+
+        assert stale.status_code == 200
+        assert stale.json() == [{"id": 1, "title": "Monthly Budget"}]
+        assert stale.headers["warning"] == '110 - "Response is Stale"'
+        assert stale.headers["cache-control"] == "no-store"
+        assert missing.status_code == 503
+
+
+class TestMetrics:
+    """Test the Prometheus /metrics endpoint"""
+
+    @pytest.fixture
+    def auth_headers(self):
+        login_response = client.post("/auth/login", json={"username": "admin", "password": "secret"})
+        return {"Authorization": f"Bearer {login_response.json()['access_token']}"}
+
+    def test_route_template_labels_and_in_flight(self, auth_headers):
+        """Test that requests are labelled by route template and counted in flight while running"""
+        in_flight = []
+
+        def handler(request):
+            in_flight.append(http_requests_in_flight.labels("GET", "/api/plans/{plan_id}")._value.get())
+            return TestStreamingProxy._streamed_json(200, {"id": 4242, "title": "Plan"})
+
+        with patch.object(upstream_client, "_client", httpx.AsyncClient(transport=httpx.MockTransport(handler))):
+            assert client.get("/api/plans/4242", headers=auth_headers).status_code == 200
+
+        assert in_flight == [1]
+        assert http_requests_in_flight.labels("GET", "/api/plans/{plan_id}")._value.get() == 0
+
+        response = client.get("/metrics")
+        assert response.status_code == 200
+        assert response.headers["content-type"].startswith("text/plain")
+        body = response.text
+        assert 'http_requests_total{method="GET",route="/api/plans/{plan_id}",status="200"}' in body
+        assert 'http_request_duration_seconds_bucket{le="0.005",method="GET",route="/api/plans/{plan_id}"}' in body
+        assert "4242" not in body
+
+    def test_unknown_paths_share_one_label(self):
+        """Test that unmatched paths do not create a series per path"""
+        client.get("/no-such-route/1")
+        client.get("/no-such-route/2")
+        body = client.get("/metrics").text
+        assert 'route="unmatched",status="404"' in body
+        assert "no-such-route" not in body
+
+    def test_cache_and_pool_metrics(self, auth_headers):
+        """Test that cache hit ratios and upstream pool utilization are exported"""
+        client.get("/auth/me", headers=auth_headers)
+        client.get("/auth/me", headers=auth_headers)
+
+        transport = httpx.MockTransport(lambda request: httpx.Response(200, json=[]))
+        with patch.object(upstream_client, "_client", httpx.AsyncClient(transport=transport)):
+            body = client.get("/metrics").text
+        assert 'cache_requests_total{cache="token",result="hit"}' in body
+        assert 'cache_hit_ratio{cache="token"}' in body
+        assert 'cache_hit_ratio{cache="response"}' in body
+        assert 'connection_pool_connections{pool="planning-service",state="max"}' in body
+        assert 'connection_pool_utilization{pool="planning-service"}' in body
+
+    def test_store_operation_histogram(self):
+        """Test that store operations are timed including failed ones"""
+        with pytest.raises(RuntimeError):
+            with observe_store("redis", "test_failure"):
+                raise RuntimeError("connection lost")
+
+        count = registry.get_sample_value(
+            "store_operation_duration_seconds_count", {"store": "redis", "operation": "test_failure"}
+        )
+        assert count == 1
+
+    def test_metrics_disabled(self, monkeypatch):
+        """Test that requests are not counted when metrics are disabled"""
+        monkeypatch.setattr(settings, "metrics_enabled", False)
+        before = registry.get_sample_value(
+            "http_requests_total", {"method": "GET", "route": "/health", "status": "200"}
+        ) or 0
+        client.get("/health")
+        after = registry.get_sample_value(
+            "http_requests_total", {"method": "GET", "route": "/health", "status": "200"}
+        ) or 0
+        assert after == before
+
+
+class TestTracing:
+    """Test request ID and trace context propagation, spans and Server-Timing"""
+
+    TRACE_ID = "4bf92f3577b34da6a3ce929d0e0e4736"
+    TRACEPARENT = f"00-{TRACE_ID}-00f067aa0ba902b7-01"
+
+    @pytest.fixture
+    def auth_headers(self):
+        login_response = client.post("/auth/login", json={"username": "admin", "password": "secret"})
+        return {"Authorization": f"Bearer {login_response.json()['access_token']}"}
+
+    @staticmethod
+    def _upstream(seen):
+        def handler(request):
+            seen.append(request.headers)
+            return TestStreamingProxy._streamed(
+                200, b'{"id": 1, "title": "Plan"}',
+                {"content-type": "application/json", "Server-Timing": "postgres;dur=5.00, serialize;dur=1.00, total;dur=7.00"}
+            )
+        return httpx.AsyncClient(transport=httpx.MockTransport(handler))
+
+    def test_propagates_trace_context(self, auth_headers):
+        """Test that the request ID and traceparent reach planning service and Server-Timing merges its phases"""
+        seen = []
+        with patch.object(upstream_client, "_client", self._upstream(seen)):
+            response = client.get(
+                "/api/plans/1",
+                headers={**auth_headers, "traceparent": self.TRACEPARENT, "X-Request-ID": "req-42"}
+            )
+
+        assert response.status_code == 200
+        assert response.headers["x-request-id"] == "req-42"
+        trace_id, parent_id, sampled = parse_traceparent(seen[0]["traceparent"])
+        assert trace_id == self.TRACE_ID
+        assert parent_id != "00f067aa0ba902b7"
+        assert sampled
+        assert seen[0]["x-request-id"] == "req-42"
+
+        server_timing = response.headers["server-timing"]
+        for phase in ("auth;dur=", "upstream;dur=", "planning-postgres;dur=5.00", "planning-total;dur=7.00", "total;dur="):
+            assert phase in server_timing
+
+    def test_new_trace_without_incoming_headers(self, auth_headers):
+        """Test that a request ID and trace are created when the client sends none"""
+        seen = []
+        with patch.object(upstream_client, "_client", self._upstream(seen)):
+            response = client.get("/api/plans/1", headers={**auth_headers, "X-Request-ID": "bad id with spaces"})
+
+        request_id = response.headers["x-request-id"]
+        assert len(request_id) == 32 and request_id != "bad id with spaces"
+        assert seen[0]["x-request-id"] == request_id
+        assert parse_traceparent(seen[0]["traceparent"]) is not None
+
+    def test_invalid_traceparent(self):
+        """Test that malformed and all-zero trace contexts are rejected"""
+        assert parse_traceparent("00-abc-def-01") is None
+        assert parse_traceparent(f"00-{'0' * 32}-00f067aa0ba902b7-01") is None
+        assert parse_traceparent(f"00-{self.TRACE_ID}-00f067aa0ba902b7-00") == (self.TRACE_ID, "00f067aa0ba902b7", False)
+
+    def test_spans_exported_as_otlp_json(self, auth_headers, tmp_path, monkeypatch):
+        """Test that server, proxy and upstream attempt spans are exported as one trace"""
+        monkeypatch.setattr(settings, "tracing_exporter", "file")
+        monkeypatch.setattr(settings, "tracing_file_path", str(tmp_path / "traces.jsonl"))
+        with patch.object(upstream_client, "_client", self._upstream([])):
+            client.get("/api/plans/1", headers={**auth_headers, "traceparent": self.TRACEPARENT})
+        asyncio.run(span_exporter.flush())
+
+        [line] = (tmp_path / "traces.jsonl").read_text().splitlines()
+        [resource] = json.loads(line)["resourceSpans"]
+        assert resource["resource"]["attributes"][0]["value"]["stringValue"] == "api-gateway"
+        spans = {span["name"]: span for span in resource["scopeSpans"][0]["spans"]}
+        server, proxy, attempt = spans["GET /api/plans/{plan_id}"], spans["proxy_request"], spans["HTTP GET"]
+        assert {server["traceId"], proxy["traceId"], attempt["traceId"]} == {self.TRACE_ID}
+        assert server["parentSpanId"] == "00f067aa0ba902b7"
+        assert proxy["parentSpanId"] == server["spanId"]
+        assert attempt["parentSpanId"] == proxy["spanId"]
+        assert attempt["kind"] == 3
+
+    def test_stream_proxy_replaces_upstream_server_timing(self, auth_headers):
+        """Test that the streamed route returns one Server-Timing header built by the gateway"""
+        def handler(request):
+            return TestStreamingProxy._streamed(200, b"[]", {"Server-Timing": "mongodb;dur=3.00, total;dur=4.00"})
+
+        with patch.object(upstream_client, "_client", httpx.AsyncClient(transport=httpx.MockTransport(handler))):
+            response = client.get("/api/transactions-mongo", headers=auth_headers)
+
+        assert len(response.headers.get_list("server-timing")) == 1
+        assert "planning-mongodb;dur=3.00" in response.headers["server-timing"]
+
+
+class TestProfiling:
+    """Test on-demand and sampled request profiling"""
+
+    @pytest.fixture
+    def auth_headers(self):
+        login_response = client.post("/auth/login", json={"username": "admin", "password": "secret"})
+        return {"Authorization": f"Bearer {login_response.json()['access_token']}"}
+
+    @pytest.fixture(autouse=True)
+    def reset_profiles(self):
+        profile_store.reset()
+        yield
+        profile_store.reset()
+
+    @staticmethod
+    def _upstream(seen):
+        def handler(request):
+            seen.append(request)
+            return TestStreamingProxy._streamed_json(200, {"id": 1, "title": "Plan"})
+        return httpx.AsyncClient(transport=httpx.MockTransport(handler))
+
+    def test_profile_replaces_response(self, auth_headers):
+        """Test that X-Profile: text returns the profile and the flag does not reach planning service"""
+        seen = []
+        with patch.object(upstream_client, "_client", self._upstream(seen)):
+            response = client.get("/api/plans/1", headers={**auth_headers, "X-Profile": "text"})
+
+        assert response.status_code == 200
+        assert response.headers["content-type"].startswith("text/plain")
+        assert response.headers["x-profile-status"] == "200"
+        assert float(response.headers["x-profile-duration-ms"]) > 0
+        assert "x-profile" not in seen[0].headers
+
+    def test_stored_profile_by_query_flag(self, auth_headers):
+        """Test that ?profile=store keeps the response and stores a profile retrievable by id"""
+        seen = []
+        with patch.object(upstream_client, "_client", self._upstream(seen)):
+            response = client.get("/api/plans/1?profile=store", headers=auth_headers)
+
+        assert response.json() == {"id": 1, "title": "Plan"}
+        assert "profile" not in seen[0].url.params
+        profile_id = response.headers["x-profile-id"]
+
+        listing = client.get("/admin/profiles", headers=auth_headers).json()
+        assert listing["stored"][0]["id"] == profile_id
+        assert listing["stored"][0]["route"] == "/api/plans/{plan_id}"
+        text = client.get(f"/admin/profiles/{profile_id}", params={"format": "text"}, headers=auth_headers)
+        assert text.status_code == 200
+        assert client.get("/admin/profiles/unknown", headers=auth_headers).status_code == 404
+
+    def test_profiling_requires_admin(self, auth_headers):
+        """Test that non-admins get 403 for the profiling flag and the admin endpoints"""
+        assert client.get("/api/plans/1", headers={"X-Profile": "text"}).status_code == 403
+
+        user = UserResponse(id=2, username="user", is_admin=False)
+        with patch("api_gateway.profiling.authenticate_token", return_value=user), \
+                patch("api_gateway.dependencies.authenticate_token", return_value=user):
+            assert client.get("/api/plans/1", headers={**auth_headers, "X-Profile": "1"}).status_code == 403
+            assert client.get("/admin/profiles", headers=auth_headers).status_code == 403
+
+    def test_sampled_requests_aggregated_per_route(self, auth_headers, monkeypatch):
+        """Test that every N-th request is profiled into the aggregate of its route"""
+        monkeypatch.setattr(settings, "profiling_sample_rate", 2)
+        monkeypatch.setattr(settings, "profiling_profiler", "cprofile")
+        with patch.object(upstream_client, "_client", self._upstream([])):
+            for plan_id in range(1, 5):
+                client.get(f"/api/plans/{plan_id}", headers=auth_headers)
+
+        routes = {route["route"]: route for route in client.get("/admin/profiles", headers=auth_headers).json()["routes"]}
+        assert routes["/api/plans/{plan_id}"]["samples"] == 2
+        aggregate = client.get("/admin/profiles/aggregate", params={"route": "/api/plans/{plan_id}"}, headers=auth_headers)
+        assert aggregate.headers["x-profile-format"] == "pstats"
+        assert "proxy_request" in aggregate.text
+
+        assert client.delete("/admin/profiles", headers=auth_headers).status_code == 204
+        assert profile_store.routes == {}
+
+    @pytest.mark.skipif(PyinstrumentProfiler is None, reason="pyinstrument is not installed")
+    def test_folded_stacks(self, monkeypatch):
+        """Test that pyinstrument samples are aggregated as folded stacks"""
+        monkeypatch.setattr(settings, "profiling_interval", 0.0005)
+
+        def busy():
+            deadline = time.perf_counter() + 0.02
+            while time.perf_counter() < deadline:
+                pass
+
+        run = _PyinstrumentRun(settings)
+        run.start()
+        busy()
+        run.stop()
+        profile = RouteProfile(settings)
+        profile.add(run, 20.0)
+        profile.add(run, 20.0)
+
+        body, profile_format = profile.render()
+        assert profile_format == "folded"
+        stacks = dict(line.rsplit(" ", 1) for line in body.splitlines())
+        busy_micros = sum(int(micros) for stack, micros in stacks.items() if ";busy (" in stack)
+        assert busy_micros >= 30000
+
+
 class TestHealthCheck:
     """Test health check endpoint"""
 
@@ -0,0 +1,72 @@
+import asyncio
+import sys
+from pathlib import Path
+
+import pytest
+
+pytest.importorskip("fakeredis")
+pytest.importorskip("mongomock")
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "performance_tests" / "loadgen"))
+
+from hermetic import GATEWAY_URL, PLANNING_URL, HermeticEnvironment  # noqa: E402
+from api_gateway.config import settings as gateway_settings  # noqa: E402
+from planning_service.config import settings as planning_settings  # noqa: E402
+from planning_service.database.mongodb import mongodb  # noqa: E402
+from planning_service.database.redis import redis_manager  # noqa: E402
+
+
+class TestHermeticEnvironment:
+    """Both services in one process over ASGI with in-memory stores"""
+
+    def test_gateway_to_planning_with_in_memory_stores(self):
+        """Test a login, plan, PostgreSQL and MongoDB transaction flow without external servers"""
+        planning_url = gateway_settings.planning_service_url
+        redis_url = planning_settings.redis_url
+
+        async def scenario():
+            async with HermeticEnvironment() as environment:
+                assert environment.describe() == {"postgres": "in-memory", "mongodb": "mongomock", "redis": "fakeredis"}
+                assert mongodb.is_connected() and redis_manager.is_connected()
+                async with environment.client() as client:
+                    login = await client.post(f"{GATEWAY_URL}/auth/login", json={"username": "admin", "password": "secret"})
+                    headers = {"Authorization": f"Bearer {login.json()['access_token']}"}
+
+                    plan = await client.post(
+                        f"{GATEWAY_URL}/api/plans",
+                        json={"title": "Hermetic", "planned_income": 1000.0, "planned_expenses": 500.0},
+                        headers=headers
+                    )
+                    assert plan.status_code == 200
+                    plan_id = plan.json()["id"]
+
+                    transaction = await client.post(
+                        f"{GATEWAY_URL}/api/transactions",
+                        json={"plan_id": plan_id, "type": "income", "amount": 300.0, "category": "Salary"},
+                        headers=headers
+                    )
+                    assert transaction.status_code == 200
+                    mongo_transaction = await client.post(
+                        f"{GATEWAY_URL}/api/transactions-mongo",
+                        json={"plan_id": plan_id, "type": "expense", "amount": 40.0, "category": "Food", "user_id": "admin"},
+                        headers=headers
+                    )
+                    assert mongo_transaction.status_code == 200
+
+                    analytics = await client.get(f"{GATEWAY_URL}/api/plans/{plan_id}/analytics", headers=headers)
+                    assert analytics.json()["total_income"] == 300.0
+                    mongo_analytics = await client.get(
+                        f"{GATEWAY_URL}/api/transactions-mongo/plan/{plan_id}/analytics", headers=headers
+                    )
+                    assert mongo_analytics.json()["total_expenses"] == 40.0
+
+                    health = (await client.get(f"{PLANNING_URL}/health")).json()
+                    assert health["database_mode"] == "in-memory"
+                    assert health["redis_status"] == "connected"
+
+        asyncio.run(scenario())
+
+        # Service settings are restored when the environment exits
+        assert gateway_settings.planning_service_url == planning_url
+        assert planning_settings.redis_url == redis_url
+        assert not redis_manager.is_connected()
@@ -9,9 +9,30 @@ from planning_service.models.mongodb_models import (
     TransactionCreateMongo, 
     TransactionUpdateMongo,
     TransactionFilter,
-    TransactionType
+    TransactionType,
+    ExportFormat
 )
-from planning_service.services.transaction_mongo_service import transaction_mongo_service
+from planning_service.services.transaction_mongo_service import (
+    transaction_mongo_service,
+    encode_cursor,
+    decode_cursor,
+    seek_filter,
+    build_projection,
+    export_columns
+)
+from planning_service.models.mongodb_models import dump_transactions_json, dump_transactions_ndjson
+from planning_service.services.rollup_service import rollup_key
+from planning_service.services.cache_service import cache_service
+from planning_service.database.mongo_indexes import (
+    DECLARED_INDEXES,
+    apply_indexes,
+    build_report,
+    find_redundant,
+    is_prefix
+)
+from unittest.mock import AsyncMock, patch
+import json
+from bson import ObjectId
 
 
 @pytest_asyncio.fixture(scope="module")
@@ -38,13 +59,15 @@ async def setup_mongodb():
             os.environ.pop('MONGODB_URL', None)
         pytest.skip("MongoDB not available for tests")
     
-    # Очищаем коллекцию перед тестами
+    # Очищаем коллекции перед тестами
     mongodb.transactions_collection.delete_many({})
+    mongodb.rollups_collection.delete_many({})
     
     yield mongodb
     
     # Очищаем после тестов
     mongodb.transactions_collection.delete_many({})
+    mongodb.rollups_collection.delete_many({})
     mongodb.disconnect()
     
     # Восстанавливаем исходную настройку
@@ -252,6 +275,146 @@ class TestTransactionFiltering:
         assert food_transactions[0].category == "food"
 
 
+class TestCursorPagination:
+    """Тесты seek-пагинации по (created_at, _id)"""
+    
+    def test_cursor_roundtrip(self):
+        """Тест кодирования и декодирования токена продолжения"""
+        created_at = datetime(2024, 1, 15, 14, 30, 0, 123000)
+        object_id = ObjectId("507f1f77bcf86cd799439011")
+        
+        token = encode_cursor(created_at, object_id)
+        
+        assert "=" not in token
+        assert decode_cursor(token) == (created_at, object_id)
+    
+    @pytest.mark.parametrize("token", ["", "not-a-cursor", "eyJjIjoxfQ"])
+    def test_invalid_cursor(self, token):
+        """Тест отказа на некорректном токене"""
+        with pytest.raises(ValueError):
+            decode_cursor(token)
+    
+    def test_seek_filter(self):
+        """Тест условия продолжения после позиции курсора"""
+        created_at = datetime(2024, 1, 15)
+        object_id = ObjectId("507f1f77bcf86cd799439011")
+        
+        assert seek_filter(created_at, object_id) == {
+            "$or": [
+                {"created_at": {"$lt": created_at}},
+                {"created_at": created_at, "_id": {"$lt": object_id}}
+            ]
+        }
+    
+    @pytest.mark.asyncio
+    async def test_pages_cover_all_transactions(self, setup_mongodb):
+        """Тест обхода всех транзакций страницами без пропусков и повторов"""
+        mongodb.transactions_collection.delete_many({"user_id": "cursor_user"})
+        
+        for i in range(5):
+            await transaction_mongo_service.create_transaction(TransactionCreateMongo(
+                plan_id=30, type=TransactionType.expense, amount=10.0 + i,
+                description=f"Page item {i}", category="test", user_id="cursor_user"
+            ))
+        
+        seen = []
+        cursor = None
+        while True:
+            page, cursor = await transaction_mongo_service.get_transactions_page(
+                "cursor_user", limit=2, cursor=cursor
+            )
+            assert len(page) <= 2
+            seen.extend(t.id for t in page)
+            if cursor is None:
+                break
+        
+        assert len(seen) == 5
+        assert len(set(seen)) == 5
+
+
+class TestLeanResponses:
+    """Тесты проекции полей и облегченной сериализации"""
+    
+    def test_build_projection(self):
+        """Тест преобразования fields в проекцию MongoDB"""
+        assert build_projection(None) is None
+        assert build_projection("amount, category") == {"amount": 1, "category": 1, "_id": 0}
+        assert build_projection("id,amount") == {"_id": 1, "amount": 1}
+    
+    def test_build_projection_unknown_field(self):
+        """Тест отказа на неизвестном поле"""
+        with pytest.raises(ValueError):
+            build_projection("amount,password")
+    
+    def test_lean_json_matches_validated_model(self):
+        """Тест совпадения облегченной сериализации с полной"""
+        doc = {
+            "_id": ObjectId("507f1f77bcf86cd799439011"),
+            "plan_id": 1,
+            "type": "expense",
+            "amount": 200.0,
+            "description": "Lean",
+            "category": "test",
+            "user_id": "test_user",
+            "created_at": datetime(2024, 1, 15, 14, 30)
+        }
+        
+        expected = TransactionMongo.from_mongo(dict(doc)).model_dump(mode="json", by_alias=True)
+        
+        assert json.loads(dump_transactions_json([dict(doc)])) == [expected]
+    
+    def test_lean_json_partial_documents(self):
+        """Тест сериализации документов после проекции"""
+        content = dump_transactions_json([{"amount": 10.0, "category": "food"}])
+        
+        assert json.loads(content) == [{"amount": 10.0, "category": "food"}]
+    
+    def test_lean_ndjson_matches_lean_json(self):
+        """Тест совпадения строк NDJSON выгрузки с облегченным JSON"""
+        docs = [
+            {"_id": ObjectId(), "amount": 10.0, "created_at": datetime(2024, 1, 15, 14, 30)},
+            {"_id": ObjectId(), "amount": 20.0, "category": "food"}
+        ]
+        
+        lines = dump_transactions_ndjson([dict(doc) for doc in docs]).decode().splitlines()
+        
+        assert [json.loads(line) for line in lines] == json.loads(dump_transactions_json([dict(doc) for doc in docs]))
+
+
+class TestTransactionExport:
+    """Тесты потоковой выгрузки транзакций"""
+    
+    def test_export_columns(self):
+        """Тест порядка колонок выгрузки"""
+        assert export_columns(None)[0] == "id"
+        assert export_columns("amount, id") == ["amount", "id"]
+    
+    @pytest.mark.asyncio
+    async def test_export_ndjson_and_csv(self, setup_mongodb):
+        """Тест выгрузки в NDJSON и CSV с фильтром по плану"""
+        mongodb.transactions_collection.delete_many({"user_id": "export_user"})
+        
+        for plan_id in (40, 40, 41):
+            await transaction_mongo_service.create_transaction(TransactionCreateMongo(
+                plan_id=plan_id, type=TransactionType.income, amount=100.0,
+                description="Export", category="salary", user_id="export_user"
+            ))
+        
+        ndjson = b"".join(transaction_mongo_service.export_transactions(
+            "export_user", TransactionFilter(plan_id=40)
+        ))
+        lines = ndjson.decode().splitlines()
+        assert len(lines) == 2
+        assert all(json.loads(line)["plan_id"] == 40 for line in lines)
+        
+        csv_content = b"".join(transaction_mongo_service.export_transactions(
+            "export_user", export_format=ExportFormat.csv, fields="plan_id,amount"
+        ))
+        rows = csv_content.decode().splitlines()
+        assert rows[0] == "plan_id,amount"
+        assert len(rows) == 4
+
+
 class TestTransactionAnalytics:
     """Тесты аналитики транзакций"""
     
@@ -332,6 +495,278 @@ class TestTransactionAnalytics:
         assert analytics["transaction_count"] == 4
 
 
+class TestTransactionRollups:
+    """Тесты дневных агрегатов транзакций"""
+    
+    def test_rollup_key(self):
+        """Тест ключа дневного агрегата"""
+        doc = {
+            "user_id": "u", "plan_id": 1, "type": "expense", "category": "food",
+            "amount": 10.0, "created_at": datetime(2024, 1, 15, 23, 59)
+        }
+        
+        assert rollup_key(doc) == {
+            "user_id": "u", "plan_id": 1, "day": "2024-01-15", "type": "expense", "category": "food"
+        }
+    
+    @pytest.mark.asyncio
+    async def test_rollups_follow_updates_and_deletes(self, setup_mongodb):
+        """Тест согласованности агрегатов при изменении и удалении транзакций"""
+        mongodb.transactions_collection.delete_many({"user_id": "rollup_user"})
+        mongodb.rollups_collection.delete_many({"user_id": "rollup_user"})
+        
+        income = await transaction_mongo_service.create_transaction(TransactionCreateMongo(
+            plan_id=50, type=TransactionType.income, amount=1000.0,
+            description="Salary", category="salary", user_id="rollup_user"
+        ))
+        expense = await transaction_mongo_service.create_transaction(TransactionCreateMongo(
+            plan_id=50, type=TransactionType.expense, amount=200.0,
+            description="Food", category="food", user_id="rollup_user"
+        ))
+        
+        await transaction_mongo_service.update_transaction(
+            expense.id, "rollup_user", TransactionUpdateMongo(amount=300.0, category="housing")
+        )
+        await transaction_mongo_service.delete_transaction(income.id, "rollup_user")
+        
+        analytics = await transaction_mongo_service.get_plan_analytics(50, "rollup_user")
+        assert analytics["total_income"] == 0.0
+        assert analytics["total_expenses"] == 300.0
+        assert analytics["transaction_count"] == 1
+        
+        categories = await transaction_mongo_service.get_category_analytics("rollup_user")
+        assert [c["category"] for c in categories] == ["housing"]
+        
+        monthly = await transaction_mongo_service.get_monthly_analytics("rollup_user", plan_id=50)
+        assert len(monthly) == 1
+        assert monthly[0]["balance"] == -300.0
+    
+    @pytest.mark.asyncio
+    async def test_rebuild_rollups(self, setup_mongodb):
+        """Тест перестроения агрегатов по сырым транзакциям"""
+        mongodb.transactions_collection.delete_many({"user_id": "rebuild_user"})
+        mongodb.rollups_collection.delete_many({"user_id": "rebuild_user"})
+        
+        mongodb.transactions_collection.insert_many([
+            {"plan_id": 60, "type": "income", "amount": 100.0, "category": "salary",
+             "user_id": "rebuild_user", "created_at": datetime(2024, 1, 1, 10)},
+            {"plan_id": 60, "type": "income", "amount": 50.0, "category": "salary",
+             "user_id": "rebuild_user", "created_at": datetime(2024, 1, 1, 12)},
+            {"plan_id": 60, "type": "expense", "amount": 30.0, "category": "food",
+             "user_id": "rebuild_user", "created_at": datetime(2024, 2, 3, 9)}
+        ])
+        
+        count = await transaction_mongo_service.rebuild_rollups("rebuild_user")
+        assert count == 2
+        
+        analytics = await transaction_mongo_service.get_user_analytics("rebuild_user")
+        assert analytics["total_income"] == 150.0
+        assert analytics["total_expenses"] == 30.0
+        assert analytics["transaction_count"] == 3
+        
+        monthly = await transaction_mongo_service.get_monthly_analytics("rebuild_user")
+        assert [m["month"] for m in monthly] == ["2024-01", "2024-02"]
+    
+    @pytest.mark.asyncio
+    async def test_rebuild_replaces_stale_rollups(self, setup_mongodb):
+        """Тест удаления устаревших агрегатов пользователя и инвалидации кеша при перестроении"""
+        mongodb.transactions_collection.delete_many({"user_id": {"$in": ["stale_user", "other_user"]}})
+        mongodb.rollups_collection.delete_many({"user_id": {"$in": ["stale_user", "other_user"]}})
+        
+        mongodb.transactions_collection.insert_one(
+            {"plan_id": 61, "type": "expense", "amount": 40.0, "category": "food",
+             "user_id": "stale_user", "created_at": datetime(2024, 3, 1, 9)}
+        )
+        mongodb.rollups_collection.insert_many([
+            {"user_id": "stale_user", "plan_id": 61, "day": "2024-03-01", "type": "expense",
+             "category": "food", "total_amount": 999.0, "count": 7},
+            {"user_id": "stale_user", "plan_id": 61, "day": "2023-12-31", "type": "income",
+             "category": "salary", "total_amount": 10.0, "count": 1},
+            {"user_id": "other_user", "plan_id": 62, "day": "2024-03-01", "type": "income",
+             "category": "salary", "total_amount": 5.0, "count": 1}
+        ])
+        
+        with patch.object(cache_service, "invalidate_rollups", AsyncMock(return_value=True)) as invalidate:
+            count = await transaction_mongo_service.rebuild_rollups("stale_user")
+        
+        assert count == 1
+        invalidate.assert_awaited_once_with("stale_user")
+        rollups = list(mongodb.rollups_collection.find({"user_id": "stale_user"}))
+        assert [(r["day"], r["total_amount"], r["count"]) for r in rollups] == [("2024-03-01", 40.0, 1)]
+        assert mongodb.rollups_collection.count_documents({"user_id": "other_user"}) == 1
+
+
+class TestPlanDashboard:
+    """Тесты дашборда плана ($facet)"""
+    
+    def test_dashboard_cache_key(self):
+        """Тест ключа кеша дашборда"""
+        assert cache_service.make_plan_dashboard_key("admin", 1, 10, 5) == "mongo:dashboard:admin:1:10:5"
+    
+    @pytest.mark.asyncio
+    async def test_plan_dashboard(self, setup_mongodb):
+        """Тест построения дашборда одним запросом"""
+        mongodb.transactions_collection.delete_many({"user_id": "dashboard_user"})
+        
+        for amount, tx_type, category in [(1000.0, "income", "salary"), (300.0, "expense", "food"), (50.0, "expense", "fun")]:
+            await transaction_mongo_service.create_transaction(TransactionCreateMongo(
+                plan_id=70, type=tx_type, amount=amount,
+                description="Dashboard", category=category, user_id="dashboard_user"
+            ))
+        
+        dashboard = await transaction_mongo_service.get_plan_dashboard(70, "dashboard_user", latest=2, top=2)
+        
+        assert dashboard["totals"]["balance"] == 650.0
+        assert dashboard["totals"]["transaction_count"] == 3
+        assert [c["category"] for c in dashboard["top_categories"]] == ["salary", "food"]
+        assert len(dashboard["monthly"]) == 1
+        assert len(dashboard["latest_transactions"]) == 2
+        assert dashboard["latest_transactions"][0]["amount"] == 50.0
+    
+    @pytest.mark.asyncio
+    async def test_writes_invalidate_plan_cache(self, setup_mongodb):
+        """Тест инвалидации кеша плана при записи транзакций плана"""
+        with patch.object(cache_service, "invalidate_transactions", new=AsyncMock()) as mock_invalidate:
+            created = await transaction_mongo_service.create_transaction(TransactionCreateMongo(
+                plan_id=71, type=TransactionType.expense, amount=10.0,
+                description="Invalidate", category="test", user_id="dashboard_user"
+            ))
+            await transaction_mongo_service.update_transaction(
+                created.id, "dashboard_user", TransactionUpdateMongo(amount=20.0)
+            )
+            await transaction_mongo_service.delete_transaction(created.id, "dashboard_user")
+        
+        assert [call.args for call in mock_invalidate.await_args_list] == [
+            ("dashboard_user", 71),
+            ("dashboard_user", 71),
+            ("dashboard_user", 71)
+        ]
+
+
+class TestTransactionQueryCache:
+    """Тесты кеширования выборок и аналитики транзакций MongoDB"""
+    
+    def test_query_key_is_normalized(self):
+        """Тест: ключ не зависит от порядка и пустых фильтров, но зависит от параметров страницы"""
+        key = cache_service.make_transactions_query_key("admin", {"plan_id": 1, "category": "food"}, limit=100)
+        
+        assert key.startswith("mongo:transactions:admin:")
+        assert key == cache_service.make_transactions_query_key(
+            "admin", {"category": "food", "type": None, "plan_id": 1}, limit=100
+        )
+        assert key != cache_service.make_transactions_query_key("admin", {"plan_id": 1, "category": "food"}, limit=50)
+        assert key != cache_service.make_transactions_query_key("other", {"plan_id": 1, "category": "food"}, limit=100)
+    
+    def test_query_tags(self):
+        """Тест: выборка по плану помечается тегом плана, остальные - тегом пользователя"""
+        assert transaction_mongo_service._query_cache_tags("admin", TransactionFilter(plan_id=3)) == ["mongo:tag:plan:admin:3"]
+        assert transaction_mongo_service._query_cache_tags("admin", TransactionFilter(category="food")) == ["mongo:tag:user:admin"]
+        assert transaction_mongo_service._query_cache_tags("admin", None) == ["mongo:tag:user:admin"]
+    
+    @pytest.mark.asyncio
+    async def test_invalidate_transactions_tags(self):
+        """Тест: запись в план сбрасывает записи по всем планам и записи этого плана"""
+        with patch.object(cache_service, "invalidate_tags", new=AsyncMock(return_value=True)) as mock_invalidate:
+            await cache_service.invalidate_transactions("admin", 1, 1)
+        
+        mock_invalidate.assert_awaited_once_with("mongo:tag:user:admin", "mongo:tag:plan:admin:1")
+    
+    @pytest.mark.asyncio
+    async def test_cached_page_and_analytics(self, setup_mongodb):
+        """Тест: повторная выборка и аналитика берутся из кеша с тегами"""
+        store = {}
+        
+        async def fake_get(key):
+            return store.get(key)
+        
+        async def fake_set_with_tags(key, value, tags, ttl=None, generations=None):
+            store[key] = json.loads(json.dumps(value, default=str))
+            return True
+        
+        await transaction_mongo_service.create_transaction(TransactionCreateMongo(
+            plan_id=80, type=TransactionType.income, amount=500.0,
+            description="Cached", category="salary", user_id="cache_user"
+        ))
+        filters = TransactionFilter(plan_id=80)
+        
+        with patch.object(cache_service, "enabled", True), \
+             patch("planning_service.services.cache_service.redis_manager") as mock_redis:
+            mock_redis.get.side_effect = fake_get
+            mock_redis.set_with_tags.side_effect = fake_set_with_tags
+            mock_redis.get_generations = AsyncMock(return_value=["0"])
+            
+            first, _ = await transaction_mongo_service.get_transactions_page("cache_user", filters, limit=10)
+            analytics = await transaction_mongo_service.get_user_analytics("cache_user")
+            
+            with patch.object(transaction_mongo_service, "_find_page", side_effect=AssertionError("MongoDB queried")), \
+                 patch.object(transaction_mongo_service, "_totals_by_type", side_effect=AssertionError("MongoDB queried")):
+                second, _ = await transaction_mongo_service.get_transactions_page("cache_user", filters, limit=10)
+                cached_analytics = await transaction_mongo_service.get_user_analytics("cache_user")
+        
+        assert second == first
+        assert cached_analytics == analytics
+        assert analytics["total_income"] == 500.0
+        tags = [call.args[2] for call in mock_redis.set_with_tags.call_args_list]
+        assert tags == [["mongo:tag:plan:cache_user:80"], ["mongo:tag:user:cache_user"]]
+
+
+class TestIndexManagement:
+    """Тесты управления индексами MongoDB"""
+    
+    def test_is_prefix(self):
+        """Тест проверки префикса ключа индекса"""
+        assert is_prefix([("user_id", 1)], [("user_id", 1), ("created_at", -1)])
+        assert not is_prefix([("user_id", -1)], [("user_id", 1), ("created_at", -1)])
+        assert not is_prefix([("user_id", 1)], [("user_id", 1)])
+    
+    def test_find_redundant(self):
+        """Тест поиска избыточных индексов"""
+        indexes = {
+            "_id_": {"key": [("_id", 1)]},
+            "user_id_1": {"key": [("user_id", 1)]},
+            "type_1": {"key": [("type", 1)]},
+            "user_id_1_created_at_-1": {"key": [("user_id", 1), ("created_at", -1)]},
+            "user_id_unique": {"key": [("user_id", 1)], "unique": True}
+        }
+        
+        assert find_redundant(indexes) == {"user_id_1": "user_id_1_created_at_-1"}
+    
+    def test_declared_indexes_follow_esr(self):
+        """Тест: объявленные индексы транзакций начинаются с равенства по user_id и заканчиваются сортировкой"""
+        for model in DECLARED_INDEXES["transactions"]:
+            key = list(model.document["key"].items())
+            assert key[0] == ("user_id", 1)
+            assert key[-2:] == [("created_at", -1), ("_id", -1)]
+    
+    def test_apply_is_idempotent(self, setup_mongodb):
+        """Тест идемпотентного применения объявленного набора индексов"""
+        collection = mongodb.database["test_index_management"]
+        collection.drop()
+        collection.create_index([("user_id", 1)])
+        collection.create_index([("amount", 1)])
+        declared = DECLARED_INDEXES["transactions"]
+        
+        report = build_report(collection, declared)
+        assert len(report["missing"]) == len(declared)
+        assert report["undeclared"] == ["amount_1", "user_id_1"]
+        
+        # Без drop лишние индексы остаются; user_id_1 становится префиксом объявленного
+        created = apply_indexes(collection, declared)
+        assert len(created["created"]) == len(declared)
+        assert created["dropped"] == []
+        assert "user_id_1" in build_report(collection, declared)["redundant"]
+        
+        dropped = apply_indexes(collection, declared, drop=True)
+        repeated = apply_indexes(collection, declared, drop=True)
+        
+        assert dropped["created"] == []
+        assert dropped["dropped"] == ["amount_1", "user_id_1"]
+        assert repeated == {"collection": collection.name, "created": [], "recreated": [], "dropped": []}
+        assert set(collection.index_information()) == {"_id_"} | {m.document["name"] for m in declared}
+        
+        collection.drop()
+
+
 class TestMongoDBModels:
     """Тесты MongoDB моделей"""
     
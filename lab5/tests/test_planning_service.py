@@ -1,10 +1,19 @@
 import pytest
 import asyncio
+import time
 from fastapi.testclient import TestClient
 from unittest.mock import patch, AsyncMock
 from datetime import datetime
 
+from types import SimpleNamespace
+
 from planning_service.main import app
+from planning_service.metrics import event_loop_monitor, registry
+from planning_service.database.mongodb import MongoCommandMetrics
+from planning_service.services.cache_service import cache_service
+from planning_service.tracing import RequestTrace, _current_trace, span_exporter
+from planning_service.profiling import profile_store
+import json
 from planning_service.models.pydantic_models import (
     BudgetPlanCreate, BudgetPlanUpdate, TransactionCreate, TransactionType
 )
@@ -414,6 +423,23 @@ class TestAnalyticsEndpoints:
         response = client.get("/plans/invalid/analytics", headers={"X-User": "testuser"})
         assert response.status_code == 422
 
+    def test_summarize_plan(self):
+        """Test plan totals and percentages computed from transactions"""
+        from planning_service.services.analytics_service import summarize_plan
+
+        plan = {"planned_income": 4000.0, "planned_expenses": 0.0}
+        transactions = [
+            {"type": "income", "amount": 2500.0},
+            {"type": "income", "amount": 500.0},
+            {"type": "expense", "amount": 1200.0}
+        ]
+        analytics = summarize_plan(1, plan, transactions)
+        assert analytics.total_income == 3000.0
+        assert analytics.total_expenses == 1200.0
+        assert analytics.balance == 1800.0
+        assert analytics.income_vs_planned == 75.0
+        assert analytics.expenses_vs_planned == 0
+
 
 class TestAuthenticationAndAuthorization:
     """Test authentication and authorization"""
@@ -522,6 +548,335 @@ class TestHealthCheck:
         assert data["status"] == "healthy"
         assert data["service"] == "planning-service"
 
+    def test_liveness_check(self):
+        """Test liveness endpoint used by the gateway health checks"""
+        with patch("planning_service.main.mongodb.is_connected") as is_connected:
+            response = client.get("/health/live")
+        assert response.status_code == 200
+        assert response.json() == {"status": "ok"}
+        is_connected.assert_not_called()
+
+
+class TestCompression:
+    """Test negotiated compression of large responses"""
+
+    @staticmethod
+    def _plans(count):
+        return [
+            {
+                "id": i,
+                "title": f"Plan {i}",
+                "description": "Monthly budget",
+                "planned_income": 5000.0,
+                "planned_expenses": 3000.0,
+                "user_id": "testuser",
+                "created_at": datetime(2024, 1, 1),
+                "updated_at": datetime(2024, 1, 1)
+            }
+            for i in range(count)
+        ]
+
+    def test_large_list_compressed(self):
+        """Test that a 100-item list is gzip-encoded when the client accepts gzip"""
+        with patch('planning_service.services.plans_service.get_plans') as mock_get:
+            mock_get.return_value = self._plans(100)
+            response = client.get("/plans", headers={"X-User": "testuser", "Accept-Encoding": "gzip"})
+
+        assert response.status_code == 200
+        assert response.headers["content-encoding"] == "gzip"
+        assert response.headers["vary"] == "Accept-Encoding"
+        assert len(response.json()) == 100
+
+    def test_small_response_not_compressed(self):
+        """Test that responses under the size threshold are sent as is"""
+        with patch('planning_service.services.plans_service.get_plans') as mock_get:
+            mock_get.return_value = self._plans(1)
+            response = client.get("/plans", headers={"X-User": "testuser", "Accept-Encoding": "gzip"})
+
+        assert response.status_code == 200
+        assert "content-encoding" not in response.headers
+        assert len(response.json()) == 1
+
+
+class TestMetrics:
+    """Test the Prometheus /metrics endpoint"""
+
+    def test_route_template_labels(self):
+        """Test that requests are labelled by route template, not by plan id"""
+        with patch('planning_service.services.plans_service.get_plan') as mock_get:
+            mock_get.return_value = None
+            client.get("/plans/31337", headers={"X-User": "testuser"})
+
+        body = client.get("/metrics").text
+        assert 'http_requests_total{method="GET",route="/plans/{plan_id}",status="404"}' in body
+        assert 'http_requests_in_flight{method="GET",route="/plans/{plan_id}"} 0.0' in body
+        assert "31337" not in body
+
+    def test_mongo_command_histogram(self):
+        """Test that MongoDB command events are recorded per command"""
+        listener = MongoCommandMetrics()
+        labels = {"store": "mongodb", "operation": "aggregate"}
+        before = registry.get_sample_value("store_operation_duration_seconds_count", labels) or 0
+        listener.succeeded(SimpleNamespace(command_name="aggregate", duration_micros=1500, connection_id=("db", 27017), request_id=1))
+        assert registry.get_sample_value("store_operation_duration_seconds_count", labels) == before + 1
+
+    def test_cache_hit_ratio(self):
+        """Test that read-through hits and misses are exported as a hit ratio"""
+        fetch = AsyncMock(return_value={"value": 1})
+        with patch.object(cache_service, "enabled", True), \
+                patch.object(cache_service, "hits", 0), patch.object(cache_service, "misses", 0), \
+                patch('planning_service.services.cache_service.redis_manager') as redis:
+            redis.get = AsyncMock(side_effect=[None, {"value": 1}, {"value": 1}])
+            redis.set = AsyncMock(return_value=True)
+            for _ in range(3):
+                asyncio.run(cache_service.read_through("key", fetch))
+
+            body = client.get("/metrics").text
+
+        assert 'cache_requests_total{cache="redis",result="hit"} 2.0' in body
+        assert 'cache_hit_ratio{cache="redis"} 0.6666666666666666' in body
+        fetch.assert_awaited_once()
+
+
+class TestTagInvalidation:
+    """Test tag invalidation and guarded read-through writes on an in-memory Redis"""
+
+    @staticmethod
+    def _run_with_redis(monkeypatch, scenario):
+        pytest.importorskip("fakeredis")
+        from planning_service.config import settings
+        from planning_service.database.redis import RedisManager
+        monkeypatch.setattr(settings, "enable_cache", True)
+        monkeypatch.setattr(settings, "redis_url", "fakeredis://")
+        manager = RedisManager()
+
+        async def run():
+            assert await manager.connect()
+            await manager.redis_client.flushall()
+            try:
+                with patch.object(cache_service, "enabled", True), \
+                        patch('planning_service.services.cache_service.redis_manager', manager):
+                    await scenario(manager)
+            finally:
+                await manager.disconnect()
+
+        asyncio.run(run())
+
+    def test_delete_tags_removes_keys_and_bumps_generations(self, monkeypatch):
+        """Test that tagged keys and the tags are removed together and only their generations change"""
+        async def scenario(manager):
+            await manager.set_with_tags("a", 1, ["tag:1"])
+            await manager.set_with_tags("b", 2, ["tag:1", "tag:2"])
+            await manager.set_with_tags("c", 3, ["tag:3"])
+
+            assert await cache_service.invalidate_tags("tag:1")
+
+            assert sorted(await manager.redis_client.keys("*")) == ["c", "gen:tag:1", "tag:2", "tag:3"]
+            assert await manager.get_generations(["tag:1", "tag:2"]) == ["1", "0"]
+            assert 0 < await manager.redis_client.ttl("gen:tag:1") <= manager.max_tagged_ttl
+
+        self._run_with_redis(monkeypatch, scenario)
+
+    def test_read_through_skips_write_after_concurrent_invalidation(self, monkeypatch):
+        """Test that data read before an invalidation of its tag is returned but not cached"""
+        async def scenario(manager):
+            async def fetch_then_invalidate():
+                # A write lands between the database read and the cache write
+                await cache_service.invalidate_tags("tag:plan")
+                return {"value": "stale"}
+
+            data = await cache_service.read_through("plan:key", fetch_then_invalidate, tags=["tag:plan"])
+            assert data == {"value": "stale"}
+            assert await manager.get("plan:key") is None
+
+            fetch = AsyncMock(return_value={"value": "fresh"})
+            await cache_service.read_through("plan:key", fetch, tags=["tag:plan"])
+            assert await manager.get("plan:key") == {"value": "fresh"}
+            assert await manager.redis_client.smembers("tag:plan") == {"plan:key"}
+
+        self._run_with_redis(monkeypatch, scenario)
+
+
+class TestTracing:
+    """Test trace context propagation, spans and the Server-Timing header"""
+
+    TRACE_ID = "4bf92f3577b34da6a3ce929d0e0e4736"
+    TRACEPARENT = f"00-{TRACE_ID}-00f067aa0ba902b7-01"
+
+    @pytest.fixture
+    def trace_file(self, tmp_path, monkeypatch):
+        from planning_service.config import settings
+        monkeypatch.setattr(settings, "tracing_exporter", "file")
+        monkeypatch.setattr(settings, "tracing_file_path", str(tmp_path / "traces.jsonl"))
+        return tmp_path / "traces.jsonl"
+
+    @staticmethod
+    def _exported_spans(trace_file):
+        asyncio.run(span_exporter.flush())
+        spans = []
+        for line in trace_file.read_text().splitlines():
+            for resource in json.loads(line)["resourceSpans"]:
+                for scope in resource["scopeSpans"]:
+                    spans.extend(scope["spans"])
+        return spans
+
+    def test_continues_gateway_trace(self):
+        """Test that the gateway traceparent and request ID are continued and Server-Timing is returned"""
+        with patch('planning_service.services.plans_service.get_plans') as mock_get:
+            mock_get.return_value = []
+            response = client.get(
+                "/plans", headers={"X-User": "testuser", "traceparent": self.TRACEPARENT, "X-Request-ID": "req-42"}
+            )
+
+        assert response.status_code == 200
+        assert response.headers["x-request-id"] == "req-42"
+        server_timing = response.headers["server-timing"]
+        assert "serialize;dur=" in server_timing
+        assert "total;dur=" in server_timing
+        assert f'traceparent;desc="00-{self.TRACE_ID}-' in server_timing
+
+    def test_handler_span_exported_under_gateway_span(self, trace_file):
+        """Test that the server and handler spans are exported with the gateway span as parent"""
+        with patch('planning_service.services.plans_service.get_plans') as mock_get:
+            mock_get.return_value = []
+            client.get("/plans", headers={"X-User": "testuser", "traceparent": self.TRACEPARENT})
+
+        spans = {span["name"]: span for span in self._exported_spans(trace_file)}
+        server, handler = spans["GET /plans"], spans["get_plans"]
+        assert server["traceId"] == handler["traceId"] == self.TRACE_ID
+        assert server["parentSpanId"] == "00f067aa0ba902b7"
+        assert server["kind"] == 2
+        assert handler["parentSpanId"] == server["spanId"]
+
+    def test_mongo_command_span(self, trace_file):
+        """Test that PyMongo command events become client spans and a mongodb phase"""
+        listener = MongoCommandMetrics()
+        trace = RequestTrace(self.TRACE_ID, "req-1", True, span_exporter)
+        token = _current_trace.set(trace)
+        try:
+            event = SimpleNamespace(
+                command_name="find", database_name="transactions_db", duration_micros=2500,
+                connection_id=("mongodb", 27017), request_id=7
+            )
+            listener.started(event)
+            listener.succeeded(event)
+        finally:
+            _current_trace.reset(token)
+
+        assert trace.phases["mongodb"] == pytest.approx(2.5)
+        [mongo_span] = [span for span in self._exported_spans(trace_file) if span["name"] == "mongodb find"]
+        assert mongo_span["kind"] == 3
+        assert int(mongo_span["endTimeUnixNano"]) - int(mongo_span["startTimeUnixNano"]) == 2500000
+
+
+class TestEventLoopMonitor:
+    """Test detection of handlers that block the event loop"""
+
+    @staticmethod
+    def _blocking_get_plans(user_id):
+        time.sleep(0.2)
+        return []
+
+    @pytest.mark.allow_loop_block
+    def test_blocking_handler_recorded_with_stack(self, monkeypatch):
+        """Test that a synchronous call in a handler is recorded as a stall with its stack"""
+        from planning_service.config import settings
+        monkeypatch.setattr(settings, "metrics_event_loop_stall_ms", 50)
+        stall_count = event_loop_monitor.stall_count
+
+        with patch('planning_service.services.plans_service.get_plans', AsyncMock(side_effect=self._blocking_get_plans)):
+            response = client.get("/plans", headers={"X-User": "testuser"})
+
+        assert response.status_code == 200
+        assert event_loop_monitor.stall_count == stall_count + 1
+        stall = event_loop_monitor.recent_stalls()[0]
+        assert stall["duration_ms"] >= 100
+        assert "_blocking_get_plans" in "\n".join(stall["stack"])
+        assert registry.get_sample_value("event_loop_stalls_total") >= 1
+
+        report = client.get("/admin/event-loop", headers={"X-User": "admin"}).json()
+        assert report["recent"][0]["duration_ms"] == stall["duration_ms"]
+        assert client.get("/admin/event-loop", headers={"X-User": "testuser"}).status_code == 403
+
+    def test_admin_routes_use_admin_users(self, monkeypatch):
+        """Test that admin routes are guarded by ADMIN_USERS, not the profiling list"""
+        from planning_service.config import settings
+        monkeypatch.setattr(settings, "admin_users", ["ops"])
+        monkeypatch.setattr(settings, "profiling_admin_users", ["admin"])
+
+        assert client.get("/admin/event-loop", headers={"X-User": "ops"}).status_code == 200
+        assert client.get("/admin/event-loop", headers={"X-User": "admin"}).status_code == 403
+
+    def test_non_blocking_handler(self, monkeypatch):
+        """Test that awaiting does not count as a stall"""
+        from planning_service.config import settings
+        monkeypatch.setattr(settings, "metrics_event_loop_stall_ms", 50)
+        stall_count = event_loop_monitor.stall_count
+
+        async def sleeping_get_plans(user_id):
+            await asyncio.sleep(0.2)
+            return []
+
+        with patch('planning_service.services.plans_service.get_plans', sleeping_get_plans):
+            client.get("/plans", headers={"X-User": "testuser"})
+
+        assert event_loop_monitor.stall_count == stall_count
+
+
+class TestProfiling:
+    """Test on-demand and sampled request profiling"""
+
+    @pytest.fixture(autouse=True)
+    def reset_profiles(self):
+        profile_store.reset()
+        yield
+        profile_store.reset()
+
+    def test_profile_replaces_response(self):
+        """Test that an admin X-Profile request returns the profile instead of the response"""
+        with patch('planning_service.services.plans_service.get_plans') as mock_get:
+            mock_get.return_value = []
+            response = client.get("/plans", headers={"X-User": "admin", "X-Profile": "text"})
+
+        assert response.status_code == 200
+        assert response.headers["content-type"].startswith("text/plain")
+        assert response.headers["x-profile-status"] == "200"
+
+    def test_stored_profile(self):
+        """Test that ?profile=store returns the normal response and a profile id"""
+        with patch('planning_service.services.plans_service.get_plans') as mock_get:
+            mock_get.return_value = []
+            response = client.get("/plans?profile=store", headers={"X-User": "admin"})
+
+        assert response.json() == []
+        profile_id = response.headers["x-profile-id"]
+        listing = client.get("/admin/profiles", headers={"X-User": "admin"}).json()
+        assert listing["stored"][0]["id"] == profile_id
+        profile = client.get(f"/admin/profiles/{profile_id}", params={"format": "text"}, headers={"X-User": "admin"})
+        assert profile.status_code == 200
+
+    def test_profiling_requires_admin(self):
+        """Test that users outside PROFILING_ADMIN_USERS get 403"""
+        assert client.get("/plans", headers={"X-User": "testuser", "X-Profile": "text"}).status_code == 403
+        assert client.get("/admin/profiles", headers={"X-User": "testuser"}).status_code == 403
+
+    def test_sampled_requests_aggregated_per_route(self, monkeypatch):
+        """Test that every N-th request is added to the aggregate of its route template"""
+        from planning_service.config import settings
+        monkeypatch.setattr(settings, "profiling_sample_rate", 2)
+        monkeypatch.setattr(settings, "profiling_profiler", "cprofile")
+        with patch('planning_service.services.plans_service.get_plan') as mock_get:
+            mock_get.return_value = None
+            for plan_id in range(1, 5):
+                client.get(f"/plans/{plan_id}", headers={"X-User": "testuser"})
+
+        admin = {"X-User": "admin"}
+        [route] = client.get("/admin/profiles", headers=admin).json()["routes"]
+        assert route == {"route": "/plans/{plan_id}", "samples": 2, "avg_ms": route["avg_ms"]}
+        aggregate = client.get("/admin/profiles/aggregate", params={"route": "/plans/{plan_id}"}, headers=admin)
+        assert aggregate.headers["x-profile-format"] == "pstats"
+        assert "get_plan" in aggregate.text
+
 
 class TestEdgeCases:
     """Test edge cases and boundary conditions"""